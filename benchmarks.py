@@ -0,0 +1,658 @@
+"""
+Time the performance-critical routines of the IvS repository.
+
+Every benchmark runs a routine on a realistic problem size. Where the routine
+replaced a slower implementation, that implementation is timed as well, and
+the two results are compared. The timings are logged; the unit tests (the
+C{test*.py} modules) do not run the benchmarks.
+
+Run all benchmarks, or only those whose name contains one of the given words
+(as a module, because the directories of the repository would shadow modules
+of the standard library, such as C{io}):
+
+    $:> python -m ivs.benchmarks
+    $:> python -m ivs.benchmarks tsv2recarray
+
+The modules are imported by the benchmarks themselves, so that a missing
+optional dependency only skips the benchmarks that need it. For a list of
+the benchmarks, see
+
+    $:> python -m ivs.benchmarks -h
+"""
+import os
+import time
+import shutil
+import logging
+import tempfile
+import argparse
+import numpy as np
+from ivs.aux import loggers
+
+logger = logging.getLogger("IVS.BENCH")
+logger.addHandler(loggers.NullHandler())
+
+#{ Helper functions
+
+def timed(function,*args,**kwargs):
+    """
+    Call a function, and measure how long it takes.
+
+    @return: output of the function, duration (s)
+    @rtype: (object, float)
+    """
+    c0 = time.time()
+    output = function(*args,**kwargs)
+    return output,time.time()-c0
+
+#}
+
+#{ Catalogs
+
+def write_vizier_tsv(filename,nrows):
+    """
+    Write a VizieR-like TSV response with float, integer and string columns.
+    """
+    with open(filename,'w') as ff:
+        ff.write('#RESOURCE=yCat_2246\n#Name: II/246\n')
+        ff.write('#Title: 2MASS All-Sky Catalog of Point Sources (Cutri+ 2003)\n')
+        ff.write('#Column\t_r\t(F6.3)\tDistance from center\t[ucd=pos.angDistance]\n')
+        ff.write('#Column\tJmag\t(F6.3)\tJ magnitude\t[ucd=phot.mag;em.IR.J]\n')
+        ff.write('#Column\tNobs\t(I3)\tNumber of observations\t[ucd=meta.number]\n')
+        ff.write('#Column\tQflg\t(A3)\tQuality flag\t[ucd=meta.code.qual]\n')
+        ff.write('#Column\tVec\t(3F10.6E)\tVector column\t[ucd=meta.code]\n')
+        for j in range(10):
+            ff.write('#Column\tmag%d\t(F6.3)\tMagnitude\t[ucd=phot.mag]\n'%(j))
+        ff.write('_r\tJmag\tNobs\tQflg\tVec\t'+'\t'.join(['mag%d'%(j) for j in range(10)])+'\n')
+        ff.write('arcsec\tmag\t\t\t\t'+'\t'.join(10*['mag'])+'\n')
+        ff.write('------\t------\t---\t---\t----------'+10*'\t------'+'\n')
+        for i in range(nrows):
+            row = ['%6.3f'%(np.random.uniform(0,60)),
+                   i%7 and '%6.3f'%(np.random.uniform(5,15)) or '      ',
+                   i%5 and '%3d'%(i%1000) or '',
+                   i%3 and 'AAB' or '   ',
+                   '1,2,3'] + ['%6.3f'%(mag) for mag in np.random.uniform(5,15,size=10)]
+            ff.write('\t'.join(row)+'\n')
+
+def tsv2recarray_elementwise(filename):
+    """
+    The element-wise conversion of a VizieR TSV file that
+    C{vizier.tsv2recarray} replaced.
+    """
+    from ivs.io import ascii
+    data,comms = ascii.read2array(filename,dtype=np.str,splitchar='\t',return_comments=True)
+    data = np.array(data)
+    formats = np.zeros_like(data[0])
+    for line in comms:
+        line = line.split('\t')
+        if len(line)<3: continue
+        for i,key in enumerate(data[0]):
+            if key==line[1] and line[0]=='Column':
+                formats[i] = line[2].replace('(','').replace(')','').lower()
+                if formats[i][0].isdigit(): formats[i] = 'a100'
+                elif 'f' in formats[i]: formats[i] = 'f8'
+                elif 'i' in formats[i]: formats[i] = 'f8'
+                elif 'e' in formats[i]: formats[i] = 'f8'
+                if formats[i][0]=='a':
+                    formats[i] = 'a'+str(int(formats[i][1:])+3)
+    dtypes = np.dtype([(i,j) for i,j in zip(data[0],formats)])
+    cols = []
+    for i,key in enumerate(data[0]):
+        cols.append([(row.isspace() or not row) and np.nan or 3*' '+row for row in data[3:,i]])
+    cols = [np.cast[dtypes[i]](cols[i]) for i in range(len(cols))]
+    return np.rec.array(cols,dtype=dtypes)
+
+def bench_tsv2recarray():
+    """
+    catalogs.vizier.tsv2recarray() on a 10^5 row response
+    """
+    from ivs.catalogs import vizier
+    tempdir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tempdir,'large.tsv')
+        write_vizier_tsv(filename,100000)
+        reference,t_ref = timed(tsv2recarray_elementwise,filename)
+        (results,units,comms),t_new = timed(vizier.tsv2recarray,filename)
+    finally:
+        shutil.rmtree(tempdir)
+    logger.info('tsv2recarray: element-wise %.2fs, vectorised %.2fs'%(t_ref,t_new))
+    assert results.dtype==reference.dtype
+    for name in results.dtype.names:
+        assert np.all((results[name]==reference[name]) | (results[name]!=results[name])),name
+
+#}
+
+#{ Spectra
+
+def bench_lsd():
+    """
+    spectra.lsd.lsd() on 10^5 pixels, 2000 lines and 10 observations
+    """
+    from ivs.spectra import lsd
+    velos = np.linspace(-3e4,3e4,100000)
+    masks = [(np.random.uniform(-3e4,3e4,2000),np.random.uniform(0,1,2000))]
+    V = 1-np.random.normal(size=(len(velos),10),scale=0.01)
+    rvs = np.linspace(-50,50,201)
+    (Z,cc),t_new = timed(lsd.lsd,velos,V,np.ones(len(velos)),rvs,masks,Lambda=0.1)
+    logger.info('lsd: 10^5 pixels, 2000 lines, 10 observations in %.2fs'%(t_new))
+    assert len(Z)==10
+
+#}
+
+#{ Time series
+
+def loop_Zwavelet(time,signal,freq,position,sigma=10.0):
+    """
+    The node-by-node Z-transform that C{pergrams.Zwavelet} replaced.
+    """
+    Z = np.zeros([len(position),len(freq)])
+    for i,tau in enumerate(position):
+        arg = 2.0*np.pi*(time-tau)
+        for j,nu in enumerate(freq):
+            weight = np.exp(-(time-tau)**2*(nu/2./sigma)**2)
+            W = np.sum(weight)
+            cosine = np.cos(arg*nu)
+            sine = np.sin(arg*nu)
+            S = np.zeros([3,3])
+            S[0,0] = 1.0
+            S[0,1] = S[1,0] = np.sum(weight*cosine)/W
+            S[0,2] = S[2,0] = np.sum(weight*sine)/W
+            S[1,1] = np.sum(weight*cosine*cosine)/W
+            S[1,2] = S[2,1] = np.sum(weight*cosine*sine)/W
+            S[2,2] = np.sum(weight*sine*sine)/W
+            proj = np.array([np.sum(weight*signal),np.sum(weight*cosine*signal),
+                             np.sum(weight*sine*signal)])/W
+            y = np.dot(np.linalg.inv(S),proj)
+            model = y[0]+y[1]*cosine+y[2]*sine
+            Vsignal = np.sum(weight*signal**2)/W-(np.sum(weight*signal)/W)**2
+            Vmodel = np.sum(weight*model**2)/W-(np.sum(weight*model)/W)**2
+            Neff = W**2/np.sum(weight**2)
+            Z[i,j] = (Neff-3)*Vmodel/2./(Vsignal-Vmodel)
+    return Z
+
+def bench_Zwavelet():
+    """
+    timeseries.pergrams.Zwavelet() on a 100x100 map of 2000 points
+    """
+    from ivs.timeseries import pergrams
+    times = np.sort(np.random.uniform(0,100,2000))
+    signal = np.sin(2*np.pi*0.2*times)+np.random.normal(size=len(times))
+    freq = np.linspace(0.02,2.,100)
+    position = np.linspace(0,100,100)
+    reference,t_ref = timed(loop_Zwavelet,times,signal,freq,position)
+    Z,t_new = timed(pergrams.Zwavelet,times,signal,freq,position)
+    Z_,t_thr = timed(pergrams.Zwavelet,times,signal,freq,position,threads=4)
+    logger.info('Zwavelet: loop %.2fs, vectorised %.2fs, 4 threads %.2fs'%(t_ref,t_new,t_thr))
+    assert np.allclose(Z,reference,rtol=1e-6,atol=1e-8)
+    assert np.allclose(Z_,Z,rtol=1e-12,atol=0)
+
+def bench_windowfunction():
+    """
+    timeseries.pergrams.windowfunction() for 5000 points and 20000 frequencies
+    """
+    from ivs.timeseries import pergrams
+    times = np.sort(np.random.uniform(0,100,5000))
+    freqs = np.linspace(0,50,20000)
+    loop = lambda: np.array([np.sum(np.cos(2*np.pi*f*times))**2+np.sum(np.sin(2*np.pi*f*times))**2
+                             for f in freqs])/len(times)**2
+    reference,t_ref = timed(loop)
+    win,t_new = timed(pergrams.windowfunction,times,freqs)
+    first,t_first = timed(pergrams.windowfunction_cached,times,freqs)
+    second,t_second = timed(pergrams.windowfunction_cached,times,freqs)
+    logger.info('windowfunction: loop %.2fs, recurrence %.2fs, cached %.2fs (first) %.4fs (second)'%(t_ref,t_new,t_first,t_second))
+    assert np.allclose(win,reference,atol=1e-9)
+
+def loop_DFTpower(time,signal,f0,fn,df):
+    """
+    The phasor recurrence over all frequencies that the tiles of
+    C{pergrams.DFTpower} replaced.
+    """
+    Nfreq = int(np.ceil((fn-f0)/df))
+    A = np.exp(1j*2.*np.pi*f0*time)*signal
+    B = np.exp(1j*2.*np.pi*df*time)
+    ft = np.zeros(Nfreq,complex)
+    ft[0] = A.sum()
+    for k in range(1,Nfreq):
+        A *= B
+        ft[k] = np.sum(A)
+    return (ft.real**2+ft.imag**2)*4.0/len(time)**2
+
+def bench_DFTpower():
+    """
+    timeseries.pergrams.DFTpower() for 20000 points and 50000 frequencies
+    """
+    from ivs.timeseries import pergrams
+    times = np.sort(np.random.uniform(0,100,20000))
+    signal = np.sin(2*np.pi*0.7*times)+np.random.normal(size=len(times))
+    reference,t_ref = timed(loop_DFTpower,times,signal,0.01,50.01,0.001)
+    (freqs,power),t_new = timed(pergrams.DFTpower,times,signal,0.01,50.01,0.001)
+    (freqs,power_),t_thr = timed(pergrams.DFTpower,times,signal,0.01,50.01,0.001,threads=4)
+    logger.info('DFTpower: recurrence loop %.2fs, tiles %.2fs, tiles on 4 threads %.2fs'%(t_ref,t_new,t_thr))
+    assert np.allclose(power,reference,atol=1e-9)
+    assert np.allclose(power_,reference,atol=1e-9)
+
+def loop_spectrum_2D(x,matrix,**kwargs):
+    """
+    The column-per-column periodograms that the batches of
+    C{freqanalyse.spectrum_2D} replaced.
+    """
+    from ivs.timeseries import freqanalyse
+    matrix = matrix-matrix.mean(axis=0)
+    params,ampls,models = [],[],[]
+    for iwave in xrange(matrix.shape[1]):
+        out = freqanalyse.find_frequency(x,matrix[:,iwave],full_output=True,scale_df=0,**kwargs)
+        params.append(out[0])
+        ampls.append(out[1][1])
+        models.append(out[2])
+    return np.hstack(params),out[1][0],np.vstack(ampls).T,np.vstack(models).T
+
+def bench_spectrum_2D():
+    """
+    timeseries.freqanalyse.spectrum_2D() for 200 spectra of 200 bins
+    """
+    from ivs.timeseries import freqanalyse
+    times = np.sort(np.random.uniform(0,150,200))
+    wave = np.linspace(4500,4600,200)
+    central_wave = 5*np.sin(2*np.pi/10*times)
+    matrix = 1-0.5*np.exp(-(wave-4550-central_wave[:,None])**2/10**2)
+    matrix += np.random.normal(size=matrix.shape,scale=0.01)
+    reference,t_ref = timed(loop_spectrum_2D,times,matrix,f0=0.01,fn=2.)
+    output,t_new = timed(freqanalyse.spectrum_2D,times,wave,matrix,f0=0.01,fn=2.,full_output=True)
+    output_,t_thr = timed(freqanalyse.spectrum_2D,times,wave,matrix,f0=0.01,fn=2.,full_output=True,threads=4)
+    logger.info('spectrum_2D: column loop %.2fs, batched %.2fs, batched on 4 processes %.2fs'%(t_ref,t_new,t_thr))
+    assert np.allclose(output['pars']['freq'],reference[0]['freq'])
+    assert np.allclose(output_['pars']['freq'],reference[0]['freq'])
+
+def loop_time_frequency(times,signal,window_width,n_windows,f0,fn,df,method='scargle'):
+    """
+    The periodogram of every slice from scratch, that the sliding
+    periodogram of C{freqanalyse.time_frequency} replaced.
+    """
+    from ivs.timeseries import pergrams
+    stft_times = np.linspace(times[0]+window_width/2.,times[-1]-window_width/2.,n_windows)
+    spec = []
+    for t in stft_times:
+        region = (abs(times-t)<=(window_width/2.))
+        freqs,ampls = getattr(pergrams,method)(times[region],signal[region],f0=f0,fn=fn,df=df,nyq_stat=fn)
+        spec.append(ampls)
+    return stft_times,freqs,np.vstack(spec)
+
+def bench_time_frequency():
+    """
+    timeseries.freqanalyse.time_frequency() for 5000 points, 200 slices and 5000 frequencies
+    """
+    from ivs.timeseries import freqanalyse
+    times = np.sort(np.random.uniform(0,100,5000))
+    signal = np.sin(2*np.pi*(2.+0.01*times)*times)+np.random.normal(size=len(times))
+    kwargs = dict(window_width=10.,n_windows=200,f0=0.01,fn=5.,df=0.001)
+    reference,t_ref = timed(loop_time_frequency,times,signal,**kwargs)
+    output,t_new = timed(freqanalyse.time_frequency,times,signal,fit_params=False,**kwargs)
+    logger.info('time_frequency: periodogram per slice %.2fs, sliding periodogram %.2fs'%(t_ref,t_new))
+    assert np.allclose(output['pergram'][1],reference[2],rtol=1e-6)
+
+def loop_prewhitening(times,signal,maxiter,**kwargs):
+    """
+    The periodogram of the residuals and the fit of all frequencies in every
+    step, that the incremental fit of C{freqanalyse.iterative_prewhitening}
+    replaced.
+    """
+    from ivs.timeseries import freqanalyse
+    from ivs.sigproc import fit,evaluate
+    residuals = signal.copy()
+    frequencies = []
+    for i in range(maxiter):
+        params = freqanalyse.find_frequency(times,residuals,**kwargs)
+        frequencies.append(params['freq'][-1])
+        allparams = fit.sine(times,signal,frequencies)
+        residuals = signal-evaluate.sine(times,allparams)
+    return allparams
+
+def bench_iterative_prewhitening():
+    """
+    timeseries.freqanalyse.iterative_prewhitening() for 20 frequencies in 10^4 points
+    """
+    from ivs.timeseries import freqanalyse
+    kwargs = dict(f0=0.01,fn=6.,df=0.001)
+    for label,times in [('equidistant',np.linspace(0,100,10000)),
+                        ('random',np.sort(np.random.uniform(0,100,10000)))]:
+        signal = 2.+np.random.normal(size=len(times),scale=0.5)
+        for ampl,freq,phase in zip(np.linspace(2,0.5,20),np.random.uniform(0.5,5,20),np.random.uniform(0,1,20)):
+            signal += ampl*np.sin(2*np.pi*(freq*times+phase))
+        reference,t_ref = timed(loop_prewhitening,times,signal,20,**kwargs)
+        output,t_new = timed(freqanalyse.iterative_prewhitening,times,signal,maxiter=20,**kwargs)
+        logger.info('iterative_prewhitening (%s): refit and periodogram in every step %.2fs, incremental %.2fs'%(label,t_ref,t_new))
+        assert np.allclose(output['freq'],reference['freq'])
+
+def loop_true_anomaly(M,e,itermax=8):
+    """
+    The Newton iterations until all elements converged, that the per-element
+    convergence of C{keplerorbit.true_anomaly} replaced.
+    """
+    Fn = M+e*np.sin(M)+e**2/2.*np.sin(2*M)
+    for i in range(itermax):
+        F = Fn
+        Mn = F-e*np.sin(F)
+        Fn = F+(M-Mn)/(1.-e*np.cos(F))
+        keep = F!=0
+        if np.all(abs((Fn-F)[keep]/F[keep])<0.00001):
+            break
+    true_an = 2.*np.arctan(np.sqrt((1.+e)/(1.-e))*np.tan(Fn/2.))
+    return Fn,true_an
+
+def bench_true_anomaly():
+    """
+    timeseries.keplerorbit.true_anomaly() for 1000 orbits of 1000 points
+    """
+    from ivs.timeseries import keplerorbit
+    M = np.linspace(0,200,1000)
+    e = np.linspace(0,0.95,1000)[:,None]
+    reference,t_ref = timed(loop_true_anomaly,M*np.ones((1000,1)),e*np.ones(1000))
+    (E,theta),t_new = timed(keplerorbit.true_anomaly,M,e)
+    logger.info('true_anomaly: global convergence check %.2fs, per element %.2fs'%(t_ref,t_new))
+    assert np.all(abs(E-e*np.sin(E)-M)<1e-10)
+
+def bench_grid_search():
+    """
+    timeseries.keplerorbit.grid_search() for 150 points and 381 frequencies
+    """
+    from ivs.timeseries import keplerorbit
+    from ivs.timeseries import pyKEP
+    times = np.sort(np.random.uniform(1000,1200,150))
+    signal = keplerorbit.radial_velocity([12.456,1003.,0.37,213/180.*np.pi,98.76,55.],times=times)
+    signal += np.random.normal(scale=5,size=150)
+    def fortran():
+        f1,s1,p1,l1,s2 = [np.zeros(381) for i in range(5)]
+        k2 = np.zeros(6)
+        pyKEP.kepler(times-times.min(),signal+0,np.ones(150),0.01,0.2,0.0005,2,0.,0.91,0.1,
+                     0.,359.9,f1,s1,p1,l1,s2,k2)
+        return f1,s2
+    (f1,s2),t_ref = timed(fortran)
+    (power,best),t_new = timed(keplerorbit.grid_search,times,signal,f1)
+    logger.info('grid_search: Fortran %.2fs, numpy %.2fs'%(t_ref,t_new))
+    assert np.allclose(power,s2,atol=1e-4)
+
+#}
+
+#{ Signal processing
+
+def harmonic_parameters(nfreq):
+    """
+    Random harmonic parameters with a constant.
+    """
+    const = np.zeros(nfreq)
+    const[0] = 2.
+    return np.rec.fromarrays([const,np.random.uniform(0.5,2,nfreq),np.random.uniform(0.1,5,nfreq),
+                              np.random.uniform(0,1,nfreq)],names=['const','ampl','freq','phase'])
+
+def loop_sine(times,parameters):
+    """
+    The sum of one sine at a time, that C{evaluate.sine} replaced.
+    """
+    total = parameters['const'].sum()
+    for par in parameters:
+        total = total+par['ampl']*np.sin(2*np.pi*(par['freq']*times+par['phase']))
+    return total
+
+def bench_sine():
+    """
+    sigproc.evaluate.sine() for 10^5 points x 100 frequencies and 1000 points x 1000 frequencies
+    """
+    from ivs.sigproc import evaluate
+    for npoints,nfreq in [(100000,100),(1000,1000)]:
+        times = np.linspace(0,1000,npoints)
+        parameters = harmonic_parameters(nfreq)
+        reference,t_ref = timed(loop_sine,times,parameters)
+        output,t_new = timed(evaluate.sine,times,parameters)
+        output32,t_32 = timed(evaluate.sine,times,parameters,dtype=np.float32)
+        logger.info('sine (%d x %d): loop %.3fs, vectorised %.3fs, single precision %.3fs'%(npoints,nfreq,t_ref,t_new,t_32))
+        assert np.allclose(output,reference)
+
+def bench_optimize():
+    """
+    sigproc.fit.optimize() for 20 frequencies and 10^4 points
+    """
+    from ivs.sigproc import evaluate,fit
+    times = np.sort(np.random.uniform(0,100,10000))
+    parameters = harmonic_parameters(20)
+    signal = loop_sine(times,parameters)+np.random.normal(size=len(times),scale=0.05)
+    start = evaluate.sine_preppars(parameters)
+    start[2::3] += 1e-4
+    numerical,t_ref = timed(fit.optimize,times,signal,start,'sine',jacobian=False)
+    analytical,t_new = timed(fit.optimize,times,signal,start,'sine')
+    logger.info('optimize: numerical derivatives %.2fs, analytical jacobian %.2fs'%(t_ref,t_new))
+
+def noisy_signal(npoints):
+    """
+    Non-equidistant noisy signal with duplicate times and outliers.
+    """
+    x = np.sort(np.random.uniform(0,150,npoints))
+    x[10:15] = x[10]
+    y = np.sin(2*np.pi/20.*x)+np.random.normal(size=npoints,scale=0.3)+5.
+    y[::50] += 10.
+    return x,y
+
+def loop_filter(x,y,ftype,**kwargs):
+    """
+    The kernel function for every point, that C{filtering.filter_signal}
+    replaced.
+    """
+    from ivs.sigproc import filtering
+    lower_window,higher_window = getattr(filtering,ftype+'_window')(**kwargs)
+    kernel = getattr(filtering,ftype+'_kernel')
+    out = [kernel(x,y,t,index=x.searchsorted([t-1e-30-lower_window,t+1e-30+higher_window]),**kwargs)
+           for t in x]
+    return tuple([x]+list(np.array(out).T))
+
+def bench_filter_signal():
+    """
+    sigproc.filtering.filter_signal() for 20000 points, and the INL filter for 10^6 points
+    """
+    from ivs.sigproc import filtering
+    x,y = noisy_signal(20000)
+    for ftype,kwargs in [('box',dict(window_width=3.)),('gauss',dict(sigma=0.5)),
+                         ('inl',dict(window_width=3.))]:
+        reference,t_ref = timed(loop_filter,x,y,ftype,**kwargs)
+        output,t_new = timed(filtering.filter_signal,x,y,ftype,**kwargs)
+        logger.info('%s: kernel per point %.2fs, filter_signal %.2fs'%(ftype,t_ref,t_new))
+        assert np.allclose(output[1],reference[1])
+    x,y = noisy_signal(1000000)
+    output,t_new = timed(filtering.filter_signal,x,y,'inl',window_width=0.5)
+    logger.info('inl (10^6 points, about 3300 per window): %.1fs'%(t_new))
+
+#}
+
+#{ Statistics
+
+def bench_selectSubmodels():
+    """
+    statistics.linearregression.LinearModel.selectSubmodels() for the 4095 submodels of 12 frequencies
+    """
+    from ivs.statistics.linearregression import HarmonicModel
+    x = np.sort(np.random.uniform(0,100,2000))
+    freqs = np.random.uniform(0.1,5.0,12)
+    observations = np.sin(2*np.pi*freqs[0]*x)+0.5*np.cos(2*np.pi*freqs[3]*x)+np.random.normal(0.0,0.5,len(x))
+    harmonicModel = HarmonicModel(x,"t",freqs,["f%d"%(n) for n in range(12)])
+    ranks = np.repeat(np.arange(12),2)
+    loop = lambda: [submodel.fitData(observations).BICvalue()
+                    for submodel in harmonicModel.submodels(nested=False,ranks=ranks)]
+    BICvalues,t_ref = timed(loop)
+    selection,t_new = timed(harmonicModel.selectSubmodels,observations,nested=False,ranks=ranks)
+    logger.info('%d submodels: LinearFit per submodel %.2fs, selectSubmodels %.2fs'%(len(BICvalues),t_ref,t_new))
+    assert np.allclose(selection.BICvalues(),BICvalues)
+
+def bench_PCA():
+    """
+    statistics.pca for the first 5 PCs of a 20000 x 200 matrix
+    """
+    from ivs.statistics import pca
+    X = np.dot(np.random.normal(size=(20000,5))*np.logspace(1,0,5),np.random.normal(size=(5,200)))
+    X += np.random.normal(size=(20000,200),scale=0.1)+np.linspace(0,5,200)
+    nipals,t_nipals = timed(pca.PCA_nipals2,X,PCs=5)
+    svd,t_svd = timed(pca.PCA_svd,X)
+    randomized,t_randomized = timed(pca.PCA_randomized,X,PCs=5)
+    logger.info('PCA_nipals2 %.2fs, PCA_svd %.2fs, PCA_randomized %.2fs'%(t_nipals,t_svd,t_randomized))
+    assert np.allclose(randomized[2],svd[2][:5],rtol=1e-6)
+
+#}
+
+#{ Input/output
+
+def reopen_write(filename,tables):
+    """
+    Open the file in update mode for every extension, as was done before
+    C{fits.FitsWriter}.
+    """
+    import pyfits
+    from ivs.io import fits
+    pyfits.HDUList([pyfits.PrimaryHDU(np.array([[0]]))]).writeto(filename)
+    for table in tables:
+        hdulist = pyfits.open(filename,mode='update')
+        hdulist.append(fits._recarray_to_hdu(table))
+        hdulist.close()
+
+def bench_FitsWriter():
+    """
+    io.fits.FitsWriter() against reopening the file for 100, 200 and 400 extensions
+    """
+    import pyfits
+    from ivs.io import fits
+    tempdir = tempfile.mkdtemp()
+    table = np.rec.fromarrays([np.random.normal(size=2000) for i in range(8)],names='abcdefgh')
+    try:
+        for n in [100,200,400]:
+            output,t_ref = timed(reopen_write,os.path.join(tempdir,'reopen%d.fits'%(n)),[table]*n)
+            c0 = time.time()
+            with fits.FitsWriter(os.path.join(tempdir,'writer%d.fits'%(n))) as writer:
+                for i in range(n):
+                    writer.write_recarray(table)
+            t_new = time.time()-c0
+            logger.info('%d extensions: reopen %.2fs, FitsWriter %.2fs'%(n,t_ref,t_new))
+            hdulist = pyfits.open(os.path.join(tempdir,'writer%d.fits'%(n)))
+            assert len(hdulist)==n+1
+            hdulist.close()
+    finally:
+        shutil.rmtree(tempdir)
+
+def bench_hdf5():
+    """
+    io.hdf5.read2dict() of the CI of a SED with a grid of 10^6 samples
+    """
+    from ivs.io import hdf5
+    tempdir = tempfile.mkdtemp()
+    filename = os.path.join(tempdir,'sed.hdf5')
+    grid = np.rec.fromarrays([np.random.uniform(size=1000000) for i in range(10)],names='abcdefghij')
+    data = {'results':{'igrid_search':{'grid':grid,'CI':dict(teff=1.),'factor':1.}}}
+    try:
+        output,t_write = timed(hdf5.write_dict,data,filename)
+        output,t_update = timed(hdf5.write_dict,data,filename)
+        full,t_read = timed(hdf5.read2dict,filename)
+        c0 = time.time()
+        with hdf5.read2dict(filename,lazy=True) as lazy:
+            lazy = lazy['results']['igrid_search']['CI']
+        t_lazy = time.time()-c0
+        logger.info('write %.2fs, unchanged update %.2fs, read2dict %.3fs, lazy %.3fs'%(t_write,t_update,t_read,t_lazy))
+        assert full['results']['igrid_search']['CI']==lazy
+        output,t_write = timed(hdf5.write_dict,data,filename,update=False,compression='gzip')
+        output,t_read = timed(hdf5.read2dict,filename)
+        logger.info('gzip: write %.2fs, read2dict %.2fs'%(t_write,t_read))
+    finally:
+        shutil.rmtree(tempdir)
+
+#}
+
+#{ Spectral energy distributions
+
+def bench_SEDStore():
+    """
+    sed.store.SEDStore() against reading 1000 SED files for the Teff of the sample
+    """
+    from ivs.io import hdf5
+    from ivs.sed import store
+    photbands = np.array(['JOHNSON.V','JOHNSON.B','2MASS.J','GALEX.FUV'])[np.arange(40)%4]
+    sources = np.array(['II/168/ubvmeans','II/168/ubvmeans','II/246/out','II/312/ais'])[np.arange(40)%4]
+    tempdir = tempfile.mkdtemp()
+    try:
+        filenames = []
+        for i in range(1000):
+            master = np.zeros(40,dtype=store.photometry_dtype.descr[1:]).view(np.recarray)
+            master['photband'] = photbands
+            master['source'] = sources
+            master['cmeas'] = np.random.uniform(1,2,40)
+            master['e_cmeas'] = np.random.uniform(0.01,0.1,40)
+            master['include'] = True
+            teff = 10000.+10*i
+            grid = np.rec.fromarrays([np.random.normal(teff,500,1000),np.random.uniform(size=1000)],names=['teff','ci_red'])
+            results = {'igrid_search':{'grid':grid,'factor':1e-20,
+                                       'CI':{'teff':teff,'teff_l':teff-500.,'teff_u':teff+500.,'logg':4.}}}
+            filenames.append(os.path.join(tempdir,'star%d.hdf5'%(i)))
+            hdf5.write_dict(dict(master=master,results=results),filenames[-1])
+        read_all = lambda: np.array([hdf5.read2dict(filename)['results']['igrid_search']['CI']['teff']
+                                     for filename in filenames])
+        reference,t_ref = timed(read_all)
+        c0 = time.time()
+        with store.SEDStore(os.path.join(tempdir,'sample.h5')) as sedstore:
+            sedstore.update(filenames)
+        c1 = time.time()
+        with store.SEDStore(os.path.join(tempdir,'sample.h5'),mode='r') as sedstore:
+            teff = sedstore.get_confidence_interval('teff')[:,1]
+            summary = sedstore.summarize()
+        c2 = time.time()
+        logger.info('read all files %.2fs, ingest %.2fs, query and summarize %.3fs'%(t_ref,c1-c0,c2-c1))
+        assert np.all(teff==reference)
+    finally:
+        shutil.rmtree(tempdir)
+
+#}
+
+#{ Observations
+
+def bench_visibility():
+    """
+    observations.visibility.Ephemeris.visibility() of 10 objects for 30 days every 5 minutes
+    """
+    import ephem
+    from ivs.observations import visibility
+    objects = [ephem.readdb("star%d,f|M|A0,%d:%02d:00,%d:00:00,8.0,2000"%(i,(7*i)%24,(13*i)%60,-60+37*i%120))
+               for i in range(10)]
+    output = []
+    for vectorized in [False,True]:
+        eph = visibility.Ephemeris(sitename='lapalma',startdate='2011/09/27 12:00:00.0')
+        eph.objects = objects
+        duration = timed(eph.visibility,vectorized=vectorized,days=30,dt=5.)[1]
+        output.append((eph,duration))
+    (loop,t_ref),(vect,t_new) = output
+    logger.info('step by step %.2fs, vectorized %.2fs'%(t_ref,t_new))
+    assert np.all(loop.vis['during_night']==vect.vis['during_night'])
+
+def bench_helcorr():
+    """
+    observations.barycentric_correction.helcorr() of 10000 observations
+    """
+    from ivs.observations import barycentric_correction as bc
+    jds = 2455000.+np.linspace(0,1000,10000)
+    loop,t_ref = timed(lambda: np.array([bc.helcorr(18.61,38.78,jd) for jd in jds]).T)
+    (corr,hjd),t_new = timed(bc.helcorr,18.61,38.78,jds)
+    logger.info('loop %.2fs, arrays %.3fs'%(t_ref,t_new))
+    assert np.allclose(corr,loop[0],rtol=1e-10)
+
+#}
+
+if __name__=="__main__":
+    benchmarks = sorted([value for name,value in globals().items() if name.startswith('bench_')],
+                        key=lambda function:function.func_code.co_firstlineno)
+    parser = argparse.ArgumentParser(description='Time the performance-critical routines of the IvS repository',
+                                     epilog='benchmarks: '+', '.join([function.__name__[6:] for function in benchmarks]))
+    parser.add_argument('names',nargs='*',help='run only the benchmarks whose name contains one of these words')
+    parser.add_argument('-s','--seed',type=int,default=1111,help='seed of the random test data')
+    args = parser.parse_args()
+
+    logger = loggers.get_basic_logger()
+    np.random.seed(args.seed)
+    for function in benchmarks:
+        name = function.__name__[6:]
+        if args.names and not [word for word in args.names if word in name]:
+            continue
+        logger.info('%s: %s'%(name,function.__doc__.strip()))
+        try:
+            function()
+        except ImportError,msg:
+            logger.warning('Skipped %s (%s)'%(name,msg))
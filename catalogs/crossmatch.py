@@ -12,6 +12,8 @@ or ask for help on any function::
 """
 import logging
 import itertools
+import threading
+from multiprocessing.pool import ThreadPool
 import pylab as pl
 import numpy as np
 
@@ -26,13 +28,17 @@ from ivs.aux import progressMeter
 from ivs.aux import loggers
 from ivs.aux import argkwargparser
 from ivs.io import ascii
+from ivs.io import http
 
 from scipy.spatial import KDTree
 
 logger = logging.getLogger("CAT.XMATCH")
 
+#-- maximum number of simultaneous queries to each service
+max_connections = dict(mast=2,gator=2,vizier=4,sesame=2,gcpd=1)
+
 def get_photometry(ID=None,to_units='erg/s/cm2/AA',extra_fields=[],include=None,
-         exclude=None,**kwargs):
+         exclude=None,threads=8,timeout=60.,**kwargs):
     """
     Collect photometry from different sources.
     
@@ -65,6 +71,15 @@ def get_photometry(ID=None,to_units='erg/s/cm2/AA',extra_fields=[],include=None,
     Extra keyword arguments are passed to each C{get_photometry} functions in
     this package's modules.
     
+    The catalogs are queried concurrently on a pool of C{threads} threads,
+    while the number of simultaneous queries to any one service is limited by
+    C{max_connections}. A query that does not respond within C{timeout}
+    seconds is skipped with a warning. The measurements are always collected
+    in the same order (mast, gator, vizier, gcpd), regardless of which query
+    finishes first. Set C{threads=1} to query the catalogs one by one.
+    
+    To collect photometry for a whole sample, use L{get_photometry_sample}.
+    
     Example usage:
     
         1. You want to download all available photometry and write the results to
@@ -93,9 +108,47 @@ def get_photometry(ID=None,to_units='erg/s/cm2/AA',extra_fields=[],include=None,
     @type include: list of strings (from C{gator}, C{vizier} or C{gcpd})
     @param exclude: sources to include
     @type exclude: list of strings (from C{gator}, C{vizier} or C{gcpd})
+    @param threads: number of simultaneous queries
+    @type threads: int
+    @param timeout: network timeout of a single query (seconds)
+    @type timeout: float
     @return: record array where eacht entry is a photometric measurement
     @rtype: record array
     """
+    master = get_photometry_sample([ID],to_units=to_units,extra_fields=extra_fields,
+                   include=include,exclude=exclude,threads=threads,timeout=timeout,
+                   **kwargs)[0]
+    
+    #-- now make a summary of the contents:
+    if master is not None:
+        photbands = [phot.split('.')[0]  for phot in master['photband']]
+        contents = [(i,photbands.count(i)) for i in sorted(list(set(photbands)))]
+        for phot in contents:
+            logger.info('%10s: found %d measurements'%phot)
+    return master
+
+def get_photometry_sample(IDs,to_units='erg/s/cm2/AA',extra_fields=[],include=None,
+         exclude=None,threads=8,timeout=60.,**kwargs):
+    """
+    Collect photometry from different sources for a list of targets.
+    
+    All catalog queries of all targets share one pool of C{threads} threads,
+    so that the total number of simultaneous queries stays bounded, also for
+    large samples. See L{get_photometry} for the meaning of the arguments.
+    
+    Example usage:
+    
+    >>> masters = get_photometry_sample(['vega','HD180642'],threads=16)
+    
+    @param IDs: the targets' names, understandable by SIMBAD
+    @type IDs: list of str
+    @param threads: number of simultaneous queries
+    @type threads: int
+    @param timeout: network timeout of a single query (seconds)
+    @type timeout: float
+    @return: list of record arrays (one per target, in the order of C{IDs})
+    @rtype: list of record arrays
+    """
     #-- make sure all catalog names are lower case
     if include is not None: include = [i.lower() for i in include]
     if exclude is not None: exclude = [i.lower() for i in exclude]
@@ -107,37 +160,28 @@ def get_photometry(ID=None,to_units='erg/s/cm2/AA',extra_fields=[],include=None,
     if exclude is not None:
         searchables = list( set(searchables)- set(exclude))
     
-    #-- and search photometry
-    if 'mast' in searchables:
-        kwargs['master'] = mast.get_photometry(ID=ID,to_units=to_units,extra_fields=extra_fields,**kwargs)
-    if 'gator' in searchables:
-        kwargs['master'] = gator.get_photometry(ID=ID,to_units=to_units,extra_fields=extra_fields,**kwargs)
-    if 'vizier' in searchables:
-        #-- first query catalogs that can only be queried via HD number
-        info = sesame.search(ID=ID,fix=True)
-        if 'alias' in info:
-            HDnumber = [name for name in info['alias'] if name[:2]=='HD']
-            if HDnumber:
-                kwargs['master'] = vizier.get_photometry(extra_fields=extra_fields,constraints=['HD=%s'%(HDnumber[0][3:])],sources=['II/83/catalog','V/33/phot'],sort=None,**kwargs)
-        #-- then query catalogs that can only be queried via another catalog
-        results,units,comms = vizier.search('J/A+A/380/609/table1',ID=ID)
-        if results is not None:
-            catname = results[0]['Name'].strip()
-            kwargs['master'] = vizier.get_photometry(take_mean=True,extra_fields=extra_fields,constraints=['Name={0}'.format(catname)],sources=['J/A+A/380/609/table{0}'.format(tnr) for tnr in range(2,5)],sort=None,**kwargs)
-        #-- then query normal catalogs
-        kwargs['master'] = vizier.get_photometry(ID=ID,to_units=to_units,extra_fields=extra_fields,**kwargs)
-        
-        
-    if 'gcpd' in searchables:
-        kwargs['master'] = gcpd.get_photometry(ID=ID,to_units=to_units,extra_fields=extra_fields,**kwargs)
-    master = kwargs['master']
+    #-- a master given as a keyword is the start of every target's master
+    master_ = kwargs.pop('master',None)
     
-    #-- now make a summary of the contents:
-    photbands = [phot.split('.')[0]  for phot in master['photband']]
-    contents = [(i,photbands.count(i)) for i in sorted(list(set(photbands)))]
-    for phot in contents:
-        logger.info('%10s: found %d measurements'%phot)
-    return master
+    #-- make the list of queries for every target, and run them all
+    plans = [_query_plan(ID,searchables,to_units,extra_fields,**kwargs) for ID in IDs]
+    tasks = [task for plan in plans for task in plan]
+    parts = iter(_run_queries(tasks,threads=threads,timeout=timeout))
+    
+    #-- merge the results per target, in the order of the query plan
+    masters = []
+    for plan in plans:
+        master = master_
+        for i in range(len(plan)):
+            part = parts.next()
+            if part is None:
+                continue
+            elif master is None:
+                master = part
+            else:
+                master = numpy_ext.recarr_addrows(master,part.tolist())
+        masters.append(master)
+    return masters
 
 def add_bibcodes(master):
     """
@@ -229,6 +273,93 @@ def photometry2str(master):
         txt+='%20s %12g %12g %12s %10.0f %12g %12g erg/s/cm2/AA %s\n'%(i,j,k,l,m,n,o,p)
     return txt    
 
+#{ Internal helper functions
+
+def _query_plan(ID,searchables,to_units,extra_fields,**kwargs):
+    """
+    Make the list of independent catalog queries for one target.
+    
+    Each query is a tuple (service, function, kwargs). The order of the list
+    sets the order of the measurements in the final master record array.
+    Every ViZieR catalog is queried separately, so that they can be retrieved
+    concurrently.
+    """
+    sources = kwargs.pop('sources',vizier.cat_info.sections())
+    plan = []
+    if 'mast' in searchables:
+        plan.append(('mast',mast.get_photometry,dict(ID=ID,to_units=to_units,extra_fields=extra_fields,**kwargs)))
+    if 'gator' in searchables:
+        plan.append(('gator',gator.get_photometry,dict(ID=ID,to_units=to_units,extra_fields=extra_fields,**kwargs)))
+    if 'vizier' in searchables:
+        #-- first query catalogs that can only be queried via HD number, then
+        #   catalogs that can only be queried via another catalog, then the
+        #   normal catalogs
+        plan.append((None,_get_HD_photometry,dict(ID=ID,extra_fields=extra_fields,**kwargs)))
+        plan.append(('vizier',_get_secondary_photometry,dict(ID=ID,extra_fields=extra_fields,**kwargs)))
+        for source in sources:
+            plan.append(('vizier',vizier.get_photometry,dict(ID=ID,to_units=to_units,extra_fields=extra_fields,sources=[source],**kwargs)))
+    if 'gcpd' in searchables:
+        plan.append(('gcpd',gcpd.get_photometry,dict(ID=ID,to_units=to_units,extra_fields=extra_fields,**kwargs)))
+    return plan
+
+def _get_HD_photometry(ID=None,extra_fields=[],connections=None,**kwargs):
+    """
+    Query the ViZieR catalogs that can only be queried via the HD number.
+    """
+    with connections['sesame']:
+        info = sesame.search(ID=ID,fix=True)
+    if 'alias' in info:
+        HDnumber = [name for name in info['alias'] if name[:2]=='HD']
+        if HDnumber:
+            with connections['vizier']:
+                return vizier.get_photometry(extra_fields=extra_fields,constraints=['HD=%s'%(HDnumber[0][3:])],sources=['II/83/catalog','V/33/phot'],sort=None,**kwargs)
+
+def _get_secondary_photometry(ID=None,extra_fields=[],**kwargs):
+    """
+    Query the ViZieR catalogs that can only be queried via another catalog.
+    """
+    results,units,comms = vizier.search('J/A+A/380/609/table1',ID=ID)
+    if results is not None:
+        catname = results[0]['Name'].strip()
+        return vizier.get_photometry(take_mean=True,extra_fields=extra_fields,constraints=['Name={0}'.format(catname)],sources=['J/A+A/380/609/table{0}'.format(tnr) for tnr in range(2,5)],sort=None,**kwargs)
+
+def _run_query(service,function,kwargs,connections,timeout=60.):
+    """
+    Run one catalog query, respecting the connection limit of its service.
+    
+    A query that fails on the network level is skipped with a warning.
+    """
+    previous = http.set_timeout(timeout)
+    try:
+        if service is None:
+            return function(connections=connections,**kwargs)
+        with connections[service]:
+            return function(**kwargs)
+    except IOError,msg:
+        logger.warning('Query of %s for %s failed, skipping (%s)'%(service or 'sesame/vizier',kwargs.get('ID'),msg))
+    finally:
+        http.set_timeout(previous)
+
+def _run_queries(tasks,threads=8,timeout=60.):
+    """
+    Run a list of catalog queries concurrently.
+    
+    @return: results of the queries, in the order of C{tasks}
+    @rtype: list
+    """
+    connections = dict([(service,threading.BoundedSemaphore(max_connections[service])) for service in max_connections])
+    if threads==1:
+        return [_run_query(service,function,kwargs,connections,timeout) for service,function,kwargs in tasks]
+    pool = ThreadPool(min(threads,max(len(tasks),1)))
+    try:
+        results = [pool.apply_async(_run_query,(service,function,kwargs,connections,timeout)) for service,function,kwargs in tasks]
+        #-- get() without a timeout cannot be interrupted from the keyboard
+        return [result.get(1e9) for result in results]
+    finally:
+        pool.terminate()
+
+#}
+
 if __name__=="__main__":
     logger = loggers.get_basic_logger()
     
@@ -11,6 +11,7 @@ import numpy as np
 from ivs.aux import loggers
 from ivs.aux import numpy_ext
 from ivs.io import ascii
+from ivs.io import http
 from ivs.sed import filters
 from ivs.units import conversions
 
@@ -55,6 +56,9 @@ def search(catalog,**kwargs):
     catalog). The entries in the dictionary are of type C{ndarray}, and will
     be converted to a float-array if possible. If not, the array will consist
     of strings. The comments are also returned as a list of strings.
+    
+    Responses are kept in a local cache, so repeating a query does not
+    download the results again (see L{ivs.io.http.retrieve}).
         
     
     @param catalog: name of a GATOR catalog (e.g. 'II/246/out')
@@ -73,13 +77,11 @@ def search(catalog,**kwargs):
     
     #-- gradually build URI
     base_url = _get_URI(catalog,**kwargs)
-    #-- prepare to open URI
-    url = urllib.URLopener()
-    filen,msg = url.retrieve(base_url,filename=filename)
+    #-- retrieve the response, from the local cache if possible
+    filen = http.retrieve(base_url,filename=filename)
     #   maybe we are just interest in the file, not immediately in the content
     if filename is not None:
         logger.info('Querying GATOR source %s and downloading to %s'%(catalog,filen))
-        url.close()
         return filen
     
     #   otherwise, we read everything into a dictionary
@@ -89,7 +91,8 @@ def search(catalog,**kwargs):
         #-- raise an exception when multiple catalogs were specified
         except ValueError:
             raise ValueError, "failed to read %s, perhaps multiple catalogs specified (e.g. III/168 instead of III/168/catalog)"%(catalog)
-        url.close()
+        finally:
+            http.release(filen)
         logger.info('Querying GATOR source %s (%d)'%(catalog,(results is not None and len(results) or 0)))
         return results,units,comms
 
@@ -252,23 +255,13 @@ def txt2recarray(filename):
         units_ = [head.strip() for head in comms[2].split('|')[1:-1]]
         #-- define dtypes for record array
         dtypes = np.dtype([(i,j) for i,j in zip(names,formats)])
-        #-- remove spaces or empty values
-        cols = []
-        for i,key in enumerate(names):
-            units[key] = units_[i]
-            if len(data)==0: break
-            col = data[:,i]
-            #-- fill empty or null values with nan
-            col = [(row.isspace() or not row or row=='null') and 'nan' or row for row in col]
-            cols.append(col)
-            
-        #-- define columns for record array and construct record array
+        units = dict(zip(names,units_))
+        #-- define columns for record array (empty or null values are filled
+        #   with nan) and construct record array
         if len(data)==0:
             results = None
         else:
-            cols = np.array(cols)
-            cols = [np.cast[dtypes[i]](cols[i]) for i in range(len(cols))]
-            results = np.rec.array(cols, dtype=dtypes)
+            results = ascii.str2recarray(data,dtypes,null_values=['null'])
     return results,units,comms
 
 
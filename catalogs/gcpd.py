@@ -15,6 +15,7 @@ from ivs.catalogs import sesame
 from ivs.catalogs import vizier
 from ivs.sed import filters
 from ivs.units import conversions
+from ivs.io import http
 
 #-- the photometric systems in GCPD are represented by a number
 systems = {'JOHNSON':1,
@@ -52,7 +53,7 @@ def search(name,**kwargs):
     
     #-- the data is listed in two lines: one with the header, one with
     #   the values
-    webpage = urllib.urlopen(base_url)
+    webpage = http.urlopen(base_url)
     entries,values = None,None
     log_message = '0'
     start = -1
@@ -105,6 +105,16 @@ To ensure a fast lookup of datafiles, an overview file C{HermesFullDataOverview.
 is created via L{make_data_overview}. The file resides in one of the C{IVSdata}
 directories, and there should also exist a copy at C{/STER/mercator/hermes/}.
 
+Next to the TSV file, L{make_data_overview} keeps an indexed SQLite version of
+the overview (C{HermesFullDataOverview.db}, location set by the module variable
+C{overviewIndex}). It has indexes on the normalised object name, the date of
+observation, the program ID and the declination, so that L{search} only reads
+the matching rows instead of the complete overview. When the index does not
+exist, L{search} falls back to the TSV file. The FITS headers of new files are
+read in parallel; set the number of processes with C{threads}:
+
+>>> make_data_overview(threads=8)
+
 The best strategy to keep the file up-to-date is by running this module in the
 background in a terminal, via (probably on pleiad22)::
 
@@ -138,6 +148,10 @@ and everything should be fine.
 @var tempDir: Path to temporary directory where files nessessary for hermesVR to run
               can be copied to. You need write permission in this directory. The 
               default is set to '/scratch/user/'
+
+@var overviewIndex: Path to the indexed (SQLite) version of the Hermes overview
+                    file. By default this is set to
+                    '/STER/mercator/hermes/HermesFullDataOverview.db'.
 """
 import re
 import os
@@ -149,10 +163,12 @@ import logging
 import getpass
 import datetime
 import subprocess
+import sqlite3
 import numpy as np
 import pyfits
 
 import copy
+from multiprocessing import Pool
 from lxml import etree
 from xml.etree import ElementTree as ET
 from collections import defaultdict
@@ -169,6 +185,17 @@ from ivs.spectra import tools as sptools
 
 hermesDir = os.path.expanduser('~/')
 tempDir = '/scratch/%s/'%(getpass.getuser())
+overviewIndex = os.path.join(config.ivs_dirs['hermes'],'HermesFullDataOverview.db')
+
+#-- columns of the overview file, with their dtype in the record array and
+#   their type in the indexed overview
+_overview_columns = [('unseq','i','INTEGER'),('prog_id','i','INTEGER'),
+                     ('obsmode','a20','TEXT'),('bvcor','>f8','REAL'),
+                     ('observer','a50','TEXT'),('object','a50','TEXT'),
+                     ('ra','>f8','REAL'),('dec','>f8','REAL'),('bjd','>f8','REAL'),
+                     ('exptime','>f8','REAL'),('pmtotal','>f8','REAL'),
+                     ('date-avg','a30','TEXT'),('airmass','>f8','REAL'),
+                     ('filename','a200','TEXT')]
 
 logger = logging.getLogger("CAT.HERMES")
 logger.addHandler(loggers.NullHandler())
@@ -207,6 +234,8 @@ def search(ID=None,time_range=None,prog_ID=None,data_type='cosmicsremoved_log',
     
     This functions needs a C{HermesFullDataOverview.tsv} file located in one
     of the datadirectories from C{config.py}, and subdirectory C{catalogs/hermes}.
+    If the indexed version of the overview (C{overviewIndex}) exists, only
+    the matching rows are read from it.
     
     If this file does not exist, you can create it with L{make_data_overview}.
     
@@ -286,29 +315,37 @@ def search(ID=None,time_range=None,prog_ID=None,data_type='cosmicsremoved_log',
     as their location (column 'filename')
     @rtype: numpy rec array
     """
-    #-- read in the data from the overview file, and get SIMBAD information
-    #   of the star
-    ctlFile = '/STER/mercator/hermes/HermesFullDataOverview.tsv'
-    data = ascii.read2recarray(ctlFile, splitchar='\t')
-    #data = ascii.read2recarray(config.get_datafile(os.path.join('catalogs','hermes'),'HermesFullDataOverview.tsv'),splitchar='\t')
-    keep = np.array(np.ones(len(data)),bool)
-    #-- confined search within given time range
+    #-- get the time range and SIMBAD information of the star
     if time_range is not None:
         if isinstance(time_range,str):
             time_range = _timestamp2datetime(time_range)
             time_range = (time_range,time_range+datetime.timedelta(days=1))
         else:
             time_range = (_timestamp2datetime(time_range[0]),_timestamp2datetime(time_range[1]))
-        keep = keep & np.array([(time_range[0]<=_timestamp2datetime(i)<=time_range[1]) for i in data['date-avg']],bool)
         info = None
-        
-    
-    #-- search on ID
     if ID is not None:
         info = sesame.search(ID)
+        ID = ID.replace(' ','').replace('.','').replace('+','').replace('-','').replace('*','')
+    
+    #-- read in the data from the overview file: from the index, we only need
+    #   to read the candidate matches. The selection below is then repeated
+    #   on this subset.
+    if os.path.isfile(overviewIndex):
+        position = (ID is not None and info) and (info['jradeg'],info['jdedeg'],radius/60.) or None
+        data = _query_overview(overviewIndex,time_range=time_range,name=ID,
+                               position=position,prog_ID=prog_ID)
+    else:
+        ctlFile = os.path.join(config.ivs_dirs['hermes'],'HermesFullDataOverview.tsv')
+        data = ascii.read2recarray(ctlFile, splitchar='\t')
+    #data = ascii.read2recarray(config.get_datafile(os.path.join('catalogs','hermes'),'HermesFullDataOverview.tsv'),splitchar='\t')
+    keep = np.array(np.ones(len(data)),bool)
+    #-- confined search within given time range
+    if time_range is not None:
+        keep = keep & np.array([(time_range[0]<=_timestamp2datetime(i)<=time_range[1]) for i in data['date-avg']],bool)
     
+    #-- search on ID
+    if ID is not None:
         #-- first search on object name only
-        ID = ID.replace(' ','').replace('.','').replace('+','').replace('-','').replace('*','')
         match_names = np.array([objectn.replace(' ','').replace('.','').replace('+','').replace('-','').replace('*','') for objectn in data['object']],str)
         keep_id = [((((ID in objectn) or (objectn in ID)) and len(objectn)) and True or False) for objectn in match_names]
         keep_id = np.array(keep_id)
@@ -344,25 +381,26 @@ def search(ID=None,time_range=None,prog_ID=None,data_type='cosmicsremoved_log',
     #   If not, we calculate it here, but only if the object was found in
     #   SIMBAD. Else, we have no information on the ra and dec (if bvcorr was
     #   not calculated, ra and dec are not in the header).
-    for obs in data:
-        if ID is not None and info:
+    #   The corrections of all spectra are computed at once.
+    if ID is not None and info and len(data):
+        jds = np.zeros(len(data))
+        for i,obs in enumerate(data):
             try:
-                jd  = _timestamp2jd(obs['date-avg'])
+                jds[i] = _timestamp2jd(obs['date-avg'])
             except ValueError:
                 logger.info('Header probably corrupted for unseq {}: no info on time or barycentric correction'.format(obs['unseq']))
-                jd = np.nan
+                jds[i] = np.nan
             # the previous line is equivalent to:
             # day = dateutil.parser.parse(header['DATE-AVG'])
             # BJD = ephem.julian_date(day)
-            bvcorr, hjd = helcorr(ra/360.*24, dec, jd)
-        else:
-            break
-        if np.isnan(obs['bvcor']):
-            logger.info("Corrected 'bvcor' for unseq {} (missing in header)".format(obs['unseq']))
-            obs['bvcor'] = float(bvcorr)
-        if np.isnan(obs['bjd']):
-            logger.info("Corrected 'bjd' for unseq {} (missing in header)".format(obs['unseq']))
-            obs['bjd'] = float(hjd)
+        bvcorrs, hjds = helcorr(ra/360.*24, dec, jds)
+        for obs,bvcorr,hjd in zip(data,bvcorrs,hjds):
+            if np.isnan(obs['bvcor']):
+                logger.info("Corrected 'bvcor' for unseq {} (missing in header)".format(obs['unseq']))
+                obs['bvcor'] = float(bvcorr)
+            if np.isnan(obs['bjd']):
+                logger.info("Corrected 'bjd' for unseq {} (missing in header)".format(obs['unseq']))
+                obs['bjd'] = float(hjd)
         
     
     #-- do we need the information as a file, or as a numpy array?
@@ -1030,7 +1068,7 @@ class HermesCCF(object):
 
 #{ Administrator functions
 
-def make_data_overview():
+def make_data_overview(threads=1,index=None):
     """
     Summarize all Hermes data in a file for easy data retrieval.
     
@@ -1061,7 +1099,21 @@ def make_data_overview():
     >>> hermes_file = config.get_datafile(os.path.join('catalogs','hermes'),'HermesFullDataOverview.tsv')
     >>> data = ascii.read2recarray(hermes_file,splitchar='\\t')
     
+    The same information is stored in an indexed SQLite database (C{index},
+    by default C{overviewIndex}), which is used by L{search}. Only files that
+    are not yet in the overview are scanned, so the overview can be brought
+    up to date incrementally. Rows that are in the TSV file but not yet in the
+    index are copied without reading their headers again.
+    
+    @param threads: number of processes to read the FITS headers with
+    @type threads: int
+    @param index: name of the indexed overview file
+    @type index: str
+    @return: name of the overview file
+    @rtype: str
     """
+    if index is None:
+        index = overviewIndex
     logger.info('Collecting files...')
     #-- all hermes data directories
     dirs = sorted(glob.glob(os.path.join(config.ivs_dirs['hermes'],'20??????')))
@@ -1088,53 +1140,206 @@ def make_data_overview():
         outfile = open(overview_file,'w')
         outfile.write('#unseq prog_id obsmode bvcor observer object ra dec bjd exptime pmtotal date-avg airmass filename\n')
         outfile.write('#i i a20 >f8 a50 a50 >f8 >f8 >f8 >f8 >f8 a30 >f8 a200\n')
-        overview_data = {'filename':[]}
+        overview_data = None
         logger.info('Found %d FITS files: starting new overview file %s'%(len(obj_files),overview_file))
     
-    #-- and summarize the contents in a tab separated file (some columns contain spaces)
-    existing_files = np.sort(overview_data['filename'])
-    for i,obj_file in enumerate(obj_files):
-        sys.stdout.write(chr(27)+'[s') # save cursor
-        sys.stdout.write(chr(27)+'[2K') # remove line
-        sys.stdout.write('Scanning %5d / %5d FITS files'%(i+1,len(obj_files)))
-        sys.stdout.flush() # flush to screen
-        
-        #-- maybe this file is already processed: forget about it then
-        index = existing_files.searchsorted(obj_file)
-        if index<len(existing_files) and existing_files[index]==obj_file:
+    #-- bring the index up to date with the rows that are already in the file
+    conn = _open_overview(index)
+    indexed_files = set([row[0] for row in conn.execute('SELECT filename FROM overview')])
+    if overview_data is not None:
+        rows = [_overview_row(dict(zip(overview_data.dtype.names,record))) for record in overview_data.tolist()]
+        rows = [row for row in rows if not row[13] in indexed_files]
+        conn.executemany(_overview_insert,rows)
+        conn.commit()
+        indexed_files.update([row[13] for row in rows])
+        logger.info('Copied %d rows from overview file to index %s'%(len(rows),index))
+        existing_files = set(overview_data['filename'])
+    else:
+        existing_files = set()
+    
+    #-- maybe a file is already processed: forget about it then
+    obj_files = [obj_file for obj_file in obj_files if not obj_file in existing_files]
+    
+    #-- and summarize the contents in a tab separated file (some columns
+    #   contain spaces). The headers are read in parallel, but the results
+    #   come back in the original order of the files.
+    if threads>1 and len(obj_files)>1:
+        pool = Pool(min(threads,len(obj_files)))
+        all_contents = pool.imap(_header2contents,obj_files,chunksize=16)
+    else:
+        pool = None
+        all_contents = (_header2contents(obj_file) for obj_file in obj_files)
+    try:
+        rows = []
+        for i,contents in enumerate(all_contents):
+            sys.stdout.write(chr(27)+'[s') # save cursor
+            sys.stdout.write(chr(27)+'[2K') # remove line
+            sys.stdout.write('Scanning %5d / %5d FITS files'%(i+1,len(obj_files)))
+            sys.stdout.flush() # flush to screen
+            
+            outfile.write('%(unseq)d\t%(prog_id)d\t%(obsmode)s\t%(bvcor)f\t%(observer)s\t%(object)s\t%(ra)f\t%(dec)f\t%(bjd)f\t%(exptime)f\t%(pmtotal)f\t%(date-avg)s\t%(airmass)f\t%(filename)s\n'%contents)
+            outfile.flush()
+            if not contents['filename'] in indexed_files:
+                rows.append(_overview_row(contents))
+            #-- commit regularly, such that an interrupted scan is not lost
+            if len(rows)>=500:
+                conn.executemany(_overview_insert,rows)
+                conn.commit()
+                rows = []
             sys.stdout.write(chr(27)+'[u') # reset cursor
-            continue
-        
-        #-- keep track of: UNSEQ, PROG_ID, OBSMODE, BVCOR, OBSERVER, 
-        #                  OBJECT, RA, DEC, BJD, EXPTIME, DATE-AVG, PMTOTAL,
-        #                  airmass and filename (not part of fitsheader)
-        contents = dict(unseq=-1,prog_id=-1,obsmode='nan',bvcor=np.nan,observer='nan',
-                        object='nan',ra=np.nan,dec=np.nan,
-                        bjd=np.nan,exptime=np.nan,pmtotal=np.nan,airmass=np.nan,
-                        filename=os.path.realpath(obj_file))
-        contents['date-avg'] = 'nan'
-        header = pyfits.getheader(obj_file)
-        for key in contents:
-            if key in header and key in ['unseq','prog_id']:
-                try: contents[key] = int(header[key])
-                except: pass
-            elif key in header and key in ['obsmode','observer','object','date-avg']:
-                contents[key] = str(header[key])
-            elif key in header and key in ['ra','dec','exptime','pmtotal','bjd','bvcor']:
-                contents[key] = float(header[key])
-            elif key=='airmass' and 'telalt' in header:
-                if float(header['telalt'])<90:
-                    try:
-                        contents[key] = airmass.airmass(90-float(header['telalt']))
-                    except ValueError:
-                        pass
-                
-        outfile.write('%(unseq)d\t%(prog_id)d\t%(obsmode)s\t%(bvcor)f\t%(observer)s\t%(object)s\t%(ra)f\t%(dec)f\t%(bjd)f\t%(exptime)f\t%(pmtotal)f\t%(date-avg)s\t%(airmass)f\t%(filename)s\n'%contents)
-        outfile.flush()
-        sys.stdout.write(chr(27)+'[u') # reset cursor
-    outfile.close()
+        conn.executemany(_overview_insert,rows)
+        conn.commit()
+    finally:
+        if pool is not None:
+            pool.terminate()
+        outfile.close()
+        conn.close()
     return overview_file
 
+def _header2contents(obj_file):
+    """
+    Extract the overview information from the header of a Hermes FITS file.
+    
+    @param obj_file: name of the FITS file
+    @type obj_file: str
+    @return: overview information (see L{make_data_overview})
+    @rtype: dict
+    """
+    #-- keep track of: UNSEQ, PROG_ID, OBSMODE, BVCOR, OBSERVER, 
+    #                  OBJECT, RA, DEC, BJD, EXPTIME, DATE-AVG, PMTOTAL,
+    #                  airmass and filename (not part of fitsheader)
+    contents = dict(unseq=-1,prog_id=-1,obsmode='nan',bvcor=np.nan,observer='nan',
+                    object='nan',ra=np.nan,dec=np.nan,
+                    bjd=np.nan,exptime=np.nan,pmtotal=np.nan,airmass=np.nan,
+                    filename=os.path.realpath(obj_file))
+    contents['date-avg'] = 'nan'
+    header = pyfits.getheader(obj_file)
+    for key in contents:
+        if key in header and key in ['unseq','prog_id']:
+            try: contents[key] = int(header[key])
+            except: pass
+        elif key in header and key in ['obsmode','observer','object','date-avg']:
+            contents[key] = str(header[key])
+        elif key in header and key in ['ra','dec','exptime','pmtotal','bjd','bvcor']:
+            contents[key] = float(header[key])
+        elif key=='airmass' and 'telalt' in header:
+            if float(header['telalt'])<90:
+                try:
+                    contents[key] = airmass.airmass(90-float(header['telalt']))
+                except ValueError:
+                    pass
+    return contents
+
+_overview_insert = 'INSERT OR IGNORE INTO overview VALUES (%s)'%(','.join(16*['?']))
+
+def _normalise_name(name):
+    """
+    Remove spaces, dots, plus and minus signs and asterisks from a name.
+    """
+    return name.replace(' ','').replace('.','').replace('+','').replace('-','').replace('*','')
+
+def _timestamp2epoch(timestamp):
+    """
+    Convert the time stamp from a HERMES FITS 'date-avg' to seconds since 1970.
+    
+    Unreadable time stamps are converted to C{None}.
+    """
+    if not isinstance(timestamp,datetime.datetime):
+        try:
+            timestamp = _timestamp2datetime(timestamp)
+        except ValueError:
+            return None
+    delta = timestamp - datetime.datetime(1970,1,1)
+    return delta.days*86400. + delta.seconds + delta.microseconds*1e-6
+
+def _overview_row(contents):
+    """
+    Convert the overview information of one file to a row in the index.
+    """
+    row = []
+    for name,dtype,sqltype in _overview_columns:
+        if sqltype=='INTEGER':
+            row.append(int(contents[name]))
+        elif sqltype=='REAL':
+            row.append(float(contents[name]))
+        else:
+            row.append(str(contents[name]))
+    return tuple(row) + (_normalise_name(row[5]),_timestamp2epoch(row[11]))
+
+def _open_overview(index):
+    """
+    Open (and create if necessary) the indexed overview.
+    
+    @param index: name of the SQLite file
+    @type index: str
+    @return: connection to the database
+    @rtype: sqlite3.Connection
+    """
+    conn = sqlite3.connect(index)
+    conn.text_factory = str
+    columns = ['"%s" %s'%(name,sqltype) for name,dtype,sqltype in _overview_columns]
+    conn.execute('CREATE TABLE IF NOT EXISTS overview (%s, objname TEXT, epoch REAL)'%(', '.join(columns)))
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS overview_filename ON overview (filename)')
+    conn.execute('CREATE INDEX IF NOT EXISTS overview_objname ON overview (objname)')
+    conn.execute('CREATE INDEX IF NOT EXISTS overview_epoch ON overview (epoch)')
+    conn.execute('CREATE INDEX IF NOT EXISTS overview_prog_id ON overview (prog_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS overview_dec ON overview (dec,ra)')
+    conn.commit()
+    return conn
+
+def _query_overview(index,time_range=None,name=None,position=None,prog_ID=None):
+    """
+    Read the candidate matches to a search from the indexed overview.
+    
+    The selection is a superset of the one made in L{search}: the time range
+    is widened by one second, and the positional search uses a box instead
+    of a circle.
+    
+    @param index: name of the SQLite file
+    @type index: str
+    @param time_range: start and end of the time range
+    @type time_range: tuple of datetime
+    @param name: normalised object name
+    @type name: str
+    @param position: ra, dec and radius of the positional search (degrees)
+    @type position: tuple of floats
+    @param prog_ID: program ID
+    @type prog_ID: int
+    @return: overview information, as it is read from the TSV file
+    @rtype: numpy rec array
+    """
+    conditions,values = [],[]
+    if time_range is not None:
+        conditions.append('epoch BETWEEN ? AND ?')
+        values += [_timestamp2epoch(time_range[0])-1,_timestamp2epoch(time_range[1])+1]
+    if name is not None:
+        condition = "(objname!='' AND (instr(objname,?)>0 OR instr(?,objname)>0))"
+        values += [name,name]
+        if position is not None:
+            ra,dec,radius = position
+            condition = '(%s OR (dec BETWEEN ? AND ? AND ra BETWEEN ? AND ?))'%(condition)
+            values += [dec-radius,dec+radius,ra-radius,ra+radius]
+        conditions.append(condition)
+    if prog_ID is not None:
+        conditions.append('prog_id=?')
+        values.append(int(prog_ID))
+    query = 'SELECT %s FROM overview'%(','.join(['"%s"'%(name) for name,dtype,sqltype in _overview_columns]))
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    query += ' ORDER BY rowid'
+    
+    conn = sqlite3.connect(index)
+    conn.text_factory = str
+    try:
+        rows = conn.execute(query,values).fetchall()
+    finally:
+        conn.close()
+    #-- NaNs are stored as NULL
+    rows = [tuple([(value is None) and np.nan or value for value in row]) for row in rows]
+    dtype = [(name,dtype) for name,dtype,sqltype in _overview_columns]
+    logger.debug('Read %d rows from overview index %s'%(len(rows),index))
+    return np.rec.array(np.array(rows,dtype=dtype))
+
 def _derive_filelocation_from_raw(rawfile,data_type):
     """
     Derive the location of a reduced file from the raw file.
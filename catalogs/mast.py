@@ -179,6 +179,9 @@ def search(catalog,**kwargs):
     catalog). The entries in the dictionary are of type C{ndarray}, and will
     be converted to a float-array if possible. If not, the array will consist
     of strings. The comments are also returned as a list of strings.
+    
+    Responses are kept in a local cache, so repeating a query does not
+    download the results again (see L{ivs.io.http.retrieve}).
         
     
     @param catalog: name of a MAST mission catalog
@@ -197,14 +200,11 @@ def search(catalog,**kwargs):
     
     #-- gradually build URI
     base_url = _get_URI(catalog,**kwargs)
-    #-- prepare to open URI
-    
-    url = urllib.URLopener()
-    filen,msg = url.retrieve(base_url,filename=filename)
+    #-- retrieve the response, from the local cache if possible
+    filen = http.retrieve(base_url,filename=filename)
     #   maybe we are just interest in the file, not immediately in the content
     if filename is not None:
         logger.info('Querying MAST source %s and downloading to %s'%(catalog,filename))
-        url.close()
         return filen
     
     #   otherwise, we read everything into a dictionary
@@ -214,10 +214,10 @@ def search(catalog,**kwargs):
             results,units,comms = csv2recarray(filen)
         #-- raise an exception when multiple catalogs were specified
         except ValueError:
-            url.close()
             #raise ValueError, "failed to read %s, perhaps multiple catalogs specified (e.g. III/168 instead of III/168/catalog)"%(catalog)
             results,units,comms = None,None,None
-        url.close()
+        finally:
+            http.release(filen)
         logger.info('Querying MAST source %s (%d)'%(catalog,(results is not None and len(results) or 0)))
         return results,units,comms
     else:
@@ -344,7 +344,7 @@ def csv2recarray(filename):
     @return: catalog data columns, units, comments
     @rtype: record array, dict, list of str
     """
-    data,comms = ascii.read2array(filename,dtype=np.str,splitchar=',',return_comments=True)
+    data,comms = ascii.read2strarray(filename,splitchar=',',return_comments=True)
     results = None
     units = {}
     #-- retrieve the data and put it into a record array
@@ -355,31 +355,24 @@ def csv2recarray(filename):
         #   Fortran format. In rare cases, columns contain multiple values
         #   themselves (so called vectors). In those cases, we interpret
         #   the contents as a long string
-        formats = np.zeros_like(data[0])
-        for i,fmt in enumerate(data[1]):
-            if 'string' in fmt or fmt=='datetime': formats[i] = 'a100'
-            if fmt=='integer': formats[i] = 'f8'
-            if fmt=='ra': formats[i] = 'f8'
-            if fmt=='dec': formats[i] = 'f8'
-            if fmt=='float': formats[i] = 'f8'
+        formats = []
+        for fmt in data[1]:
+            if 'string' in fmt or fmt=='datetime': formats.append('a100')
+            elif fmt in ['integer','ra','dec','float']: formats.append('f8')
+            else: formats.append('')
         #-- define dtypes for record array
         dtypes = np.dtype([(i,j) for i,j in zip(data[0],formats)])
-        #-- remove spaces or empty values
-        cols = []
-        for i,key in enumerate(data[0]):
-             col = data[2:,i]
-             #-- fill empty values with nan
-             cols.append([(row.isspace() or not row) and np.nan or row for row in col])
-             #-- fix unit name
-             for source in cat_info.sections():
-                if cat_info.has_option(source,data[0,i]+'_unit'):
-                    units[key] = cat_info.get(source,data[0,i]+'_unit')
+        #-- fix unit names
+        for key in data[0]:
+            for source in cat_info.sections():
+                if cat_info.has_option(source,key+'_unit'):
+                    units[key] = cat_info.get(source,key+'_unit')
                     break
-             else:  
+            else:
                 units[key] = 'nan'
-        #-- define columns for record array and construct record array
-        cols = [np.cast[dtypes[i]](cols[i]) for i in range(len(cols))]
-        results = np.rec.array(cols, dtype=dtypes)
+        #-- define columns for record array (empty values are filled with
+        #   nan) and construct record array
+        results = ascii.str2recarray(data[2:],dtypes)
     else:
         results = None
         units = {}
@@ -7,6 +7,7 @@ import logging
 
 import numpy as np
 from ivs.units import conversions
+from ivs.io import http
 from ivs.aux import xmlparser
 from ivs.catalogs import vizier
 
@@ -145,21 +146,25 @@ def search(ID,db='S',fix=False):
     @rtype: dictionary
     """
     base_url = get_URI(ID,db=db)
-    ff = urllib.urlopen(base_url)
-    xmlpage = ""
-    for line in ff.readlines():
-        line_ = line[::-1].strip(' ')[::-1]
-        if line_[0]=='<':
-            line = line_
-        xmlpage+=line.strip('\n')
-    database = xmlparser.XMLParser(xmlpage).content
+    filen = http.retrieve(base_url)
     try:
-        database = database['Sesame']['Target']['%s'%(db)]['Resolver']
-        database = database[database.keys()[0]]
-    except KeyError,IndexError:
-        #-- we found nothing!
-        database = {}
-    ff.close()
+        ff = open(filen,'r')
+        xmlpage = ""
+        for line in ff.readlines():
+            line_ = line[::-1].strip(' ')[::-1]
+            if line_[0]=='<':
+                line = line_
+            xmlpage+=line.strip('\n')
+        ff.close()
+        database = xmlparser.XMLParser(xmlpage).content
+        try:
+            database = database['Sesame']['Target']['%s'%(db)]['Resolver']
+            database = database[database.keys()[0]]
+        except KeyError,IndexError:
+            #-- we found nothing!
+            database = {}
+    finally:
+        http.release(filen)
     
     if fix:
         #-- fix the parallax: make sure we have the Van Leeuwen 2007 value.
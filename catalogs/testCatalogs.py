@@ -0,0 +1,180 @@
+"""
+Unit tests covering the parsers of catalog responses (vizier, mast, gator)
+and the concurrent queries of crossmatch.
+"""
+import os
+import time
+import shutil
+import socket
+import logging
+import tempfile
+import threading
+import numpy as np
+from ivs.io import ascii
+from ivs.io import http
+from ivs.catalogs import vizier
+from ivs.catalogs import mast
+from ivs.catalogs import gator
+from ivs.catalogs import gcpd
+from ivs.catalogs import crossmatch
+
+import unittest
+
+
+class ParserTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def testStr2recarray(self):
+        """ io.ascii.str2recarray() """
+        data = np.array([[' 1.5', 'abc', 'x'], ['', ' ', 'null'], ['2e3', 'de', ' 3']])
+        rec = ascii.str2recarray(data, [('a','f8'), ('b','a5'), ('c','a4')], null_values=['null'])
+        self.assertTrue(np.isnan(rec['a'][1]))
+        self.assertEqual(rec['a'][2], 2000.)
+        self.assertEqual(list(rec['b']), ['abc', 'nan', 'de'])
+        self.assertEqual(list(rec['c']), ['x', 'nan', ' 3'])
+        rec = ascii.str2recarray(data, [('a','f8'), ('b','a5'), ('c','a4')], strip=True)
+        self.assertEqual(list(rec['c']), ['x', 'null', '3'])
+
+    def testTsv2recarray(self):
+        """ catalogs.vizier.tsv2recarray() """
+        filename = os.path.join(self.tempdir, 'test.tsv')
+        with open(filename, 'w') as ff:
+            ff.write('#RESOURCE=yCat_2246\n')
+            ff.write('#Name: II/246\n')
+            ff.write('#Column\t_r\t(F6.3)\tDistance from center\t[ucd=pos.angDistance]\n')
+            ff.write('#Column\tJmag\t(F6.3)\tJ magnitude\t[ucd=phot.mag;em.IR.J]\n')
+            ff.write('#Column\tNobs\t(I3)\tNumber of observations\t[ucd=meta.number]\n')
+            ff.write('#Column\tQflg\t(A3)\tQuality flag\t[ucd=meta.code.qual]\n')
+            ff.write('#Column\tVec\t(3F10.6E)\tVector column\t[ucd=meta.code]\n')
+            ff.write('_r\tJmag\tNobs\tQflg\tVec\n')
+            ff.write('arcsec\tmag\t\t\t\n')
+            ff.write('------\t------\t---\t---\t----------\n')
+            ff.write('12.345\t      \t\t   \t1,2,3\n')
+            ff.write(' 0.500\t 7.250\t  6\tAAB\t4,5,6\n')
+        results, units, comms = vizier.tsv2recarray(filename)
+        self.assertEqual(units['_r'], 'arcsec')
+        self.assertEqual(results.dtype.names, ('_r', 'Jmag', 'Nobs', 'Qflg', 'Vec'))
+        self.assertEqual([results.dtype[i] for i in range(5)], [np.dtype('f8')]*3 + [np.dtype('a6'), np.dtype('a103')])
+        self.assertEqual(list(results['_r']), [12.345, 0.5])
+        self.assertTrue(np.isnan(results['Jmag'][0]))
+        self.assertEqual(results['Jmag'][1], 7.25)
+        self.assertTrue(np.isnan(results['Nobs'][0]))
+        self.assertEqual(results['Nobs'][1], 6.)
+        self.assertEqual(list(results['Qflg']), ['nan', '   AAB'])
+        self.assertEqual(list(results['Vec']), ['   1,2,3', '   4,5,6'])
+
+    def testCsv2recarray(self):
+        """ catalogs.mast.csv2recarray() """
+        filename = os.path.join(self.tempdir, 'test.csv')
+        with open(filename, 'w') as ff:
+            ff.write('ra,dec,name,fuv_mag\n')
+            ff.write('ra,dec,string,float\n')
+            ff.write('279.23,38.78,vega,1.53\n')
+            ff.write('279.24,38.79, ,\n')
+        results, units, comms = mast.csv2recarray(filename)
+        self.assertEqual(results.dtype['name'], np.dtype('a100'))
+        self.assertEqual(list(results['name']), ['vega', 'nan'])
+        self.assertEqual(results['fuv_mag'][0], 1.53)
+        self.assertTrue(np.isnan(results['fuv_mag'][1]))
+
+    def testTxt2recarray(self):
+        """ catalogs.gator.txt2recarray() """
+        filename = os.path.join(self.tempdir, 'test.txt')
+        with open(filename, 'w') as ff:
+            ff.write('\\fixlen = T\n')
+            ff.write('|   ra      |   dec     |  designation  |  w1mpro |\n')
+            ff.write('|   double  |   double  |  char         |  double |\n')
+            ff.write('|   deg     |   deg     |               |  mag    |\n')
+            ff.write('   279.2347    38.7837    J183656.33+3    null    \n')
+            ff.write('   279.2400    38.7900                     1.234  \n')
+        results, units, comms = gator.txt2recarray(filename)
+        self.assertEqual(units['w1mpro'], 'mag')
+        self.assertEqual(list(results['designation']), ['J183656.33+3', 'nan'])
+        self.assertTrue(np.isnan(results['w1mpro'][0]))
+        self.assertEqual(results['w1mpro'][1], 1.234)
+        self.assertEqual(results['ra'][0], 279.2347)
+
+
+class ListHandler(logging.Handler):
+    """Keep the messages of the log records"""
+    
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+    
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class CrossmatchTestCase(unittest.TestCase):
+    """The catalog services are replaced by stand-ins that do not use the network"""
+    
+    def setUp(self):
+        self.originals = [(module, module.get_photometry) for module in [mast, gator, gcpd]]
+        self.limits = crossmatch.max_connections.copy()
+        crossmatch.max_connections.update(mast=2, gator=1, gcpd=3)
+        self.lock = threading.Lock()
+        self.active = dict(mast=0, gator=0, gcpd=0)
+        self.maximum = dict(mast=0, gator=0, gcpd=0)
+        self.timeouts = set()
+        for i, module in enumerate([mast, gator, gcpd]):
+            module.get_photometry = self.make_service(module.__name__.split('.')[-1], delay=0.02*(3-i))
+        self.handler = ListHandler()
+        logging.getLogger("CAT.XMATCH").addHandler(self.handler)
+    
+    def tearDown(self):
+        for module, function in self.originals:
+            module.get_photometry = function
+        crossmatch.max_connections.clear()
+        crossmatch.max_connections.update(self.limits)
+        logging.getLogger("CAT.XMATCH").removeHandler(self.handler)
+    
+    def make_service(self, service, delay):
+        """Stand-in for get_photometry of a service: the first service finishes last"""
+        def get_photometry(ID=None, **kwargs):
+            with self.lock:
+                self.active[service] += 1
+                self.maximum[service] = max(self.maximum[service], self.active[service])
+                timeout = http.set_timeout(None)
+                http.set_timeout(timeout)
+                self.timeouts.add(timeout)
+            try:
+                time.sleep(delay)
+                if ID == 'HD1' and service == 'gator':
+                    raise IOError('connection refused')
+                return np.rec.fromarrays([[ID], [service]], names=['ID', 'source'], formats=['S10', 'S10'])
+            finally:
+                with self.lock:
+                    self.active[service] -= 1
+        return get_photometry
+    
+    def testSample(self):
+        """ catalogs.crossmatch.get_photometry_sample() merges concurrent queries in plan order """
+        IDs = ['HD%d'%(i) for i in range(8)]
+        masters = crossmatch.get_photometry_sample(IDs, include=['mast', 'gator', 'gcpd'], threads=8, timeout=5.)
+        for ID, master in zip(IDs, masters):
+            sources = ID == 'HD1' and ['mast', 'gcpd'] or ['mast', 'gator', 'gcpd']
+            self.assertEqual(list(master['source']), sources)
+            self.assertTrue(np.all(master['ID'] == ID))
+        #-- the connection limits hold, but the services are queried concurrently
+        for service, limit in [('mast', 2), ('gator', 1), ('gcpd', 3)]:
+            self.assertTrue(1 <= self.maximum[service] <= limit)
+        self.assertTrue(max(self.maximum.values()) > 1)
+        #-- the failed query is skipped with a warning
+        self.assertEqual(len(self.handler.messages), 1)
+        self.assertTrue('gator' in self.handler.messages[0] and 'HD1' in self.handler.messages[0])
+        #-- the timeout is set per thread, not for the whole process
+        self.assertEqual(self.timeouts, set([5.]))
+        self.assertEqual(socket.getdefaulttimeout(), None)
+        self.assertEqual(http.set_timeout(None), None)
+    
+    def testSerial(self):
+        """ catalogs.crossmatch.get_photometry_sample() with a single thread """
+        masters = crossmatch.get_photometry_sample(['HD1', 'HD2'], include=['gcpd', 'mast'], threads=1)
+        self.assertEqual([list(master['source']) for master in masters], [['mast', 'gcpd'], ['mast', 'gcpd']])
+        self.assertEqual(self.maximum, dict(mast=1, gator=0, gcpd=1))
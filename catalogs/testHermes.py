@@ -1,11 +1,13 @@
 import os
 import nose
 import shutil
+import tempfile
 import getpass
 import numpy as np
 import pylab as pl
 from ivs.catalogs import hermes
 from ivs.io import fits
+from ivs.io import ascii
 
 import unittest
 try:
@@ -693,3 +695,86 @@ class TestCase6RunHermesVR(HermesTestCase):
     
     
         
+
+
+class TestCase7DataOverview(unittest.TestCase):
+    """catalogs.hermes make_data_overview and the indexed search"""
+    
+    def setUp(self):
+        import pyfits
+        from ivs import config
+        self.cwd = os.getcwd()
+        self.hermes_dir = config.ivs_dirs['hermes']
+        self.overviewIndex = hermes.overviewIndex
+        self.sesame_search = hermes.sesame.search
+        self.testdir = tempfile.mkdtemp()
+        config.ivs_dirs['hermes'] = self.testdir
+        os.chdir(self.testdir)
+        hermes.sesame.search = lambda ID: dict(jradeg=98.1, jdedeg=-0.99)
+        
+        names = ['HD 50230', 'HD50230', 'Vega', '', 'BD+20 307']
+        for n in range(40):
+            rawdir = os.path.join(self.testdir, '2010%02d%02d'%(n%12+1, n%28+1), 'raw')
+            if not os.path.isdir(rawdir):
+                os.makedirs(rawdir)
+            header = pyfits.Header()
+            header['unseq'] = n
+            header['prog_id'] = n%3
+            header['object'] = names[n%5]
+            header['ra'] = 98. + n*0.01
+            header['dec'] = -1. + 0.001*n
+            if n%4: header['bjd'] = 2455000. + n
+            header['date-avg'] = '2010-%02d-%02dT0%d:00:00.5'%(n%12+1, n%28+1, n%10)
+            header['telalt'] = 60.
+            pyfits.writeto(os.path.join(rawdir, '%08d_HRF_OBJ.fits'%(n)), np.zeros(2), header)
+    
+    def tearDown(self):
+        from ivs import config
+        config.ivs_dirs['hermes'] = self.hermes_dir
+        hermes.overviewIndex = self.overviewIndex
+        hermes.sesame.search = self.sesame_search
+        os.chdir(self.cwd)
+        shutil.rmtree(self.testdir)
+    
+    def search(self, **kwargs):
+        """Search with and without the index"""
+        hermes.overviewIndex = os.path.join(self.testdir, 'HermesFullDataOverview.db')
+        indexed = hermes.search(data_type='raw', **kwargs)
+        hermes.overviewIndex = os.path.join(self.testdir, 'nonexisting.db')
+        scanned = hermes.search(data_type='raw', **kwargs)
+        return indexed, scanned
+    
+    def test1index(self):
+        """catalogs.hermes make_data_overview index equals TSV file"""
+        index = os.path.join(self.testdir, 'HermesFullDataOverview.db')
+        hermes.make_data_overview(threads=2, index=index)
+        data = ascii.read2recarray('HermesFullDataOverview.tsv', splitchar='\t')
+        indexed = hermes._query_overview(index)
+        self.assertEqual(data.dtype, indexed.dtype)
+        self.assertEqual(len(indexed), 40)
+        for name in data.dtype.names:
+            if data.dtype[name].kind=='f':
+                equal = np.isnan(data[name]) == np.isnan(indexed[name])
+                equal[~np.isnan(data[name])] = np.abs(data[name]-indexed[name])[~np.isnan(data[name])]<1e-5
+                self.assertTrue(np.all(equal), msg=name)
+            else:
+                self.assertTrue(np.all(data[name]==indexed[name]), msg=name)
+        
+        #-- nothing new is added the second time, and a new index is
+        #   filled from the TSV file
+        hermes.make_data_overview(index=index)
+        self.assertEqual(len(hermes._query_overview(index)), 40)
+        os.remove(index)
+        hermes.make_data_overview(index=index)
+        self.assertEqual(len(hermes._query_overview(index)), 40)
+    
+    def test2search(self):
+        """catalogs.hermes search with index equals search without index"""
+        hermes.make_data_overview(index=os.path.join(self.testdir, 'HermesFullDataOverview.db'))
+        for kwargs in [dict(ID='HD50230'), dict(ID='HD50230', radius=0.1),
+                       dict(time_range=('2010-3-1', '2010-6-1')),
+                       dict(ID='Vega', prog_ID=1),
+                       dict(ID='BD+20307', time_range=('2010-3-1', '2010-12-1'), prog_ID=2)]:
+            indexed, scanned = self.search(**kwargs)
+            self.assertEqual(list(indexed['unseq']), list(scanned['unseq']), msg=str(kwargs))
+            self.assertTrue(len(indexed)>0, msg=str(kwargs))
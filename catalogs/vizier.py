@@ -167,6 +167,9 @@ def search(name,filetype='tsv',filename=None,**kwargs):
     possible. If not, the array will consist of strings. The comments are also
     returned as a list of strings.
     
+    Responses are kept in a local cache, so repeating a query does not
+    download the results again (see L{ivs.io.http.retrieve}).
+    
     WARNING: when retrieving a FITS file, ViZieR sometimes puts weird formats
     into the header ('3F10.6E' in the 2MASS catalog), which cannot be read by
     the C{pyfits} module. These columns are actually multi-dimensional vectors.
@@ -220,13 +223,13 @@ def search(name,filetype='tsv',filename=None,**kwargs):
     #-- gradually build URI
     base_url = _get_URI(name=name,**kwargs)
     
-    #-- prepare to open URI
-    url = urllib.URLopener()
-    filen,msg = url.retrieve(base_url,filename=filename)
+    #-- retrieve the response, from the local cache if possible. The mirrors
+    #   all serve the same content, so the host is left out of the cache key.
+    cache_key = base_url.replace(mirrors['current'],'vizier')
+    filen = http.retrieve(base_url,filename=filename,key=cache_key)
     #   maybe we are just interest in the file, not immediately in the content
     if filename is not None:
         logger.info('Querying ViZieR source %s and downloading to %s'%(name,filen))
-        url.close()
         return filen
     
     #   otherwise, we read everything into a dictionary
@@ -236,7 +239,8 @@ def search(name,filetype='tsv',filename=None,**kwargs):
         #-- raise an exception when multiple catalogs were specified
         except ValueError:
             raise ValueError, "failed to read %s, perhaps multiple catalogs specified (e.g. III/168 instead of III/168/catalog)"%(name)
-        url.close()
+        finally:
+            http.release(filen)
         logger.info('Querying ViZieR source %s (%d)'%(name,(results is not None and len(results) or 0)))
         return results,units,comms
     
@@ -758,7 +762,7 @@ def tsv2recarray(filename):
     @return: catalog data columns, units, comments
     @rtype: record array, dict, list of str
     """
-    data,comms = ascii.read2array(filename,dtype=np.str,splitchar='\t',return_comments=True)
+    data,comms = ascii.read2strarray(filename,splitchar='\t',return_comments=True)
     results = None
     units = {}
     #-- retrieve the data and put it into a record array
@@ -769,39 +773,35 @@ def tsv2recarray(filename):
         #   Fortran format. In rare cases, columns contain multiple values
         #   themselves (so called vectors). In those cases, we interpret
         #   the contents as a long string
-        formats = np.zeros_like(data[0])
-        for line in comms:                  
+        column_formats = {}
+        for line in comms:
             line = line.split('\t')
-            if len(line)<3: continue
-            for i,key in enumerate(data[0]):
-                if key == line[1] and line[0]=='Column': # this is the line with information
-                    formats[i] = line[2].replace('(','').replace(')','').lower()
-                    if formats[i][0].isdigit(): formats[i] = 'a100'
-                    elif 'f' in formats[i]: formats[i] = 'f8' # floating point
-                    elif 'i' in formats[i]: formats[i] = 'f8' # integer, but make it float to contain nans
-                    elif 'e' in formats[i]: formats[i] = 'f8' # exponential
-                    #-- see remark about the nans a few lines down
-                    if formats[i][0]=='a':
-                        formats[i] = 'a'+str(int(formats[i][1:])+3)
+            if len(line)>=3 and line[0]=='Column': # this is the line with information
+                column_formats[line[1]] = line[2]
+        formats = []
+        for key in data[0]:
+            fmt = column_formats.get(key,'').replace('(','').replace(')','').lower()
+            if not fmt: pass
+            elif fmt[0].isdigit(): fmt = 'a100'
+            elif 'f' in fmt: fmt = 'f8' # floating point
+            elif 'i' in fmt: fmt = 'f8' # integer, but make it float to contain nans
+            elif 'e' in fmt: fmt = 'f8' # exponential
+            #-- see remark about the nans a few lines down
+            if fmt and fmt[0]=='a':
+                fmt = 'a'+str(int(fmt[1:])+3)
+            formats.append(fmt)
         #-- define dtypes for record array
         dtypes = np.dtype([(i,j) for i,j in zip(data[0],formats)])
-        #-- remove spaces or empty values
-        cols = []
-        for i,key in enumerate(data[0]):
-             col = data[3:,i]
-             #-- fill empty values with nan, and make sure each string in the
-             #   array is at least three spaces long (otherwise we cannot fit
-             #   'nan' in the row and the casting will not work properly in a
-             #   few lines
-             cols.append([(row.isspace() or not row) and np.nan or 3*' '+row for row in col])
-             #-- fix unit name
-             #if source in cat_info.sections() and cat_info.has_option(source,data[1,i]):
-             #   units[key] = cat_info.get(source,data[1,i])
-             #else:  
-             units[key] = data[1,i]
+        units = dict(zip(data[0],data[1]))
+        #-- empty values are filled with nan. Non-empty strings get a three
+        #   space prefix, the string columns are three characters wider to
+        #   make sure 'nan' fits.
+        cols = np.array(data[3:],dtype='S%d'%(data.dtype.itemsize+3))
+        for i in range(len(formats)):
+            if dtypes[i].kind=='S':
+                cols[:,i] = np.char.add(3*' ',data[3:,i])
         #-- define columns for record array and construct record array
-        cols = [np.cast[dtypes[i]](cols[i]) for i in range(len(cols))]
-        results = np.rec.array(cols, dtype=dtypes)
+        results = ascii.str2recarray(cols,dtypes)
     return results,units,comms
 
 def vizier2phot(source,results,units,master=None,e_flag='e_',q_flag='q_',extra_fields=None,take_mean=False):
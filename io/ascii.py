@@ -171,6 +171,97 @@ def read2recarray(filename,**kwargs):
     #-- and build the record array
     data = np.rec.array(data, dtype=dtype)
     return return_comments and (data,comm) or data
+
+def read2strarray(filename,splitchar=None,commentchar=['#'],return_comments=False):
+    """
+    Load an ASCII table to a 2D numpy array of strings.
+
+    This gives the same result as C{read2array(filename,dtype=str)}, but is
+    much faster for large files: when all rows have the same number of
+    entries, the whole table is split in one go instead of line by line.
+
+    @param filename: name of file with the data
+    @type filename: string
+    @param splitchar: character seperating entries in a row (default: whitespace)
+    @type splitchar: str or None
+    @param commentchar: character(s) denoting comment rules
+    @type commentchar: list of str
+    @param return_comments: flag to return comments (default: False)
+    @type return_comments: bool
+    @return: data array (, list of comments)
+    @rtype: ndarray (, list)
+    """
+    if os.path.splitext(filename)[1] == '.gz':
+        ff = gzip.open(filename)
+    else:
+        ff = open(filename)
+    lines = ff.read().split('\n')
+    ff.close()
+
+    data = []
+    comm = []
+    for line in lines:
+        if not line or line.isspace():
+            continue
+        if line[0] in commentchar:
+            comm.append(line[1:])
+        else:
+            data.append(line)
+
+    #-- if every row has the same number of entries, split everything at once
+    if splitchar is not None and len(set([line.count(splitchar) for line in data]))==1:
+        ncols = data[0].count(splitchar)+1
+        data = np.array(splitchar.join(data).split(splitchar),dtype=str).reshape(-1,ncols)
+    else:
+        data = np.array([line.split(splitchar) for line in data],dtype=str)
+
+    logger.debug('Data file %s read'%(filename))
+    return return_comments and (data,comm) or data
+
+def str2recarray(data,dtype,null_values=None,strip=False):
+    """
+    Convert a 2D array of strings to a record array.
+
+    Every column is converted in one go, so this is fast also for large
+    tables. Empty entries, entries consisting of whitespace only and entries
+    listed in C{null_values} are replaced by 'nan': they become NaN in float
+    columns and the string 'nan' in string columns.
+
+    >>> data = np.array([['1.5','a'],['','b'],['null','  ']])
+    >>> rec = str2recarray(data,[('x','f8'),('y','a5')],null_values=['null'])
+    >>> print rec['x']
+    [ 1.5  nan  nan]
+    >>> print rec['y']
+    ['a' 'b' 'nan']
+
+    @param data: table of strings (rows x columns)
+    @type data: 2D numpy array
+    @param dtype: dtypes of the record array (one for each column)
+    @type dtype: list of tuples or numpy dtype
+    @param null_values: extra strings denoting missing values
+    @type null_values: list of str
+    @param strip: strip leading and trailing whitespace from the entries
+    @type strip: bool
+    @return: record array
+    @rtype: numpy record array
+    """
+    dtype = np.dtype(dtype)
+    data = np.asarray(data,dtype=str)
+    cols = []
+    for i in range(len(dtype.names)):
+        col = np.ascontiguousarray(data[:,i])
+        if strip:
+            col = np.char.strip(col)
+        #-- an entry is missing if all its characters are whitespace or NULL
+        #   (the padding of fixed width strings). Checking the bytes directly
+        #   avoids calling a string method on every entry.
+        chars = col.view(np.uint8).reshape(len(col),col.dtype.itemsize)
+        missing = np.all((chars==0) | (chars==32) | ((chars>=9) & (chars<=13)),axis=1)
+        if null_values:
+            missing |= np.in1d(col,null_values)
+        col = np.where(missing,'nan',col)
+        cols.append(col.astype(dtype[i]))
+    return np.rec.fromarrays(cols,dtype=dtype)
 #}
 
 #{ General Output
@@ -2,13 +2,38 @@
 """
 A simple interface to work with a database saved on the hard disk. 
 
+Two storage backends are available:
+
+    - C{pickle}: the whole dictionary is pickled to a single file. Every
+      sync() reads and writes the complete database.
+    - C{sqlite}: every key is stored as a separate row in an SQLite database
+      in write-ahead-log mode. A sync() only writes the changed and deleted
+      keys, and only reads the keys that were changed by others since the
+      last read. Readers never see a partially written database, and many
+      processes can sync to the same file at the same time: writers simply
+      wait for each other's transaction to finish.
+
+The backend of an existing database is detected automatically. New databases
+use the pickle backend, unless asked otherwise:
+
+>>> db = Database('results.db',backend='sqlite')
+No database present at results.db. Creating a new one.
+>>> os.remove('results.db')
+
 Author: Robin Lombaert
 
 """
 
 import os
 import cPickle
+import cStringIO
 import time
+import sqlite3
+import tempfile
+
+#-- the umask of the process, which sets the mode of new databases
+_umask = os.umask(0)
+os.umask(_umask)
 
 
 class Database(dict):
@@ -98,7 +123,7 @@ class Database(dict):
     '''
     
     
-    def __init__(self,db_path):
+    def __init__(self,db_path,backend=None,timeout=600.):
         
         '''
         Initializing a Database class.
@@ -106,17 +131,36 @@ class Database(dict):
         Upon initialization, the class will read the dictionary saved at the 
         db_path given as a dictionary.
         
-        Note that cPickle is used to write and read these dictionaries.
+        Note that cPickle is used to write and read these dictionaries, or
+        the separate keys and values in the case of the sqlite backend.
         
         If no database exists at db_path, a new dictionary will be created.
         
         @param db_path: The path to the database on the hard disk.
         @type db_path: string
+        @keyword backend: 'pickle' or 'sqlite'. If None, the backend of an 
+                          existing database is detected, and new databases
+                          are pickled.
+        @type backend: string
+        @keyword timeout: the maximum time (in seconds) to wait for another 
+                          process that is writing to the (sqlite) database.
+        @type timeout: float
   
         '''
         
         super(Database, self).__init__()
         self.db_path = db_path
+        self.timeout = timeout
+        detected = _detect_backend(db_path)
+        if backend is None:
+            backend = detected is None and 'pickle' or detected
+        elif backend not in ['pickle','sqlite']:
+            raise ValueError, "Unknown database backend '%s'"%backend
+        elif detected is not None and detected != backend:
+            raise ValueError, "Database at %s uses the %s backend, not %s"\
+                              %(db_path,detected,backend)
+        self.backend = backend
+        self.__stamp = 0
         self.read()
         self.__changed = []
         self.__deleted = []
@@ -284,10 +328,34 @@ class Database(dict):
         initialisation, a new Database is made by saving an empty dict() at the
         requested location.        
         
-        Reading and saving of the database is done by cPickle-ing the dict(). 
+        Reading and saving of the database is done by cPickle-ing the dict(),
+        or by cPickle-ing the keys and values separately for the sqlite 
+        backend. 
         
         '''
         
+        if self.backend == 'sqlite':
+            if not os.path.isfile(self.db_path):
+                print 'No database present at %s. Creating a new one.'\
+                      %self.db_path
+            conn = self.__connect()
+            try:
+                #-- read the entries and the stamp from the same snapshot
+                conn.execute('BEGIN')
+                rows = conn.execute('SELECT key,value FROM entries '+\
+                                    'WHERE value IS NOT NULL').fetchall()
+                stamp = conn.execute('SELECT coalesce(max(stamp),0) '+\
+                                     'FROM entries').fetchone()[0]
+                conn.execute('COMMIT')
+            finally:
+                conn.close()
+            self.clear()
+            super(Database,self).update([(cPickle.loads(str(k)),\
+                                          cPickle.loads(str(v)))
+                                         for k,v in rows])
+            self.__stamp = stamp
+            return
+        
         try:
             dbfile = open(self.db_path,'r')
             while True:
@@ -325,8 +393,18 @@ class Database(dict):
         to which entries can be added manually using the addChangedKey method, 
         or automatically by calling .update(), .__setitem__() or .setdefault().
         
+        For the sqlite backend, only the changed and deleted keys are written,
+        and only the keys changed on the hard disk since the last read or sync
+        are read. This is done in a single transaction, which waits for other
+        processes to finish theirs.
+        
         '''
         
+        if self.backend == 'sqlite':
+            if self.__changed or self.__deleted:
+                self.__sync_sqlite()
+            return
+        
         if self.__changed or self.__deleted:
             current_db = dict([(k,v) 
                                for k,v in self.items() 
@@ -355,11 +433,112 @@ class Database(dict):
         
         Reading and saving of the database is done by cPickle-ing the dict(). 
         
+        The dict() is first written to a temporary file, which then replaces
+        the database, so that other programs never read a partial database.
+        The database keeps its permissions.
+        
         '''
         
-        dbfile = open(self.db_path,'w')
-        cPickle.dump(self,dbfile)
+        if self.backend == 'sqlite':
+            self.__connect().close()
+            return
+        dbdir = os.path.dirname(os.path.abspath(self.db_path))
+        fd,tmp_path = tempfile.mkstemp(dir=dbdir,suffix='.tmp')
+        dbfile = os.fdopen(fd,'w')
+        cPickle.dump(dict(self),dbfile)
         dbfile.close()
+        #-- mkstemp makes the file private: keep the mode of the database
+        if os.path.isfile(self.db_path):
+            mode = os.stat(self.db_path).st_mode & 07777
+        else:
+            mode = 0666 & ~_umask
+        os.chmod(tmp_path,mode)
+        os.rename(tmp_path,self.db_path)
+    
+    
+    
+    def __connect(self):
+        
+        '''
+        
+        Open a connection to an sqlite database, and create the table of 
+        entries if it does not exist yet.
+        
+        Only called by Database() internally.
+        
+        @return: the connection to the database
+        @rtype: sqlite3.Connection
+        
+        '''
+        
+        conn = sqlite3.connect(self.db_path,timeout=self.timeout,\
+                               isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS entries '+\
+                     '(key BLOB PRIMARY KEY, value BLOB, stamp INTEGER)')
+        conn.execute('CREATE INDEX IF NOT EXISTS entries_stamp '+\
+                     'ON entries (stamp)')
+        return conn
+    
+    
+    
+    def __sync_sqlite(self):
+        
+        '''
+        
+        Write the changed and deleted keys to an sqlite database, and read the
+        keys changed by others since the last read or sync.
+        
+        Every sync gets a new stamp, which is stored with the keys it writes. 
+        Deleted keys are kept as a row without value, so that other instances
+        of the Database learn about the deletion in their next sync.
+        
+        Only called by Database() internally.
+        
+        '''
+        
+        #-- a key that was deleted and set again is simply changed
+        deleted = set([k for k in self.__deleted if not self.has_key(k)])
+        changed = [(k,self[k]) for k in set(self.__changed) if self.has_key(k)]
+        conn = self.__connect()
+        try:
+            #-- take the write lock immediately, so that the stamps of 
+            #   concurrent syncs are unique and ordered
+            conn.execute('BEGIN IMMEDIATE')
+            stamp = conn.execute('SELECT coalesce(max(stamp),0)+1 '+\
+                                 'FROM entries').fetchone()[0]
+            rows = [(_dumps(k),None,stamp) for k in deleted]
+            rows += [(_dumps(k),sqlite3.Binary(cPickle.dumps(v,2)),stamp) 
+                     for k,v in changed]
+            conn.executemany('INSERT OR REPLACE INTO entries VALUES (?,?,?)',\
+                             rows)
+            updates = conn.execute('SELECT key,value FROM entries WHERE '+\
+                                   'stamp>? AND stamp<?',\
+                                   (self.__stamp,stamp)).fetchall()
+            conn.execute('COMMIT')
+        except:
+            try:
+                conn.execute('ROLLBACK')
+            except sqlite3.OperationalError:
+                pass
+            raise
+        finally:
+            conn.close()
+        
+        #-- apply the changes made by others, except for the keys changed 
+        #   in this session: those were just written.
+        mine = deleted | set([k for k,v in changed])
+        for k,v in updates:
+            k = cPickle.loads(str(k))
+            if k in mine:
+                continue
+            if v is None:
+                super(Database,self).pop(k,None)
+            else:
+                super(Database,self).__setitem__(k,cPickle.loads(str(v)))
+        self.__stamp = stamp
+        self.__changed = []
+        self.__deleted = []
     
     
     
@@ -408,7 +587,100 @@ class Database(dict):
         '''
         
         return self.__changed
-        
+    
+    
+    
+def _detect_backend(db_path):
+    
+    '''
+    Detect the backend of the database saved at db_path.
+    
+    @param db_path: The path to the database on the hard disk.
+    @type db_path: string
+    @return: 'sqlite', 'pickle', or None if there is no database (yet)
+    @rtype: string
+    
+    '''
+    
+    if not os.path.isfile(db_path) or not os.path.getsize(db_path):
+        return None
+    dbfile = open(db_path,'rb')
+    header = dbfile.read(16)
+    dbfile.close()
+    if header == 'SQLite format 3\x00':
+        return 'sqlite'
+    return 'pickle'
+
+
+
+def _dumps(key):
+    
+    '''
+    Pickle a database key for use as a primary key in an sqlite database.
+    
+    Keys that are equal as dict keys are stored as the same row: the key is
+    brought in its canonical form first (see L{_canonical}), and pickled 
+    without memo, so that the bytes do not depend on which members of a 
+    tuple happen to be the same object.
+    
+    @param key: a dict key
+    @type key: a type valid for a dict key
+    @return: the pickled key
+    @rtype: sqlite3.Binary
+    
+    '''
+    
+    output = cStringIO.StringIO()
+    pickler = cPickle.Pickler(output,2)
+    pickler.fast = 1
+    pickler.dump(_canonical(key))
+    return sqlite3.Binary(output.getvalue())
+
+
+
+def _canonical(key):
+    
+    '''
+    Bring a database key in a canonical form.
+    
+    Numbers with an integer value become ints (1.0, 1L and True are all 
+    stored as 1), ascii unicode strings become str, and the members of 
+    tuples and frozensets are treated recursively (the members of a 
+    frozenset are sorted on their pickle).
+    
+    >>> _canonical((1.0,u'a',True,2.5))
+    (1, 'a', 1, 2.5)
+    
+    @param key: a dict key
+    @type key: a type valid for a dict key
+    @return: the equal key in canonical form
+    @rtype: a type valid for a dict key
+    
+    '''
+    
+    if isinstance(key,complex) and not key.imag:
+        key = key.real
+    if isinstance(key,(bool,int,long,float)):
+        try:
+            if key == int(key):
+                return int(key)
+        except (OverflowError,ValueError):
+            #-- inf and nan
+            pass
+        return key
+    if isinstance(key,unicode):
+        try:
+            return str(key)
+        except UnicodeEncodeError:
+            return key
+    if isinstance(key,tuple):
+        return tuple([_canonical(k) for k in key])
+    if isinstance(key,frozenset):
+        return frozenset(sorted([_canonical(k) for k in key],key=_dumps))
+    return key
+
+
+
 if __name__ == "__main__":
     import doctest
     doctest.testmod()
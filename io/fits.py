@@ -5,6 +5,9 @@ Read and write FITS files.
 import gzip
 import logging
 import os
+from cStringIO import StringIO
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 import pyfits
 
 import numpy as np
@@ -16,31 +19,46 @@ logger.addHandler(loggers.NullHandler())
 
 #{ Input
 
-def read_spectrum(filename, return_header=False):
+def read_spectrum(filename, return_header=False, wrange=None):
     """
     Read a standard 1D spectrum from the primary HDU of a FITS file.
     
+    The file is memory-mapped: if a wavelength range is given, only the
+    fluxes within that range are read from disk.
+    
     @param filename: FITS filename
     @type filename: str
     @param return_header: return header information as dictionary
     @type return_header: bool
+    @param wrange: only read the spectrum between these wavelengths
+    @type wrange: tuple (wmin, wmax)
     @return: wavelength, flux(, header)
     @rtype: array, array(, dict)
     """
-    flux = pyfits.getdata(filename)
-    header = pyfits.getheader(filename)
+    ff = pyfits.open(filename, memmap=True)
+    header = ff[0].header
+    npoints = header['NAXIS1']
     
     #-- Make the equidistant wavelengthgrid using the Fits standard info
     #   in the header
     ref_pix = int(header["CRPIX1"])-1
     dnu = float(header["CDELT1"])
     nu0 = float(header["CRVAL1"]) - ref_pix*dnu
-    nun = nu0 + (len(flux)-1)*dnu
-    wave = np.linspace(nu0,nun,len(flux))
+    nun = nu0 + (npoints-1)*dnu
+    wave = np.linspace(nu0,nun,npoints)
     #-- fix wavelengths for logarithmic sampling
     if 'ctype1' in header and header['CTYPE1']=='log(wavelength)':
         wave = np.exp(wave)
     
+    #-- only copy the requested part of the memory-mapped fluxes
+    if wrange is not None:
+        start,end = wave.searchsorted(wrange[0]),wave.searchsorted(wrange[1],side='right')
+    else:
+        start,end = 0,npoints
+    wave = wave[start:end]
+    flux = np.array(ff[0].data[start:end])
+    ff.close()
+    
     logger.debug('Read spectrum %s'%(filename))
     
     if return_header:
@@ -50,7 +68,7 @@ def read_spectrum(filename, return_header=False):
 
 
 def read_corot(fits_file,  return_header=False, type_data='hel',
-                         remove_flagged=True):
+                         remove_flagged=True, lazy=False):
     """
     Read CoRoT data from a CoRoT FITS file.
     
@@ -69,29 +87,29 @@ def read_corot(fits_file,  return_header=False, type_data='hel',
     @type type_data: string (one of 'raw','hel' or 'helreg')
     @param remove_flagged: remove flagged datapoints
     @type remove_flagged: True
+    @param lazy: return memory-mapped columns instead of copies (the file
+    stays open as long as they exist; only without C{remove_flagged})
+    @type lazy: bool
     @return: CoRoT data (times, flux, error, flags)
     @rtype: array, array, array, array(, header)
     """
     #-- read in the FITS file
     # headers: ['DATE', 'DATEJD', 'DATEHEL', 'STATUS', 'WHITEFLUX', 'WHITEFLUXDEV', 'BG', 'CORREC']
-    fits_file_    = pyfits.open(fits_file)
-    if fits_file_[0].header['hlfccdid'][0]=='A':
-        times,flux,error,flags = fits_file_[type_data].data.field(0),\
-                                 fits_file_[type_data].data.field(1),\
-                                 fits_file_[type_data].data.field(2),\
-                                 fits_file_[type_data].data.field(3)
-        # extract the header if asked
-        if return_header:
-            header = fits_file_[0].header
-        fits_file_.close()
-        
+    #   The file is memory-mapped, so only the columns we need are read
+    fits_file_    = pyfits.open(fits_file,memmap=True)
+    header = fits_file_[0].header
+    if header['hlfccdid'][0]=='A':
+        table = fits_file_[type_data].data
+        times,flux,error,flags = table.field(0),table.field(1),\
+                                 table.field(2),table.field(3)
         logger.debug('Read CoRoT SISMO file %s'%(fits_file))
-    elif fits_file_[0].header['hlfccdid'][0]=='E':
-        times = fits_file_['bintable'].data.field('datehel')
+    elif header['hlfccdid'][0]=='E':
+        table = fits_file_['bintable'].data
+        times = table.field('datehel')
         if 'blueflux' in fits_file_['bintable'].columns.names:
-            blueflux,e_blueflux = fits_file_['bintable'].data.field('blueflux'),fits_file_['bintable'].data.field('bluefluxdev')
-            greenflux,e_greenflux = fits_file_['bintable'].data.field('greenflux'),fits_file_['bintable'].data.field('greenfluxdev')
-            redflux,e_redflux = fits_file_['bintable'].data.field('redflux'),fits_file_['bintable'].data.field('redfluxdev')
+            blueflux,e_blueflux = table.field('blueflux'),table.field('bluefluxdev')
+            greenflux,e_greenflux = table.field('greenflux'),table.field('greenfluxdev')
+            redflux,e_redflux = table.field('redflux'),table.field('redfluxdev')
             #-- chromatic light curves
             if type_data=='colors':
                 flux = np.column_stack([blueflux,greenflux,redflux])
@@ -101,8 +119,13 @@ def read_corot(fits_file,  return_header=False, type_data='hel',
                 flux = blueflux + greenflux + redflux
                 error = np.sqrt(e_blueflux**2 + e_greenflux**2 + e_redflux**2)
         else:
-            flux,error = fits_file_['bintable'].data.field('whiteflux'),fits_file_['bintable'].data.field('whitefluxdev')
-        flags = fits_file_['bintable'].data.field('status')
+            flux,error = table.field('whiteflux'),table.field('whitefluxdev')
+        flags = table.field('status')
+        logger.debug('Read CoRoT EXO file %s'%(fits_file))
+    #-- copy the columns, so that the memory map can be closed
+    if not lazy:
+        times,flux,error,flags = [np.array(column) for column in (times,flux,error,flags)]
+    fits_file_.close()
         
     # remove flagged datapoints if asked
     if remove_flagged:
@@ -138,7 +161,7 @@ def read_fuse(ff,combine=True,return_header=False):
     
     Use TTAGfcal files.
     """
-    ff = pyfits.open(ff)
+    ff = pyfits.open(ff,memmap=True)
     hdr = ff[0].header
     if hdr['SRC_TYPE']=='EE':
         logger.warning("Warning: %s is not thrustworty (see manual)"%(ff))
@@ -191,7 +214,7 @@ def read_iue(filename,return_header=False):
 
     
     """
-    ff = pyfits.open(filename)
+    ff = pyfits.open(filename,memmap=True)
     header = ff[0].header
     if os.path.splitext(filename)[1]=='.mxlo':
         try:
@@ -246,43 +269,254 @@ def read_iue(filename,return_header=False):
 
 #{ Generic reading
 
-def read2recarray(fits_file,ext=1,return_header=False):
+def read2recarray(fits_file,ext=1,return_header=False,columns=None,rows=None):
     """
     Read the contents of a FITS file to a record array.
     
+    The file is memory-mapped, and only the requested columns and rows are
+    copied to the record array. See L{FitsTable} to access the data without
+    copying it.
+    
     Should add a test that the strings were not chopped of...
+    
+    @param fits_file: FITS filename or HDUList
+    @type fits_file: str or HDUList
+    @param ext: extension of the table
+    @type ext: int or str
+    @param return_header: return header information as dictionary
+    @type return_header: bool
+    @param columns: names of the columns to read (default: all)
+    @type columns: list of str
+    @param rows: rows to read (default: all)
+    @type rows: slice or array of indices or booleans
+    @return: data(, header)
+    @rtype: recarray(, dict)
     """
-    dtype_translator = dict(L=np.bool,D=np.float64,E=np.float32,J=np.int)
-    if isinstance(fits_file,str):
-        ff = pyfits.open(fits_file)
-    elif isinstance(fits_file,pyfits.HDUList):
-        ff = fits_file
-    data = ff[ext].data
-    names = ff[ext].columns.names
-    formats = ff[ext].columns.formats
-    dtypes = []
-    for name,dtype in zip(names,formats):
-        if 'A' in dtype:
-            dtypes.append((name,'S60'))
-        else:
-            dtypes.append((name,dtype_translator[dtype]))
-    dtypes = np.dtype(dtypes)
-    data = [np.cast[dtypes[i]](data.field(name)) for i,name in enumerate(names)]
-    data = np.rec.array(data,dtype=dtypes)
-    header = {}
-    for key in ff[ext].header.keys():
-        if 'TTYPE' in key: continue
-        if 'TUNIT' in key: continue
-        if 'TFORM' in key: continue
-        header[key] = ff[ext].header[key]
-    if isinstance(fits_file,str):
-        ff.close()
+    table = FitsTable(fits_file,ext=ext)
+    data = table.read(columns=columns,rows=rows)
+    header = table.header
+    table.close()
     if not return_header:
         return data
     else:
         return data,header
 
 
+def read_batch(filenames,reader=read2recarray,threads=4,skip_errors=False,**kwargs):
+    """
+    Read many FITS files with a pool of threads.
+    
+    Reading FITS files is mostly waiting for the disk, so the files are read
+    concurrently by a number of threads. Any reader of this module (or other
+    function that takes a filename as first argument) can be used, with
+    the extra keyword arguments passed on to it.
+    
+    Example usage:
+    
+    >>> curves = read_batch(filenames,reader=read_corot,threads=8,type_data='hel')
+    >>> tables = read_batch(filenames,columns=['DATEHEL','WHITEFLUX'],rows=slice(0,1000))
+    
+    @param filenames: FITS filenames
+    @type filenames: list of str
+    @param reader: function to read one file
+    @type reader: callable
+    @param threads: number of threads (an integer, 'max' or 'safe')
+    @type threads: integer or string
+    @param skip_errors: if True, files that cannot be read give None and a
+    warning, else the error is raised
+    @type skip_errors: bool
+    @return: the output of the reader for each file, in the same order
+    @rtype: list
+    """
+    def read_one(filename):
+        try:
+            return reader(filename,**kwargs)
+        except Exception,msg:
+            if not skip_errors:
+                raise
+            logger.warning('Could not read %s: %s'%(filename,msg))
+            return None
+    return _thread_map(read_one,filenames,threads)
+
+
+def read_headers(filenames,ext=0,keys=None,threads=4):
+    """
+    Read the headers of many FITS files with a pool of threads.
+    
+    Only the header blocks are read from disk, not the data.
+    
+    @param filenames: FITS filenames
+    @type filenames: list of str
+    @param ext: extension of the header
+    @type ext: int or str
+    @param keys: only return these header keys (missing keys give None)
+    @type keys: list of str
+    @param threads: number of threads (an integer, 'max' or 'safe')
+    @type threads: integer or string
+    @return: header of each file, in the same order
+    @rtype: list of dict
+    """
+    def read_one(filename):
+        header = pyfits.getheader(filename,ext)
+        if keys is None:
+            return dict(header.items())
+        return dict([(key,header.get(key,None)) for key in keys])
+    return _thread_map(read_one,filenames,threads)
+
+
+def _thread_map(function,args,threads):
+    """
+    Map a function over a list of arguments with a pool of threads.
+    """
+    if threads=='max':
+        threads = multiprocessing.cpu_count()
+    elif threads=='safe':
+        threads = multiprocessing.cpu_count()-1
+    threads = max(1,min(int(threads),len(args)))
+    if threads==1:
+        return map(function,args)
+    pool = ThreadPool(threads)
+    try:
+        return pool.map(function,args)
+    finally:
+        pool.close()
+        pool.join()
+
+#}
+
+#{ Lazy reading
+
+class FitsTable(object):
+    """
+    Lazy access to a binary table extension of a FITS file.
+    
+    The file is memory-mapped: nothing is read from disk until a column or
+    a range of rows is asked for, and only those rows are converted.
+    
+    Example usage:
+    
+    >>> table = FitsTable('lightcurve.fits',ext='bintable')
+    >>> print len(table),table.names
+    >>> times = table.field('DATEHEL',rows=slice(0,1000))
+    >>> data = table.read(columns=['DATEHEL','WHITEFLUX'])
+    >>> table.close()
+    
+    or, closing the file automatically:
+    
+    >>> with FitsTable('lightcurve.fits') as table:
+    ...     flux = table['WHITEFLUX']
+    
+    Arrays returned by L{field} are views on the memory-mapped file; use
+    L{read} (or copy them) to keep the data after the file is closed.
+    """
+    def __init__(self,fits_file,ext=1):
+        """
+        Open a FITS table.
+        
+        @param fits_file: FITS filename or HDUList
+        @type fits_file: str or HDUList
+        @param ext: extension of the table
+        @type ext: int or str
+        """
+        if isinstance(fits_file,pyfits.HDUList):
+            self.hdulist = fits_file
+            self._owner = False
+        else:
+            self.hdulist = pyfits.open(fits_file,memmap=True)
+            self._owner = True
+        self.hdu = self.hdulist[ext]
+        self.names = list(self.hdu.columns.names)
+        self.formats = list(self.hdu.columns.formats)
+    
+    def __len__(self):
+        return self.hdu.header['NAXIS2']
+    
+    def __getitem__(self,name):
+        return self.field(name)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self,*args):
+        self.close()
+    
+    @property
+    def header(self):
+        """
+        Header of the table as a dictionary, without the column definitions.
+        """
+        header = {}
+        for key in self.hdu.header.keys():
+            if 'TTYPE' in key: continue
+            if 'TUNIT' in key: continue
+            if 'TFORM' in key: continue
+            header[key] = self.hdu.header[key]
+        return header
+    
+    def field(self,name,rows=None):
+        """
+        Return (a range of rows of) one column.
+        
+        @param name: column name
+        @type name: str
+        @param rows: rows to read (default: all)
+        @type rows: slice or array of indices or booleans
+        @return: column
+        @rtype: array
+        """
+        return self._rows(rows).field(name)
+    
+    def read(self,columns=None,rows=None):
+        """
+        Copy (a range of rows of) some columns to a record array.
+        
+        The column types are translated as in L{read2recarray}.
+        
+        @param columns: names of the columns to read (default: all)
+        @type columns: list of str
+        @param rows: rows to read (default: all)
+        @type rows: slice or array of indices or booleans
+        @return: data
+        @rtype: recarray
+        """
+        dtype_translator = dict(L=np.bool,D=np.float64,E=np.float32,J=np.int,K=np.int64,I=np.int16,B=np.uint8)
+        if columns is None:
+            columns = self.names
+        formats = dict(zip([name.lower() for name in self.names],self.formats))
+        dtypes = []
+        for name in columns:
+            dtype = formats[name.lower()].upper()
+            if 'A' in dtype:
+                dtypes.append((name,'S60'))
+            else:
+                dtypes.append((name,dtype_translator[dtype]))
+        data = self._rows(rows)
+        output = np.empty(len(data),dtype=dtypes)
+        for name in columns:
+            output[name] = data.field(name)
+        return output.view(np.recarray)
+    
+    def close(self):
+        """
+        Close the file (if it was opened by this table).
+        """
+        if self._owner:
+            self.hdulist.close()
+    
+    def _rows(self,rows):
+        """
+        Select rows of the memory-mapped table, without converting them.
+        """
+        data = self.hdu.data
+        if rows is None:
+            return data
+        elif isinstance(rows,(int,long,np.integer)):
+            rows = slice(rows,rows+1)
+        elif not isinstance(rows,slice):
+            rows = np.asarray(rows)
+            if rows.dtype==bool:
+                rows = np.flatnonzero(rows)
+        return data[rows]
 
 #}
 
@@ -299,7 +533,7 @@ def write_primary(filename,data=None,header_dict={}):
         data = np.array([[0]])
     hdulist = pyfits.HDUList([pyfits.PrimaryHDU(data)])
     for key in header_dict:
-        hdulist[0].header.update(key,header_dict[key])
+        _update_header(hdulist[0].header,key,header_dict[key])
     hdulist.writeto(filename)
     hdulist.close()
     return filename
@@ -318,56 +552,37 @@ def write_recarray(recarr,filename,header_dict={},units={},ext='new',close=True)
     
     A header_dictionary can be given, it is used to update an existing header
     or create a new one if the extension is new.
-    """
-    is_file = isinstance(filename,str) and os.path.isfile(filename)
-    if isinstance(filename,str) and not os.path.isfile(filename):
-        primary = np.array([[0]])
-        hdulist = pyfits.HDUList([pyfits.PrimaryHDU(primary)])
-        hdulist.writeto(filename)
-        hdulist.close()
     
-    if is_file or isinstance(filename,str):
-        hdulist = pyfits.open(filename,mode='update')
-    else:
+    Instead of a filename, a L{FitsWriter} (or a HDUList) can be given. With
+    close=False, the FitsWriter is returned, so that the next record arrays
+    are appended without reopening the file.
+    """
+    if isinstance(filename,pyfits.HDUList):
         hdulist = filename
-          
-    
-    #-- create the table HDU
-    cols = []
-    for i,name in enumerate(recarr.dtype.names):
-        format = recarr.dtype[i].str.lower().replace('|','').replace('s','a').replace('>','')
-        format = format.replace('b1','L').replace('<','')
-        unit = name in units and units[name] or 'NA'
-        cols.append(pyfits.Column(name=name,format=format,array=recarr[name],unit=unit))
-    tbhdu = pyfits.new_table(pyfits.ColDefs(cols))
-    
-    #-- take care of the header:
-    if len(header_dict):
-        for key in header_dict:
-            if (len(key)>8) and (not key in tbhdu.header.keys()) and (not key[:9]=='HIERARCH'):
-                key_ = 'HIERARCH '+key
-            else:
-                key_ = key
-            tbhdu.header.update(key_,header_dict[key])
+        tbhdu = _recarray_to_hdu(recarr,header_dict,units)
         if ext!='new':
-            tbhdu.header.update('EXTNAME',ext)
-    
+            _update_header(tbhdu.header,'EXTNAME',ext)
+        extnames = [iext.name for iext in hdulist]
+        if ext=='new' or not ext in extnames:
+            logger.info('Creating new extension %s'%(ext))
+            hdulist.append(tbhdu)
+        else:
+            logger.info('Overwriting existing extension %s'%(ext))
+            hdulist[ext] = tbhdu
+        if close:
+            hdulist.close()
+        return hdulist
     
-    #   put it in the right place
-    extnames = [iext.header['EXTNAME'] for iext in hdulist if ('extname' in iext.header.keys()) or ('EXTNAME' in iext.header.keys())]
-    if ext=='new' or not ext in extnames:
-        logger.info('Creating new extension %s'%(ext))
-        hdulist.append(tbhdu)
-        ext = -1
+    if isinstance(filename,FitsWriter):
+        writer = filename
     else:
-        logger.info('Overwriting existing extension %s'%(ext))
-        hdulist[ext] = tbhdu
-        
+        writer = FitsWriter(filename,mode='a')
+    writer.write_recarray(recarr,header_dict=header_dict,units=units,ext=ext)
     if close:
-        hdulist.close()
-        return filename
+        writer.close()
+        return writer.filename
     else:
-        return hdulist
+        return writer
 
 def write_array(arr,filename,names=(),units=(),header_dict={},ext='new',close=True):
     """
@@ -383,23 +598,240 @@ def write_array(arr,filename,names=(),units=(),header_dict={},ext='new',close=Tr
     A header_dictionary can be given, it is used to update an existing header
     or create a new one if the extension is new.
     
-    Instead of writing the file, you can give a hdulist and append to it.
-    Supply a HDUList for 'filename', and set close=False
+    Instead of writing the file, you can give a hdulist or a L{FitsWriter}
+    and append to it. Supply it for 'filename', and set close=False
     """
-    if isinstance(filename,str) and not os.path.isfile(filename):
-            primary = np.array([[0]])
-            hdulist = pyfits.HDUList([pyfits.PrimaryHDU(primary)])
-            hdulist.writeto(filename)
-            
-    if isinstance(filename,str):
-        hdulist = pyfits.open(filename,mode='update')
-    else:
+    if isinstance(filename,pyfits.HDUList):
         hdulist = filename
+        tbhdu = _array_to_hdu(arr,names,units,header_dict)
+        if ext=='new' or ext==len(hdulist):
+            hdulist.append(tbhdu)
+        else:
+            hdulist[ext] = tbhdu
+        if close:
+            hdulist.close()
+        else:
+            return hdulist
+        return
+    
+    if isinstance(filename,FitsWriter):
+        writer = filename
+    else:
+        writer = FitsWriter(filename,mode='a')
+    writer.write_array(arr,names=names,units=units,header_dict=header_dict,ext=ext)
+    if close:
+        writer.close()
+    else:
+        return writer
+
+
+class FitsWriter(object):
+    """
+    Write many extensions to a FITS file, keeping the file open.
+    
+    Each new extension is streamed to the end of the file, so that writing
+    n extensions takes a time proportional to n, and only one extension
+    is kept in memory at a time. The HDU numbers of the extensions are kept
+    in an index, so that the file is never scanned while writing (a file
+    that already existed is scanned once, and only if an extension is
+    looked up by name). Extensions that replace an existing one are
+    written in one go when the file is closed.
+    
+    Example usage:
+    
+    >>> with FitsWriter('mesh.fits',header_dict=dict(scalefac=1.2)) as writer:
+    ...     for phase in phases:
+    ...         writer.write_recarray(compute_mesh(phase),header_dict=dict(phase=phase))
+    
+    The functions L{write_recarray} and L{write_array} accept a FitsWriter
+    instead of a filename.
+    """
+    def __init__(self,filename,header_dict={},data=None,mode='w'):
+        """
+        Open a FITS file for writing.
+        
+        If the file is created, a primary HDU is written with the data (by
+        default a 1x1 zero array, as in L{write_primary}) and the header_dict.
+        
+        @param filename: FITS filename
+        @type filename: str
+        @param header_dict: header of the primary HDU of a new file
+        @type header_dict: dict
+        @param data: data of the primary HDU of a new file
+        @type data: array
+        @param mode: 'w' to (over)write the file, 'a' to append to an existing file
+        @type mode: str
+        """
+        self.filename = filename
+        self._replacements = []
+        #-- the primary HDU written in front of each extension to serialise
+        #   it, and stripped before the extension is appended to the file
+        buffer = StringIO()
+        pyfits.HDUList([pyfits.PrimaryHDU()]).writeto(buffer)
+        self._primary_size = len(buffer.getvalue())
+        
+        if mode=='a' and os.path.isfile(filename):
+            self._file = open(filename,'ab')
+            self._index = None
+            self._count = None
+        else:
+            if data is None:
+                data = np.array([[0]])
+            primary = pyfits.PrimaryHDU(data)
+            for key in header_dict:
+                _update_header(primary.header,key,header_dict[key])
+            buffer = StringIO()
+            pyfits.HDUList([primary]).writeto(buffer)
+            self._file = open(filename,'wb')
+            self._file.write(buffer.getvalue())
+            self._index = {'PRIMARY':0}
+            self._count = 1
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self,*args):
+        self.close()
+    
+    def __len__(self):
+        """
+        Number of HDUs in the file, including the primary HDU.
+        """
+        if self._count is None:
+            self._build_index()
+        return self._count
+    
+    def __contains__(self,ext):
+        return self.hdu_number(ext) is not None
+    
+    def hdu_number(self,ext):
+        """
+        HDU number of an extension name, or None if there is none.
+        
+        @param ext: extension name
+        @type ext: str
+        @return: HDU number
+        @rtype: int
+        """
+        if self._index is None:
+            self._build_index()
+        return self._index.get(ext.upper(),None)
+    
+    def write_recarray(self,recarr,header_dict={},units={},ext='new'):
+        """
+        Append a record array, or replace an existing extension by it.
+        
+        See L{write_recarray} for the meaning of the arguments.
+        """
+        tbhdu = _recarray_to_hdu(recarr,header_dict,units)
+        if ext!='new' and not isinstance(ext,int):
+            _update_header(tbhdu.header,'EXTNAME',ext)
+        self.write_hdu(tbhdu,ext=ext)
+    
+    def write_array(self,arr,names=(),units=(),header_dict={},ext='new'):
+        """
+        Append a list of arrays, or replace an existing extension by it.
+        
+        See L{write_array} for the meaning of the arguments.
+        """
+        self.write_hdu(_array_to_hdu(arr,names,units,header_dict),ext=ext)
     
-    #-- create the table HDU
+    def write_hdu(self,hdu,ext='new'):
+        """
+        Append an extension HDU, or replace an existing extension by it.
+        
+        @param hdu: extension HDU
+        @type hdu: pyfits HDU
+        @param ext: 'new' to append, or the number or name of the extension to replace
+        @type ext: str or int
+        @raise ValueError: when C{ext} is the primary HDU
+        """
+        if ext=='new':
+            number = None
+        elif isinstance(ext,int):
+            number = ext if ext<len(self) else None
+        else:
+            number = self.hdu_number(ext)
+        if number is not None and number in (0,-len(self)):
+            raise ValueError('The primary HDU cannot be replaced by an extension')
+        
+        if number is None:
+            logger.debug('Creating new extension %s'%(ext))
+            buffer = StringIO()
+            pyfits.HDUList([pyfits.PrimaryHDU(),hdu]).writeto(buffer)
+            buffer.seek(self._primary_size)
+            self._file.write(buffer.read())
+            if self._index is not None:
+                if hdu.name:
+                    self._index.setdefault(hdu.name.upper(),self._count)
+                self._count += 1
+        else:
+            logger.info('Overwriting existing extension %s'%(ext))
+            self._replacements.append((number,hdu))
+    
+    def flush(self):
+        """
+        Write the buffered extensions to disk.
+        """
+        self._file.flush()
+    
+    def close(self):
+        """
+        Close the file, and replace the extensions that were overwritten.
+        """
+        if self._file.closed:
+            return
+        self._file.close()
+        if self._replacements:
+            hdulist = pyfits.open(self.filename,mode='update')
+            for number,hdu in self._replacements:
+                hdulist[number] = hdu
+            hdulist.close()
+            self._replacements = []
+    
+    def _build_index(self):
+        """
+        Scan the headers of the file to find the names of the extensions.
+        """
+        self._file.flush()
+        hdulist = pyfits.open(self.filename,memmap=True)
+        self._index = {}
+        for number,hdu in enumerate(hdulist):
+            if hdu.name:
+                self._index.setdefault(hdu.name.upper(),number)
+        self._count = len(hdulist)
+        hdulist.close()
+
+
+def _recarray_to_hdu(recarr,header_dict={},units={}):
+    """
+    Make a binary table HDU of a record array.
+    """
+    cols = []
+    for i,name in enumerate(recarr.dtype.names):
+        format = recarr.dtype[i].str.lower().replace('|','').replace('s','A').replace('>','')
+        format = format.replace('b1','L').replace('<','')
+        unit = name in units and units[name] or 'NA'
+        cols.append(pyfits.Column(name=name,format=format,array=recarr[name],unit=unit))
+    tbhdu = pyfits.new_table(pyfits.ColDefs(cols))
+    
+    #-- take care of the header:
+    for key in header_dict:
+        if (len(key)>8) and (not key in tbhdu.header.keys()) and (not key[:9]=='HIERARCH'):
+            key_ = 'HIERARCH '+key
+        else:
+            key_ = key
+        _update_header(tbhdu.header,key_,header_dict[key])
+    return tbhdu
+
+
+def _array_to_hdu(arr,names=(),units=(),header_dict={}):
+    """
+    Make a binary table HDU of a list of arrays.
+    """
     cols = []
     for i,name in enumerate(names):
-        format = arr[i].dtype.str.lower().replace('|','').replace('s','a').replace('>','')
+        format = arr[i].dtype.str.lower().replace('|','').replace('s','A').replace('>','')
         format = format.replace('b1','L').replace('<','')
         if format=='f8':
             format = 'D'
@@ -411,22 +843,19 @@ def write_array(arr,filename,names=(),units=(),header_dict={},ext='new',close=Tr
             unit = 'NA'
         cols.append(pyfits.Column(name=name,format=format,array=arr[i],unit=unit))
     tbhdu = pyfits.new_table(pyfits.ColDefs(cols))
-    
-    #   put it in the right place
-    if ext=='new' or ext==len(hdulist):
-        hdulist.append(tbhdu)
-        ext = -1
-    else:
-        hdulist[ext] = tbhdu
-    
-    #-- take care of the header:
-    if len(header_dict):
-        for key in header_dict:
-            hdulist[ext].header.update(key,header_dict[key])
-    
-    if close:
-        hdulist.close()
-    else:
-        return hdulist
+    for key in header_dict:
+        _update_header(tbhdu.header,key,header_dict[key])
+    return tbhdu
+
+
+def _update_header(header,key,value):
+    """
+    Set a header keyword, with the item assignment of recent pyfits versions
+    or the update method of older ones.
+    """
+    try:
+        header[key] = value
+    except KeyError:
+        header.update(key,value)
 
 #}
\ No newline at end of file
@@ -11,6 +11,9 @@ http://alfven.org/wp/hdf5-for-python/
 """
 
 import os
+import hashlib
+import collections
+import numpy as np
 import h5py
 import logging
 from ivs.aux import loggers
@@ -18,51 +21,209 @@ from ivs.aux import loggers
 logger = logging.getLogger("IO.HDF5")
 logger.addHandler(loggers.NullHandler())
 
+#-- approximate size of the chunks of resizable datasets (bytes)
+chunk_size = 2**16
+
 #{ Input
 
-def read2dict(filename):
+def read2dict(filename, path=None, lazy=False):
     """
     Read the filestructure of a hdf5 file to a dictionary.
     
+    Attributes of a group are read as keys of its dictionary, next to its
+    datasets and subgroups.
+    
+    With C{path}, only that group (or dataset) is read, e.g.
+    C{path='results/igrid_search'}. With C{lazy=True}, nothing is read
+    yet: an L{HDF5Dict} is returned, that reads the datasets when they are
+    first accessed. The file stays open until the HDF5Dict is closed.
+    
+    >>> data = read2dict('HD180642.hdf5', path='results/igrid_search', lazy=True)
+    >>> ci = data['CI']
+    >>> last_rows = data.read('grid', rows=slice(-1000,None))
+    
     @param filename: the name of the hdf5 file to read
     @type filename: str
+    @param path: path of the group or dataset to read
+    @type path: str
+    @param lazy: read the datasets only when they are accessed
+    @type lazy: bool
     @return: dictionary with read filestructure
-    @rtype: dict
+    @rtype: dict or HDF5Dict
     """
     
     if not os.path.isfile(filename):
         logger.error('The file you try to read does not exist!')
         raise IOError
     
-    def read_rec(hdf):
-        """ recusively read the hdf5 file """
-        res = {}
-        for name,grp in hdf.items():
-            #-- read the subgroups and datasets
-            if hasattr(grp, 'items'):
-                # in case of a group, read the group into a new dictionary key
-                res[name] = read_rec(grp)
-            else:
-                # in case of dataset, read the value
-                res[name] = grp.value
-                
-        #-- read all the attributes
-        for name, atr in hdf.attrs.iteritems():
-            res[name] = atr
-                
-        return res
-    
     hdf = h5py.File(filename, 'r')
-    result = read_rec(hdf)
-    hdf.close()
+    if path is not None and isinstance(hdf[path], h5py.Dataset):
+        result = hdf[path][()]
+        hdf.close()
+        return result
     
+    result = HDF5Dict(hdf if path is None else hdf[path])
+    if not lazy:
+        result = result.todict()
+        hdf.close()
+    
+    return result
+
+def read_dataset(filename, path, rows=None):
+    """
+    Read (a selection of the rows of) one dataset of a hdf5 file.
+    
+    Only the selected rows are read from disk.
+    
+    >>> grid = read_dataset('HD180642.hdf5', 'results/igrid_search/grid', rows=slice(0,1000))
+    
+    @param filename: the name of the hdf5 file to read
+    @type filename: str
+    @param path: path of the dataset
+    @type path: str
+    @param rows: selection of rows (slice, integer or sorted array of indices)
+    @type rows: slice, int or array
+    @return: the dataset
+    @rtype: array
+    """
+    hdf = h5py.File(filename, 'r')
+    try:
+        dataset = hdf[path]
+        result = dataset[()] if rows is None else dataset[rows]
+    finally:
+        hdf.close()
     return result
 
+
+class HDF5Dict(collections.MutableMapping):
+    """
+    Dictionary view of a group of a hdf5 file.
+    
+    Subgroups are HDF5Dicts themselves; datasets and attributes are read
+    when they are first accessed, and then kept in memory. Values can be
+    set and deleted, but the file itself is never changed: write the view
+    with L{write_dict} (which only writes the values that were accessed or
+    set). Use L{todict} to read everything, and L{read} to read a
+    selection of the rows of a dataset.
+    
+    The file stays open until L{close} is called; it is reopened (read
+    only) when a value is accessed afterwards.
+    """
+    def __init__(self, group, parent=None):
+        """
+        @param group: the hdf5 group
+        @type group: h5py Group or File
+        @param parent: view of the parent group
+        @type parent: HDF5Dict
+        """
+        self._group = group
+        self._parent = parent
+        self.filename = os.path.abspath(group.file.filename)
+        self.path = group.name
+        self._values = {}
+        self._keys = list(group.keys()) + list(group.attrs.keys())
+    
+    @property
+    def group(self):
+        """
+        The hdf5 group, the file is reopened if it was closed.
+        """
+        if not self._group:
+            if self._parent is not None:
+                self._group = self._parent.group[self.path]
+            else:
+                self._group = h5py.File(self.filename, 'r')[self.path]
+        return self._group
+    
+    def __getitem__(self, key):
+        if '/' in key.strip('/'):
+            head, tail = key.strip('/').split('/', 1)
+            return self[head][tail]
+        if key in self._values:
+            return self._values[key]
+        if not key in self._keys:
+            raise KeyError(key)
+        if key in self.group:
+            item = self.group[key]
+            if isinstance(item, h5py.Group):
+                value = HDF5Dict(item, parent=self)
+            else:
+                value = item[()]
+        else:
+            value = self.group.attrs[key]
+        self._values[key] = value
+        return value
+    
+    def __setitem__(self, key, value):
+        if not key in self._keys:
+            self._keys.append(key)
+        self._values[key] = value
+    
+    def __delitem__(self, key):
+        self._keys.remove(key)
+        self._values.pop(key, None)
+    
+    def __iter__(self):
+        return iter(self._keys)
+    
+    def __len__(self):
+        return len(self._keys)
+    
+    def __contains__(self, key):
+        return key in self._keys
+    
+    def __repr__(self):
+        return '<HDF5Dict %s: %s>'%(self.path, ', '.join(self._keys))
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args):
+        self.close()
+    
+    def read(self, key, rows=None):
+        """
+        Read a selection of the rows of a dataset.
+        
+        @param key: name or path of the dataset
+        @type key: str
+        @param rows: selection of rows (slice, integer or sorted array of indices)
+        @type rows: slice, int or array
+        @return: the selected rows
+        @rtype: array
+        """
+        if rows is None:
+            return self[key]
+        if key in self._values:
+            return self._values[key][rows]
+        return self.group[key][rows]
+    
+    def todict(self):
+        """
+        Read everything into a (nested) dictionary.
+        
+        @return: dictionary with read filestructure
+        @rtype: dict
+        """
+        result = {}
+        for key in self._keys:
+            value = self[key]
+            result[key] = value.todict() if isinstance(value, HDF5Dict) else value
+        return result
+    
+    def close(self):
+        """
+        Close the hdf5 file.
+        """
+        if self._group:
+            self._group.file.close()
+
 #}
 
 #{ Output
 
-def write_dict(data, filename, update=True, attr_types=[]):
+def write_dict(data, filename, update=True, attr_types=[], compression=None,
+               resizable=False):
     """
     Write the content of a dictionary to a hdf5 file. The dictionary can contain other
     nested dictionaries, this file stucture will be maintained in the saved hdf5 file.
@@ -72,6 +233,17 @@ def write_dict(data, filename, update=True, attr_types=[]):
     the same type: ['bla', 1, 24.5] will become ['bla', '1', '24.5']. Upt till now there
     is nothing in place to check this, or correct it when reading a hdf5 file.
     
+    When an existing file is updated, only the datasets that changed are
+    written: a checksum of every dataset is stored in its attributes. A
+    dataset that keeps its shape and type is overwritten in place, a
+    resizable dataset is resized, all others are recreated. Of an
+    L{HDF5Dict} of the same file, only the values that were accessed or set
+    are written; when the file is overwritten, the view is read completely
+    first.
+    
+    Datasets are chunked when they are compressed or resizable. A resizable
+    dataset can grow along its first axis (see L{append}).
+    
     @param data: the dictionary to write to file
     @type data: dict
     @param filename: the name of the hdf5 file to write to
@@ -81,16 +253,35 @@ def write_dict(data, filename, update=True, attr_types=[]):
     @param attr_types: the data types that you want to save as an attribute instead of
                        a dataset. (standard everything is saved as dataset.)
     @type attr_types: List of types
+    @param compression: compression filter of the datasets ('gzip', 'lzf' or None)
+    @type compression: str
+    @param resizable: make the datasets resizable along the first axis
+    @type resizable: bool
     """
     
+    #-- views of this file are closed, and only their loaded values are saved
+    filename = os.path.abspath(filename)
+    views = _views(data, filename)
+    if not update and views:
+        #-- the file is replaced: read everything of its views before it is removed
+        for view in views.values():
+            view.todict()
+        views = _views(data, filename)
+    for view in views.values():
+        view.close()
+    
     if not update and os.path.isfile(filename):
         os.remove(filename)
     
     def save_rec(data, hdf):
         """ recusively save a dictionary """
-        for key in data.keys():
+        if id(data) in views and data.path == hdf.name:
+            keys = data._values.keys()
+        else:
+            keys = data.keys()
+        for key in keys:
             
-            if type(data[key]) == dict:
+            if isinstance(data[key], collections.Mapping):
                 # if part is dictionary: add 1 level and save dictionary in new level
                 if not key in hdf:
                     hdf.create_group(key)
@@ -98,15 +289,141 @@ def write_dict(data, filename, update=True, attr_types=[]):
                 
             elif type(data[key]) in attr_types:
                 # save data as attribute
-                hdf.attrs[key] = data[key]
+                if not key in hdf.attrs or not _equal(hdf.attrs[key], data[key]):
+                    hdf.attrs[key] = data[key]
                 
             else:
                 # other data is stored as datasets
-                if key in hdf:
-                    del hdf[key]
-                hdf.create_dataset(key, data=data[key])
+                _write_dataset(hdf, key, data[key], compression=compression,
+                               resizable=resizable)
     
-    hdf = h5py.File(filename)
+    hdf = h5py.File(filename, 'a')
     save_rec(data, hdf)
     hdf.close()
-#}
\ No newline at end of file
+
+def append(filename, path, data, compression=None):
+    """
+    Append rows to a dataset of a hdf5 file.
+    
+    The dataset is created (resizable) if it does not exist yet, an
+    existing dataset needs to be resizable (see L{write_dict}).
+    
+    >>> for chunk in chunks:
+    ...     append('HD180642.hdf5', 'results/imc/grid', chunk)
+    
+    @param filename: the name of the hdf5 file
+    @type filename: str
+    @param path: path of the dataset
+    @type path: str
+    @param data: rows to append
+    @type data: array
+    @param compression: compression filter of a new dataset ('gzip', 'lzf' or None)
+    @type compression: str
+    @return: the number of rows of the dataset
+    @rtype: int
+    """
+    data = np.asarray(data)
+    hdf = h5py.File(filename, 'a')
+    try:
+        if not path in hdf:
+            dataset = _create_dataset(hdf, path, data, compression=compression, resizable=True)
+        else:
+            dataset = hdf[path]
+            nrows = len(dataset)
+            dataset.resize(nrows+len(data), axis=0)
+            dataset[nrows:] = data
+            dataset.attrs['checksum'] = _checksum(dataset[()])
+        nrows = len(dataset)
+    finally:
+        hdf.close()
+    return nrows
+
+def _views(data, filename):
+    """
+    Find the loaded HDF5Dicts of a file in a (nested) dictionary.
+    """
+    views = {}
+    if isinstance(data, HDF5Dict):
+        if data.filename == filename:
+            views[id(data)] = data
+        values = data._values.values()
+    else:
+        values = data.values()
+    for value in values:
+        if isinstance(value, collections.Mapping):
+            views.update(_views(value, filename))
+    return views
+
+def _write_dataset(hdf, key, value, compression=None, resizable=False):
+    """
+    Write a dataset to a group, only if it changed.
+    """
+    if np.asarray(value).dtype.kind in 'UO':
+        # leave it to h5py to convert unicode strings and objects
+        if key in hdf:
+            del hdf[key]
+        return hdf.create_dataset(key, data=value)
+    value = np.asarray(value)
+    checksum = _checksum(value)
+    if key in hdf and isinstance(hdf[key], h5py.Dataset):
+        dataset = hdf[key]
+        if checksum is not None and dataset.attrs.get('checksum', None) == checksum:
+            logger.debug('Dataset %s did not change'%(dataset.name))
+            return dataset
+        if dataset.dtype == value.dtype:
+            if dataset.shape == value.shape:
+                dataset[()] = value
+                dataset.attrs['checksum'] = checksum
+                return dataset
+            if dataset.maxshape[:1] == (None,) and dataset.shape[1:] == value.shape[1:]:
+                dataset.resize(value.shape)
+                dataset[()] = value
+                dataset.attrs['checksum'] = checksum
+                return dataset
+    if key in hdf:
+        del hdf[key]
+    return _create_dataset(hdf, key, value, checksum=checksum,
+                           compression=compression, resizable=resizable)
+
+def _create_dataset(hdf, key, value, checksum=None, compression=None, resizable=False):
+    """
+    Create a (chunked, compressed or resizable) dataset.
+    """
+    kwargs = {}
+    if value.ndim > 0:
+        if resizable:
+            row_size = value.dtype.itemsize*int(np.prod(value.shape[1:]))
+            kwargs['maxshape'] = (None,) + value.shape[1:]
+            kwargs['chunks'] = (max(1, chunk_size//row_size),) + value.shape[1:]
+        if compression is not None and value.size > 0:
+            kwargs['compression'] = compression
+            kwargs['shuffle'] = True
+    dataset = hdf.create_dataset(key, data=value, **kwargs)
+    if checksum is None:
+        checksum = _checksum(value)
+    if checksum is not None:
+        dataset.attrs['checksum'] = checksum
+    return dataset
+
+def _checksum(value):
+    """
+    Checksum of the type (with the field names), shape and content of an
+    array (None for object arrays).
+    """
+    if value.dtype.hasobject:
+        return None
+    checksum = hashlib.sha1(str(value.dtype.descr) + str(value.shape))
+    checksum.update(np.ascontiguousarray(value).view(np.uint8))
+    return checksum.hexdigest()
+
+def _equal(value1, value2):
+    """
+    Check if two attribute values are the same.
+    """
+    try:
+        return bool(np.all(np.asarray(value1) == np.asarray(value2))) and \
+               np.shape(value1) == np.shape(value2)
+    except (ValueError, TypeError):
+        return False
+
+#}
@@ -1,9 +1,86 @@
 """
 Read or download files from the internet.
+
+Section 1. Plain downloads
+==========================
+
+Use L{download} to fetch a single file from a link, either to a named file or
+to a temporary file.
+
+Section 2. Cached catalog queries
+=================================
+
+The catalog interfaces (C{vizier}, C{gator}, C{mast}, C{sesame}) do not talk to
+the network directly, but go through L{retrieve}. Each response is kept in a
+local, content-addressed cache: the file name is the SHA1 hash of the
+normalised query URI (see L{normalise_uri}), so repeating a query for the same
+target does not trigger a new download.
+
+The behaviour of the cache is governed by the module-level dictionary C{cache}:
+
+    - C{directory}: location of the cache (environment variable C{ivscache}
+      or C{~/.ivs/cache/http})
+    - C{ttl}: time-to-live of an entry in seconds
+    - C{max_size}: maximum size of the cache in bytes. When it is exceeded,
+      the least recently used entries are evicted (other files in the
+      directory are left alone).
+    - C{enabled}: switch the cache on or off
+    - C{offline}: only serve responses from the cache, never query the network
+
+Use L{set_cache} to change these settings, e.g. to work without a network
+connection on previously queried targets:
+
+>>> set_cache(offline=True)
+>>> set_cache(offline=False,ttl=3600.)
+
+and L{clear_cache} to wipe the cache.
+
+The network timeout of the queries is set per thread with L{set_timeout}, so
+that concurrent queries (see C{ivs.catalogs.crossmatch}) do not need to change
+the process-wide default of the C{socket} module.
 """
+import os
+import time
+import shutil
+import socket
 import urllib
+import urllib2
+import urlparse
+import uuid
+import hashlib
+import tempfile
+import logging
+import threading
+import collections
+
+from ivs.aux import loggers
 from ivs.aux import decorators
 
+logger = logging.getLogger("IO.HTTP")
+logger.addHandler(loggers.NullHandler())
+
+cache = dict(directory=os.getenv('ivscache',os.path.join(os.path.expanduser('~'),'.ivs','cache','http')),
+             ttl=30*24*3600.,
+             max_size=500*1024**2,
+             enabled=True,
+             offline=False)
+
+#-- per-thread settings of the queries (see set_timeout)
+_local = threading.local()
+
+#-- in-memory index of the cache entries and their sizes, least recently used
+#   first, and the number of downloads after which it is rebuilt (see _evict)
+_index = dict(directory=None,entries=collections.OrderedDict(),size=0,writes=0)
+_index_lock = threading.Lock()
+_rescan = 100
+_hexdigits = set('0123456789abcdef')
+
+#-- the umask of the process, which sets the mode of new cache entries
+_umask = os.umask(0)
+os.umask(_umask)
+
+#{ Plain downloads
+
 #@decorators.retry_http(3)
 def download(link,filename=None):
     """
@@ -29,4 +106,334 @@ def download(link,filename=None):
         url.close()
         return myfile
     else:
-        return myfile,url
\ No newline at end of file
+        return myfile,url
+
+#}
+
+#{ Cached queries
+
+def set_cache(**kwargs):
+    """
+    Change the settings of the local response cache.
+
+    Accepted keywords are the keys of the module-level C{cache} dictionary
+    (C{directory}, C{ttl}, C{max_size}, C{enabled} and C{offline}).
+
+    @return: previous settings
+    @rtype: dict
+    """
+    previous = cache.copy()
+    for key in kwargs:
+        if not key in cache:
+            raise ValueError, "Unknown cache setting '%s'"%(key)
+    cache.update(kwargs)
+    logger.debug('HTTP cache settings: %s'%(cache))
+    return previous
+
+def set_timeout(timeout):
+    """
+    Set the network timeout of the queries made by the current thread.
+
+    Other threads, and the process-wide default of the C{socket} module, are
+    not affected.
+
+    @param timeout: timeout in seconds (None for the C{socket} default)
+    @type timeout: float
+    @return: previous timeout of this thread
+    @rtype: float
+    """
+    previous = getattr(_local,'timeout',None)
+    _local.timeout = timeout
+    return previous
+
+def urlopen(link):
+    """
+    Open a link, with the network timeout of the current thread.
+
+    @param link: the url to open
+    @type link: str
+    @return: file-like object of the response
+    @rtype: file-like object
+    """
+    timeout = getattr(_local,'timeout',None)
+    if timeout is None:
+        timeout = socket._GLOBAL_DEFAULT_TIMEOUT
+    return urllib2.urlopen(link,timeout=timeout)
+
+def clear_cache():
+    """
+    Remove all entries from the local response cache.
+    """
+    with _index_lock:
+        _index['directory'] = None
+    if os.path.isdir(cache['directory']):
+        shutil.rmtree(cache['directory'])
+        logger.info('Cleared HTTP cache %s'%(cache['directory']))
+
+def normalise_uri(link):
+    """
+    Bring a query URI in a canonical form.
+
+    The scheme and host are lowercased, empty query parameters are removed
+    and the remaining parameters are sorted on their name. Two URIs that
+    differ only in the order of their parameters are thus mapped onto the
+    same cache entry.
+
+    >>> normalise_uri('HTTP://Vizier.u-strasbg.fr/viz-bin/asu-tsv/VizieR?&-source=I/239&-c.rs=5')
+    'http://vizier.u-strasbg.fr/viz-bin/asu-tsv/VizieR?-c.rs=5&-source=I/239'
+
+    @param link: query URI
+    @type link: str
+    @return: normalised URI
+    @rtype: str
+    """
+    scheme,netloc,path,query,fragment = urlparse.urlsplit(link.strip())
+    params = [param for param in query.split('&') if param]
+    params = sorted(params,key=lambda param:param.split('=')[0])
+    return urlparse.urlunsplit((scheme.lower(),netloc.lower(),path,'&'.join(params),''))
+
+def cache_filename(key):
+    """
+    Return the location of the cache entry for a query.
+
+    @param key: query URI
+    @type key: str
+    @return: absolute path of the (possibly non-existing) cache entry
+    @rtype: str
+    """
+    digest = hashlib.sha1(normalise_uri(key)).hexdigest()
+    return os.path.join(cache['directory'],digest[:2],digest)
+
+def retrieve(link,filename=None,key=None,ttl=None):
+    """
+    Retrieve the response to a query, via the local cache if possible.
+
+    If C{filename} is given, the response is copied to that file. Otherwise,
+    the path to a private link to the cache entry is returned, which stays
+    readable when the entry is evicted in the meantime; this file should be
+    treated as read-only and passed to L{release} when you're done with it.
+
+    The cache entry is looked up via C{key}, which defaults to the link itself.
+    Give an explicit key when different links return the same content, for
+    example the mirrors of ViZieR.
+
+    When a fresh download fails but an expired entry is present, the expired
+    entry is served and a warning is logged.
+
+    @param link: the url of the query
+    @type link: str
+    @param filename: the name of the file to write to (optional)
+    @type filename: str
+    @param key: URI identifying the query in the cache
+    @type key: str
+    @param ttl: time-to-live of the entry in seconds (defaults to C{cache['ttl']})
+    @type ttl: float
+    @return: name of the file containing the response
+    @rtype: str
+    """
+    if not cache['enabled'] and not cache['offline']:
+        if filename is None:
+            fd,filename = tempfile.mkstemp()
+            os.close(fd)
+        _copy(link,filename)
+        return filename
+
+    if key is None:
+        key = link
+    if ttl is None:
+        ttl = cache['ttl']
+    entry = cache_filename(key)
+
+    try:
+        age = time.time()-os.path.getmtime(entry)
+    except OSError:
+        age = None
+    if age is not None and (age<=ttl or cache['offline']):
+        logger.debug('Serving %s from cache (age %.0fs)'%(link,age))
+        try:
+            return _serve(entry,filename)
+        except EnvironmentError:
+            #-- evicted by another thread or process in the meantime
+            if os.path.isfile(entry):
+                raise
+    if cache['offline']:
+        raise IOError, "Offline mode: %s is not in the cache %s"%(link,cache['directory'])
+
+    try:
+        download = _fetch(link,entry)
+    except IOError:
+        if not os.path.isfile(entry):
+            raise
+        logger.warning('Failed to refresh %s, serving expired cache entry'%(link))
+        return _serve(entry,filename)
+    logger.debug('Cached %s as %s'%(link,entry))
+    return _serve(entry,filename,download=download)
+
+def release(filename):
+    """
+    Clean up a file returned by L{retrieve}.
+
+    Temporary downloads and links to cache entries are removed; cache entries
+    are left untouched.
+
+    @param filename: name of the file returned by L{retrieve}
+    @type filename: str
+    """
+    if not _is_entry(os.path.abspath(filename)) and os.path.isfile(filename):
+        os.unlink(filename)
+
+#}
+
+#{ Internal helper functions
+
+def _fetch(link,entry):
+    """
+    Download a link for the cache.
+
+    The response is written to a temporary file in the cache directory, which
+    is renamed to the entry by L{_serve}, so that concurrent readers never
+    see a partial entry.
+
+    @return: name of the temporary file
+    @rtype: str
+    """
+    directory = os.path.dirname(entry)
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            #-- another process created it in the meantime
+            if not os.path.isdir(directory):
+                raise
+    fd,tmpname = tempfile.mkstemp(dir=directory,suffix='.part')
+    os.close(fd)
+    try:
+        _copy(link,tmpname)
+        #-- mkstemp makes the file private, a cache can be shared
+        os.chmod(tmpname,0666&~_umask)
+    except:
+        os.unlink(tmpname)
+        raise
+    return tmpname
+
+def _copy(link,filename):
+    """
+    Download a link to a file, with the network timeout of the current thread.
+    """
+    response = urlopen(link)
+    try:
+        with open(filename,'wb') as ff:
+            shutil.copyfileobj(response,ff)
+    finally:
+        response.close()
+
+def _serve(entry,filename=None,download=None):
+    """
+    Mark a cache entry as used, or put a new C{download} in its place (see
+    L{_fetch} and L{_evict}), and copy it to C{filename} or make a private
+    link to it.
+    
+    This is done while holding the lock of the index, so that the entry
+    cannot be evicted by another thread halfway; a link keeps the contents
+    readable when the entry is evicted afterwards.
+    """
+    with _index_lock:
+        if download is not None:
+            try:
+                os.rename(download,entry)
+            finally:
+                if os.path.isfile(download):
+                    os.unlink(download)
+            _evict(keep=entry)
+        elif entry in _index['entries']:
+            _index['entries'][entry] = _index['entries'].pop(entry)
+        link = '%s.%s.served'%(entry,uuid.uuid4().hex)
+        try:
+            os.link(entry,link)
+        except AttributeError:
+            #-- no hard links on this platform
+            shutil.copyfile(entry,link)
+    if filename is None:
+        return link
+    try:
+        shutil.copyfile(link,filename)
+    finally:
+        os.unlink(link)
+    return filename
+
+def _evict(keep=None):
+    """
+    Add a new download to the index of the cache, and remove least recently
+    used cache entries until the cache fits in its maximum size.
+    
+    The index lives in memory, so that a download does not cost a walk over
+    the whole cache. It is built from the disk when it is first needed
+    (ordered on the time of download), and rebuilt every C{_rescan}
+    downloads to account for the entries written and evicted by other
+    processes.
+    
+    The caller holds C{_index_lock}.
+    """
+    if _index['directory']!=cache['directory'] or _index['writes']>=_rescan:
+        _scan()
+        if keep in _index['entries']:
+            _index['entries'][keep] = _index['entries'].pop(keep)
+    elif keep is not None:
+        size = os.path.getsize(keep)
+        _index['size'] += size-_index['entries'].pop(keep,0)
+        _index['entries'][keep] = size
+        _index['writes'] += 1
+    entries = _index['entries']
+    while _index['size']>cache['max_size'] and len(entries)>1:
+        fullname,size = entries.popitem(last=False)
+        if fullname==keep:
+            entries[fullname] = size
+            continue
+        try:
+            os.unlink(fullname)
+        except OSError:
+            #-- already evicted by another process
+            pass
+        _index['size'] -= size
+        logger.debug('Evicted %s from cache'%(fullname))
+
+def _scan():
+    """
+    Rebuild the index of the cache from the disk.
+    
+    Only cache entries are indexed (see L{_is_entry}): other files in the
+    cache directory are never evicted. Entries used by this process keep
+    their order and come last, the others are ordered on their time of
+    download.
+    """
+    found = []
+    for root,dirs,files in os.walk(cache['directory']):
+        for name in files:
+            fullname = os.path.join(root,name)
+            if not _is_entry(fullname): continue
+            try:
+                stat = os.stat(fullname)
+            except OSError:
+                #-- evicted by another process in the meantime
+                continue
+            found.append((stat.st_mtime,fullname,stat.st_size))
+    previous = _index['entries'] if _index['directory']==cache['directory'] else {}
+    entries = collections.OrderedDict()
+    for mtime,fullname,size in sorted(found):
+        if not fullname in previous:
+            entries[fullname] = size
+    for fullname in previous:
+        if os.path.isfile(fullname):
+            entries[fullname] = os.path.getsize(fullname)
+    _index.update(directory=cache['directory'],entries=entries,
+                  size=sum(entries.values()),writes=0)
+
+def _is_entry(fullname):
+    """
+    Check if a file has the name of a cache entry (see L{cache_filename}).
+    """
+    directory,name = os.path.split(fullname)
+    return len(name)==40 and _hexdigits.issuperset(name) and \
+           os.path.basename(directory)==name[:2]
+
+#}
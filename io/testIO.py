@@ -1,12 +1,524 @@
 import os
+import time
+import shutil
+import socket
+import sqlite3
+import tempfile
+import threading
+import multiprocessing
+import BaseHTTPServer
 import h5py
+import pyfits
 import numpy as np
+from ivs.io import fits
 from ivs.io import hdf5
+from ivs.io import http
+from ivs.io import database
 
 import unittest
 
+
+class CountingHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Stand-in for a catalog server: echoes the path and counts requests"""
+    
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        if self.path.startswith('/missing'):
+            self.send_error(404)
+            return
+        if self.path.startswith('/slow'):
+            time.sleep(1.)
+        body = 'response to %s\n'%(self.path) + 'x'*self.server.padding
+        self.send_response(200)
+        self.send_header('Content-Type','text/plain')
+        self.send_header('Content-Length',str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, *args):
+        pass
+
+
+class HTTPCacheTestCase(unittest.TestCase):
+    
+    def setUp(self):
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1',0), CountingHandler)
+        self.server.requests = []
+        self.server.padding = 0
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.base = 'http://127.0.0.1:%d'%(self.server.server_address[1])
+        self.cache_dir = tempfile.mkdtemp()
+        self.settings = http.set_cache(directory=self.cache_dir, enabled=True,
+                                       offline=False, ttl=3600., max_size=10**6)
+    
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        http.set_cache(**self.settings)
+        shutil.rmtree(self.cache_dir)
+    
+    def testCacheHit(self):
+        """ io.http.retrieve() serves a repeated query from the cache """
+        link = self.base + '/query?-source=I/239&-c=vega'
+        filen1 = http.retrieve(link)
+        filen2 = http.retrieve(link)
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(open(filen2).read(), 'response to /query?-source=I/239&-c=vega\n')
+        #-- the served files are links to the cache entry, which is readable
+        #   for others as the umask allows
+        umask = os.umask(0)
+        os.umask(umask)
+        self.assertEqual(os.stat(http.cache_filename(link)).st_mode & 0777, 0666 & ~umask)
+        http.release(filen1)
+        self.assertFalse(os.path.isfile(filen1))
+        self.assertTrue(os.path.isfile(http.cache_filename(link)))
+        
+        #-- the order of the parameters does not matter
+        http.retrieve(self.base + '/query?&-c=vega&-source=I/239')
+        self.assertEqual(len(self.server.requests), 1)
+        
+        #-- copy to a user-supplied file
+        outfile = os.path.join(self.cache_dir, 'copy.tsv')
+        self.assertEqual(http.retrieve(link, filename=outfile), outfile)
+        self.assertEqual(open(outfile).read(), open(filen2).read())
+        self.assertEqual(len(self.server.requests), 1)
+    
+    def testKey(self):
+        """ io.http.retrieve() with an explicit cache key """
+        http.retrieve(self.base + '/mirror1?q=1', key='http://vizier/q=1')
+        http.retrieve(self.base + '/mirror2?q=1', key='http://vizier/q=1')
+        self.assertEqual(self.server.requests, ['/mirror1?q=1'])
+    
+    def testTTL(self):
+        """ io.http.retrieve() refreshes expired entries """
+        link = self.base + '/query?ID=vega'
+        filen = http.retrieve(link)
+        os.utime(filen, (time.time()-7200, time.time()-7200))
+        http.retrieve(link)
+        self.assertEqual(len(self.server.requests), 2)
+        http.retrieve(link, ttl=0)
+        self.assertEqual(len(self.server.requests), 3)
+    
+    def testOffline(self):
+        """ io.http.retrieve() in offline mode """
+        link = self.base + '/query?ID=vega'
+        http.retrieve(link)
+        os.utime(http.cache_filename(link), (0, 0))
+        http.set_cache(offline=True)
+        #-- expired entries are still served, missing ones raise an error
+        self.assertEqual(open(http.retrieve(link)).read(), 'response to /query?ID=vega\n')
+        self.assertRaises(IOError, http.retrieve, self.base + '/query?ID=altair')
+        self.assertEqual(len(self.server.requests), 1)
+    
+    def testFailure(self):
+        """ io.http.retrieve() does not cache failed requests """
+        link = self.base + '/missing?ID=vega'
+        self.assertRaises(IOError, http.retrieve, link)
+        self.assertFalse(os.path.isfile(http.cache_filename(link)))
+    
+    def testTimeout(self):
+        """ io.http.retrieve() with the network timeout of the current thread """
+        previous = http.set_timeout(0.2)
+        try:
+            self.assertRaises(IOError, http.retrieve, self.base + '/slow?ID=vega')
+        finally:
+            http.set_timeout(previous)
+        self.assertEqual(socket.getdefaulttimeout(), None)
+    
+    def testEviction(self):
+        """ io.http.retrieve() keeps the cache below its maximum size """
+        self.server.padding = 4000
+        http.set_cache(max_size=10000)
+        links = [self.base + '/query?ID=star%d'%(i) for i in range(5)]
+        #-- the cache holds two entries, cache hits count as use
+        for i, link in enumerate(links):
+            http.retrieve(link)
+            if i in [1, 3]:
+                http.retrieve(links[i-1])
+        present = [os.path.isfile(http.cache_filename(link)) for link in links]
+        self.assertEqual(present, [False, False, True, False, True])
+        self.assertEqual(len(self.server.requests), 5)
+        #-- entries of other processes are found when the index is rebuilt,
+        #   files that are not cache entries are left alone
+        other = http.cache_filename('http://elsewhere/query?ID=star6')
+        unrelated = os.path.join(self.cache_dir, 'notes.txt')
+        for fname in [other, unrelated]:
+            if not os.path.isdir(os.path.dirname(fname)):
+                os.makedirs(os.path.dirname(fname))
+            with open(fname, 'w') as ff:
+                ff.write('x'*4000)
+            os.utime(fname, (0, 0))
+        rescan, http._rescan = http._rescan, 0
+        try:
+            http.retrieve(self.base + '/query?ID=star5')
+        finally:
+            http._rescan = rescan
+        self.assertFalse(os.path.isfile(other))
+        self.assertTrue(os.path.isfile(unrelated))
+        self.assertTrue(os.path.isfile(http.cache_filename(links[4])))
+    
+    def testConcurrentEviction(self):
+        """ io.http.retrieve() from threads that evict each other's entries """
+        self.server.padding = 4000
+        http.set_cache(max_size=10000)
+        links = [self.base + '/query?ID=star%d'%(i) for i in range(4)]
+        errors = []
+        def worker(i):
+            for j in range(10):
+                link = links[(i+j) % len(links)]
+                try:
+                    filen = http.retrieve(link)
+                    time.sleep(0.005)
+                    if not open(filen).read().startswith('response to /query?ID=star%d\n'%((i+j) % len(links))):
+                        errors.append('wrong content')
+                    http.release(filen)
+                except Exception, msg:
+                    errors.append(repr(msg))
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        served = [fname for root, dirs, files in os.walk(self.cache_dir) for fname in files if fname.endswith('.served')]
+        self.assertEqual(served, [])
+    
+    def testDisabled(self):
+        """ io.http.retrieve() without cache """
+        http.set_cache(enabled=False)
+        link = self.base + '/query?ID=vega'
+        filen = http.retrieve(link)
+        http.retrieve(link)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertTrue(os.path.isfile(filen))
+        http.release(filen)
+        self.assertFalse(os.path.isfile(filen))
+
+def sync_worker(db_path, worker, nkeys):
+    """Write a range of keys to a shared database, syncing after every key"""
+    db = database.Database(db_path)
+    for i in range(nkeys):
+        db[(worker, i)] = dict(worker=worker, values=range(i))
+        db.sync()
+    del db[(worker, 0)]
+    db.sync()
+
+class DatabaseTestCase(unittest.TestCase):
+    
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tempdir, 'test.db')
+    
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+    
+    def testBackend(self):
+        """ io.database.Database() backend detection """
+        database.Database(self.db_path, backend='sqlite')
+        self.assertEqual(database.Database(self.db_path).backend, 'sqlite')
+        self.assertRaises(ValueError, database.Database, self.db_path, backend='pickle')
+        pickled = os.path.join(self.tempdir, 'pickled.db')
+        db = database.Database(pickled)
+        db['a'] = 1
+        db.sync()
+        self.assertEqual(database.Database(pickled).backend, 'pickle')
+        self.assertEqual(database.Database(pickled)['a'], 1)
+        #-- a save keeps the permissions of the database
+        umask = os.umask(0)
+        os.umask(umask)
+        self.assertEqual(os.stat(pickled).st_mode & 0777, 0666 & ~umask)
+        os.chmod(pickled, 0640)
+        db['a'] = 2
+        db.sync()
+        self.assertEqual(os.stat(pickled).st_mode & 0777, 0640)
+    
+    def testSync(self):
+        """ io.database.Database.sync() with sqlite backend """
+        db = database.Database(self.db_path, backend='sqlite')
+        db['test'] = 1
+        db['test2'] = 'robin'
+        db.sync()
+        db2 = database.Database(self.db_path)
+        self.assertEqual(db2['test'], 1)
+        self.assertEqual(db2['test2'], 'robin')
+        #-- changes by others are only read in the next sync with changes
+        db2['test'] = 2
+        del db2['test2']
+        db2.sync()
+        db.sync()
+        self.assertEqual(db['test'], 1)
+        db['test3'] = [1, 2]
+        db.sync()
+        self.assertEqual(db['test'], 2)
+        self.assertFalse('test2' in db)
+        #-- deeper changes need addChangedKey
+        db['test3'].append(3)
+        db.sync()
+        db2.read()
+        self.assertEqual(db2['test3'], [1, 2])
+        db.addChangedKey('test3')
+        db.sync()
+        db2.read()
+        self.assertEqual(db2['test3'], [1, 2, 3])
+        #-- a key that is deleted and set again is kept
+        del db2['test3']
+        db2['test3'] = 'again'
+        db2.setdefault('test4', 'defval')
+        db2.pop('test')
+        db2.sync()
+        db.read()
+        self.assertEqual(db, {'test3':'again', 'test4':'defval'})
+        self.assertEqual(db.getChangedKeys(), [])
+        self.assertEqual(db2.getDeletedKeys(), [])
+    
+    def testEqualKeys(self):
+        """ io.database.Database.sync() stores equal keys as the same row """
+        db = database.Database(self.db_path, backend='sqlite')
+        name = ''.join(['na', 'me'])
+        db[1] = 'int'
+        db[(name, 'name', 2.5)] = 'tuple'
+        db.sync()
+        db2 = database.Database(self.db_path)
+        db2[1.0] = 'float'
+        db2[('name', 'name', 2.5)] = 'other tuple'
+        db2[u'key'] = 'unicode'
+        db2.sync()
+        db3 = database.Database(self.db_path)
+        self.assertEqual(db3, {1:'float', ('name', 'name', 2.5):'other tuple', 'key':'unicode'})
+        conn = sqlite3.connect(self.db_path)
+        self.assertEqual(conn.execute('SELECT count(*) FROM entries').fetchone()[0], 3)
+        conn.close()
+        self.assertEqual(database._dumps(frozenset([1.0, 'a'])), database._dumps(frozenset([u'a', True])))
+    
+    def testConcurrentSync(self):
+        """ io.database.Database.sync() from concurrent processes """
+        database.Database(self.db_path, backend='sqlite')
+        nworkers, nkeys = 4, 25
+        processes = [multiprocessing.Process(target=sync_worker, args=(self.db_path, worker, nkeys))
+                     for worker in range(nworkers)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+            self.assertEqual(process.exitcode, 0)
+        db = database.Database(self.db_path)
+        self.assertEqual(len(db), nworkers*(nkeys-1))
+        self.assertEqual(db[(2, 10)], dict(worker=2, values=range(10)))
+        self.assertFalse((1, 0) in db)
+
+class FitsTestCase(unittest.TestCase):
+    
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        np.random.seed(1111)
+        self.data = np.rec.fromarrays([np.linspace(0,10,500), np.random.normal(size=500).astype(np.float32),
+                                       np.arange(500), np.arange(500)%3==0, ['star%d'%i for i in range(500)]],
+                                      names=['time','flux','number','flag','name'])
+        self.filenames = []
+        for i in range(5):
+            self.filenames.append(os.path.join(self.tmpdir, 'table%d.fits'%i))
+            columns = [pyfits.Column(name=name, format=format, array=self.data[name][i:])
+                       for name, format in zip(self.data.dtype.names, ['D','E','K','L','10A'])]
+            pyfits.HDUList([pyfits.PrimaryHDU(), pyfits.new_table(columns)]).writeto(self.filenames[-1])
+            pyfits.setval(self.filenames[-1], 'OBJECT', value='star%d'%i, ext=1)
+    
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+    
+    def testRead2recarray(self):
+        """ io.fits.read2recarray() with a selection of columns and rows """
+        data, header = fits.read2recarray(self.filenames[0], return_header=True)
+        self.assertEqual(data.dtype.names, self.data.dtype.names)
+        self.assertEqual(data.tolist(), self.data.tolist())
+        self.assertEqual(header['OBJECT'], 'star0')
+        self.assertTrue(isinstance(data, np.recarray))
+        data = fits.read2recarray(self.filenames[0], columns=['flux','name'], rows=slice(100,200))
+        self.assertEqual(data.tolist(), self.data[['flux','name']][100:200].tolist())
+        data = fits.read2recarray(self.filenames[0], columns=['time'], rows=self.data['flag'])
+        self.assertEqual(data.tolist(), self.data[['time']][self.data['flag']].tolist())
+    
+    def testReadCorot(self):
+        """ io.fits.read_corot() copies the columns, unless they are asked for lazily """
+        filename = os.path.join(self.tmpdir, 'corot.fits')
+        columns = [pyfits.Column(name=name, format='D', array=self.data['time']) for name in ['DATEHEL','WHITEFLUX','WHITEFLUXDEV']]
+        columns.append(pyfits.Column(name='STATUS', format='K', array=self.data['number']%2))
+        primary = pyfits.PrimaryHDU()
+        primary.header['HLFCCDID'] = 'A2'
+        table = pyfits.new_table(columns)
+        table.name = 'HEL'
+        pyfits.HDUList([primary, table]).writeto(filename)
+        opened = lambda: [fd for fd in os.listdir('/proc/self/fd') if os.path.realpath('/proc/self/fd/'+fd) == filename]
+        times, flux, error, flags = fits.read_corot(filename, remove_flagged=False)
+        self.assertTrue(flux.flags.owndata and error.flags.owndata and flags.flags.owndata)
+        self.assertEqual(opened(), [])
+        self.assertTrue(np.all(flux == self.data['time']))
+        self.assertEqual(len(fits.read_corot(filename)[0]), 250)
+        times, flux, error, flags = fits.read_corot(filename, remove_flagged=False, lazy=True)
+        self.assertFalse(flux.flags.owndata)
+        self.assertTrue(np.all(flags == self.data['number']%2))
+    
+    def testFitsTable(self):
+        """ io.fits.FitsTable() reads only what is asked for """
+        with fits.FitsTable(self.filenames[0]) as table:
+            self.assertEqual(len(table), 500)
+            self.assertEqual(table.names, list(self.data.dtype.names))
+            self.assertTrue(np.all(table['number'] == self.data['number']))
+            self.assertTrue(np.all(table.field('flux', rows=[3,1,400]) == self.data['flux'][[3,1,400]]))
+            self.assertEqual(table.field('time', rows=7), self.data['time'][7])
+            self.assertEqual(table.read(rows=slice(None,None,50)).tolist(), self.data[::50].tolist())
+        hdulist = pyfits.open(self.filenames[0])
+        table = fits.FitsTable(hdulist, ext=1)
+        table.close()
+        self.assertTrue(np.all(hdulist[1].data.field('name') == self.data['name']))
+        hdulist.close()
+    
+    def testReadSpectrum(self):
+        """ io.fits.read_spectrum() of a wavelength range """
+        filename = os.path.join(self.tmpdir, 'spectrum.fits')
+        flux = np.random.uniform(size=1000)
+        fits.write_primary(filename, data=flux)
+        for key, value in [('CRPIX1', 1), ('CDELT1', 0.5), ('CRVAL1', 4000.)]:
+            pyfits.setval(filename, key, value=value)
+        wave, flux_ = fits.read_spectrum(filename)
+        self.assertTrue(np.allclose(wave, 4000. + 0.5*np.arange(1000)))
+        self.assertTrue(np.all(flux_ == flux))
+        wave_, flux_ = fits.read_spectrum(filename, wrange=(4100., 4200.))
+        self.assertTrue(np.all(wave_ == wave[(4100<=wave) & (wave<=4200)]))
+        self.assertTrue(np.all(flux_ == flux[(4100<=wave) & (wave<=4200)]))
+    
+    def testReadBatch(self):
+        """ io.fits.read_batch() and io.fits.read_headers() with threads """
+        tables = fits.read_batch(self.filenames, threads=3, columns=['number'], rows=slice(0,10))
+        for i, table in enumerate(tables):
+            self.assertTrue(np.all(table['number'] == np.arange(i, i+10)))
+        missing = os.path.join(self.tmpdir, 'missing.fits')
+        self.assertRaises(IOError, fits.read_batch, self.filenames+[missing], threads=2)
+        tables = fits.read_batch([missing]+self.filenames, threads=2, skip_errors=True)
+        self.assertEqual(tables[0], None)
+        self.assertEqual(tables[1].tolist(), self.data.tolist())
+        headers = fits.read_headers(self.filenames, ext=1, keys=['OBJECT','NAXIS2','NOKEY'], threads=2)
+        self.assertEqual([header['OBJECT'] for header in headers], ['star%d'%i for i in range(5)])
+        self.assertEqual([header['NAXIS2'] for header in headers], [500-i for i in range(5)])
+        self.assertEqual(headers[0]['NOKEY'], None)
+    
+    def testFitsWriter(self):
+        """ io.fits.FitsWriter() appends and replaces extensions """
+        filename = os.path.join(self.tmpdir, 'written.fits')
+        with fits.FitsWriter(filename, header_dict=dict(scalefac=1.5)) as writer:
+            for i in range(3):
+                writer.write_recarray(self.data[i:], header_dict=dict(phase=0.1*i, longkeyword=i), ext='mesh%d'%i)
+            writer.write_array([self.data['time'], self.data['number']], names=['time','number'], units=['d',''])
+            self.assertEqual(len(writer), 5)
+            self.assertTrue('MESH1' in writer)
+            writer.write_recarray(self.data[:10], ext='mesh1')
+            self.assertRaises(ValueError, writer.write_recarray, self.data, ext=0)
+            self.assertRaises(ValueError, writer.write_recarray, self.data, ext='primary')
+            self.assertEqual(len(writer), 5)
+        hdulist = pyfits.open(filename)
+        self.assertEqual([hdu.name.upper() for hdu in hdulist], ['PRIMARY','MESH0','MESH1','MESH2',''])
+        self.assertEqual(hdulist[0].header['SCALEFAC'], 1.5)
+        self.assertEqual(hdulist[2].header['NAXIS2'], 10)
+        self.assertEqual(hdulist[3].header['PHASE'], 0.2)
+        self.assertEqual(hdulist[3].header['LONGKEYWORD'], 2)
+        self.assertEqual(hdulist[4].columns.units, ['d',''])
+        hdulist.close()
+        self.assertEqual(fits.read2recarray(filename, ext='mesh2').tolist(), self.data[2:].tolist())
+    
+    def testWriteRecarray(self):
+        """ io.fits.write_recarray() to a new file, an existing file and an open writer """
+        filename = os.path.join(self.tmpdir, 'written.fits')
+        self.assertEqual(fits.write_recarray(self.data, filename, ext='data'), filename)
+        fits.write_recarray(self.data[::2], filename, ext='half', units=dict(time='d'))
+        writer = fits.write_recarray(self.data[:5], filename, ext='data', close=False)
+        writer = fits.write_array([self.data['flux']], writer, names=['flux'], close=False)
+        self.assertEqual(len(writer), 4)
+        writer.close()
+        self.assertEqual(fits.read2recarray(filename, ext='data').tolist(), self.data[:5].tolist())
+        self.assertEqual(fits.read2recarray(filename, ext='half').tolist(), self.data[::2].tolist())
+        self.assertTrue(np.all(fits.read2recarray(filename, ext=3)['flux'] == self.data['flux']))
+
+
 class HDF5TestCase(unittest.TestCase):
     
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'sed.hdf5')
+        self.grid = np.rec.fromarrays([np.random.uniform(size=5000), np.arange(5000)], names=['teff','nr'])
+        self.data = {'master': np.rec.fromarrays([np.arange(3.), ['U','B','V']], names=['flux','photband']),
+                     'results': {'igrid_search': {'grid': self.grid, 'factor': 2., 'CI': {'teff': 0.5}}},
+                     'label': 'text'}
+    
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+    
+    def testLazy(self):
+        """ io.hdf5.read2dict() lazily, of a path and of a selection of rows """
+        hdf5.write_dict(self.data, self.filename, attr_types=[str])
+        with hdf5.read2dict(self.filename, lazy=True) as data:
+            self.assertEqual(sorted(data.keys()), ['label','master','results'])
+            self.assertEqual(data['label'], 'text')
+            self.assertEqual(data['results']['igrid_search']._values, {})
+            self.assertEqual(data['results/igrid_search/CI/teff'], 0.5)
+            self.assertTrue(np.all(data.read('results/igrid_search/grid', rows=slice(10,20)) == self.grid[10:20]))
+            self.assertFalse('grid' in data['results']['igrid_search']._values)
+            self.assertEqual(data.todict()['results']['igrid_search']['factor'], 2.)
+        self.assertEqual(hdf5.read2dict(self.filename, path='results/igrid_search/CI'), {'teff': 0.5})
+        rows = hdf5.read_dataset(self.filename, 'results/igrid_search/grid', rows=[1,5,4000])
+        self.assertTrue(np.all(rows == self.grid[[1,5,4000]]))
+    
+    def testUpdate(self):
+        """ io.hdf5.write_dict() writes only what changed, compressed and resizable """
+        hdf5.write_dict(self.data, self.filename, compression='gzip', resizable=True)
+        hdf = h5py.File(self.filename, 'a')
+        grid = hdf['results/igrid_search/grid']
+        self.assertEqual((grid.compression, grid.maxshape), ('gzip', (None,)))
+        #-- change the file behind the back of the checksum
+        hdf['results/igrid_search/factor'][()] = 5.
+        hdf.close()
+        hdf5.write_dict(self.data, self.filename)
+        self.assertEqual(hdf5.read2dict(self.filename, path='results/igrid_search/factor'), 5.)
+        #-- update a lazily read file
+        data = hdf5.read2dict(self.filename, lazy=True)
+        data['results']['igrid_search']['factor'] = 3.
+        data['results']['igrid_search']['CI']['teff'] = 0.7
+        hdf5.write_dict(data, self.filename)
+        self.assertTrue(np.all(data['results']['igrid_search']['grid'] == self.grid))
+        data.close()
+        data = hdf5.read2dict(self.filename)
+        self.assertEqual(data['results']['igrid_search']['factor'], 3.)
+        self.assertEqual(data['results']['igrid_search']['CI'], {'teff': 0.7})
+        self.assertTrue(np.all(data['results']['igrid_search']['grid'] == self.grid))
+        #-- a resizable dataset grows in place
+        self.data['results']['igrid_search']['grid'] = self.grid[:100]
+        hdf5.write_dict(self.data, self.filename)
+        self.assertEqual(len(hdf5.read_dataset(self.filename, 'results/igrid_search/grid')), 100)
+        #-- the same bytes under other field names are rewritten
+        self.data['results']['igrid_search']['grid'] = self.grid[:100].view([('logg','f8'),('nr',self.grid.dtype['nr'])])
+        hdf5.write_dict(self.data, self.filename)
+        grid = hdf5.read_dataset(self.filename, 'results/igrid_search/grid')
+        self.assertEqual(grid.dtype.names, ('logg','nr'))
+    
+    def testOverwriteLazy(self):
+        """ io.hdf5.write_dict() overwrites a file with a lazy view of itself """
+        hdf5.write_dict(self.data, self.filename, attr_types=[str])
+        data = hdf5.read2dict(self.filename, lazy=True)
+        data['results']['igrid_search']['CI']['teff'] = 0.7
+        hdf5.write_dict(data, self.filename, update=False, attr_types=[str])
+        data.close()
+        data = hdf5.read2dict(self.filename)
+        self.assertEqual(data['results']['igrid_search']['CI'], {'teff': 0.7})
+        self.assertTrue(np.all(data['results']['igrid_search']['grid'] == self.grid))
+        self.assertEqual((data['label'], data['results']['igrid_search']['factor']), ('text', 2.))
+    
+    def testAppend(self):
+        """ io.hdf5.append() to a new and an existing dataset """
+        for i in range(0, 5000, 1500):
+            nrows = hdf5.append(self.filename, 'results/imc/grid', self.grid[i:i+1500], compression='gzip')
+        self.assertEqual(nrows, 5000)
+        self.assertTrue(np.all(hdf5.read_dataset(self.filename, 'results/imc/grid') == self.grid))
+    
     def testWriteDict(self):
         """ io.hdf5.write_dict() """
         data = {}
@@ -104,7 +616,3 @@ class HDF5TestCase(unittest.TestCase):
         
         if os.path.isfile('test.hdf5'):
             os.remove('test.hdf5')
-
-        
-        
-        
\ No newline at end of file
@@ -22,11 +22,11 @@ def baryvel(dje, deq=0):
    
   Inputs:
   @param dje: Julian ephemeris date.
-  @type dje: array
+  @type dje: float or array
   @param deq: epoch of mean equinox of dvelh and dvelb. If deq = 0 then deq is assumed to be equal to dje
   @type deq: float
   @return: heliocentric and barycentric velocity components in km/s (The 3-vectors dvelh and dvelb are given in a right-handed coordinate system with the +X axis toward the Vernal Equinox, and +Z axis toward the celestial pole.)
-  @rtype: array (2X3)          
+  @rtype: array (2X3), or (2X3XN) for N dates
   
   Functions called:
     premat() -- computes precession matrix
@@ -102,26 +102,26 @@ def baryvel(dje, deq=0):
   ccpamv = array([8.326827e-11, 1.843484e-11, 1.988712e-12, 1.881276e-12])
   dc1mme = 0.99999696e0
   
-  #Time arguments.
+  #Time arguments (the last axis runs over the dates).
+  dje = asarray(dje, dtype=float)
   dt = (dje - dcto) / dcjul
-  tvec = array([1e0, dt, dt * dt])
+  tvec = array([ones_like(dt), dt, dt * dt])
   
   #Values of all elements for the instant dje.
-  temp = (transpose(dot(transpose(tvec), transpose(dcfel)))) % dc2pi
+  temp = tensordot(dcfel, tvec, 1) % dc2pi
   dml = temp[0]
   forbel = temp[1:8]
   g = forbel[0]      #old fortran equivalence
   
-  deps = (tvec * dceps).sum() % dc2pi
-  sorbel = (transpose(dot(transpose(tvec), transpose(ccsel)))) % dc2pi
+  deps = tensordot(dceps, tvec, 1) % dc2pi
+  sorbel = tensordot(ccsel, tvec, 1) % dc2pi
   e = sorbel[0]     #old fortran equivalence
   
   #Secular perturbations in longitude.
-  dummy = cos(2.0)
-  sn = sin((transpose(dot(transpose(tvec[0:2]), transpose(ccsec[:,1:3])))) % cc2pi)
+  sn = sin(tensordot(ccsec[:,1:3], tvec[0:2], 1) % cc2pi)
   
   #Periodic perturbations of the emb (earth-moon barycenter).
-  pertl = (ccsec[:,0] * sn).sum() + dt * ccsec3 * sn[2]
+  pertl = tensordot(ccsec[:,0], sn, 1) + dt * ccsec3 * sn[2]
   pertld = 0.0
   pertr = 0.0
   pertrd = 0.0
@@ -208,11 +208,11 @@ def baryvel(dje, deq=0):
     dvelb = au * (array([dxbd, dyabd, dzabd]))
     return (dvelh,dvelb)
   
-  #General precession from epoch dje to deq.
+  #General precession from epoch dje to deq (a matrix for each date).
   deqdat = (dje - dcto - dcbes) / dctrop + dc1900
   prema = premat(deqdat, deq, fk4=True)
-  dvelh = au * (transpose(dot(transpose(prema), transpose(array([dxhd, dyahd, dzahd])))))
-  dvelb = au * (transpose(dot(transpose(prema), transpose(array([dxbd, dyabd, dzabd])))))
+  dvelh = au * einsum('ji...,j...->i...', prema, array([dxhd, dyahd, dzahd]))
+  dvelb = au * einsum('ji...,j...->i...', prema, array([dxbd, dyabd, dzabd]))
   
   return (dvelh, dvelb)
 
@@ -310,53 +310,51 @@ def bprecess(ra0, dec0, mu_radec=None, parallax=None, rad_vel=None, epoch=None):
   sinra = sin(ra_rad)
   cosdec = cos(dec_rad)
   sindec = sin(dec_rad)
-  dec_1950 = dec * 0.
-  ra_1950 = ra * 0.
-  
-  for i in range(n):
-    # Following statement moved inside loop in Feb 2000.
-    a = 1e-6 * array([-1.62557e0, -0.31919e0, -0.13843e0])        #in radians
-    r0 = array([cosra[i] * cosdec[i], sinra[i] * cosdec[i], sindec[i]])
-    if (mu_radec is not None):   
-      mu_a = mu_radec[i,0]
-      mu_d = mu_radec[i,1]
-      r0_dot = array([-mu_a * sinra[i] * cosdec[i] - mu_d * cosra[i] * sindec[i], mu_a * cosra[i] * cosdec[i] - mu_d * sinra[i] * sindec[i], mu_d * cosdec[i]]) + 21.095e0 * rad_vel[i] * parallax[i] * r0
-    else:   
-      r0_dot = array([0.0e0, 0.0e0, 0.0e0])
-      
-    r_0 = concatenate((r0, r0_dot))
-    r_1 = transpose(dot(transpose(m), transpose(r_0)))
-    
-    # Include the effects of the E-terms of aberration to form r and r_dot.
-    r1 = r_1[0:3]
-    r1_dot = r_1[3:6]
-    if mu_radec is None:   
-      r1 = r1 + sec_to_radian ( r1_dot * (epoch - 1950.0e0) / 100. )
-      a = a + sec_to_radian ( a_dot * (epoch - 1950.0e0) / 100. )
-      
-    x1 = r_1[0]   ;   y1 = r_1[1]    ;  z1 = r_1[2]
-    rmag = sqrt(x1 ** 2 + y1 ** 2 + z1 ** 2)
-    s1 = r1 / rmag    ; s1_dot = r1_dot / rmag
-    s = s1
-    for j in arange(0, 3):
-      r = s1 + a - ((s * a).sum()) * s
-      s = r / rmag
-    x = r[0]          ; y = r[1]     ;  z = r[2]
-    r2 = x ** 2 + y ** 2 + z ** 2
-    rmag = sqrt(r2)
-    
-    if mu_radec is not None:   
-      r_dot = s1_dot + a_dot - ((s * a_dot).sum()) * s
-      x_dot = r_dot[0]  ; y_dot = r_dot[1]  ;  z_dot = r_dot[2]
-      mu_radec[i,0] = (x * y_dot - y * x_dot) / (x ** 2 + y ** 2)
-      mu_radec[i,1] = (z_dot * (x ** 2 + y ** 2) - z * (x * x_dot + y * y_dot)) / (r2 * sqrt(x ** 2 + y ** 2))
+  
+  # All stars at once: vectors are (3, n) arrays
+  a = 1e-6 * array([-1.62557e0, -0.31919e0, -0.13843e0])[:,newaxis] * ones(n)        #in radians
+  r0 = array([cosra * cosdec, sinra * cosdec, sindec])
+  if (mu_radec is not None):   
+    mu_a = mu_radec[:,0]
+    mu_d = mu_radec[:,1]
+    r0_dot = array([-mu_a * sinra * cosdec - mu_d * cosra * sindec, mu_a * cosra * cosdec - mu_d * sinra * sindec, mu_d * cosdec]) + 21.095e0 * rad_vel * parallax * r0
+  else:   
+    r0_dot = zeros((3, n))
     
-    dec_1950[i] = arcsin(z / rmag)
-    ra_1950[i] = arctan2(y, x)
+  r_0 = concatenate((r0, r0_dot))
+  r_1 = dot(transpose(m), r_0)
+  
+  # Include the effects of the E-terms of aberration to form r and r_dot.
+  r1 = r_1[0:3]
+  r1_dot = r_1[3:6]
+  if mu_radec is None:   
+    r1 = r1 + sec_to_radian ( r1_dot * (epoch - 1950.0e0) / 100. )
+    a = a + sec_to_radian ( a_dot * (epoch - 1950.0e0) / 100. )[:,newaxis]
     
-    if parallax[i] > 0.:   
-      rad_vel[i] = (x * x_dot + y * y_dot + z * z_dot) / (21.095 * parallax[i] * rmag)
-      parallax[i] = parallax[i] / rmag
+  x1 = r_1[0]   ;   y1 = r_1[1]    ;  z1 = r_1[2]
+  rmag = sqrt(x1 ** 2 + y1 ** 2 + z1 ** 2)
+  s1 = r1 / rmag    ; s1_dot = r1_dot / rmag
+  s = s1
+  for j in arange(0, 3):
+    r = s1 + a - ((s * a).sum(axis=0)) * s
+    s = r / rmag
+  x = r[0]          ; y = r[1]     ;  z = r[2]
+  r2 = x ** 2 + y ** 2 + z ** 2
+  rmag = sqrt(r2)
+  
+  if mu_radec is not None:   
+    r_dot = s1_dot + a_dot[:,newaxis] - ((s * a_dot[:,newaxis]).sum(axis=0)) * s
+    x_dot = r_dot[0]  ; y_dot = r_dot[1]  ;  z_dot = r_dot[2]
+    mu_radec[:,0] = (x * y_dot - y * x_dot) / (x ** 2 + y ** 2)
+    mu_radec[:,1] = (z_dot * (x ** 2 + y ** 2) - z * (x * x_dot + y * y_dot)) / (r2 * sqrt(x ** 2 + y ** 2))
+  
+  dec_1950 = arcsin(z / rmag)
+  ra_1950 = arctan2(y, x)
+  
+  pos = parallax > 0.
+  if pos.any():   
+    rad_vel[pos] = ((x * x_dot + y * y_dot + z * z_dot) / (21.095 * parallax * rmag))[pos]
+    parallax[pos] = parallax[pos] / rmag[pos]
   
   neg = (ra_1950 < 0)
   if neg.any() > 0:   
@@ -646,11 +644,11 @@ def helcorr(ra2000, dec2000, jd, obs_long=None, obs_lat=None, obs_alt=None, debu
 
   INPUT:
   @param ra2000: Right ascension of object for epoch 2000.0 (hours)
-  @type ra2000: float
+  @type ra2000: float or array
   @param dec2000: declination of object for epoch 2000.0 (degrees)
-  @type dec2000: float
+  @type dec2000: float or array
   @param jd: julian date for the middle of exposure
-  @type jd: float
+  @type jd: float or array
   @keyword obs_long: longitude of observatory (degrees, western direction is positive)
   @type obs_long: float
   @keyword obs_lat: latitude of observatory (degrees)
@@ -658,10 +656,18 @@ def helcorr(ra2000, dec2000, jd, obs_long=None, obs_lat=None, obs_alt=None, debu
   @keyword obs_alt: altitude of observatory (meters)
   @type obs_alt: float
   
+  @return: barycentric correction (km/s) and heliocentric julian date
+  @rtype: float, float (or arrays)
+  
   Algorithms used are taken from the IRAF task noao.astutils.rvcorrect
   and some procedures of the IDL Astrolib are used as well.
   Accuracy is about 0.5 seconds in time and about 1 m/s in velocity.
   
+  Arrays of julian dates (and coordinates) are corrected at once, which is
+  much faster than calling this function for every observation:
+  
+  >>> corr, hjd = helcorr(18.61, 38.78, array([2456084.01922, 2456085.02]))
+  
   History:
   written by Peter Mittermayer, Nov 8,2003
   2005-January-13   Kudryavtsev   Made more accurate calculation of the sideral time.
@@ -679,6 +685,8 @@ def helcorr(ra2000, dec2000, jd, obs_long=None, obs_lat=None, obs_alt=None, debu
     obs_alt = 2333.
   
   #covert JD to Gregorian calendar date
+  if not isscalar(jd):
+    jd = asarray(jd, dtype=float)
   xjd = jd*1.0
   jd  = jd-2400000.0
   year, month, dayraw = convert("JD", "CD", xjd)
@@ -732,11 +740,11 @@ def helio_jd(date, ra, dec, b1950=False, time_diff=False):
   
   Input:
     @param date: Reduced Julian date (= JD - 2400000)
-    @type date: float
+    @type date: float or array
     @param ra: J2000 right ascension in DEGREES (unless B1950 keyword is set)
-    @type ra: float
+    @type ra: float or array
     @param dec: J2000 declination in DEGREES (unless B1950 keyword is set)
-    @type dec: float
+    @type dec: float or array
     @keyword b1950: if set, then input coordinates are assumed to be in equinox B1950 coordinates
     @type b1950: bool
     @keyword time_diff: if set, then HELIO_JD() returns the time difference (heliocentric JD - geocentric JD ) in seconds
@@ -775,18 +783,22 @@ def precess(ra0, dec0, equinox1, equinox2, doprint=False, fk4=False, radian=Fals
   
   Input:
     @param ra0: Input right ascension in DEGREES
-    @type ra0: float
+    @type ra0: float or array
     @param dec0: Input declination in degrees
-    @type dec0: float
+    @type dec0: float or array
     @param equinox1: first equinox
-    @type equinox1: float
+    @type equinox1: float or array
     @param equinox2: second equinox
-    @type equinox2: float
+    @type equinox2: float or array
     @keyword fk4: If this keyword is set and non-zero, the FK4 (B1950.0) system will be used otherwise FK5 (J2000.0) will be used instead.
     @type fk4: float
     @keyword radian: If this keyword is set, input is in radian instead of degrees
     @type radian
     
+  The coordinates and equinoxes are broadcast against each other, such that a
+  star can be precessed to the equinoxes of many observations at once. Every
+  distinct pair of equinoxes needs one precession matrix (see L{premat}).
+  
   Restrictions:
     Accuracy of precession decreases for declination values near 90 degrees.
     PRECESS should not be used more than 2.5 centuries from 2000 on the FK5 system (1950.0 on the FK4 system).
@@ -804,14 +816,11 @@ def precess(ra0, dec0, equinox1, equinox2, doprint=False, fk4=False, radian=Fals
     Convert to Python (S. Koposov, july 2010)
     Converted for use at IvS (K. Smolders)
   """
-  scal = True
-  if isinstance(ra0, ndarray):
-    ra   = ra0.copy()  
-    dec  = dec0.copy()
-    scal = False
-  else:
-    ra  = array([ra0])
-    dec = array([dec0])
+  scal = not [arg for arg in (ra0, dec0, equinox1, equinox2) if isinstance(arg, ndarray)]
+  ra, dec, equinox1, equinox2 = broadcast_arrays(array(ra0, dtype=float, ndmin=1), array(dec0, dtype=float, ndmin=1),
+                                                 array(equinox1, dtype=float, ndmin=1), array(equinox2, dtype=float, ndmin=1))
+  ra   = ra.ravel()
+  dec  = dec.ravel()
   npts = ra.size 
   
   if not radian:   
@@ -827,9 +836,16 @@ def precess(ra0, dec0, equinox1, equinox2, doprint=False, fk4=False, radian=Fals
   x[:,1] = a * sin(ra_rad)
   x[:,2] = sin(dec_rad)
   
-  # Use PREMAT function to get precession matrix from Equinox1 to Equinox2
-  r       = premat(equinox1, equinox2, fk4=fk4)
-  x2      = transpose(dot(transpose(r), transpose(x)))
+  # Use PREMAT function to get precession matrix from Equinox1 to Equinox2,
+  # for every pair of equinoxes
+  equinox1 = equinox1.ravel()
+  equinox2 = equinox2.ravel()
+  x2       = zeros((npts, 3)) + nan
+  for eq1 in unique(equinox1):
+    for eq2 in unique(equinox2[equinox1 == eq1]):
+      keep     = (equinox1 == eq1) & (equinox2 == eq2)
+      r        = premat(eq1, eq2, fk4=fk4)
+      x2[keep] = dot(x[keep], r)
   ra_rad  = zeros(npts) + arctan2(x2[:,1], x2[:,0])
   dec_rad = zeros(npts) + arcsin(x2[:,2])
   
@@ -891,22 +907,43 @@ def premat(equinox1, equinox2, fk4=False):
   """
   Return the precession matrix needed to go from EQUINOX1 to EQUINOX2.
   
-  This matrix is used by the procedures PRECESS and BARYVEL to precess astronomical coordinates
-  @param equinox1: Original equinox of coordinates, numeric scalar.
-  @type equinox1: float
+  This matrix is used by the procedures PRECESS and BARYVEL to precess astronomical coordinates.
+  The matrices of scalar equinoxes are cached (and read-only); arrays of equinoxes
+  give a matrix for every pair of equinoxes.
+  
+  @param equinox1: Original equinox of coordinates.
+  @type equinox1: float or array
   @param equinox2: Equinox of precessed coordinates.
-  @type equinox2: float
+  @type equinox2: float or array
   @return: double precision 3 x 3 precession matrix, used to precess equatorial rectangular coordinates
-  @rtype: 3 by 3 array
+  @rtype: 3 by 3 array, or 3 by 3 by N array
   @keyword fk4: If this keyword is set, the FK4 (B1950.0) system precession angles are used to compute the precession matrix. The default is to use FK5 (J2000.0) precession angles
   
   Revision history:
     Written, Wayne Landsman, HSTX Corporation, June 1994
     Converted to IDL V5.0   W. Landsman   September 1997
   """
+  if isscalar(equinox1) and isscalar(equinox2):
+    key = (float(equinox1), float(equinox2), bool(fk4))
+    if not key in _premat_cache:
+      if len(_premat_cache) >= 1000:
+        _premat_cache.clear()
+      r = _premat(equinox1, equinox2, fk4=fk4)
+      r.flags.writeable = False
+      _premat_cache[key] = r
+    return _premat_cache[key]
+  return _premat(equinox1, equinox2, fk4=fk4)
+
+#-- precession matrices of pairs of equinoxes
+_premat_cache = {}
+
+def _premat(equinox1, equinox2, fk4=False):
+  """
+  Compute the precession matrix from EQUINOX1 to EQUINOX2 (see L{premat}).
+  """
   deg_to_rad = pi / 180.0e0
   sec_to_rad = deg_to_rad / 3600.e0
-  t          = 0.001e0 * (equinox2 - equinox1)
+  t          = 0.001e0 * (asarray(equinox2, dtype=float) - equinox1)
   
   if not fk4:   
     st = 0.001e0 * (equinox1 - 2000.e0)
@@ -927,10 +964,9 @@ def premat(equinox1, equinox2, fk4=False):
   cosa   = cos(a)
   cosb   = cos(b)
   cosc   = cos(c)
-  r      = zeros((3, 3))
-  r[0,:] = array([cosa * cosb * cosc - sina * sinb, sina * cosb + cosa * sinb * cosc, cosa * sinc])
-  r[1,:] = array([-cosa * sinb - sina * cosb * cosc, cosa * cosb - sina * sinb * cosc, -sina * sinc])
-  r[2,:] = array([-cosb * sinc, -sinb * sinc, cosc])
+  r      = array([[cosa * cosb * cosc - sina * sinb, sina * cosb + cosa * sinb * cosc, cosa * sinc],
+                  [-cosa * sinb - sina * cosb * cosc, cosa * cosb - sina * sinb * cosc, -sina * sinc],
+                  [-cosb * sinc, -sinb * sinc, cosc]])
   
   return r
 
@@ -0,0 +1,52 @@
+"""
+Unit tests for the barycentric corrections (observations.barycentric_correction).
+"""
+import numpy as np
+from ivs.observations import barycentric_correction as bc
+
+import unittest
+
+class BarycentricTestCase(unittest.TestCase):
+
+    def testReference(self):
+        """ observations.barycentric_correction.helcorr() equals the original scalar results """
+        #-- ra (h), dec (deg), jd, observatory (long, lat, alt) and the output of the
+        #   original scalar helcorr (barycentric correction in km/s, HJD - 2400000)
+        for ra, dec, jd, site, corr, hjd in [(3.2, -12.5, 2455832.25, None, 15.645648925622831, 55832.25400432068),
+                                             (18.61, 38.78, 2456084.01922, None, 6.881746574135647, 56084.021616196995),
+                                             (0.5, 75.3, 2451545.0, (-70.73, -29.257, 2347.), -9.740334890254532, 51545.002061594794),
+                                             (12.1, -60.2, 2457400.9, (116.863, 33.356, 1706.), 18.147787844439666, 57400.89918734684),
+                                             (6.86, 10.15, 2455862.75, None, 27.041372825753054, 55862.75201692813)]:
+            site = dict(zip(['obs_long', 'obs_lat', 'obs_alt'], site or ()))
+            output = bc.helcorr(ra, dec, jd, **site)
+            self.assertAlmostEqual(output[0], corr, places=10)
+            self.assertAlmostEqual(output[1], hjd, places=10)
+        vh, vb = bc.baryvel(2455832.25, 2000)
+        self.assertTrue(np.allclose(vb, [-2.622066506022459, 27.161398304610987, 11.774522443425365], rtol=1e-12))
+        self.assertAlmostEqual(bc.helio_jd(55832.25, 120.5, -30.2), 55832.247668199416, places=10)
+
+    def testArrays(self):
+        """ observations.barycentric_correction.helcorr() of arrays equals the scalar calls """
+        jds = 2455000. + np.linspace(0, 1000, 50)
+        ras, decs = np.linspace(0, 24, 50), np.linspace(-80, 80, 50)
+        corr, hjd = bc.helcorr(ras, decs, jds)
+        self.assertEqual(corr.shape, (50,))
+        for i in range(50):
+            scalar = bc.helcorr(ras[i], decs[i], jds[i])
+            self.assertAlmostEqual(corr[i], scalar[0], places=10)
+            self.assertAlmostEqual(hjd[i], scalar[1], places=10)
+        #-- one star at many dates, and dates that cannot be corrected
+        corr, hjd = bc.helcorr(ras[3], decs[3], np.array([jds[3], np.nan]))
+        self.assertAlmostEqual(corr[0], bc.helcorr(ras[3], decs[3], jds[3])[0], places=10)
+        self.assertTrue(np.isnan(corr[1]) and np.isnan(hjd[1]))
+        for deq in [0, 2000]:
+            vh, vb = bc.baryvel(jds, deq)
+            self.assertEqual(vb.shape, (3, 50))
+            self.assertTrue(np.allclose(vb[:, 7], bc.baryvel(jds[7], deq)[1], rtol=1e-12))
+
+    def testPrecess(self):
+        """ observations.barycentric_correction.precess() to many equinoxes """
+        ra, dec = bc.precess(120., 30., 2000., np.array([1950., 2010., 1950.]))
+        self.assertEqual(ra[0], ra[2])
+        self.assertEqual((ra[1], dec[1]), bc.precess(120., 30., 2000., 2010.))
+        self.assertFalse(bc.premat(2000., 2010.).flags.writeable)
@@ -0,0 +1,67 @@
+"""
+Unit tests for the visibility of objects (observations.visibility).
+"""
+import ephem
+import numpy as np
+from ivs.observations import visibility
+
+import unittest
+
+#-- an arcsecond and a second
+arcsec = np.radians(1./3600.)
+second = ephem.second
+
+
+class VisibilityTestCase(unittest.TestCase):
+
+    def setUp(self):
+        #-- fixed objects at a spread of declinations
+        self.objects = [ephem.readdb("star0,f|M|A0,0:00:00,-60:00:00,8.0,2000"),
+                        ephem.readdb("star1,f|M|A0,7:13:00,-23:00:00,8.0,2000"),
+                        ephem.readdb("star2,f|M|A0,14:26:00,14:00:00,8.0,2000")]
+
+    def testVectorized(self):
+        """ observations.visibility.Ephemeris.visibility() vectorized equals the step-by-step computation """
+        #-- a grid of dates, and the middle of each night
+        for sitename, startdate, kwargs, ndates in [('lapalma', '2011/09/27 12:00:00.0', dict(days=3, dt=10.), 3*144),
+                                                    ('lasilla', '2011/09/27 12:00:00.0', dict(days=3, dt=10.), 3*144),
+                                                    ('Paris', '2011/09/27 12:00:00.0', dict(midnight=True), 365),
+                                                    ('Paris', '2011/09/27 23:00:00.0', dict(midnight=True), 365)]:
+            loop = visibility.Ephemeris(sitename=sitename, startdate=startdate)
+            vect = visibility.Ephemeris(sitename=sitename, startdate=startdate)
+            for eph, vectorized in [(loop, False), (vect, True)]:
+                eph.objects = self.objects
+                eph.visibility(vectorized=vectorized, **kwargs)
+            self.assertEqual(vect.vis['alts'].shape, (3*ndates,))
+            self.assertTrue(np.all(abs(loop.vis['MJDs']-vect.vis['MJDs']) < 0.1*second))
+            self.assertTrue(np.all(loop.vis['during_night'] == vect.vis['during_night']))
+            up = loop.vis['alts'] > 0
+            self.assertTrue(np.all(abs(loop.vis['alts']-vect.vis['alts'])[up] < 3*arcsec))
+            self.assertTrue(np.allclose(loop.vis['airmass'][up], vect.vis['airmass'][up], rtol=1e-4))
+            for key in ['_sun_prevrise', '_sun_prevset', '_sun_nextrise', '_sun_nextset']:
+                self.assertTrue(np.all(abs(getattr(loop, key)-getattr(vect, key)) < 2*second))
+            if 'midnight' in kwargs:
+                continue
+            self.assertTrue(np.all(loop.vis['dates'] == vect.vis['dates']))
+            self.assertEqual(str(loop.get_date()), str(vect.get_date()))
+            up = loop.vis['moon_alts'] > 0
+            self.assertTrue(np.all(abs(loop.vis['moon_alts']-vect.vis['moon_alts'])[up] < 20*arcsec))
+            self.assertTrue(np.all(abs(loop.vis['moon_separation']-vect.vis['moon_separation']) < 20*arcsec))
+
+    def testSparseDates(self):
+        """ observations.visibility.ephemeris() at dates spread over a year """
+        site = ephem.city('Paris')
+        objects = self.objects[:2]
+        dates = float(ephem.Date('2012/01/01')) + np.array([0.1, 0.35, 17.8, 120.2, 300.9])
+        eph = visibility.ephemeris(site, objects, dates)
+        sun, moon = ephem.Sun(), ephem.Moon()
+        for i, date in enumerate(dates):
+            site.date = date
+            moon.compute(site)
+            self.assertTrue(abs(eph['moon_alts'][i]-float(moon.alt)) < 20*arcsec)
+            self.assertTrue(abs(eph['sun_nextset'][i]-float(site.next_setting(sun))) < 2*second)
+            self.assertTrue(abs(eph['sun_prevrise'][i]-float(site.previous_rising(sun))) < 2*second)
+            for j, star in enumerate(objects):
+                star.compute(site)
+                self.assertTrue(abs(eph['alts'][j, i]-float(star.alt)) < 3*arcsec)
+                self.assertTrue(abs(eph['moon_separation'][j, i]-float(ephem.separation(moon, star))) < 20*arcsec)
@@ -293,7 +293,7 @@ class Ephemeris(object):
     
     #{ Compute and plot visibilities
     
-    def visibility(self,multiple=False,midnight=None,airmassmodel='Pickering2002',**kwargs):
+    def visibility(self,multiple=False,midnight=None,airmassmodel='Pickering2002',vectorized=True,**kwargs):
         """
         Calculate ephemeri.
         
@@ -323,6 +323,11 @@ class Ephemeris(object):
         NOTE: use the 'get_out_objects', 'get_out_objectnames', 'get_out_sites' and 'get_out_sitenames' functions to retrieve the object, name of the object, 
         site and name of the site corresponding to a particular row in each of the arrays 'vis' contains.
         
+        *If 'vectorized' = True (default), the positions of the sun, moon and objects are not computed with 'ephem' at every time step. Instead, the
+        apparent positions of the moon and the objects are computed with 'ephem' on a sparse grid and interpolated, and the altitudes and separations
+        of all objects at all times are computed at once from the local sidereal time (see L{ephemeris}). The sun rises and sets are computed once per
+        night. The altitudes agree with the step-by-step computation ('vectorized' = False) to a few arcseconds (about ten for the moon).
+        
         """
         #-- if no values are given for these keywords, this means nothing should change --> None
         kwargs.setdefault('sitename',None)
@@ -360,8 +365,27 @@ class Ephemeris(object):
             sun_nextrise = np.zeros(total_minutes)
             sun_nextset = np.zeros(total_minutes)
                 
+            #-- compute all timesteps at once
+            if vectorized:
+                events = None
+                if midnight is None:
+                    steps = np.ones(total_minutes+1)*ephem.minute*timestep_minutes
+                    steps[0] = float(self.thesite.date)
+                    rawdates = np.cumsum(steps)
+                    self.thesite.date,rawdates = rawdates[-1],rawdates[:-1]
+                else:
+                    startdate = float(self.thesite.date)
+                    events = sun_events(self.thesite,startdate,startdate+total_minutes+2)
+                    rawdates = midnights(events,startdate,nights=total_minutes)
+                    self.thesite.date = rawdates[-1] + 1.
+                eph = ephemeris(self.thesite,self.objects,rawdates,events=events)
+                alts,moon_alts,moon_separation = eph['alts'],eph['moon_alts'],eph['moon_separation']
+                sun_prevrise,sun_prevset = eph['sun_prevrise'],eph['sun_prevset']
+                sun_nextrise,sun_nextset = eph['sun_nextrise'],eph['sun_nextset']
+                during_night = np.array(sun_prevrise<=sun_prevset,int)
+            
             #-- run over all timesteps
-            if midnight is None:
+            elif midnight is None:
                 for i in range(total_minutes):
                     sun_prevset[i] = float(self.thesite.previous_setting(sun))
                     sun_prevrise[i] = float(self.thesite.previous_rising(sun))
@@ -454,47 +478,74 @@ class Ephemeris(object):
             sun_nextrise = np.zeros(it.shape[0])
             sun_nextset = np.zeros(it.shape[0])
                 
+            #-- compute all elements at the same site at once
+            if vectorized:
+                defaultdate = float(self.thesite.date)
+                dates = np.array([_djd(date,defaultdate) for date in startdate])
+                dates,siteIndices,objectIndices = np.broadcast_arrays(dates,self._siteIndices,self._objectIndices)
+                rawdates[:] = dates
+                for j,site in enumerate(self._uniqueSites):
+                    atsite = siteIndices==j
+                    if not np.any(atsite):
+                        continue
+                    sitedates,inverse = np.unique(rawdates[atsite],return_inverse=True)
+                    eph = ephemeris(site,self.objects,sitedates)
+                    alts[atsite] = eph['alts'][objectIndices[atsite],inverse]
+                    moon_separation[atsite] = eph['moon_separation'][objectIndices[atsite],inverse]
+                    moon_alts[atsite] = eph['moon_alts'][inverse]
+                    sun_prevrise[atsite] = eph['sun_prevrise'][inverse]
+                    sun_prevset[atsite] = eph['sun_prevset'][inverse]
+                    sun_nextrise[atsite] = eph['sun_nextrise'][inverse]
+                    sun_nextset[atsite] = eph['sun_nextset'][inverse]
+                during_night = np.array(sun_prevrise<=sun_prevset,int)
+                self.thesite = self._uniqueSites[siteIndices[-1]]
+                self.thesite.date = rawdates[-1]
+            
             #-- run over all elements
-            for i,element in enumerate(it):
-                #-- set the site and date
-                self.thesite = self._uniqueSites[element[1]]
-                self.set_date(startdate=element[0],days=None,dt=None)
-                #-- determine whether the time corresponds to night or day
-                sun_prevset[i] = float(self.thesite.previous_setting(sun))
-                sun_prevrise[i] = float(self.thesite.previous_rising(sun))
-                sun_nextset[i] = float(self.thesite.next_setting(sun))
-                sun_nextrise[i] = float(self.thesite.next_rising(sun))
-                if (sun_prevrise[i]<=sun_prevset[i]):
-                    during_night[i] = 1
-                rawdates[i] = float(self.thesite.date)
-                #-- compute the moon position
-                moon.compute(self.thesite)
-                moon_alts[i] = float(moon.alt)
-                #-- compute the star's position
-                star = self.objects[element[2]]
-                star.compute(self.thesite)
-                alts[i] = float(star.alt)
-                moon_separation[i] = ephem.separation(moon,star)
+            else:
+                for i,element in enumerate(it):
+                    #-- set the site and date
+                    self.thesite = self._uniqueSites[element[1]]
+                    self.set_date(startdate=element[0],days=None,dt=None)
+                    #-- determine whether the time corresponds to night or day
+                    sun_prevset[i] = float(self.thesite.previous_setting(sun))
+                    sun_prevrise[i] = float(self.thesite.previous_rising(sun))
+                    sun_nextset[i] = float(self.thesite.next_setting(sun))
+                    sun_nextrise[i] = float(self.thesite.next_rising(sun))
+                    if (sun_prevrise[i]<=sun_prevset[i]):
+                        during_night[i] = 1
+                    rawdates[i] = float(self.thesite.date)
+                    #-- compute the moon position
+                    moon.compute(self.thesite)
+                    moon_alts[i] = float(moon.alt)
+                    #-- compute the star's position
+                    star = self.objects[element[2]]
+                    star.compute(self.thesite)
+                    alts[i] = float(star.alt)
+                    moon_separation[i] = ephem.separation(moon,star)
                 
         #-- calculate airmass
         airmass = obs_airmass.airmass(90-alts/pi*180,model=airmassmodel)
         moon_airmass = obs_airmass.airmass(90-moon_alts/pi*180,model=airmassmodel)
         
         #-- calculate dates for plotting and output
-        self._plotdates = np.array([date2num(ephem.Date(h).datetime()) for h in rawdates])
-        self._sun_prevset = np.array([date2num(ephem.Date(h).datetime()) for h in sun_prevset])
-        self._sun_prevrise = np.array([date2num(ephem.Date(h).datetime()) for h in sun_prevrise])
-        self._sun_nextset = np.array([date2num(ephem.Date(h).datetime()) for h in sun_nextset])
-        self._sun_nextrise = np.array([date2num(ephem.Date(h).datetime()) for h in sun_nextrise])
-        dates = np.array([str(ephem.Date(h).datetime()) for h in rawdates])
+        #   (only once per distinct date: they repeat for every object and every step during the night or day)
+        ephem2num = lambda h: date2num(ephem.Date(h).datetime())
+        self._plotdates = _map_unique(ephem2num,rawdates)
+        self._sun_prevset = _map_unique(ephem2num,sun_prevset)
+        self._sun_prevrise = _map_unique(ephem2num,sun_prevrise)
+        self._sun_nextset = _map_unique(ephem2num,sun_nextset)
+        self._sun_nextrise = _map_unique(ephem2num,sun_nextrise)
+        dates = _map_unique(lambda h: str(ephem.Date(h).datetime()),rawdates)
         MJDs = rawdates+15019.499999                                                             # the zeropoint of ephem is 1899/12/31 12:00:00.0      15019.499585
         
         #-- the output dictionary
         self.vis = dict(MJDs=MJDs,dates=dates,alts=alts,airmass=airmass,during_night=during_night,moon_alts=moon_alts,moon_airmass=moon_airmass,moon_separation=moon_separation)
-        self.vis.update(dict(sun_prevrise=np.array(num2date(self._sun_prevrise),dtype='|S19'),sun_prevset=np.array(num2date(self._sun_prevset),dtype='|S19'),sun_nextrise=np.array(num2date(self._sun_nextrise),dtype='|S19'),sun_nextset=np.array(num2date(self._sun_nextset),dtype='|S19')))
+        num2str = lambda h: np.array(num2date(h),dtype='|S19')
+        self.vis.update(dict(sun_prevrise=_map_unique(num2str,self._sun_prevrise),sun_prevset=_map_unique(num2str,self._sun_prevset),sun_nextrise=_map_unique(num2str,self._sun_nextrise),sun_nextset=_map_unique(num2str,self._sun_nextset)))
         for i,obj in enumerate(self.objects):
             keep = (self._objectIndices == i) & (during_night==1) & (0<=airmass) & (airmass<=2.5)
-            logger.info('Object %s: %s visible during night time (%.1f<airmass<%.1f)'%(obj.name,-np.any(keep) and 'not' or '',sum(keep) and airmass[keep].min() or np.nan,sum(keep) and airmass[keep].max() or np.nan))
+            logger.info('Object %s: %s visible during night time (%.1f<airmass<%.1f)'%(obj.name,not np.any(keep) and 'not' or '',keep.sum() and airmass[keep].min() or np.nan,keep.sum() and airmass[keep].max() or np.nan))
 
 
     def plot(self,plot_daynight=True,**kwargs):
@@ -597,6 +648,227 @@ class Ephemeris(object):
         pl.xlabel('time (UTC)')
         
     #}
+
+
+#{ Vectorised ephemeris
+
+def ephemeris(site,objects,dates,moon_step=1./24.,object_step=1.,events=None):
+    """
+    Compute the altitudes of objects and the moon, and the rises and sets of the sun, at a site for an array of dates.
+    
+    Only the slowly varying apparent (geocentric) positions are computed with 'ephem': those of the objects once per
+    'object_step' days, those of the moon once per 'moon_step' days. They are interpolated to the dates, and the
+    altitudes and the (topocentric) separation to the moon follow from the local sidereal time for all objects and
+    dates at once. Altitudes include the refraction of 'ephem' (set site.pressure to 0 to switch it off). The rises
+    and sets of the sun are computed once per night.
+    
+    >>> site = ephem.city('Paris')
+    >>> star = ephem.readdb("HD50230,f|M|A0,6:51:45.76,10:08:55.8,8.0,2000")
+    >>> eph = ephemeris(site,[star],float(ephem.Date('2011/09/27 12:00'))+np.arange(144)/144.)
+    >>> eph['alts'].shape,eph['moon_alts'].shape
+    ((1, 144), (144,))
+    
+    @param site: observing site
+    @type site: ephem.Observer
+    @param objects: fixed objects
+    @type objects: list of ephem.FixedBody
+    @param dates: dates (ephem format, i.e. Dublin Julian Dates)
+    @type dates: array
+    @param moon_step: sampling of the position of the moon (days)
+    @type moon_step: float
+    @param object_step: sampling of the positions of the objects (days)
+    @type object_step: float
+    @param events: sets and rises of the sun covering the dates (see L{sun_events}), computed if not given
+    @type events: tuple of 2 arrays
+    @return: altitudes of the objects (objects x dates, rad), the moon (rad), separations of the objects to the moon
+    (objects x dates, rad) and the previous/next rise/set of the sun (ephem dates)
+    @rtype: dict
+    """
+    dates = np.asarray(dates,float)
+    lat = float(site.lat)
+    lst = sidereal_time(dates,float(site.long))
+    
+    #-- apparent geocentric positions of the objects
+    ra = np.zeros((len(objects),len(dates)))
+    dec = np.zeros((len(objects),len(dates)))
+    for j,star in enumerate(objects):
+        ra[j],dec[j],distance = _apparent_position(star,dates,object_step)
+    alts = _refract(_altitude(ra,dec,lst,lat),site.pressure,site.temp)
+    
+    #-- topocentric position of the moon: subtract the position of the site
+    moon_ra,moon_dec,moon_distance = _apparent_position(ephem.Moon(),dates,moon_step)
+    moon_distance = moon_distance*ephem.meters_per_au/ephem.earth_radius
+    rho = 1. + site.elevation/ephem.earth_radius
+    x = moon_distance*cos(moon_dec)*cos(moon_ra) - rho*cos(lat)*cos(lst)
+    y = moon_distance*cos(moon_dec)*sin(moon_ra) - rho*cos(lat)*sin(lst)
+    z = moon_distance*sin(moon_dec) - rho*sin(lat)
+    moon_ra,moon_dec = np.arctan2(y,x),np.arctan2(z,sqrt(x**2+y**2))
+    moon_alts = _refract(_altitude(moon_ra,moon_dec,lst,lat),site.pressure,site.temp)
+    moon_separation = _separation(ra,dec,moon_ra,moon_dec)
+    
+    sun_prevrise,sun_prevset,sun_nextrise,sun_nextset = _sun_times(site,dates,events)
+    return dict(alts=alts,moon_alts=moon_alts,moon_separation=moon_separation,
+                sun_prevrise=sun_prevrise,sun_prevset=sun_prevset,sun_nextrise=sun_nextrise,sun_nextset=sun_nextset)
+
+def midnights(events,startdate,nights=365):
+    """
+    Compute the middle of consecutive nights.
+    
+    The first night is the one going on at 'startdate', or the next one if it is daytime.
+    
+    >>> events = sun_events(ephem.city('Paris'),float(ephem.Date('2011/09/27 12:00')),float(ephem.Date('2011/10/01')))
+    >>> print ephem.Date(midnights(events,float(ephem.Date('2011/09/27 12:00')),nights=3)[0])
+    2011/9/27 23:41:58
+    
+    @param events: sets and rises of the sun at the site, covering the nights (see L{sun_events})
+    @type events: tuple of 2 arrays
+    @param startdate: start date (ephem format)
+    @type startdate: float
+    @param nights: number of nights
+    @type nights: integer
+    @return: the middle of each night (ephem dates)
+    @rtype: array
+    """
+    sets,rises = events
+    sets = sets[np.searchsorted(sets,startdate)-int(rises[0]<=sets[0]):][:nights]
+    return (sets + rises[np.searchsorted(rises,sets)])/2.
+
+def sun_events(site,startdate,enddate):
+    """
+    Compute all sets and rises of the sun at a site, from the last ones before 'startdate' up to the first ones after
+    'enddate'.
+    
+    This takes two 'ephem' searches per night, instead of four per date when the previous and next rise and set are
+    computed for every date.
+    
+    @param site: observing site
+    @type site: ephem.Observer
+    @param startdate: start date (ephem format)
+    @type startdate: float
+    @param enddate: end date (ephem format)
+    @type enddate: float
+    @return: sets and rises of the sun (ephem dates)
+    @rtype: tuple of 2 arrays
+    """
+    observer = site.copy()
+    observer.date = startdate
+    sun = ephem.Sun()
+    sets = [float(observer.previous_setting(sun))]
+    rises = [float(observer.previous_rising(sun))]
+    while sets[-1]<=enddate:
+        sets.append(float(observer.next_setting(sun,start=sets[-1]+ephem.hour)))
+    while rises[-1]<=enddate:
+        rises.append(float(observer.next_rising(sun,start=rises[-1]+ephem.hour)))
+    return np.array(sets),np.array(rises)
+
+def sidereal_time(dates,longitude=0.):
+    """
+    Compute the local apparent sidereal time (Meeus 1998, Astronomical Algorithms, Eq. 12.4 and Chap. 22).
+    
+    @param dates: dates (ephem format)
+    @type dates: array
+    @param longitude: longitude (EAST) of the site (rad)
+    @type longitude: float
+    @return: local sidereal time (rad)
+    @rtype: array
+    """
+    jd = np.asarray(dates,float) + 2415020.
+    T = (jd - 2451545.)/36525.
+    gmst = 280.46061837 + 360.98564736629*(jd-2451545.) + 0.000387933*T**2 - T**3/38710000.
+    #-- equation of the equinoxes (nutation in longitude)
+    omega = np.radians(125.04452 - 1934.136261*T)
+    L = np.radians(280.4665 + 36000.7698*T)
+    Lmoon = np.radians(218.3165 + 481267.8813*T)
+    dpsi = -17.20*sin(omega) - 1.32*sin(2*L) - 0.23*sin(2*Lmoon) + 0.21*sin(2*omega)
+    gast = gmst + dpsi/3600.*cos(np.radians(23.4393))
+    return np.fmod(np.radians(gast) + longitude,2*pi)
+
+def _map_unique(func,values):
+    """
+    Apply a function to every distinct value of an array.
+    """
+    unique,inverse = np.unique(values,return_inverse=True)
+    return np.array([func(value) for value in unique])[inverse]
+
+def _djd(date,default):
+    """
+    Convert a calendar date (string), Julian Date or None (default) to an ephem date.
+    """
+    if date is None:
+        return float(default)
+    elif isinstance(date,str):
+        return float(ephem.Date(date))
+    return float(date) - 2415020.
+
+def _apparent_position(body,dates,step):
+    """
+    Apparent geocentric right ascension, declination (rad) and distance (AU) of a body, computed with 'ephem' every
+    'step' days and interpolated.
+    """
+    samples = np.unique(dates)
+    nsamples = int(np.ceil(samples.ptp()/step)) + 2
+    if nsamples < len(samples):
+        samples = np.linspace(samples[0],samples[-1],nsamples)
+    ra,dec,distance = np.zeros((3,len(samples)))
+    for i,date in enumerate(samples):
+        body.compute(ephem.Date(date))
+        ra[i],dec[i] = float(body.ra),float(body.dec)
+        distance[i] = getattr(body,'earth_distance',0.)
+    ra = np.unwrap(ra)
+    return np.interp(dates,samples,ra),np.interp(dates,samples,dec),np.interp(dates,samples,distance)
+
+def _altitude(ra,dec,lst,lat):
+    """
+    Altitude (rad) from the equatorial coordinates, local sidereal time and latitude (rad).
+    """
+    return np.arcsin(sin(lat)*sin(dec) + cos(lat)*cos(dec)*cos(lst-ra))
+
+def _refract(alt,pressure,temp,iterations=20):
+    """
+    Apparent altitude from the true altitude (rad), with the refraction formulas of 'ephem' (libastro), which are
+    inverted by iteration.
+    """
+    if not pressure:
+        return alt
+    apparent = alt
+    for i in range(iterations):
+        d = np.degrees(apparent)
+        low = np.radians(((2e-5*d+1.96e-2)*d+1.594e-1)*pressure/((273+temp)*((8.45e-2*d+5.05e-1)*d+1)))
+        high = 7.888888e-5*pressure/((273+temp)*np.tan(np.maximum(apparent,np.radians(15.))))
+        apparent = alt + np.maximum(np.where(d<15.,low,high),0.)
+    return apparent
+
+def _separation(ra1,dec1,ra2,dec2):
+    """
+    Angular separation (rad) with the haversine formula.
+    """
+    hav = sin((dec1-dec2)/2.)**2 + cos(dec1)*cos(dec2)*sin((ra1-ra2)/2.)**2
+    return 2*np.arcsin(sqrt(np.clip(hav,0.,1.)))
+
+def _sun_times(site,dates,events=None):
+    """
+    Previous and next rise and set of the sun for each date. Sparse dates are computed one by one, otherwise the rises
+    and sets are computed once per night (see L{sun_events}) and looked up.
+    """
+    dates = np.asarray(dates,float)
+    if not len(dates):
+        return np.zeros((4,0))
+    if events is None and dates.ptp()>len(dates):
+        observer = site.copy()
+        sun = ephem.Sun()
+        times = np.zeros((4,len(dates)))
+        for i,date in enumerate(dates):
+            observer.date = date
+            times[:,i] = [observer.previous_rising(sun),observer.previous_setting(sun),
+                          observer.next_rising(sun),observer.next_setting(sun)]
+        return times
+    if events is None:
+        events = sun_events(site,dates.min(),dates.max())
+    sets,rises = events
+    return (rises[np.searchsorted(rises,dates,'left')-1],sets[np.searchsorted(sets,dates,'left')-1],
+            rises[np.searchsorted(rises,dates,'right')],sets[np.searchsorted(sets,dates,'right')])
+
+#}
     
     
 if __name__=="__main__":
@@ -689,8 +689,8 @@ def binary_light_curve_synthesis(**parameters):
         parameters.pop('gres')
         outputfile_prim = os.path.join(direc,'%s_primary.fits'%(name))
         outputfile_secn = os.path.join(direc,'%s_secondary.fits'%(name))
-        outputfile_prim = fits.write_primary(outputfile_prim,header_dict=parameters)
-        outputfile_secn = fits.write_primary(outputfile_secn,header_dict=parameters)
+        outputfile_prim = fits.FitsWriter(outputfile_prim,header_dict=parameters)
+        outputfile_secn = fits.FitsWriter(outputfile_secn,header_dict=parameters)
     
     ext_dict = {}
     for di,d in enumerate(ds):
@@ -848,12 +848,12 @@ def binary_light_curve_synthesis(**parameters):
             com[0],com[2] = vectors.rotate(com[0],com[2],rot_i)
             prim_header = dict(x0=x1o[di],y0=y1o[di],i=view_angle,comx=com[0],comy=com[1],com_z=com[2],nr=di,time=times[di])
             secn_header = dict(x0=x2o[di],y0=y2o[di],i=view_angle,comx=com[0],comy=com[1],com_z=com[2],nr=di,time=times[di])
-            #-- only close the file every 20 cycles (for speed)
-            if direc is not None and (di%20==0): close = True
-            else:                                close = False
-            #   and append to primary HDUList
-            outputfile_prim = fits.write_recarray(prim,outputfile_prim,close=close,header_dict=prim_header)
-            outputfile_secn = fits.write_recarray(secn,outputfile_secn,close=close,header_dict=secn_header)
+            #-- append to the open files (flush them every 20 cycles)
+            outputfile_prim.write_recarray(prim,header_dict=prim_header)
+            outputfile_secn.write_recarray(secn,header_dict=secn_header)
+            if di%20==0:
+                outputfile_prim.flush()
+                outputfile_secn.flush()
         
         prim = local.project(primary,view_long=(rot_theta,x1o[di],y1o[di]),
                        view_lat=(view_angle,0,0),photband=photband,
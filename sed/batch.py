@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+"""
+Fit the SEDs of a sample of stars in batch.
+
+Instead of looping over the targets one by one (C{SED(ID)}, C{get_photometry},
+C{igrid_search}, C{save_hdf5}), L{fit_sample} runs the stages concurrently:
+
+    1. The photometry of the targets is retrieved in a pool of threads (this
+       is limited by the catalog servers, not the CPU), and saved to a phot
+       file per target.
+    2. As soon as the photometry of a target is available, it is fitted in a
+       pool of processes. Every process opens the integrated grids once, and
+       memory maps them, such that they are shared between the processes.
+    3. The results of every target are written to an HDF5 file per target
+       (see C{SED.save_hdf5}). The file is written under a temporary name
+       and renamed when it is complete, such that an interrupted batch never
+       leaves half-written results behind.
+
+When the batch is started again, targets that already have a results file are
+skipped. The results can be collected in a columnar store as they finish (see
+L{ivs.sed.store.SEDStore}).
+
+>>> summary = fit_sample(['HD180642','HD129929','HD44179'], directory='sample',
+...                      threads='safe', store='sample.h5', points=100000)
+
+The summary is a record array with the status of every target and the time
+spent in every stage. Other fitting sequences than a single grid search can
+be given as a function of a SED object:
+
+>>> def fit_twice(sed, **kwargs):
+...     sed.igrid_search(points=100000, **kwargs)
+...     sed.igrid_search(points=100000, **kwargs)
+>>> summary = fit_sample(targets, directory='sample', fit_function=fit_twice)
+"""
+import os
+import time
+import logging
+import itertools
+import traceback
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import numpy as np
+
+from ivs.aux import loggers
+from ivs.sed import builder
+from ivs.sed import model
+from ivs.sed import store as sedstore
+
+logger = logging.getLogger("SED.BATCH")
+logger.addHandler(loggers.NullHandler())
+
+#-- the columns of the summary of a batch
+summary_dtype = np.dtype([('target','S50'),('status','S20'),('photometry','f8'),('load','f8'),
+                          ('fit','f8'),('save','f8'),('message','S200')])
+
+#{ Batch fitting
+
+def fit_sample(targets, directory='.', threads='safe', prefetch=8, fit_function=None,
+               grid=None, store=None, overwrite=False, **kwargs):
+    """
+    Retrieve the photometry of a sample of targets and fit their SEDs.
+
+    The phot files and results (HDF5) files are written to C{directory}, with
+    the names of the targets (spaces replaced by underscores). Targets with a
+    results file are skipped unless C{overwrite=True}; targets with a phot
+    file are not searched for photometry again.
+
+    A target that fails (no photometry, an error in the fit) does not stop
+    the batch: its status and error message are given in the summary.
+
+    Extra keyword arguments are passed to the fit function (by default
+    C{SED.igrid_search}).
+
+    @param targets: names of the targets
+    @type targets: list of str
+    @param directory: directory of the phot and results files
+    @type directory: str
+    @param threads: number of fitting processes (an integer, 'max' or 'safe')
+    @type threads: int or str
+    @param prefetch: number of threads that retrieve photometry
+    @type prefetch: int
+    @param fit_function: function that fits a SED (gets the SED and the keyword
+                         arguments), it is sent to the processes so it must be
+                         defined at the top level of a module
+    @type fit_function: callable
+    @param grid: model grid (keyword arguments of C{model.set_defaults})
+    @type grid: dict
+    @param store: name of a columnar store to add the results to
+    @type store: str
+    @param overwrite: fit targets that already have results
+    @type overwrite: bool
+    @return: status of every target and the time spent in every stage (s)
+    @rtype: record array
+    """
+    c0 = time.time()
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    if threads == 'max':
+        threads = multiprocessing.cpu_count()
+    elif threads == 'safe':
+        threads = multiprocessing.cpu_count()-1
+    threads = max(1, int(threads))
+
+    #-- skip the targets that were done before
+    summary = np.zeros(len(targets), dtype=summary_dtype)
+    summary['target'] = targets
+    summary['status'] = 'skipped'
+    index = dict([(target, i) for i, target in enumerate(targets)])
+    todo = [target for target in targets if overwrite or not os.path.isfile(results_file(target, directory))]
+    logger.info('Fitting %d of %d targets (%d done before)'%(len(todo), len(targets), len(targets)-len(todo)))
+
+    #-- retrieve the photometry in threads, and fit the targets in processes
+    #   as soon as their photometry is available (the processes are started
+    #   before the threads, such that no thread is forked)
+    if threads > 1 and len(todo) > 1:
+        fit_pool = multiprocessing.Pool(min(threads, len(todo)), initializer=init_worker, initargs=(grid,))
+        fit_map = fit_pool.imap_unordered
+    else:
+        fit_pool = None
+        init_worker(grid)
+        fit_map = itertools.imap
+    photometry_pool = ThreadPool(max(1, min(prefetch, len(todo))))
+    photometry = photometry_pool.imap_unordered(_prefetch_photometry, [(target, directory) for target in todo])
+    results = fit_map(_fit_target, _fit_jobs(photometry, summary, index, directory, fit_function, kwargs))
+
+    output = sedstore.SEDStore(store) if store is not None else None
+    try:
+        for target, status, timings, message in results:
+            i = index[target]
+            summary['status'][i] = status
+            summary['message'][i] = message
+            for stage in timings:
+                summary[stage][i] = timings[stage]
+            if status == 'done':
+                logger.info('Fitted %s in %.1fs'%(target, sum(timings.values())))
+                if output is not None:
+                    output.add_file(results_file(target, directory), target=target)
+            else:
+                logger.error('Fitting %s failed: %s'%(target, message))
+    except BaseException:
+        #-- stop at once when interrupted, finished targets are kept
+        photometry_pool.terminate()
+        if fit_pool is not None:
+            fit_pool.terminate()
+        raise
+    finally:
+        photometry_pool.close()
+        if fit_pool is not None:
+            fit_pool.close()
+            fit_pool.join()
+        photometry_pool.join()
+        if fit_pool is None:
+            model._close_integrated_grids()
+        if output is not None:
+            output.close()
+
+    logger.info(summary2str(summary, time.time()-c0))
+    return summary.view(np.recarray)
+
+
+def summary2str(summary, walltime):
+    """
+    Summarize the throughput and the time spent in every stage of a batch.
+
+    @param summary: summary of a batch (see L{fit_sample})
+    @type summary: record array
+    @param walltime: duration of the batch (s)
+    @type walltime: float
+    @return: human readable summary
+    @rtype: str
+    """
+    done = summary['status'] == 'done'
+    txt = ['%d targets: %d fitted, %d skipped, %d failed in %.1fs (%.1f targets/hour)'%(
+           len(summary), done.sum(), (summary['status'] == 'skipped').sum(),
+           len(summary)-done.sum()-(summary['status'] == 'skipped').sum(),
+           walltime, done.sum()/walltime*3600.)]
+    for stage in ['photometry', 'load', 'fit', 'save']:
+        times = summary[stage][done]
+        if len(times):
+            txt.append('  %-10s total %8.1fs, median %6.2fs, max %6.2fs'%(stage, times.sum(), np.median(times), times.max()))
+    return "\n".join(txt)
+
+
+def results_file(target, directory='.'):
+    """
+    Name of the results (HDF5) file of a target.
+
+    @param target: name of the target
+    @type target: str
+    @param directory: directory of the results
+    @type directory: str
+    @return: name of the results file
+    @rtype: str
+    """
+    return os.path.join(directory, '%s.hdf5'%(target.replace(' ', '_')))
+
+
+def phot_file(target, directory='.'):
+    """
+    Name of the phot file of a target.
+
+    @param target: name of the target
+    @type target: str
+    @param directory: directory of the phot files
+    @type directory: str
+    @return: name of the phot file
+    @rtype: str
+    """
+    return os.path.join(directory, '%s.phot'%(target.replace(' ', '_')))
+
+
+def init_worker(grid=None):
+    """
+    Prepare a fitting process: set the model grid and open the integrated grids.
+
+    The grids stay open for all the targets the process fits; they are closed
+    when the process ends.
+
+    @param grid: model grid (keyword arguments of C{model.set_defaults})
+    @type grid: dict
+    """
+    if grid:
+        model.set_defaults(**grid)
+    gridfiles = model.get_file(z='*', Rv='*', integrated=True)
+    if isinstance(gridfiles, str):
+        gridfiles = [gridfiles]
+    for gridfile in gridfiles:
+        if os.path.isfile(gridfile):
+            model._open_integrated_grid(gridfile)
+
+#}
+
+#{ Stages
+
+def _prefetch_photometry(args):
+    """
+    Retrieve and save the photometry of a target, if it has no phot file yet.
+
+    The phot file is written under a temporary name, and renamed when it is
+    complete.
+    """
+    target, directory = args
+    photfile = phot_file(target, directory)
+    if os.path.isfile(photfile):
+        return target, 0., None
+    c0 = time.time()
+    try:
+        mysed = builder.SED(target, photfile=photfile+'.part', load_fits=False, load_hdf5=False)
+        mysed.get_photometry()
+        os.rename(photfile+'.part', photfile)
+    except Exception:
+        if os.path.isfile(photfile+'.part'):
+            os.remove(photfile+'.part')
+        return target, time.time()-c0, traceback.format_exc().strip().split('\n')[-1]
+    return target, time.time()-c0, None
+
+
+def _fit_jobs(photometry, summary, index, directory, fit_function, kwargs):
+    """
+    Turn the targets with photometry into fitting jobs, and flag the others.
+    """
+    for target, duration, message in photometry:
+        summary['photometry'][index[target]] = duration
+        if message is not None:
+            summary['status'][index[target]] = 'no photometry'
+            summary['message'][index[target]] = message
+            logger.error('No photometry for %s: %s'%(target, message))
+            continue
+        yield target, directory, fit_function, kwargs
+
+
+def _fit_target(args):
+    """
+    Fit the SED of a target and save the results.
+
+    The results file is written under a temporary name, and renamed when it
+    is complete.
+    """
+    target, directory, fit_function, kwargs = args
+    timings = {}
+    resultfile = results_file(target, directory)
+    try:
+        c0 = time.time()
+        mysed = builder.SED(target, photfile=phot_file(target, directory), load_fits=False, load_hdf5=False)
+        c1 = time.time()
+        if fit_function is None:
+            mysed.igrid_search(**kwargs)
+        else:
+            fit_function(mysed, **kwargs)
+        c2 = time.time()
+        mysed.save_hdf5(resultfile+'.part', update=False)
+        os.rename(resultfile+'.part', resultfile)
+        c3 = time.time()
+        timings = dict(load=c1-c0, fit=c2-c1, save=c3-c2)
+    except Exception:
+        if os.path.isfile(resultfile+'.part'):
+            os.remove(resultfile+'.part')
+        return target, 'failed', timings, traceback.format_exc().strip().split('\n')[-1]
+    return target, 'done', timings, ''
+
+#}
@@ -583,6 +583,7 @@ from ivs.sed import filters
 from ivs.sed import fit
 from ivs.sed import distance
 from ivs.sed import extinctionmodels
+from ivs.sed import store
 from ivs.sed.decorators import standalone_figure
 from ivs.spectra import tools
 from ivs.catalogs import crossmatch
@@ -3316,7 +3317,7 @@ class SED(object):
         
         #-- write master data
         master = self.master.copy()
-        fits.write_recarray(master,filename,header_dict=dict(extname='data'))
+        filename = fits.write_recarray(master,filename,header_dict=dict(extname='data'),close=False)
         
         #-- write the rest
         for mtype in self.results:#['igrid_search','imc']:
@@ -3338,15 +3339,16 @@ class SED(object):
             fits.write_array(list(self.results[mtype]['model']),filename,
                             names=('wave','flux','dered_flux'),
                             units=('AA','erg/s/cm2/AA','erg/s/cm2/AA'),
-                            header_dict=results_modeldict)
+                            header_dict=results_modeldict,close=False)
             if 'grid' in self.results[mtype]:
-                fits.write_recarray(self.results[mtype]['grid'],filename,header_dict=results_griddict)
+                fits.write_recarray(self.results[mtype]['grid'],filename,header_dict=results_griddict,close=False)
             
             results = np.rec.fromarrays([synflux,eff_waves,chi2],dtype=[('synflux','f8'),('mod_eff_wave','f8'),('chi2','f8')])
             
-            fits.write_recarray(results,filename,header_dict=dict(extname='synflux_'+mtype))
+            fits.write_recarray(results,filename,header_dict=dict(extname='synflux_'+mtype),close=False)
         
-        logger.info('Results saved to FITS file: %s'%(filename))
+        filename.close()
+        logger.info('Results saved to FITS file: %s'%(filename.filename))
         
     
     def load_fits(self,filename=None):
@@ -3439,7 +3441,7 @@ class SED(object):
         logger.info('Loaded previous results from FITS file: %s'%(filename))
         return filename
     
-    def save_hdf5(self, filename=None, update=True):
+    def save_hdf5(self, filename=None, update=True, compression='gzip'):
         """
         Save content of SED object to a HDF5 file. (HDF5 is the successor of FITS files, 
         providing a clearer structure of the saved content.)
@@ -3455,6 +3457,8 @@ class SED(object):
         @param update: if True, an existing file will be updated with the current information, if
                        False, an existing fill be overwritten
         @type update: bool
+        @param compression: compression filter of the datasets ('gzip', 'lzf' or None)
+        @type compression: str
         @return: the name of the output HDF5 file.
         @rtype: string
         """
@@ -3467,17 +3471,25 @@ class SED(object):
         data['results'] = self.results
         data['constraints'] = self.constraints
         
-        hdf5.write_dict(data, filename, update=update)
+        hdf5.write_dict(data, filename, update=update, compression=compression,
+                        resizable=True)
         
         logger.info('Results saved to HDF5 file: %s'%(filename))
         return filename    
                 
-    def load_hdf5(self,filename=None):
+    def load_hdf5(self,filename=None,lazy=False):
         """
         Load a previously made SED from HDF5 file.
         
+        With lazy=True, the results and constraints are only read from the
+        file when they are accessed (see L{ivs.io.hdf5.HDF5Dict}), such that
+        e.g. the confidence intervals can be read without reading the
+        samples of the grid search.
+        
         @param filename: name of SED FITS file
         @type filename: string
+        @param lazy: only read the results when they are accessed
+        @type lazy: bool
         @return: True if HDF5 file could be loaded
         @rtype: bool
         """
@@ -3487,7 +3499,7 @@ class SED(object):
             logger.warning('No previous results saved to HFD5 file {:s}'.format(filename))
             return False
             
-        data = hdf5.read2dict(filename)
+        data = hdf5.read2dict(filename, lazy=lazy)
         
         self.master = data.get('master', {})
         self.results = data.get('results', {})
@@ -3849,6 +3861,10 @@ class Calibrator(SED):
 class SampleSEDs(object):
     """
     Class representing a list of SEDs.
+    
+    For large samples, collect the photometry and fit results in a columnar
+    store (see L{to_store} and L{ivs.sed.store.SEDStore}), and query that
+    instead of the SED objects.
     """
     def __init__(self,targets,**kwargs):
         """
@@ -3998,6 +4014,28 @@ class SampleSEDs(object):
         output = np.array(output,dtype=dtypes)
         return output
     
+    def to_store(self,filename,**kwargs):
+        """
+        Add the photometry and fit results of all SEDs to a columnar store.
+        
+        Sample-wide queries on the store (see L{ivs.sed.store.SEDStore}) do
+        not need the SED objects anymore.
+        
+        Extra keyword arguments are passed to the SEDStore.
+        
+        @param filename: name of the store (HDF5 file)
+        @type filename: str
+        @return: the name of the store
+        @rtype: str
+        """
+        with store.SEDStore(filename,**kwargs) as sedstore:
+            for sed in self.seds:
+                if not sed.results:
+                    sed.load_fits()
+                sedstore.add_sed(sed)
+        logger.info("Added {} SEDs to {}".format(len(self.seds),filename))
+        return filename
+    
     def get_confidence_interval(self,parameter='teff',mtype='igrid_search'):
         values = np.zeros((len(self),3))
         for i,sed in enumerate(self):
@@ -339,6 +339,8 @@ __defaults__ = dict(grid='kurucz',odfnew=True,z=+0.0,vturb=2,
 
 defaults = __defaults__.copy()
 defaults_multiple = [defaults.copy(),defaults.copy()]
+#-- the integrated grids that are kept open (see _open_integrated_grid)
+_integrated_grids = {}
 #-- relative location of the grids
 basedir = 'sedtables/modelgrids/'
 scratchdir = None
@@ -2352,36 +2354,28 @@ def _get_pix_grid(photbands,
     grid_names = np.array(variables)
     #-- collect information from all the grid files
     for gridfile in gridfiles:
-        with pyfits.open(gridfile) as ff:
-            # Fix duplicate column names
-            had_columns = []
-            for key in ff[1].header.keys():
-                if key[:5]=='TTYPE' and not ff[1].header[key] in had_columns:
-                    had_columns.append(ff[1].header[key])
-                elif key[:5]=='TTYPE':
-                    ff[1].header[key] += '-1'
-            #-- make an alias for further reference
-            ext = ff[1]
-            #-- we already cut the grid here, in order not to take too much memory
-            keep = np.ones(len(ext.data),bool)
-            for name in variables:
-                #-- we need to be carefull for rounding errors
-                low,high = locals()[name+'range']
-                in_range = (low<=ext.data.field(name)) & (ext.data.field(name)<=high)
-                on_edge  = np.allclose(ext.data.field(name),low) | np.allclose(ext.data.field(name),high)
-                #on_edge_low = np.less_equal(np.abs(ext.data.field(name)-low),1e-8 + 1e-5*np.abs(low))
-                #on_edge_high = np.less_equal(np.abs(ext.data.field(name)-high),1e-8 + 1e-5*np.abs(high))
-                #keep_this = (in_range | on_edge_low | on_edge_high)
-                #if not sum(keep_this):
-                    #logger.warning("_get_pix_grid: No selection done in axis {}".format(name))
-                    #continue
-                #keep = keep & keep_this
-                keep = keep & (in_range | on_edge)
-            partial_grid = np.vstack([ext.data.field(name)[keep] for name in variables])
-            if sum(keep):
-                grid_pars.append(partial_grid)
-                #-- the flux grid:
-                flux.append(_get_flux_from_table(ext,photbands,include_Labs=include_Labs)[keep])
+        #-- make an alias for further reference
+        ext = _open_integrated_grid(gridfile)[1]
+        #-- we already cut the grid here, in order not to take too much memory
+        keep = np.ones(len(ext.data),bool)
+        for name in variables:
+            #-- we need to be carefull for rounding errors
+            low,high = locals()[name+'range']
+            in_range = (low<=ext.data.field(name)) & (ext.data.field(name)<=high)
+            on_edge  = np.allclose(ext.data.field(name),low) | np.allclose(ext.data.field(name),high)
+            #on_edge_low = np.less_equal(np.abs(ext.data.field(name)-low),1e-8 + 1e-5*np.abs(low))
+            #on_edge_high = np.less_equal(np.abs(ext.data.field(name)-high),1e-8 + 1e-5*np.abs(high))
+            #keep_this = (in_range | on_edge_low | on_edge_high)
+            #if not sum(keep_this):
+                #logger.warning("_get_pix_grid: No selection done in axis {}".format(name))
+                #continue
+            #keep = keep & keep_this
+            keep = keep & (in_range | on_edge)
+        partial_grid = np.vstack([ext.data.field(name)[keep] for name in variables])
+        if sum(keep):
+            grid_pars.append(partial_grid)
+            #-- the flux grid:
+            flux.append(_get_flux_from_table(ext,photbands,include_Labs=include_Labs)[keep])
     #-- make the entire grid: it consists of fluxes and grid parameters
     flux = np.vstack(flux)
     grid_pars = np.hstack(grid_pars)
@@ -2407,6 +2401,42 @@ def _get_pix_grid(photbands,
 
 
 
+def _open_integrated_grid(gridfile):
+    """
+    Open an integrated grid, and fix duplicate column names.
+    
+    The file is memory mapped and stays open until L{_close_integrated_grids}
+    is called, such that the grid is read only once per process, and the
+    processes that fit SEDs in parallel share the pages of the file. The
+    opened grids are not memoized: they survive C{clear_memoization}.
+    
+    @param gridfile: name of the integrated grid
+    @type gridfile: str
+    @return: the opened grid
+    @rtype: HDUList
+    """
+    if gridfile in _integrated_grids:
+        return _integrated_grids[gridfile]
+    ff = pf.open(gridfile,memmap=True)
+    # Fix duplicate column names
+    had_columns = []
+    for key in ff[1].header.keys():
+        if key[:5]=='TTYPE' and not ff[1].header[key] in had_columns:
+            had_columns.append(ff[1].header[key])
+        elif key[:5]=='TTYPE':
+            ff[1].header[key] += '-1'
+    _integrated_grids[gridfile] = ff
+    return ff
+
+def _close_integrated_grids():
+    """
+    Close the integrated grids opened by L{_open_integrated_grid}.
+    """
+    while _integrated_grids:
+        gridfile,ff = _integrated_grids.popitem()
+        ff.close()
+
+
 def _get_flux_from_table(fits_ext,photbands,index=None,include_Labs=True):
     """
     Retrieve flux and flux ratios from an integrated SED table.
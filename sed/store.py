@@ -0,0 +1,497 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar store of the photometry and fit results of a sample of SEDs.
+
+A L{SEDStore} collects the photometry (the C{master} record array) and the
+summary of the fits (the confidence intervals of every fitting method) of
+many SEDs in one HDF5 file. Every column is stored as a separate dataset, so
+that a query only reads the columns it needs, and no C{SED} objects or
+C{.phot} files are needed to compute sample-wide statistics.
+
+Targets are added one by one, e.g. from the HDF5 files written by
+C{SED.save_hdf5} as the fits finish:
+
+>>> store = SEDStore('sample.h5')
+>>> store.update(glob.glob('fits/*.hdf5'))
+>>> hot = store.results(mtype='igrid_search', teff=(20000, 30000))
+>>> photometry = store.photometry(targets=hot['target'], photband='GALEX.FUV')
+>>> store.close()
+
+A target that is added again replaces its previous photometry and results.
+"""
+import os
+import logging
+import numpy as np
+import h5py
+
+from ivs.aux import loggers
+from ivs.io import hdf5
+
+logger = logging.getLogger("SED.STORE")
+logger.addHandler(loggers.NullHandler())
+
+#-- the columns of the photometry (those of SED.master, and the target name)
+photometry_dtype = np.dtype([('target','S50'),('meas','f8'),('e_meas','f8'),('flag','S20'),('unit','S30'),
+                             ('photband','S30'),('source','S50'),('_r','f8'),('_RAJ2000','f8'),
+                             ('_DEJ2000','f8'),('cwave','f8'),('cmeas','f8'),('e_cmeas','f8'),('cunit','S50'),
+                             ('color',bool),('include',bool),('bibcode','S20'),('comments','S200')])
+
+#-- the columns of the index of the targets
+target_dtype = np.dtype([('target','S50'),('start','i8'),('stop','i8'),('mtime','f8')])
+
+
+class SEDStore(object):
+    """
+    Columnar HDF5 store of the photometry and fit results of many SEDs.
+
+    The file contains three groups, each with one resizable dataset per
+    column:
+
+        - C{targets}: the index of the targets, with the range of rows of
+          their photometry, and the modification time of the file they were
+          read from.
+        - C{photometry}: the photometry of all targets, one row per
+          measurement (see L{photometry_dtype}), with a C{valid} column that
+          is False for photometry that was replaced.
+        - C{results}: one row per target and fitting method, with a column
+          per parameter of the confidence intervals (NaN where missing).
+    """
+    def __init__(self, filename, mode='a', compression=None):
+        """
+        Open a store, it is created if it does not exist.
+
+        @param filename: name of the HDF5 file
+        @type filename: str
+        @param mode: 'a' to open for reading and writing, 'r' to only read
+        @type mode: str
+        @param compression: compression filter of new columns ('gzip', 'lzf' or None)
+        @type compression: str
+        """
+        self.filename = filename
+        self.compression = compression
+        self.hdf = h5py.File(filename, mode)
+        if mode != 'r':
+            for name in ['targets', 'photometry', 'results']:
+                if not name in self.hdf:
+                    self.hdf.create_group(name)
+        #-- the in-memory indices of the targets and results
+        self._targets = {}
+        self._results = {}
+        if 'target' in self.hdf['targets']:
+            for i, target in enumerate(self.hdf['targets/target'][()]):
+                self._targets[target] = i
+            for i, key in enumerate(zip(self.hdf['results/target'][()], self.hdf['results/mtype'][()])):
+                self._results[key] = i
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self._targets)
+
+    def __contains__(self, target):
+        return target in self._targets
+
+    @property
+    def targets(self):
+        """
+        The names of the targets, in the order they were added.
+        """
+        if not 'target' in self.hdf['targets']:
+            return np.zeros(0, dtype='S50')
+        return self._column('targets', 'target')
+
+    #{ Ingestion
+
+    def add(self, target, master, results={}, mtime=0.):
+        """
+        Add (or replace) the photometry and fit results of a target.
+
+        @param target: name of the target
+        @type target: str
+        @param master: photometry (see C{SED.master})
+        @type master: record array
+        @param results: fit results per method, with the confidence intervals
+                        in C{results[mtype]['CI']} (see C{SED.results})
+        @type results: dict
+        @param mtime: modification time of the file the target was read from
+        @type mtime: float
+        """
+        self.add_many([(target, master, results, mtime)])
+
+    def add_many(self, entries):
+        """
+        Add (or replace) the photometry and fit results of many targets at once.
+
+        Every column is extended only once, which is much faster than adding
+        the targets one by one.
+
+        @param entries: target, master, results and mtime of each target (see L{add})
+        @type entries: list of tuples
+        """
+        #-- collect the photometry, the index and the results of all targets
+        start = len(self.hdf['photometry/valid']) if 'valid' in self.hdf['photometry'] else 0
+        photometry, valid, index, results = [], [], {}, {}
+        for target, master, target_results, mtime in entries:
+            if target in index:
+                valid[index[target][0]] = False
+            index[target] = (len(photometry), start, start+len(master), mtime)
+            photometry.append(_photometry(target, master))
+            valid.append(True)
+            start += len(master)
+            for mtype in target_results:
+                values = dict(target_results[mtype].get('CI', {}))
+                if 'factor' in target_results[mtype]:
+                    values['factor'] = target_results[mtype]['factor']
+                results[(target, mtype)] = _parameters(values)
+        if not photometry:
+            return
+        #   the results of replaced targets are removed
+        replaced = set([target for target in index if target in self._targets])
+        if replaced:
+            for key in self._results:
+                if key[0] in replaced and not key in results:
+                    results[key] = {}
+
+        #-- the photometry is appended, previous photometry is invalidated
+        valid = np.hstack([np.ones(len(phot), bool) if keep else np.zeros(len(phot), bool)
+                           for phot, keep in zip(photometry, valid)])
+        photometry = np.hstack(photometry)
+        for name in photometry_dtype.names:
+            self._append('photometry', name, photometry[name])
+        self._append('photometry', 'valid', valid)
+        new_targets = []
+        for target in sorted(index, key=lambda target: index[target][0]):
+            row = np.array([(target,)+index[target][1:]], dtype=target_dtype)
+            if target in self._targets:
+                old = self._targets[target]
+                old_start, old_stop = self.hdf['targets/start'][old], self.hdf['targets/stop'][old]
+                self.hdf['photometry/valid'][old_start:old_stop] = False
+                for name in target_dtype.names:
+                    self.hdf['targets'][name][old] = row[name][0]
+            else:
+                self._targets[target] = len(self._targets)
+                new_targets.append(row)
+        if new_targets:
+            new_targets = np.hstack(new_targets)
+            for name in target_dtype.names:
+                self._append('targets', name, new_targets[name])
+
+        #-- the confidence intervals (and scale factor) of every fitting method,
+        #   new parameters get a column of NaNs
+        for name in set([name for values in results.values() for name in values]):
+            if not name in self.hdf['results']:
+                self._add_column('results', name, 'f8', length=len(self._results), fill=np.nan)
+        new_results = []
+        for key in sorted(results):
+            if key in self._results:
+                for name in self.parameters():
+                    self.hdf['results'][name][self._results[key]] = results[key].get(name, np.nan)
+            else:
+                self._results[key] = len(self._results)
+                new_results.append(key)
+        if new_results:
+            self._append('results', 'target', np.array([key[0] for key in new_results], 'S50'))
+            self._append('results', 'mtype', np.array([key[1] for key in new_results], 'S20'))
+            for name in self.parameters():
+                self._append('results', name, [results[key].get(name, np.nan) for key in new_results])
+        self.hdf.flush()
+
+    def add_sed(self, sed, mtime=0.):
+        """
+        Add (or replace) the photometry and fit results of a C{SED} object.
+
+        @param sed: SED
+        @type sed: builder.SED
+        """
+        self.add(sed.ID, sed.master, sed.results, mtime=mtime)
+
+    def add_file(self, filename, target=None):
+        """
+        Add (or replace) a target from a HDF5 file written by C{SED.save_hdf5}.
+
+        Only the photometry and the confidence intervals are read from the
+        file, not the samples of the fits.
+
+        @param filename: name of the HDF5 file
+        @type filename: str
+        @param target: name of the target (defaults to the basename of the file)
+        @type target: str
+        """
+        self.add(*_read_file(filename, target=target))
+
+    def update(self, filenames, batch_size=100):
+        """
+        Add the targets of HDF5 files that are new or changed since they were added.
+
+        The name of a target is the basename of its file. The targets are
+        added in batches, such that the store is usable when the update is
+        interrupted.
+
+        @param filenames: names of HDF5 files written by C{SED.save_hdf5}
+        @type filenames: list of str
+        @param batch_size: number of targets that are added at once
+        @type batch_size: int
+        @return: number of targets that were added
+        @rtype: int
+        """
+        if len(self):
+            mtimes = dict(zip(self.targets, self._column('targets', 'mtime')))
+        else:
+            mtimes = {}
+        filenames = [filename for filename in filenames
+                     if mtimes.get(os.path.splitext(os.path.basename(filename))[0], None) != os.path.getmtime(filename)]
+        for i in range(0, len(filenames), batch_size):
+            self.add_many([_read_file(filename) for filename in filenames[i:i+batch_size]])
+        logger.info('Added %d targets to %s'%(len(filenames), self.filename))
+        return len(filenames)
+
+    #}
+
+    #{ Queries
+
+    def photometry(self, targets=None, source=None, photband=None, columns=None):
+        """
+        Select photometry by target, source and photband.
+
+        Each selection can be a single value or a list of values.
+
+        @param targets: names of the targets
+        @type targets: str or list of str
+        @param source: names of the sources (catalogs)
+        @type source: str or list of str
+        @param photband: names of the photbands
+        @type photband: str or list of str
+        @param columns: columns to return (defaults to all)
+        @type columns: list of str
+        @return: selected photometry, with the name of the target in the first column
+        @rtype: record array
+        """
+        if columns is None:
+            columns = photometry_dtype.names[1:]
+        if not 'valid' in self.hdf['photometry']:
+            return np.rec.array(np.zeros(0, dtype=[(name, photometry_dtype[name]) for name in ('target',)+tuple(columns)]))
+        keep = self._column('photometry', 'valid')
+        for name, values in [('target', targets), ('source', source), ('photband', photband)]:
+            if values is not None:
+                keep &= np.in1d(self._column('photometry', name), np.atleast_1d(values))
+        rows = np.flatnonzero(keep)
+        arrays = [self._column('photometry', name)[rows] for name in ('target',)+tuple(columns)]
+        return np.rec.fromarrays(arrays, names=('target',)+tuple(columns))
+
+    def results(self, mtype='igrid_search', columns=None, targets=None, **ranges):
+        """
+        Select fit results of one fitting method, by target and parameter ranges.
+
+        Parameter ranges are given as keyword arguments, e.g. C{teff=(10000,
+        20000)}, and are inclusive.
+
+        @param mtype: fitting method
+        @type mtype: str
+        @param columns: parameters to return (defaults to all)
+        @type columns: list of str
+        @param targets: names of the targets
+        @type targets: str or list of str
+        @return: selected results, with the name of the target in the first column
+        @rtype: record array
+        """
+        if columns is None:
+            columns = self.parameters()
+        if not 'mtype' in self.hdf['results']:
+            return np.rec.array(np.zeros(0, dtype=[('target','S50')]+[(name,'f8') for name in columns]))
+        keep = self._column('results', 'mtype') == mtype
+        if targets is not None:
+            keep &= np.in1d(self._column('results', 'target'), np.atleast_1d(targets))
+        for name, (lower, upper) in ranges.items():
+            values = self._column('results', name)
+            keep &= (lower <= values) & (values <= upper)
+        rows = np.flatnonzero(keep)
+        arrays = [self._column('results', name)[rows] for name in ['target']+list(columns)]
+        return np.rec.fromarrays(arrays, names=['target']+list(columns))
+
+    def parameters(self):
+        """
+        The names of the parameters in the fit results.
+
+        @return: names of the parameters
+        @rtype: list of str
+        """
+        return sorted([name for name in self.hdf['results'] if not name in ['target', 'mtype']])
+
+    def get_confidence_interval(self, parameter='teff', mtype='igrid_search', targets=None):
+        """
+        Get the confidence interval of a parameter for every target.
+
+        @param parameter: name of the parameter
+        @type parameter: str
+        @param mtype: fitting method
+        @type mtype: str
+        @param targets: names of the targets (defaults to all)
+        @type targets: list of str
+        @return: lower limit, value and upper limit (NaN where missing)
+        @rtype: array (Ntargets x 3)
+        """
+        if targets is None:
+            targets = self.targets
+        values = np.nan*np.ones((len(targets), 3))
+        results = self.results(mtype=mtype, targets=targets)
+        rows = np.searchsorted(targets, results['target'], sorter=np.argsort(targets))
+        rows = np.argsort(targets)[rows]
+        for i, name in enumerate([parameter+'_l', parameter, parameter+'_u']):
+            if name in results.dtype.names:
+                values[rows, i] = results[name]
+        return values
+
+    def get_data(self, source, photband, targets=None):
+        """
+        Get the photometry of one photband from one source, for every target.
+
+        Targets without such photometry get zeros everywhere, except for
+        their name.
+
+        @param source: name of the source
+        @type source: str
+        @param photband: name of the photband
+        @type photband: str
+        @param targets: names of the targets (defaults to all)
+        @type targets: list of str
+        @return: the (first) measurement of each target
+        @rtype: record array
+        """
+        if targets is None:
+            targets = self.targets
+        targets = np.asarray(targets)
+        output = np.zeros(len(targets), dtype=photometry_dtype)
+        output['target'] = targets
+        photometry = self.photometry(targets=targets, source=source, photband=photband)
+        found, first = np.unique(photometry['target'], return_index=True)
+        order = np.argsort(targets)
+        rows = order[np.searchsorted(targets, found, sorter=order)]
+        output[rows] = photometry[first]
+        return output.view(np.recarray)
+
+    def summarize(self, targets=None):
+        """
+        Summarize the photometry of every target per source and photband.
+
+        The result is the same as that of C{SampleSEDs.summarize}: a record
+        array with one row per target, with for every source a record array
+        with the fluxes and errors of the photbands (NaN where missing).
+
+        @param targets: names of the targets (defaults to all)
+        @type targets: list of str
+        @return: summary of the photometry
+        @rtype: record array
+        """
+        if targets is None:
+            targets = self.targets
+        targets = np.asarray(targets)
+        photometry = self.photometry(targets=targets, columns=['source','photband','cmeas','e_cmeas'])
+        order = np.argsort(targets)
+        target_rows = order[np.searchsorted(targets, photometry['target'], sorter=order)]
+        summary = []
+        source_names = sorted(set(photometry['source']))
+        for source in source_names:
+            this_source = photometry['source'] == source
+            photbands, band_rows = np.unique(photometry['photband'][this_source], return_inverse=True)
+            data = np.nan*np.ones((len(targets), 2*len(photbands)))
+            #-- the first measurement of each target and photband
+            keys, first = np.unique(target_rows[this_source]*len(photbands) + band_rows, return_index=True)
+            data[keys//len(photbands), 2*(keys%len(photbands))] = photometry['cmeas'][this_source][first]
+            data[keys//len(photbands), 2*(keys%len(photbands))+1] = photometry['e_cmeas'][this_source][first]
+            names = []
+            for photband in photbands:
+                names += [photband, 'e_'+photband]
+            summary.append(np.rec.fromarrays(data.T, names=names))
+        dtypes = [(source, summary[i].dtype) for i, source in enumerate(source_names)]
+        output = np.zeros(len(targets), dtype=np.dtype(dtypes))
+        for i, name in enumerate(output.dtype.names):
+            output[name] = summary[i]
+        return output
+
+    #}
+
+    def close(self):
+        """
+        Close the HDF5 file.
+        """
+        if self.hdf:
+            self.hdf.close()
+
+    def _column(self, group, name):
+        """
+        Read a column.
+        """
+        return self.hdf[group][name][()]
+
+    def _append(self, group, name, values):
+        """
+        Append values to a column, the column is created (empty) if needed.
+        """
+        values = np.asarray(values)
+        if not name in self.hdf[group]:
+            self._add_column(group, name, values.dtype)
+        column = self.hdf[group][name]
+        nrows = len(column)
+        column.resize((nrows+len(values),))
+        column[nrows:] = values
+
+    def _add_column(self, group, name, dtype, length=0, fill=None):
+        """
+        Create a resizable column, filled with C{fill}.
+        """
+        chunks = (max(1, hdf5.chunk_size//np.dtype(dtype).itemsize),)
+        column = self.hdf[group].create_dataset(name, shape=(length,), dtype=dtype, maxshape=(None,),
+                                                chunks=chunks, compression=self.compression)
+        if length and fill is not None:
+            column[:] = fill
+        return column
+
+
+def _photometry(target, master):
+    """
+    Convert the photometry of a target to the columns of the store.
+    """
+    master = np.asarray(master)
+    photometry = np.zeros(len(master), dtype=photometry_dtype)
+    for name in photometry_dtype.names:
+        if master.dtype.names is not None and name in master.dtype.names:
+            photometry[name] = master[name]
+        elif photometry_dtype[name].kind == 'f':
+            photometry[name] = np.nan
+    photometry['target'] = target
+    return photometry
+
+
+def _parameters(values):
+    """
+    Keep the scalar values of the fit results.
+    """
+    parameters = {}
+    for name, value in values.items():
+        try:
+            parameters[name] = float(value)
+        except (TypeError, ValueError):
+            logger.debug('Skipping non-scalar result %s'%(name))
+    return parameters
+
+
+def _read_file(filename, target=None):
+    """
+    Read the target, photometry, confidence intervals and mtime of a SED HDF5 file.
+    """
+    if target is None:
+        target = os.path.splitext(os.path.basename(filename))[0]
+    with hdf5.read2dict(filename, lazy=True) as data:
+        master = data['master'] if 'master' in data else np.zeros(0, dtype=photometry_dtype)
+        results = {}
+        for mtype in data.get('results', {}):
+            results[mtype] = {}
+            for key in ['CI', 'factor']:
+                if key in data['results'][mtype]:
+                    value = data['results'][mtype][key]
+                    results[mtype][key] = value.todict() if key == 'CI' else value
+    return target, master, results, os.path.getmtime(filename)
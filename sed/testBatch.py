@@ -0,0 +1,97 @@
+"""
+Unit tests for the batch fitting of SEDs (sed.batch).
+
+The fits are replaced by a function that only stores confidence intervals,
+such that no model grids are needed.
+"""
+import os
+import json
+import shutil
+import tempfile
+import pyfits
+import numpy as np
+from ivs.io import ascii
+from ivs.aux import decorators
+from ivs.sed import batch, store, model
+
+import unittest
+
+
+def fake_fit(sed, teff=10000.):
+    """Stands in for the grid search: store the confidence intervals"""
+    if sed.ID == 'bad':
+        raise ValueError('no convergence')
+    sed.results['igrid_search'] = {'CI': {'teff': teff+len(sed.master), 'logg': 4.}, 'factor': 1.}
+
+
+def grid_fit(sed, gridfile=None):
+    """Stands in for the grid search: read a grid, and clear the memory as get_itable does"""
+    model._open_integrated_grid(gridfile)
+    decorators.clear_memoization(keys=['ivs.sed.model'])
+    fake_fit(sed)
+
+
+def write_photfile(target, directory, nphot):
+    """Write a phot file as SED.save_photometry does"""
+    master = np.zeros(nphot, dtype=store.photometry_dtype.descr[1:])
+    master['photband'] = 'JOHNSON.V'
+    master['source'] = 'II/168/ubvmeans'
+    master['cmeas'] = np.arange(1, nphot+1)
+    master['include'] = True
+    for name in ['flag', 'unit', 'cunit', 'bibcode', 'comments']:
+        master[name] = '-'
+    ascii.write_array(master, batch.phot_file(target, directory), header=True, auto_width=True,
+                      use_float='%g', comments=['#'+json.dumps({'oname': target})])
+
+
+class BatchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.targets = ['HD 1', 'HD 2', 'bad', 'HD 3', 'HD 4']
+        for i, target in enumerate(self.targets):
+            write_photfile(target, self.directory, i+1)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testFitSample(self):
+        """ sed.batch.fit_sample() in processes, with a store and a restart """
+        storefile = os.path.join(self.directory, 'sample.h5')
+        summary = batch.fit_sample(self.targets, directory=self.directory, threads=2, fit_function=fake_fit,
+                                   store=storefile, teff=20000.)
+        self.assertEqual(list(summary['status']), ['done', 'done', 'failed', 'done', 'done'])
+        self.assertTrue('no convergence' in summary['message'][2])
+        self.assertTrue(np.all(summary['fit'][summary['status'] == 'done'] >= 0))
+        self.assertFalse([fname for fname in os.listdir(self.directory) if fname.endswith('.part')])
+        with store.SEDStore(storefile, mode='r') as sedstore:
+            results = sedstore.results(columns=['teff'])
+            self.assertEqual(sorted(results['target']), ['HD 1', 'HD 2', 'HD 3', 'HD 4'])
+            self.assertEqual(sorted(results['teff']), [20001., 20002., 20004., 20005.])
+        #-- a restart only retries the target that failed
+        summary = batch.fit_sample(self.targets, directory=self.directory, threads=1, fit_function=fake_fit)
+        self.assertEqual(list(summary['status']), ['skipped', 'skipped', 'failed', 'skipped', 'skipped'])
+        self.assertTrue('4 skipped, 1 failed' in batch.summary2str(summary, 1.))
+
+    def testOpenGrid(self):
+        """ sed.batch._fit_target() opens the integrated grids only once """
+        gridfile = os.path.join(self.directory, 'grid.fits')
+        columns = [pyfits.Column(name=name, format='E', array=np.arange(3.)) for name in ['teff', 'logg']]
+        pyfits.HDUList([pyfits.PrimaryHDU(), pyfits.new_table(columns)]).writeto(gridfile)
+        opened = []
+        original = model.pf.open
+        def counting_open(*args, **kwargs):
+            opened.append(args[0])
+            return original(*args, **kwargs)
+        model.pf.open = counting_open
+        try:
+            for target in ['HD 1', 'HD 2']:
+                output = batch._fit_target((target, self.directory, grid_fit, dict(gridfile=gridfile)))
+                self.assertEqual(output[1], 'done')
+        finally:
+            model.pf.open = original
+            grids = model._integrated_grids.values()
+            model._close_integrated_grids()
+        self.assertEqual(opened, [gridfile])
+        self.assertEqual(model._integrated_grids, {})
+        self.assertTrue(grids[0]._file.closed)
@@ -0,0 +1,89 @@
+"""
+Unit tests for the columnar store of SED results (sed.store).
+"""
+import os
+import shutil
+import tempfile
+import numpy as np
+from ivs.io import hdf5
+from ivs.sed import store
+
+import unittest
+
+
+class SEDStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'sample.h5')
+        #-- photometry with the columns of SED.master, and the results of a grid search
+        np.random.seed(1111)
+        photbands = np.array(['JOHNSON.V', 'JOHNSON.B', '2MASS.J', 'GALEX.FUV'])
+        sources = np.array(['II/168/ubvmeans', 'II/168/ubvmeans', 'II/246/out', 'II/312/ais'])
+        self.masters = []
+        self.hdf5files = []
+        for i, teff in enumerate([10000., 15000., 20000., 25000.]):
+            master = np.zeros(4+i, dtype=store.photometry_dtype.descr[1:]).view(np.recarray)
+            master['photband'] = photbands[np.arange(4+i) % 4]
+            master['source'] = sources[np.arange(4+i) % 4]
+            master['cmeas'] = np.random.uniform(1, 2, 4+i)
+            master['e_cmeas'] = np.random.uniform(0.01, 0.1, 4+i)
+            master['include'] = True
+            grid = np.rec.fromarrays([np.random.normal(teff, 500, 100), np.random.uniform(size=100)], names=['teff', 'ci_red'])
+            results = {'igrid_search': {'grid': grid, 'factor': 1e-20,
+                                        'CI': {'teff': teff, 'teff_l': teff-500., 'teff_u': teff+500., 'logg': 4.}}}
+            self.masters.append(master)
+            self.hdf5files.append(os.path.join(self.tmpdir, 'star%d.hdf5' % i))
+            hdf5.write_dict(dict(master=master, results=results), self.hdf5files[-1])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testQueries(self):
+        """ sed.store.SEDStore() queries by target, photband and parameter range """
+        with store.SEDStore(self.filename) as sedstore:
+            self.assertEqual(sedstore.update(self.hdf5files), 4)
+        with store.SEDStore(self.filename, mode='r') as sedstore:
+            self.assertEqual(list(sedstore.targets), ['star0', 'star1', 'star2', 'star3'])
+            hot = sedstore.results(teff=(15000, 22000), columns=['teff', 'logg'])
+            self.assertEqual(list(hot['target']), ['star1', 'star2'])
+            self.assertEqual(list(hot['teff']), [15000., 20000.])
+            self.assertEqual(sedstore.parameters(), ['factor', 'logg', 'teff', 'teff_l', 'teff_u'])
+            photometry = sedstore.photometry(targets=['star2', 'star3'], photband='JOHNSON.V', columns=['cmeas'])
+            self.assertEqual(list(photometry['target']), ['star2', 'star2', 'star3', 'star3'])
+            self.assertTrue(np.all(photometry['cmeas'][:2] == self.masters[2]['cmeas'][::4]))
+            ci = sedstore.get_confidence_interval('teff', targets=['star3', 'star0', 'missing'])
+            self.assertTrue(np.all(ci[:2] == [[24500., 25000., 25500.], [9500., 10000., 10500.]]))
+            self.assertTrue(np.all(np.isnan(ci[2])))
+            data = sedstore.get_data('II/312/ais', 'GALEX.FUV')
+            self.assertEqual(list(data['cmeas']), [self.masters[i]['cmeas'][3] for i in range(4)])
+
+    def testSummarize(self):
+        """ sed.store.SEDStore.summarize() fills in the first measurement of each photband """
+        with store.SEDStore(self.filename) as sedstore:
+            sedstore.update(self.hdf5files)
+            summary = sedstore.summarize()
+        self.assertEqual(summary.dtype.names, ('II/168/ubvmeans', 'II/246/out', 'II/312/ais'))
+        self.assertEqual(summary['II/168/ubvmeans'].dtype.names, ('JOHNSON.B', 'e_JOHNSON.B', 'JOHNSON.V', 'e_JOHNSON.V'))
+        for i, master in enumerate(self.masters):
+            self.assertEqual(summary['II/246/out']['2MASS.J'][i], master['cmeas'][2])
+            self.assertEqual(summary['II/168/ubvmeans']['e_JOHNSON.V'][i], master['e_cmeas'][0])
+
+    def testIncremental(self):
+        """ sed.store.SEDStore.update() only adds new and changed files """
+        with store.SEDStore(self.filename) as sedstore:
+            sedstore.update(self.hdf5files[:2])
+        with store.SEDStore(self.filename) as sedstore:
+            self.assertEqual(sedstore.update(self.hdf5files), 2)
+            self.assertEqual(sedstore.update(self.hdf5files), 0)
+            #-- a target that is added again replaces its photometry and results
+            results = {'igrid_search': {'CI': {'teff': 12000., 'teff_l': 11500., 'teff_u': 12500., 'logg': 4.}}}
+            sedstore.add('star0', self.masters[0][:2], dict(results, imc={'CI': {'teff': 12500., 'ebv': 0.1}}))
+            self.assertEqual(len(sedstore), 4)
+            self.assertEqual(len(sedstore.photometry(targets='star0')), 2)
+            self.assertEqual(list(sedstore.results()['teff']), [12000., 15000., 20000., 25000.])
+            imc = sedstore.results(mtype='imc')
+            self.assertEqual((list(imc['target']), imc['ebv'][0]), (['star0'], 0.1))
+            self.assertTrue(np.isnan(sedstore.results()['ebv']).all())
+            sedstore.add('star0', self.masters[0][:2], results)
+            self.assertTrue(np.isnan(sedstore.results(mtype='imc')['teff']).all())
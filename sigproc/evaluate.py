@@ -23,6 +23,9 @@ from ivs.timeseries import keplerorbit
 
 logger = logging.getLogger('SIGPROC.EVAL')
 
+#-- maximum number of time points x sines evaluated at once
+sine_chunk_size = 2**16
+
 def check_input(fctn):
     """
     Decorator to check input of evaluating model, and transforming input from
@@ -34,7 +37,7 @@ def check_input(fctn):
         parameters = np.asarray(args[1])
         if not parameters.dtype.names:
             name = fctn.__name__
-            for rem in ['_diffcorr']:
+            for rem in ['_diffcorr','_jacobian']:
                 name = name.replace(rem,'')
             parameters = globals()[name+'_preppars'](parameters)
         args[1] = parameters
@@ -252,7 +255,7 @@ def phasediagram(time,signal,nu0,D=0,t0=None,forb=None,asini=None,
 
 
 @check_input
-def sine(times, parameters):
+def sine(times, parameters, dtype=None):
     """
     Creates a harmonic function based on given parameters.
     
@@ -302,12 +305,19 @@ def sine(times, parameters):
     >>> parameters = np.hstack([freq1,freq2])
     >>> mysine = sine(times,parameters)
     
+    All sines are evaluated at once, in chunks of time points to limit the
+    memory use (see C{sine_chunk_size}). With C{dtype=np.float32}, the phases
+    are still computed and reduced in double precision, but the sines and their
+    sum are evaluated in single precision.
+    
     @param times: observation times
     @type times: numpy array
     @param parameters: record array containing amplitudes ('ampl'), frequencies ('freq')
     phases ('phase') and optionally constants ('const'), or 1D numpy array (see above).
     B{Warning:} record array should have shape (n,)!
     @type parameters: record array or 1D array
+    @param dtype: precision of the evaluation (defaults to double precision)
+    @type dtype: numpy dtype
     @return: sine signal (same shape as C{times})
     @rtype: array
     """
@@ -315,11 +325,47 @@ def sine(times, parameters):
         total_fit = parameters['const'].sum()
     else:
         total_fit = 0.
-    for i in xrange(len(parameters)):
-        total_fit += parameters['ampl'][i]*sin(2*pi*(parameters['freq'][i]*times+parameters['phase'][i]))
+    freq,phase = parameters['freq'],parameters['phase']
+    cycles = lambda t: np.outer(freq,t) + phase[:,None]
+    total_fit += _sum_sines(times,parameters['ampl'],cycles,dtype=dtype)
     return total_fit
 
 
+@check_input
+def sine_jacobian(times, parameters):
+    """
+    Derivatives of a harmonic function to its parameters.
+    
+    The parameters are the same as for L{sine}. The columns of the result
+    follow the order of the flat parameter array (see L{sine_preppars}), i.e.
+    C{[const, ampl1, freq1, phase1, ampl2, ...]}, so that the result can be
+    used as the Jacobian in nonlinear optimizers.
+    
+    @param times: observation times
+    @type times: numpy 1D array
+    @param parameters: record array containing amplitudes ('ampl'), frequencies ('freq')
+    phases ('phase') and optionally constants ('const'), or 1D numpy array.
+    @type parameters: record array or 1D array
+    @return: derivatives (len(times) x number of parameters)
+    @rtype: 2D array
+    """
+    times = np.asarray(times,float).ravel()
+    ampl,freq,phase = parameters['ampl'],parameters['freq'],parameters['phase']
+    const = 'const' in parameters.dtype.names and 1 or 0
+    jacobian = np.empty((len(times),3*len(parameters)+const))
+    if const:
+        jacobian[:,0] = 1.
+    chunk = max(1,sine_chunk_size//max(1,len(parameters)))
+    for start in xrange(0,len(times),chunk):
+        t = times[start:start+chunk]
+        arg = 2*pi*(np.outer(freq,t) + phase[:,None])
+        acos = 2*pi*ampl[:,None]*cos(arg)
+        jacobian[start:start+chunk,const::3] = sin(arg).T
+        jacobian[start:start+chunk,const+1::3] = (acos*t).T
+        jacobian[start:start+chunk,const+2::3] = acos.T
+    return jacobian
+
+
 
 
 
@@ -350,10 +396,12 @@ def sine_freqshift(times,parameters,t0=None):
     signal = np.zeros(len(times))
     if 'const' in parameters.dtype.names:
         signal += np.sum(parameters['const'])
-        
-    for par in parameters:
-        frequency = (par['freq'] + par['D']/2.*(times-t0)) * (times-t0)
-        signal += par['ampl'] * sin(2*pi*(frequency + par['phase']))
+    
+    freq,D,phase = parameters['freq'],parameters['D'],parameters['phase']
+    def cycles(t):
+        t = t-t0
+        return (freq[:,None] + D[:,None]/2.*t) * t + phase[:,None]
+    signal += _sum_sines(times,parameters['ampl'],cycles)
     
     return signal
     
@@ -393,21 +441,27 @@ def sine_orbit(times,parameters,t0=None,nmax=10):
         signal += np.sum(parameters['const'])
         
     cc = 173.144632674 # speed of light in AU/d
-    for par in parameters:
-        alpha = par['freq']*par['asini']/cc
-        if not 'ecc' in names:# or par['ecc']==0:
-            frequency = par['freq']*(times-t0) + \
-              alpha*(sin(2*pi*par['forb']*times) - sin(2*pi*par['forb']*t0))
-        else:
-            e,omega = par['ecc'],par['omega']
-            ns = np.arange(1,nmax+1,1)
-            ans,bns = np.array([[ane(n,e),bne(n,e)] for n in ns]).T
-            ksins = sqrt(ans**2*cos(omega)**2+bns**2*sin(omega)**2)
-            thns = arctan(bns/ans*tan(omega))
-            tau = -np.sum(bns*sin(omega))
-            frequency = par['freq']*(times-t0) + \
-               alpha*(np.sum(np.array([ksins[i]*sin(2*pi*ns[i]*par['forb']*(times-t0)+thns[i]) for i in range(nmax)]),axis=0)+tau)
-        signal += par['ampl'] * sin(2*pi*(frequency + par['phase']))
+    freq,forb,phase = parameters['freq'],parameters['forb'],parameters['phase']
+    alpha = freq*parameters['asini']/cc
+    if not 'ecc' in names:
+        def cycles(t):
+            return np.outer(freq,t-t0) + phase[:,None] + \
+              alpha[:,None]*(sin(2*pi*np.outer(forb,t)) - sin(2*pi*forb*t0)[:,None])
+        depth = 1
+    else:
+        #-- harmonics x orbits
+        e,omega = parameters['ecc'],parameters['omega']
+        ns = np.arange(1,nmax+1,1)[:,None]
+        ans,bns = ane(ns,e),bne(ns,e)
+        ksins = sqrt(ans**2*cos(omega)**2+bns**2*sin(omega)**2)
+        thns = arctan(bns/ans*tan(omega))
+        tau = -np.sum(bns*sin(omega),axis=0)
+        def cycles(t):
+            t = t-t0
+            delay = (ksins[:,:,None]*sin(2*pi*(ns*forb)[:,:,None]*t+thns[:,:,None])).sum(axis=0)
+            return np.outer(freq,t) + alpha[:,None]*(delay+tau[:,None]) + phase[:,None]
+        depth = nmax
+    signal += _sum_sines(times,parameters['ampl'],cycles,depth=depth)
     
     return signal
 
@@ -468,9 +522,9 @@ def kepler(times,parameters,itermax=8):
         RVfit = parameters['gamma'].sum()
     else:
         RVfit = 0
-    for pars in parameters:
-        p = [pars['P'],pars['T0'],pars['e'],pars['omega'],pars['K'],0]
-        RVfit += keplerorbit.radial_velocity(p,times=times,itermax=itermax)
+    #-- all orbits at once
+    RVfit += keplerorbit.radial_velocity_grid(times,parameters['P'],parameters['T0'],
+                  parameters['e'],parameters['omega'],parameters['K'],itermax=itermax).sum(axis=0)
     return RVfit
 
 @check_input
@@ -1181,6 +1235,31 @@ def power_law_preppars(pars):
 
 #{ Helper functions
 
+def _sum_sines(times,ampl,cycles,dtype=None,depth=1):
+    """
+    Sum of sines C{ampl_i*sin(2pi*cycles_i(t))}, evaluated in chunks of time.
+    
+    C{cycles} returns the phases (in cycles) of all sines for a chunk of time
+    points, with shape (number of sines, number of time points): the sines
+    are evaluated one after the other, which is faster than alternating
+    between them. C{depth} is the number of temporary values C{cycles} needs
+    per time point and sine, and is taken into account when chunking. In
+    single precision, the phases are reduced to [0,1) before they are
+    converted.
+    """
+    times = np.asarray(times,float)
+    flat = times.ravel()
+    ampl = np.asarray(ampl,dtype or float)
+    total = np.zeros(len(flat),dtype or float)
+    chunk = max(1,sine_chunk_size//(max(1,len(ampl))*depth))
+    for start in xrange(0,len(flat),chunk):
+        phase = cycles(flat[start:start+chunk])
+        if dtype is not None:
+            phase -= np.floor(phase)
+            phase = phase.astype(dtype)
+        total[start:start+chunk] = np.dot(ampl,sin(2*pi*phase))
+    return total.reshape(times.shape)
+
 def _complex_error_function(x):
     """
     Complex error function
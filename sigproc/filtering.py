@@ -36,20 +36,21 @@ import logging
 import numpy as np
 from numpy import sqrt,exp,pi,cos,sinc,trapz,average
 
+from bisect import bisect_left,bisect_right,insort
 from scipy.integrate import trapz
-from multiprocessing import Process, Manager,cpu_count
+from multiprocessing import Pool,cpu_count
 
-from ivs.aux.decorators import make_parallel
-from ivs.timeseries.decorators import parallel_pergram,defaults_filtering
+from ivs.timeseries.decorators import defaults_filtering
 
 logger = logging.getLogger("TS.FILTERING")
 
+#-- maximum number of template points x window points evaluated at once
+filter_tile_size = 2**20
+
 #{ Main filter program for convolution-based filters
 
 @defaults_filtering
-@parallel_pergram
-@make_parallel
-def filter_signal(x,y,ftype,f0=None,fn=None,step=1,x_template=None,**kwargs):
+def filter_signal(x,y,ftype,f0=None,fn=None,step=1,x_template=None,threads=1,**kwargs):
     """
     Filter a signal.
     
@@ -64,6 +65,13 @@ def filter_signal(x,y,ftype,f0=None,fn=None,step=1,x_template=None,**kwargs):
     you can give an array to the C{window} parameter, but it needs to be the
     same length as C{x_template}.
     
+    The box, Gaussian and INL filters are not evaluated point per point with
+    their kernel functions, but on all points at once: the box filter with
+    cumulative sums, the Gaussian filter as a truncated convolution in blocks
+    of C{filter_tile_size} values, and the INL filter with a sorted window that
+    slides over the signal. The template points can be distributed over
+    several processes with C{threads} (an integer, 'max' or 'safe').
+    
     Example usage:
     
     Generate some data:
@@ -87,6 +95,8 @@ def filter_signal(x,y,ftype,f0=None,fn=None,step=1,x_template=None,**kwargs):
 
     @param ftype: one of 'gauss','pijpers','box','inl'
     @type ftype: string
+    @param threads: number of processes (integer, 'max' or 'safe')
+    @type threads: int or str
     @rtype: tuple
     @return: output from the used filter: typically (x, y, pnts)
     """
@@ -94,10 +104,9 @@ def filter_signal(x,y,ftype,f0=None,fn=None,step=1,x_template=None,**kwargs):
         x_template = x + 0.
     if f0 is None: f0 = 0
     if fn is None: fn = len(x_template)
-    #-- set window and kernel function
+    #-- set window function
     ftype = ftype.lower()    
     window = globals()[ftype+'_window']
-    kernel = globals()[ftype+'_kernel']
     logger.info("Applying filter: %s"%(ftype))
     
     #-- set window width
@@ -110,14 +119,30 @@ def filter_signal(x,y,ftype,f0=None,fn=None,step=1,x_template=None,**kwargs):
     if not isinstance(higher_window,np.ndarray):
         higher_window = higher_window*np.ones(len(x_template))[f0:fn:step]
     
-    #-- start running through timeseries (make searchsorted local for speedup)
+    #-- find the window of every template point at once
     logger.debug("FILTER between index %d-%d with step %d"%(f0,fn,step))
     x_template = x_template[f0:fn:step]
-    searchsorted = x.searchsorted
-    out = [kernel(x,y,t,index=searchsorted([t-1e-30-lower_window[i],t+1e-30+higher_window[i]]),
-                        **kwargs) for i,t in enumerate(x_template)]
+    index0 = x.searchsorted(x_template-1e-30-lower_window)
+    indexn = x.searchsorted(x_template+1e-30+higher_window)
+    
+    #-- distribute the template points over the processes
+    if threads=='max':
+        threads = cpu_count()
+    elif threads=='safe':
+        threads = cpu_count()-1
+    threads = max(1,min(int(threads),len(x_template)))
+    chunks = [(ftype,x,y,x_template[part],index0[part],indexn[part],kwargs) \
+                    for part in np.array_split(np.arange(len(x_template)),threads)]
+    if threads>1:
+        pool = Pool(threads)
+        try:
+            out = pool.map(_filter_chunk,chunks)
+        finally:
+            pool.terminate()
+    else:
+        out = [_filter_chunk(chunk) for chunk in chunks]
     #-- that's it!
-    return tuple([x_template] + list(np.array(out).T))    
+    return tuple([x_template] + [np.hstack(column) for column in zip(*out)])
     
 #}
 
@@ -255,8 +280,9 @@ def inl_kernel(times_in,signal_in,t,c=0.6745,sig_level=3.,tolerance=0.01,index=(
     continuum = np.median(signal)
     outliers = (np.abs(continuum-signal)>sig_level*sigma)
     max_iter = 3
+    signal_ = signal
     for iteration in range(max_iter):
-        signal_ = signal[outliers==0]
+        signal_ = signal_[outliers==0]
         sigma = mad(signal_,c=c)
         continuum_ = np.median(signal_)
         if abs((continuum_-continuum)/continuum_)<tolerance:
@@ -441,6 +467,168 @@ def box_kernel(times_in,signal_in,t,window_width=None,index=(0,-1),norm_weights=
 
 
 
+#}
+
+#{ Filters on all template points at once
+
+def _filter_chunk(args):
+    """
+    Filter a signal on a chunk of template points.
+    
+    Uses the C{_<ftype>_filter} implementation when there is one, and calls
+    the kernel function for every template point otherwise.
+    """
+    ftype,x,y,x_template,index0,indexn,kwargs = args
+    if '_%s_filter'%(ftype) in globals():
+        return globals()['_%s_filter'%(ftype)](x,y,x_template,index0,indexn,**kwargs)
+    kernel = globals()[ftype+'_kernel']
+    out = [kernel(x,y,t,index=(index0[i],indexn[i]),**kwargs) for i,t in enumerate(x_template)]
+    return list(np.array(out).reshape((len(x_template),-1)).T)
+
+def _box_filter(x,y,x_template,index0,indexn,window_width=None,norm_weights=True):
+    """
+    Box filter with cumulative sums (see L{box_kernel}).
+    """
+    #-- subtract the mean to limit the round off in the cumulative sum
+    offset = y.mean() if len(y) else 0.
+    cumsum = np.hstack([0.,np.cumsum(y-offset)])
+    pnts = indexn-index0
+    total = cumsum[indexn]-cumsum[index0] + offset*pnts
+    if norm_weights:
+        convolved = np.where(pnts>0,total/np.maximum(pnts,1),0.)
+    else:
+        convolved = total
+    return convolved,pnts
+
+def _gauss_filter(x,y,x_template,index0,indexn,sigma=1.,limit=4.,norm_weights=True):
+    """
+    Gaussian filter as a truncated convolution, computed in blocks of template
+    points (see L{gauss_kernel}).
+    """
+    pnts = indexn-index0
+    convolved = np.zeros(len(x_template))
+    #-- maybe sigma is changing
+    if isinstance(sigma,np.ndarray):
+        sigma = sigma[np.minimum((indexn+index0)//2,len(sigma)-1)]
+    else:
+        sigma = sigma*np.ones(len(x_template))
+    width = max(1,pnts.max()) if len(pnts) else 1
+    block = max(1,filter_tile_size//width)
+    for start in xrange(0,len(x_template),block):
+        t = x_template[start:start+block,None]
+        sig = sigma[start:start+block,None]
+        #-- indices of the points in the windows (padded to the widest one)
+        index = index0[start:start+block,None] + np.arange(width)
+        valid = index<indexn[start:start+block,None]
+        index = np.minimum(index,len(x)-1)
+        times_ = x[index]-t
+        weights = 1./(sqrt(2.*pi)*sig) * exp( -times_**2./(2.*sig**2.))
+        weights[~valid] = 0.
+        signal_ = weights*y[index]
+        if norm_weights:
+            #-- trapezoid rule, only on segments within the window
+            dx = np.diff(times_,axis=1)*valid[:,1:]
+            conv = (dx*(signal_[:,1:]+signal_[:,:-1])/2.0).sum(axis=1)
+            norm_fact = (dx*(weights[:,1:]+weights[:,:-1])/2.0).sum(axis=1)
+        else:
+            conv = signal_.sum(axis=1)
+            norm_fact = weights.sum(axis=1)
+        convolved[start:start+block] = conv/norm_fact
+    return convolved,pnts
+
+def _inl_filter(x,y,x_template,index0,indexn,c=0.6745,sig_level=3.,tolerance=0.01,window_width=None):
+    """
+    Iterative nonlinear filter with a sorted window that slides over the
+    signal (see L{inl_kernel}).
+    
+    In a sorted window, the points that survive the sigma clipping are a
+    contiguous range, so that the median and the median absolute deviation of
+    the surviving points only need a few bisections.
+    """
+    continuum = np.zeros(len(x_template))
+    sigmas = np.zeros(len(x_template))
+    signal = y.tolist()
+    window,lower,upper = [],0,0
+    for i in xrange(len(x_template)):
+        i0,i1 = index0[i],indexn[i]
+        #-- slide the window, or start a new one if that is cheaper
+        if i0<lower or i1<upper or (i0-lower)+(i1-upper)>len(window):
+            window = sorted(signal[i0:i1])
+        else:
+            for value in signal[lower:min(i0,upper)]:
+                del window[bisect_left(window,value)]
+            for value in signal[max(i0,upper):i1]:
+                insort(window,value)
+        lower,upper = i0,i1
+        if not window:
+            continuum[i] = sigmas[i] = np.nan
+            continue
+        #-- iterative sigma clipping
+        l,r = 0,len(window)
+        cont = _sorted_median(window,l,r)
+        sigma = _sorted_mad(window,l,r,cont)/c
+        l,r = _sorted_clip(window,l,r,cont,sig_level*sigma)
+        for iteration in range(3):
+            cont_ = _sorted_median(window,l,r)
+            sigma = _sorted_mad(window,l,r,cont_)/c
+            if cont_!=0 and abs((cont_-cont)/cont_)<tolerance:
+                break
+            else:
+                cont = cont_
+                l,r = _sorted_clip(window,l,r,cont,sig_level*sigma)
+        continuum[i],sigmas[i] = cont_,sigma
+    return continuum,sigmas,indexn-index0
+
+def _sorted_median(a,l,r):
+    """
+    Median of the sorted list C{a[l:r]}.
+    """
+    n = r-l
+    if n%2:
+        return a[l+n//2]
+    return (a[l+n//2-1]+a[l+n//2])/2.
+
+def _sorted_distance(a,l,r,m,k):
+    """
+    k-th smallest (starting from 0) distance of the points in the sorted
+    list C{a[l:r]} to C{m}.
+    
+    The k+1 points closest to C{m} are a contiguous range, which is found by
+    bisection.
+    """
+    lo,hi = l,r-k-1
+    while lo<hi:
+        mid = (lo+hi)//2
+        if m-a[mid] > a[mid+k+1]-m:
+            lo = mid+1
+        else:
+            hi = mid
+    return max(abs(m-a[lo]),abs(a[lo+k]-m))
+
+def _sorted_mad(a,l,r,m):
+    """
+    Median absolute deviation (without scaling) of the sorted list C{a[l:r]}
+    with median C{m}.
+    """
+    n = r-l
+    if n%2:
+        return _sorted_distance(a,l,r,m,n//2)
+    return (_sorted_distance(a,l,r,m,n//2-1)+_sorted_distance(a,l,r,m,n//2))/2.
+
+def _sorted_clip(a,l,r,m,limit):
+    """
+    Range of the points of the sorted list C{a[l:r]} that are not further
+    than C{limit} from C{m}.
+    """
+    l_ = bisect_left(a,m-limit,l,r)
+    r_ = bisect_right(a,m+limit,l,r)
+    #-- correct for round off in the bisection limits
+    while l_>l and abs(m-a[l_-1])<=limit: l_ -= 1
+    while l_<r_ and abs(m-a[l_])>limit: l_ += 1
+    while r_<r and abs(m-a[r_])<=limit: r_ += 1
+    while r_>l_ and abs(m-a[r_-1])>limit: r_ -= 1
+    return l_,r_
+
 #}
 
 def test():
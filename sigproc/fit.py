@@ -436,7 +436,7 @@ import scipy.optimize
 from ivs.aux import progressMeter as progress
 from ivs.aux import loggers
 from ivs.sigproc import evaluate
-from ivs.timeseries import pyKEP
+from ivs.timeseries import keplerorbit
 
 import re
 import copy
@@ -492,6 +492,7 @@ def sine(times, signal, freq, sigma=None,constant=True,error=False,t0=0):
         sigma = np.ones_like(signal)
     elif not hasattr(sigma,'__len__'):
         sigma = sigma * np.ones_like(signal)
+    sigma = np.asarray(sigma)
     
     #-- Determine the number of fit parameters
     Ndata = len(times)
@@ -508,9 +509,9 @@ def sine(times, signal, freq, sigma=None,constant=True,error=False,t0=0):
     #   the second Nfreq columns are the amplitudes of the cosine, and if requested,
     #   the last column belongs to the constant
     A = np.zeros((Ndata,Nparam))
-    for j in range(Nfreq):
-        A[:,j]       = sin(2*pi*freq[j]*times) * sigma
-        A[:,Nfreq+j] = cos(2*pi*freq[j]*times) * sigma
+    arg = 2*pi*np.outer(times,freq)
+    A[:,:Nfreq]        = sin(arg) * sigma[:,None]
+    A[:,Nfreq:2*Nfreq] = cos(arg) * sigma[:,None]
     if constant:
         A[:,2*Nfreq] = np.ones(Ndata) * sigma
     
@@ -520,11 +521,8 @@ def sine(times, signal, freq, sigma=None,constant=True,error=False,t0=0):
     fitparam, chisq, rank, s = np.linalg.lstsq(A,b)
   
     #-- Compute the amplitudes and phases: A_j sin(2pi*\nu_j t_i + phi_j)
-    amplitude = np.zeros(Nfreq)
-    phase = np.zeros(Nfreq)
-    for j in range(Nfreq):
-        amplitude[j] = np.sqrt(fitparam[j]**2 + fitparam[Nfreq+j]**2)
-        phase[j]     = np.arctan2(fitparam[Nfreq+j], fitparam[j])
+    amplitude = np.sqrt(fitparam[:Nfreq]**2 + fitparam[Nfreq:2*Nfreq]**2)
+    phase     = np.arctan2(fitparam[Nfreq:2*Nfreq], fitparam[:Nfreq])
 
     #-- If no error bars are needed, we are finished here, we collect all parameters    
     if constant:
@@ -692,23 +690,17 @@ def kepler(times, signal, freq, sigma=None, wexp=2., e0=0, en=0.99, de=0.01, out
     T = times[-1]-times[0]
     x00 = 0.
     x0n = 359.9
-    #-- initialize parameters
+    #-- search a small frequency range around the given frequency
     f0 = freq
     fn = freq+0.05/T
     df = 0.1/T
     maxstep = int((fn-f0)/df+1)
-    f1 = np.zeros(maxstep) #-- frequency
-    s1 = np.zeros(maxstep) #-- power
-    p1 = np.zeros(maxstep) #-- window
-    l1 = np.zeros(maxstep) #-- power LS
-    s2 = np.zeros(maxstep) #-- power Kepler
-    k2 = np.zeros(6) #-- parameters for Kepler orbit
-    
-    pyKEP.kepler(times,signal,sigma,f0,fn,df,wexp,e0,en,de,x00,x0n,
-         f1,s1,p1,l1,s2,k2)
+    f1 = f0 + df*np.arange(maxstep)
+    s2,k2 = keplerorbit.grid_search(times,signal,f1,errors=sigma,wexp=wexp,
+                                    e0=e0,en=en,de=de,x00=x00,x0n=x0n)
     
     freq,x0,e,w,K,RV0 = k2
-    pars = [1/freq,x0/(2*pi*freq) + times[0], e, w, K, RV0]
+    pars = [1/freq,x0/(2*pi*freq) + times.min(), e, w, K, RV0]
     if output_type=='old':
         pars = np.rec.array([tuple(pars)],dtype=[('P','f8'),('T0','f8'),('e','f8'),('omega','f8'),('K','f8'),('gamma','f8')])
         
@@ -937,8 +929,8 @@ def e_sine(times,signal,parameters,correlation_correction=True,limit=10000):
     T = times.ptp()
     
     #-- do we need to include the constant?
-    if 'const' in parameters.dtype.names:
-        constant = True
+    constant = 'const' in parameters.dtype.names
+    if constant:
         Nparam += 1   
     
     #-- these lists will contain the columns and their names
@@ -952,11 +944,11 @@ def e_sine(times,signal,parameters,correlation_correction=True,limit=10000):
         #   the amplitude, the 2nd Nfreq columns w.r.t. the phase, and the if relevant
         #   the last column w.r.t. the constant. From this the covariance matrix.
         F = np.zeros((Ndata, Nparam))   
-        for i in range(Ndata):
-            F[i,0:Nfreq] = sin(2*pi*freq*times[i] + phase)
-            F[i,Nfreq:2*Nfreq] = amplitude * cos(2*pi*freq*times[i] + phase)
-            #-- and for the constant
-            F[i,2*Nfreq] = 1.0 
+        arg = 2*pi*np.outer(times,freq) + phase
+        F[:,0:Nfreq] = sin(arg)
+        F[:,Nfreq:2*Nfreq] = amplitude * cos(arg)
+        #-- and for the constant
+        F[:,2*Nfreq] = 1.0 
       
         covariance = np.linalg.inv(np.dot(F.T, F))
         covariance *= chisq / (Ndata - Nparam)
@@ -1064,9 +1056,14 @@ def residuals_single(parameters,domain,data,evalfunc,weights,logar,*args):
         return sum(weights*(data-fit)**2)
 
 def optimize(times, signal, parameters, func_name, prep_func=None, 
-                        minimizer='leastsq', weights=None, logar=False, args=()):
+                        minimizer='leastsq', weights=None, logar=False, args=(),
+                        jacobian=True):
     """
     Fit a function to data.
+    
+    If C{jacobian} is True and the model has analytical derivatives in
+    L{evaluate} (e.g. C{sine_jacobian} for C{sine}), they are given to the
+    C{leastsq} minimizer instead of letting it estimate them numerically.
     """
     #-- we need these function to evaluate the fit and to (un)pack the fitting
     #   parameters from and to flat arrays
@@ -1079,6 +1076,11 @@ def optimize(times, signal, parameters, func_name, prep_func=None,
     else:
         evalfunc = func_name
     optifunc = getattr(scipy.optimize,minimizer)
+    #-- derivatives of the residuals, if they are known analytically
+    Dfun = None
+    if jacobian and isinstance(func_name,str) and not logar and hasattr(evaluate,func_name+'_jacobian'):
+        jacfunc = getattr(evaluate,func_name+'_jacobian')
+        Dfun = lambda pars,times,signal,evalfunc,weights,logar,*args: -np.reshape(weights,(-1,1))*jacfunc(times,pars,*args)
     
     #-- if no weights, everything has the same weight
     if weights is None:
@@ -1101,7 +1103,7 @@ def optimize(times, signal, parameters, func_name, prep_func=None,
     #-- optimize
     if minimizer=='leastsq':
         popt, cov, info, mesg, flag = optifunc(residuals,init_guess,
-                                     args=(times,signal,evalfunc,weights,logar)+args,full_output=1)#,diag=[1.,10,1000,1.,100000000.])
+                                     args=(times,signal,evalfunc,weights,logar)+args,Dfun=Dfun,full_output=1)#,diag=[1.,10,1000,1.,100000000.])
         #-- calculate new chisquare, and check if we have improved it
         chisq = np.sum(info['fvec']*info['fvec'])
         if chisq>chisq_init or flag!=1:
@@ -1507,9 +1509,10 @@ class Model(object):
     other settings are provided. If wanted, the parameters object itself can be obtained with
     the L{parameters} attribute.
     
-    At the moment the use of a jacobian is not supported at the Model level as it is not possible
-    to derive a symbolic jacobian from the provided functions. If you want to use a jacobian you
-    will have to write a Function yourself in which you can provide a jacobian function.
+    If the Functions are summed (no C{expr}) and all of them have a jacobian, the jacobian of the
+    Model consists of the jacobians of the Functions, in the order of the parameters. Otherwise it
+    is not possible to derive a jacobian from the provided functions. If you want to use a jacobian
+    you will have to write a Function yourself in which you can provide a jacobian function.
     """
     
     def __init__(self, functions=None, expr=None, resfunc=None):
@@ -1533,6 +1536,10 @@ class Model(object):
         self._par_names = None
         self.parameters = None
         
+        #-- The jacobian of a sum is known if the jacobians of all terms are
+        if expr == None and functions and all([f.jacobian != None for f in functions]):
+            self.jacobian = self.evaluate_jacobian
+        
         #-- Combine the parameters
         self.pull_parameters()
     
@@ -1578,9 +1585,25 @@ class Model(object):
         
     def evaluate_jacobian(self, x, *args):
         """
-        Not implemented!
+        Evaluate the jacobian of a sum of Functions for the given values and optional a given
+        parameter object. If the jacobian is not known (see introduction), zeros are returned.
+        
+        @param x: the independant values for which to evaluate the jacobian.
+        @type x: array
+        
+        @return: jacobian (len(x) x number of parameters)
+        @rtype: numpy array
         """
-        return [0.0 for p in self.parameters]
+        if self.jacobian == None:
+            return [0.0 for p in self.parameters]
+        
+        if len(args) == 0:
+            parameters = self.parameters
+        elif len(args) == 1:
+            parameters = args[0]
+        self.push_parameters(parameters=parameters)
+        
+        return np.column_stack([function.evaluate_jacobian(x) for function in self.functions])
         
     def setup_parameters(self,values=None, bounds=None, vary=None, exprs=None):
         """
@@ -2372,7 +2395,16 @@ class Minimizer(object):
         "Internal function to setup the jacobian function for the minimizer."
         if self.model.jacobian != None:
             def jacobian(params, x, y, weights=None, errors=None, **kwargs):
-                return self.model.evaluate_jacobian(x, params, **kwargs)
+                jac = np.asarray(self.model.evaluate_jacobian(x, params, **kwargs))
+                #-- the minimizer only needs the derivatives to the varying parameters, and
+                #   works on the internal (unbounded) values of the bounded parameters
+                if jac.ndim == 2 and jac.shape[1] == len(params):
+                    varying = [i for i,par in enumerate(params.values()) if par.vary and par.expr == None]
+                    scales = [params.values()[i].scale_gradient(params.values()[i].setup_bounds()) for i in varying]
+                    jac = jac[:,varying] * np.array(scales)
+                if weights is not None and self.resfunc == None:
+                    jac = jac * np.reshape(weights, (-1,1))
+                return jac
             self.jacobian = jacobian
         else:
             self.jacobian = None
@@ -2588,13 +2620,13 @@ def get_correlation_factor(residus, full_output=False):
     @return: rho(,same sign groups)
     @rtype: float(,list)
     """
-    same_sign_groups = [1]
-    
-    for i in xrange(1,len(residus)):
-        if np.sign(residus[i])==np.sign(residus[i-1]):
-            same_sign_groups[-1] += 1
-        else:
-            same_sign_groups.append(0)
+    #-- a new group starts where the sign changes. The first group counts
+    #   all its points, the others one point less.
+    sign = np.sign(residus)
+    starts = np.nonzero(~(sign[1:]==sign[:-1]))[0]+1
+    same_sign_groups = np.diff(np.hstack([0,starts,max(len(residus),1)]))
+    same_sign_groups[1:] -= 1
+    same_sign_groups = list(same_sign_groups)
     
     rho = np.average(same_sign_groups)
     
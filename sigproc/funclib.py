@@ -285,17 +285,27 @@ def gauss(use_jacobian=True):
             return np.array([-ex, -p[0] * (x-p[1]) * ex / p[2]**2, -p[0] * (x-p[1])**2 * ex / p[2]**3, [-1 for i in x] ]).T
         return Function(function=function, par_names=pnames, jacobian=jacobian)
     
-def sine():
+def sine(use_jacobian=False):
     """
     Sine (ampl,freq,phase,const)
     
     f(x) = ampl * sin(2pi*freq*x + 2pi*phase) + const
+    
+    @param use_jacobian: give the minimizer the analytical derivatives
+    @type use_jacobian: bool
     """
     pnames = ['ampl', 'freq', 'phase', 'const']
     function = lambda p, x: p[0] * sin(2*pi*(p[1]*x + p[2])) + p[3]
     function.__name__ = 'sine'
     
-    return Function(function=function, par_names=pnames)
+    if not use_jacobian:
+        return Function(function=function, par_names=pnames)
+    else:
+        def jacobian(p, x):
+            arg = 2*pi*(p[1]*x + p[2])
+            acos = 2*pi*p[0]*cos(arg)
+            return -np.array([sin(arg), acos*x, acos, np.ones_like(x)]).T
+        return Function(function=function, par_names=pnames, jacobian=jacobian)
 
 
 def sine_linfreqshift(t0=0.):
@@ -422,14 +432,16 @@ def voigt():
 
 #{ Combination functions
 
-def multi_sine(n=10):
+def multi_sine(n=10,use_jacobian=False):
     """
     Multiple sines.
     
     @param n: number of sines
     @type n: int
+    @param use_jacobian: give the minimizer the analytical derivatives
+    @type use_jacobian: bool
     """
-    return Model(functions=[sine() for i in range(n)])
+    return Model(functions=[sine(use_jacobian=use_jacobian) for i in range(n)])
 
 def multi_blackbody(n=3,**kwargs):
     """
@@ -0,0 +1,97 @@
+"""
+Unit tests for the evaluation of the harmonic models (sigproc.evaluate) and
+their use in the fitting routines (sigproc.fit, sigproc.funclib).
+"""
+import numpy as np
+from numpy import pi
+from ivs.sigproc import evaluate, fit, funclib
+
+import unittest
+
+
+class SineTestCase(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(1111)
+        self.times = np.sort(np.random.uniform(0, 100, 1000))
+        const = np.zeros(12)
+        const[0] = 2.
+        self.parameters = np.rec.fromarrays([const, np.random.uniform(0.5, 2, 12), np.random.uniform(0.1, 5, 12),
+                                             np.random.uniform(0, 1, 12)], names=['const', 'ampl', 'freq', 'phase'])
+
+    def testSine(self):
+        """ sigproc.evaluate.sine() in chunks and in single precision """
+        reference = 2.
+        for par in self.parameters:
+            reference = reference + par['ampl']*np.sin(2*pi*(par['freq']*self.times+par['phase']))
+        chunk_size = evaluate.sine_chunk_size
+        evaluate.sine_chunk_size = 100
+        try:
+            output = evaluate.sine(self.times, self.parameters)
+        finally:
+            evaluate.sine_chunk_size = chunk_size
+        self.assertTrue(np.allclose(output, reference, rtol=1e-12, atol=1e-12))
+        output = evaluate.sine(self.times, evaluate.sine_preppars(self.parameters), dtype=np.float32)
+        self.assertEqual(output.dtype, np.float32)
+        self.assertTrue(np.allclose(output, reference, atol=1e-5))
+        self.assertEqual(evaluate.sine(self.times.reshape(10, 100), self.parameters).shape, (10, 100))
+
+    def testFreqshift(self):
+        """ sigproc.evaluate.sine_freqshift() with several frequencies """
+        D = np.linspace(-1e-3, 1e-3, len(self.parameters))
+        parameters = np.rec.fromarrays([self.parameters[name] for name in self.parameters.dtype.names]+[D],
+                                       names=list(self.parameters.dtype.names)+['D'])
+        t = self.times - 10.
+        reference = parameters['const'].sum()
+        for par in parameters:
+            reference = reference + par['ampl']*np.sin(2*pi*((par['freq']+par['D']/2.*t)*t+par['phase']))
+        output = evaluate.sine_freqshift(self.times, parameters, t0=10.)
+        self.assertTrue(np.allclose(output, reference, rtol=1e-12, atol=1e-12))
+
+    def testJacobian(self):
+        """ sigproc.evaluate.sine_jacobian() equals numerical derivatives """
+        pars = evaluate.sine_preppars(self.parameters)
+        jacobian = evaluate.sine_jacobian(self.times, pars)
+        self.assertEqual(jacobian.shape, (len(self.times), len(pars)))
+        for i in range(len(pars)):
+            dp = np.zeros(len(pars))
+            dp[i] = 1e-6
+            numerical = (evaluate.sine(self.times, pars+dp)-evaluate.sine(self.times, pars-dp))/2e-6
+            self.assertTrue(np.allclose(jacobian[:, i], numerical, rtol=1e-5, atol=1e-5), msg=str(i))
+
+
+class SineFitTestCase(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(1111)
+        self.times = np.sort(np.random.uniform(0, 50, 2000))
+        self.parameters = np.rec.fromarrays([[2., 0., 0.], [1.5, 0.8, 0.6], [0.7, 2.3, 4.1], [0.2, 0.9, 0.45]],
+                                            names=['const', 'ampl', 'freq', 'phase'])
+        self.signal = 2. + np.random.normal(size=len(self.times), scale=0.05)
+        for par in self.parameters:
+            self.signal += par['ampl']*np.sin(2*pi*(par['freq']*self.times+par['phase']))
+
+    def testOptimize(self):
+        """ sigproc.fit.optimize() with the analytical jacobian """
+        start = evaluate.sine_preppars(self.parameters)
+        start[2::3] += 1e-4
+        numerical = fit.optimize(self.times, self.signal, start, 'sine', jacobian=False)[0]
+        analytical = fit.optimize(self.times, self.signal, start, 'sine')[0]
+        for name in ['const', 'ampl', 'freq', 'phase']:
+            self.assertTrue(np.allclose(analytical[name], numerical[name], rtol=1e-6, atol=1e-7), msg=name)
+        self.assertTrue(np.allclose(analytical['freq'], self.parameters['freq'], atol=1e-4))
+
+    def testMinimizer(self):
+        """ sigproc.fit.minimize() of a multi_sine with fixed and bounded parameters """
+        values = []
+        for use_jacobian in [False, True]:
+            model = funclib.multi_sine(n=3, use_jacobian=use_jacobian)
+            for i, func in enumerate(model.functions):
+                par = self.parameters[i]
+                func.setup_parameters(values=[par['ampl'], par['freq']+1e-4, par['phase'], par['const']],
+                                      bounds=[(0, 5), (None, None), (None, None), (None, None)],
+                                      vary=[True, True, True, i == 0])
+            model.pull_parameters()
+            fit.minimize(self.times, self.signal, model)
+            values.append(np.array([par.value for par in model.parameters.values()]))
+        self.assertTrue(np.allclose(values[0], values[1], rtol=1e-5, atol=1e-6))
@@ -0,0 +1,50 @@
+"""
+Unit tests for the filters of non-equidistant signals (sigproc.filtering).
+"""
+import numpy as np
+from numpy import pi
+from ivs.sigproc import filtering
+
+import unittest
+
+
+class FilterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        #-- non-equidistant noisy signal with duplicate times and outliers
+        np.random.seed(1111)
+        self.x = np.sort(np.random.uniform(0, 150, 2000))
+        self.x[10:15] = self.x[10]
+        self.y = np.sin(2*pi/20.*self.x) + np.random.normal(size=2000, scale=0.3) + 5.
+        self.y[::50] += 10.
+        self.tile_size = filtering.filter_tile_size
+
+    def tearDown(self):
+        filtering.filter_tile_size = self.tile_size
+
+    def testFilters(self):
+        """ sigproc.filtering.filter_signal() equals the kernel functions """
+        x_template = np.linspace(-5, 155, 300)
+        sigma = np.linspace(0.2, 1., len(self.x))
+        for ftype, kwargs, options in [('box', dict(window_width=3.), {}),
+                                       ('box', dict(window_width=0.05), dict(x_template=x_template)),
+                                       ('gauss', dict(sigma=0.5), {}),
+                                       ('gauss', dict(sigma=sigma), dict(x_template=x_template[10:-10], tile_size=1000)),
+                                       ('inl', dict(window_width=0.5), {}),
+                                       ('inl', dict(window_width=3.), {}),
+                                       ('inl', dict(window_width=20.), {}),
+                                       ('inl', dict(window_width=3.), dict(x_template=x_template[::-1])),
+                                       ('box', dict(window_width=3.), dict(threads=3, step=7)),
+                                       ('inl', dict(window_width=3.), dict(threads=3, step=7)),
+                                       ('pijpers', dict(delta=0.1), dict(threads=3, step=7))]:
+            filtering.filter_tile_size = options.pop('tile_size', self.tile_size)
+            output = filtering.filter_signal(self.x, self.y, ftype, **dict(options, **kwargs))
+            template = options.get('x_template', self.x[::options.get('step', 1)])
+            self.assertTrue(np.allclose(output[0], template))
+            lower_window, higher_window = getattr(filtering, ftype+'_window')(**kwargs)
+            for i in [0, 1, 11, len(template)//2, len(template)-1]:
+                t = template[i]
+                index = self.x.searchsorted([t-1e-30-lower_window, t+1e-30+higher_window])
+                reference = getattr(filtering, ftype+'_kernel')(self.x, self.y, t, index=index, **kwargs)
+                self.assertTrue(np.allclose([column[i] for column in output[1:]], reference, rtol=1e-10, atol=1e-12,
+                                            equal_nan=True), msg=(ftype, kwargs, i))
@@ -503,7 +503,9 @@ class TestCase5IntegrationJacobian(FitTestCase):
         val = self.model.parameters.value
         err = self.model.parameters.stderr
         valr = [2.4272, 1.2912, 0.4928]
-        errr = [0.4345, 0.3796, 0.0921]
+        #-- same best fit as minimize, hence the same errors: the jacobian is now
+        #   given to lmfit w.r.t. its internal (bounded) variables
+        errr = [0.0665, 0.0772, 0.0297]
         
         print self.model.param2str(accuracy=4, output='result')
         
@@ -103,6 +103,8 @@ we plot the LSD profile when taking binarity into account.
 import pylab as pl
 import numpy as np
 import numpy.linalg as la
+import scipy.linalg
+from scipy import sparse
 from ivs.sigproc import evaluate
 import itertools
 
@@ -119,10 +121,14 @@ def lsd(velos,V,S,rvs,masks,Lambda=0.):
     
     See Donati, 1997 for the original paper and Kochukhov, 2010 for extensions.
     
+    All observations are deconvolved with the same factorisation of the
+    normal equations. If you have more observations than fit in memory at once,
+    use L{lsd_operator} and feed them in chunks.
+    
     @parameter velos: velocity vector of observations
     @type velos: array of length N_spec
     @parameter V: observation array
-    @type V: N_obs x N_spec array
+    @type V: N_spec x N_obs array
     @parameter S: weights of individual pixels
     @type S: array of length N_spec
     @parameter rvs: radial velocity vector to compute the profile on
@@ -134,61 +140,133 @@ def lsd(velos,V,S,rvs,masks,Lambda=0.):
     @return: LSD profile, CCF of shape (N_obs x (N_rv.N_mask))
     @rtype: 2D array, 2D array
     """
+    return lsd_operator(velos,S,rvs,masks,Lambda=Lambda)(V)
+
+def lsd_operator(velos,S,rvs,masks,Lambda=0.):
+    """
+    Set up the LSD of observations with a common velocity grid and weights.
+    
+    The line mask matrix and the factorisation of the normal equations only
+    depend on the velocities, weights, masks and regularization, not on the
+    observations. This function computes them once, and returns a function
+    that deconvolves observations with them:
+    
+    >>> velos,V,S,masks = __generate_test_spectra(4,binary=True,noise=0.01)
+    >>> rvs = np.linspace(-10,10,100)
+    >>> deconvolve = lsd_operator(velos,S,rvs,masks,Lambda=0.1)
+    >>> Z,cc = deconvolve(V[:,:2])
+    >>> Z,cc = deconvolve(V[:,2:])
+    
+    The normal equations are solved via a Cholesky factorisation. If they are
+    singular (e.g. when some velocity bins are not covered by the spectrum),
+    the least-squares solution via the pseudo-inverse is used instead.
+    
+    @parameter velos: velocity vector of observations
+    @type velos: array of length N_spec
+    @parameter S: weights of individual pixels
+    @type S: array of length N_spec
+    @parameter rvs: radial velocity vector to compute the profile on
+    @type rvs: array of length N_rv
+    @parameter masks: list of tuples (center velocities, weights)
+    @type masks: list (length N_mask) of tuples of 1D arrays
+    @parameter Lambda: Tikhonov regularization parameter
+    @type Lambda: float
+    @return: function that takes an observation array (N_spec x N_obs) and
+    returns the LSD profiles and CCFs (see L{lsd})
+    @rtype: callable
+    """
     #-- some global parameters
     m,n = len(rvs),len(velos)
-    Nspec = V.shape[1]
     Nmask = len(masks)
-    V = np.matrix(V)-1
     
-    #-- weights of the individual pixels
-    S = np.matrix(np.diag(S))
-    #-- line masks (yes, this can be vectorized but I'm too lazy for the moment)
-    M = np.matrix(np.zeros((n,m*len(masks))))
-    for N,(line_centers,weights) in enumerate(masks):
-        for l,lc in enumerate(line_centers):
-            for i in range(n):
-                for j in range(m-1):
-                    vi = velos[i]-lc
-                    if not (rvs[j]<vi<rvs[j+1]): continue
-                    M[i,j+  N*m] = weights[l]*(rvs[j+1]-vi)/(rvs[j+1]-rvs[j])
-                    M[i,j+1+N*m] = weights[l]*(vi    -rvs[j])/(rvs[j+1]-rvs[j])
-    M = np.matrix(M)
+    #-- line masks and weights of the individual pixels
+    M = lsd_matrix(velos,rvs,masks)
+    X = (M.T*sparse.diags(np.asarray(S,float).ravel()**2,0)).tocsr()
+    #-- compute the normal equations, these are only of shape (m.Nmask x m.Nmask)
+    XM = (X*M).toarray()
     #-- regularization parameter
     if Lambda:
-        R = np.matrix(np.zeros((m*Nmask,m*Nmask)))
-        for i in range(1,m-1):
-            R[i,i] = 2
-            R[i-1,i] = -1
-            R[i+1,i] = -1
+        R = np.diag(2*np.ones(m)) - np.diag(np.ones(m-1),1) - np.diag(np.ones(m-1),-1)
         R[0,0] = 1
-        R[1,0] = -1
         R[-1,-1] = 1
-        R[-2,-1] = -1
-    #-- compute the LSD    
-    X = M.T*(S**2)
-    XM = X*M
-    if Lambda:
-        XM = XM+Lambda*R
-    cc = X*V # this is in fact the cross correlation profile
-    #-- XM is of shape (mxm), cc is of shape (mxNspec)
-    #-- we can solve this system quickly ourselves or call numpy. I find the
-    #   latter more elegant, but it might be slower.
-    #Z = la.inv(XM)*cc
-    Z,res,rank,s = la.lstsq(XM,cc)
-    #-- retrieve LSD profile and cross-correlation function
-    Z = np.array(Z.T)
-    cc = np.array(cc.T)
-    #-- split up the profiles
-    Z_ = []
-    C_ = []
-    for i in range(len(Z)):
-        Z_.append([])
-        C_.append([])
-        for N in range(Nmask):
-            Z_[-1].append(Z[i][N*m:(N+1)*m])
-            C_[-1].append(cc[i][N*m:(N+1)*m])
-    #-- that's it!
-    return Z_,C_
+        XM = XM + Lambda*np.kron(np.eye(Nmask),R)
+    try:
+        factor = scipy.linalg.cho_factor(XM)
+        solve = lambda cc: scipy.linalg.cho_solve(factor,cc)
+    except la.LinAlgError:
+        XMinv = la.pinv(XM)
+        solve = lambda cc: np.dot(XMinv,cc)
+    
+    def deconvolve(V):
+        V = np.asarray(V,float)
+        if V.ndim==1:
+            V = V.reshape((-1,1))
+        cc = X*(V-1) # this is in fact the cross correlation profile
+        #-- cc is of shape (m.Nmask x Nobs)
+        Z = solve(cc)
+        #-- retrieve LSD profile and cross-correlation function
+        Z = Z.T
+        cc = cc.T
+        #-- split up the profiles
+        Z_ = [[Z[i][N*m:(N+1)*m] for N in range(Nmask)] for i in range(len(Z))]
+        C_ = [[cc[i][N*m:(N+1)*m] for N in range(Nmask)] for i in range(len(cc))]
+        #-- that's it!
+        return Z_,C_
+    
+    return deconvolve
+
+def lsd_matrix(velos,rvs,masks):
+    """
+    Construct the line mask matrix.
+    
+    Element (i,j+N.N_rv) is the contribution of velocity bin j of the profile
+    of mask N to pixel i of the spectrum, summed over all lines in the mask.
+    Every line contributes to at most two velocity bins per pixel (linear
+    interpolation), so the matrix is sparse.
+    
+    @parameter velos: velocity vector of observations
+    @type velos: array of length N_spec
+    @parameter rvs: radial velocity vector to compute the profile on (sorted)
+    @type rvs: array of length N_rv
+    @parameter masks: list of tuples (center velocities, weights)
+    @type masks: list (length N_mask) of tuples of 1D arrays
+    @return: line mask matrix
+    @rtype: sparse matrix of shape (N_spec x (N_rv.N_mask))
+    """
+    velos = np.asarray(velos,float).ravel()
+    rvs = np.asarray(rvs,float)
+    m,n = len(rvs),len(velos)
+    sort = np.argsort(velos)
+    sorted_velos = velos[sort]
+    rows,cols,data = [],[],[]
+    for N,(line_centers,weights) in enumerate(masks):
+        line_centers = np.asarray(line_centers,float)
+        weights = np.asarray(weights,float)
+        #-- pixels within the velocity range of each line
+        start = sorted_velos.searchsorted(line_centers+rvs[0],'left')
+        end = sorted_velos.searchsorted(line_centers+rvs[-1],'right')
+        counts = np.maximum(end-start,0)
+        if not counts.sum(): continue
+        lines = np.repeat(np.arange(len(line_centers)),counts)
+        offset = np.cumsum(counts)-counts
+        pixels = np.arange(counts.sum()) - np.repeat(offset,counts) + np.repeat(start,counts)
+        #-- velocity bin of each pixel: rvs[j] < vi < rvs[j+1]
+        vi = sorted_velos[pixels]-line_centers[lines]
+        j = rvs.searchsorted(vi,'left')-1
+        keep = (j>=0) & (j<m-1)
+        j,vi,lines,pixels = j[keep],vi[keep],lines[keep],pixels[keep]
+        keep = vi<rvs[j+1]
+        j,vi,lines,pixels = j[keep],vi[keep],lines[keep],pixels[keep]
+        drv = rvs[j+1]-rvs[j]
+        rows += [sort[pixels],sort[pixels]]
+        cols += [j+N*m,j+1+N*m]
+        data += [weights[lines]*(rvs[j+1]-vi)/drv,weights[lines]*(vi-rvs[j])/drv]
+    if not rows:
+        return sparse.csr_matrix((n,m*len(masks)))
+    M = sparse.coo_matrix((np.hstack(data),(np.hstack(rows),np.hstack(cols))),
+                          shape=(n,m*len(masks)))
+    #-- contributions of overlapping lines are summed
+    return M.tocsr()
 
 def __generate_test_spectra(Nspec,binary=False,noise=0.01):
     spec_length = 1000 # n
@@ -0,0 +1,72 @@
+"""
+Unit tests for the least-squares deconvolution (spectra.lsd).
+"""
+import numpy as np
+from ivs.spectra import lsd
+
+import unittest
+
+
+class LSDTestCase(unittest.TestCase):
+    
+    def setUp(self):
+        np.random.seed(1111)
+        self.velos, V, S, self.masks = lsd.__dict__['__generate_test_spectra'](3, binary=True, noise=0.01)
+        self.S = np.random.uniform(0.5, 1.5, len(self.velos))
+        self.rvs = np.linspace(-10, 10, 50)
+        #-- spectra that are exactly a combination of the line masks
+        self.M = lsd.lsd_matrix(self.velos, self.rvs, self.masks).toarray()
+        self.Z = np.random.uniform(0, 1, size=(100, 3))
+        self.V = 1 + np.dot(self.M, self.Z)
+    
+    def testMatrix(self):
+        """ spectra.lsd.lsd_matrix() """
+        velos = np.array([0.25, 1.5, 2.0, 5.0])
+        rvs = np.array([-1., 0., 1., 2.])
+        masks = [([1.0], [0.5]), ([0.0], [1.0])]
+        M = [[0.375, 0.125, 0.00, 0.0, 0.0, 0.75, 0.25, 0.0],
+             [0.000, 0.250, 0.25, 0.0, 0.0, 0.00, 0.50, 0.5],
+             [0.000, 0.000, 0.00, 0.0, 0.0, 0.00, 0.00, 0.0],
+             [0.000, 0.000, 0.00, 0.0, 0.0, 0.00, 0.00, 0.0]]
+        self.assertTrue(np.allclose(lsd.lsd_matrix(velos, rvs, masks).toarray(), M, rtol=0, atol=1e-14))
+        #-- the order of the pixels does not matter, overlapping lines are summed
+        order = np.random.permutation(len(self.velos))
+        M_ = lsd.lsd_matrix(self.velos[order], self.rvs, self.masks).toarray()
+        self.assertTrue(np.allclose(M_, self.M[order], rtol=0, atol=1e-14))
+        M_ = lsd.lsd_matrix(velos, rvs, [([1.0, 1.0], [0.2, 0.3])]).toarray()
+        self.assertTrue(np.allclose(M_, np.array(M)[:, :4], rtol=0, atol=1e-14))
+    
+    def testLSD(self):
+        """ spectra.lsd.lsd() """
+        Z, cc = lsd.lsd(self.velos, self.V, self.S, self.rvs, self.masks)
+        for i in range(3):
+            for N in range(2):
+                self.assertTrue(np.allclose(Z[i][N], self.Z[N*50:(N+1)*50, i], rtol=0, atol=1e-10))
+        self.assertTrue(np.allclose(np.hstack(cc[1]), np.dot(self.M.T*self.S**2, self.V[:, 1]-1)))
+        #-- the regularized profiles solve the regularized normal equations
+        R = 2*np.eye(50) - np.eye(50, k=1) - np.eye(50, k=-1)
+        R[0, 0] = R[-1, -1] = 1
+        Z, cc = lsd.lsd(self.velos, self.V, self.S, self.rvs, self.masks, Lambda=0.5)
+        XM = np.dot(self.M.T*self.S**2, self.M) + 0.5*np.kron(np.eye(2), R)
+        for i in range(3):
+            self.assertTrue(np.allclose(np.dot(XM, np.hstack(Z[i])), np.hstack(cc[i]), rtol=0, atol=1e-10))
+    
+    def testOperator(self):
+        """ spectra.lsd.lsd_operator() """
+        Z, cc = lsd.lsd(self.velos, self.V, self.S, self.rvs, self.masks, Lambda=0.1)
+        deconvolve = lsd.lsd_operator(self.velos, self.S, self.rvs, self.masks, Lambda=0.1)
+        Z_, cc_ = deconvolve(np.asarray(self.V)[:, 2])
+        self.assertEqual(len(Z_), 1)
+        self.assertTrue(np.allclose(Z_[0][1], Z[2][1]))
+        self.assertTrue(np.allclose(cc_[0][0], cc[2][0]))
+    
+    def testSingular(self):
+        """ spectra.lsd.lsd() with velocity bins outside the spectrum """
+        rvs = np.linspace(-40, 40, 50)
+        masks = [(np.array([-2.]), np.array([1.]))]
+        M = lsd.lsd_matrix(self.velos, rvs, masks).toarray()
+        covered = M.any(axis=0)
+        self.assertFalse(covered.all())
+        Z = np.where(covered, np.random.uniform(0, 1, 50), 0.)
+        Z_, cc_ = lsd.lsd(self.velos, 1+np.dot(M, Z), self.S, rvs, masks)
+        self.assertTrue(np.allclose(Z_[0][0], Z, rtol=0, atol=1e-8))
@@ -148,8 +148,11 @@ import sys
 import copy
 from math import sqrt,log,pi
 from itertools import combinations
+from multiprocessing import Pool, cpu_count
 import numpy as np
 import scipy as sp
+import scipy.linalg
+import scipy.sparse
 import scipy.stats as stats
 
 
@@ -195,8 +198,9 @@ class LinearModel(object):
         @type nameList: list
         @param covMatrix: square array containing the covariance matrix of the
                           observations. Weights, and correlations can hence be
-                          taken into account.
-        @type covMatrix: ndarray
+                          taken into account. For many observations, a banded
+                          covariance matrix is best given as a scipy.sparse matrix.
+        @type covMatrix: ndarray or scipy.sparse matrix
         @param regressorsAreWeighted: False if regressors are not yet weighted, True otherwise
         @type regressorsAreWeighted: boolean
         @return: a LinearModel instance
@@ -226,12 +230,14 @@ class LinearModel(object):
             self._regressorNames = copy.copy(nameList)
 
  
-        # Sanity check of the 'covMatrix'
+        # Sanity check of the 'covMatrix'. Besides a dense ndarray, a scipy.sparse
+        # matrix is accepted, so that banded covariance matrices of many observations
+        # never have to be stored as a full N x N array.
         
-        if covMatrix == None:
+        if covMatrix is None:
             self._covMatrixObserv = None
-        elif not isinstance(covMatrix, np.ndarray):
-            raise TypeError, "Covariance matrix of observations needs to be an ndarray object"
+        elif not isinstance(covMatrix, np.ndarray) and not sp.sparse.issparse(covMatrix):
+            raise TypeError, "Covariance matrix of observations needs to be an ndarray object or a sparse matrix"
         else:
             if len(covMatrix.shape) != 2:
                 raise TypeError, "Covariance matrix not a 2-dimensional array"
@@ -243,20 +249,22 @@ class LinearModel(object):
                 self._covMatrixObserv = covMatrix
 
             
-        # If a covariance matrix is specified, and if not already done, compute the weighted 
-        # design matrix. The weights are determined by the cholesky decomposition of the 
-        # inverse of the covariance matrix. A simple way would be to first invert the covariance 
-        # matrix, cholesky-decompose the result, and then do a matrix multiplication. A faster 
-        # method is to cholesky-decompose the covariance matrix, and then determine the
-        # weighted design matrix by a standard solve.
-        # 'choleskyLower' is the lower triangular matrix of the cholesky decomposition.
-        
-        if (self._covMatrixObserv != None) and (regressorsAreWeighted == False):
-            self._choleskyLower = np.linalg.cholesky(self._covMatrixObserv)
-            for n in range(self._designMatrix.shape[1]):
-                self._designMatrix[:,n] = np.linalg.solve(self._choleskyLower, self._designMatrix[:,n])
+        # If a covariance matrix is specified, compute its cholesky decomposition, and if 
+        # not already done, compute the weighted design matrix. The weights are determined
+        # by the cholesky decomposition of the inverse of the covariance matrix. A simple way
+        # would be to first invert the covariance matrix, cholesky-decompose the result, and
+        # then do a matrix multiplication. A faster method is to cholesky-decompose the
+        # covariance matrix, and then determine the weighted design matrix with one 
+        # triangular solve. A banded covariance matrix has a banded cholesky factor, which 
+        # is stored and solved in banded form. See L{_choleskyDecompose}.
+        
+        if self._covMatrixObserv is not None:
+            self._choleskyLower, self._bandwidth = _choleskyDecompose(self._covMatrixObserv)
+            if regressorsAreWeighted == False:
+                self._designMatrix = self._weigh(self._designMatrix)
         else:
             self._choleskyLower = None
+            self._bandwidth = None
             
         
         
@@ -266,6 +274,7 @@ class LinearModel(object):
         self._standardCovarianceMatrix = None
         self._conditionNumber = None
         self._hatMatrix = None
+        self._leverages = None
         self._traceHatMatrix = None
         self._degreesOfFreedom = None
         self._withIntercept = None
@@ -307,16 +316,13 @@ class LinearModel(object):
         if linearModel.designMatrix().shape[0] != self._nObservations:
             raise ValueError, "Linear model has incompatible design matrix"
 
-        if not np.alltrue(linearModel._covMatrixObserv == self._covMatrixObserv):
+        if not _sameCovariance(linearModel._covMatrixObserv, self._covMatrixObserv):
             raise ValueError, "Linear model has a different covariance matrix"
             
         designMatrix = np.hstack([self._designMatrix, linearModel.designMatrix()])
         regressorNames = self._regressorNames + linearModel.regressorNames()
         
-        if self._covMatrixObserv == None:
-            return LinearModel(designMatrix, regressorNames)
-        else:
-            return LinearModel(designMatrix, regressorNames, self._covMatrixObserv, regressorsAreWeighted = True)
+        return self._sameWeights(LinearModel(designMatrix, regressorNames))
         
         
 
@@ -409,6 +415,67 @@ class LinearModel(object):
                 self._invSingularValues[n] = 1.0 / self._w[n]
 
 
+
+
+
+
+    def _weigh(self, array):
+    
+        """
+        Weighs (decorrelates) an array of observations, or the columns of a design matrix
+        
+        Private class method, not to be used by the user.
+        
+        With C{C = L * L^t} the cholesky decomposition of the covariance matrix of the 
+        observations, the weighted array is C{L^{-1} * array}. It is computed with one
+        (banded) triangular solve for all columns at once.
+        
+        @param array: M-dimensional vector or M x N matrix, with M the number of observations
+        @type array: ndarray
+        @return: the weighted array
+        @rtype: ndarray
+        
+        """
+        
+        if self._bandwidth is None:
+            return sp.linalg.solve_triangular(self._choleskyLower, array, lower=True)
+        elif self._bandwidth == 0:
+            return array / self._choleskyLower[0].reshape((-1,) + (1,)*(array.ndim-1))
+        else:
+            return sp.linalg.solve_banded((self._bandwidth, 0), self._choleskyLower, array)
+    
+    
+    
+    
+    
+    
+    def _unweigh(self, array):
+    
+        """
+        Inverse operation of L{_weigh}: returns C{L * array}
+        
+        Private class method, not to be used by the user.
+        
+        @param array: M-dimensional vector or M x N matrix, with M the number of observations
+        @type array: ndarray
+        @return: the unweighted array
+        @rtype: ndarray
+        
+        """
+        
+        if self._bandwidth is None:
+            return np.dot(self._choleskyLower, array)
+        else:
+            
+            # In lower banded storage L[i+k,i] = choleskyLower[k,i]
+            
+            M = len(array)
+            result = np.zeros(array.shape)
+            for k in range(self._bandwidth+1):
+                result[k:] += self._choleskyLower[k,:M-k].reshape((-1,) + (1,)*(array.ndim-1)) * array[:M-k]
+            return result
+
+
    
 
 
@@ -449,13 +516,8 @@ class LinearModel(object):
         if self._pseudoInverse is not None:
             return self._pseudoInverse
         else:
-            if self._U == None: self._singularValueDecompose()
-            M = self._U.shape[0]      # number of observations
-            N = self._U.shape[1]      # number of regressors
-            temp = np.zeros((N,M))
-            for n in range(N):
-                temp[n] = self._invSingularValues[n] * self._U[:,n]
-            self._pseudoInverse = np.dot(self._V, temp)
+            if self._U is None: self._singularValueDecompose()
+            self._pseudoInverse = np.dot(self._V * self._invSingularValues, self._U.T)
             
             return self._pseudoInverse
 
@@ -503,11 +565,11 @@ class LinearModel(object):
 
         """
         
-        if self._standardCovarianceMatrix != None:
+        if self._standardCovarianceMatrix is not None:
             return self._standardCovarianceMatrix
         else:
-            if self._V == None: self._singularValueDecompose()
-            self._standardCovarianceMatrix = np.dot(self._V, np.dot(np.diag(self._invSingularValues**2), self._V.T))
+            if self._V is None: self._singularValueDecompose()
+            self._standardCovarianceMatrix = np.dot(self._V * self._invSingularValues**2, self._V.T)
             return self._standardCovarianceMatrix
         
 
@@ -544,7 +606,7 @@ class LinearModel(object):
         if self._conditionNumber is not None:
             return self._conditionNumber
         else:
-            if self._w == None: self._singularValueDecompose()
+            if self._w is None: self._singularValueDecompose()
             self._conditionNumber = self._w.max() / self._w.min()
             return self._conditionNumber
         
@@ -580,7 +642,7 @@ class LinearModel(object):
 
         """
         
-        if self._w != None:
+        if self._w is not None:
             return self._w
         else:
             self._singularValueDecompose()
@@ -615,7 +677,8 @@ class LinearModel(object):
         Remarks:
             - as the number of data points may be large, this matrix may
               become so huge that it no longer fits into your computer's
-              memory
+              memory. None of the other methods need it: use L{leverages} 
+              for its diagonal and L{traceHatMatrix} for its trace.
             - for weighted (and/or correlated) observations, the resulting 
               weighted hat matrix does not put a hat on the unweighted 
               observations vector, only on the weighted one.
@@ -645,7 +708,8 @@ class LinearModel(object):
             return self._hatMatrix
         else:
             if self._U is None: self._singularValueDecompose()
-            self._hatMatrix = np.dot(self._U, self._U.T)
+            U = self._U[:, self._invSingularValues != 0.0]
+            self._hatMatrix = np.dot(U, U.T)
             return self._hatMatrix
         
 
@@ -659,6 +723,47 @@ class LinearModel(object):
 
 
 
+    def leverages(self):
+    
+        """
+        Returns the leverages, i.e. the diagonal of the (possibly weighted) hat matrix.
+        
+        With X = U * W * V^t the thin singular value decomposition of the design 
+        matrix, the hat matrix is H = U * U^t, so that its diagonal is the sum of 
+        the squares of each row of U. The MxM hat matrix (M the number of 
+        observations) is never computed.
+        
+        Example:
+        
+        >>> x = linspace(0,10,5)
+        >>> lm = LinearModel([x, x**2], ["x", "x^2"])
+        >>> lm.leverages()
+        array([ 0.        ,  0.29677419,  0.47741935,  0.3483871 ,  0.87741935])
+        
+        @return: The M leverages
+        @rtype: ndarray
+        
+        """
+        
+        if self._leverages is not None:
+            return self._leverages
+        else:
+            if self._U is None: self._singularValueDecompose()
+            U = self._U[:, self._invSingularValues != 0.0]
+            self._leverages = np.einsum('ij,ij->i', U, U)
+            return self._leverages
+        
+
+
+
+
+
+
+
+
+
+
+
     def traceHatMatrix(self):
     
         """
@@ -679,7 +784,7 @@ class LinearModel(object):
         
         >>> x = linspace(0,10,5)
         >>> lm = LinearModel([x, x**2], ["x", "x^2"])
-        >>> lm.hatMatrix()
+        >>> lm.traceHatMatrix()
         1.9999999999999993
 
         @return: The trace of the hat matrix.
@@ -693,10 +798,7 @@ class LinearModel(object):
             if self._hatMatrix is not None:
                 self._traceHatMatrix = self._hatMatrix.trace()
             else:
-                if self._U is None: self._singularValueDecompose()
-                self._traceHatMatrix = 0.0
-                for k in range(self._U.shape[1]):
-                    self._traceHatMatrix += np.sum(np.square(self._U[:,k]))
+                self._traceHatMatrix = np.sum(self.leverages())
             return self._traceHatMatrix
             
         
@@ -1056,17 +1158,101 @@ class LinearModel(object):
         
         """
         
+        for indices in self._submodelIndices(Nmin, Nmax, nested, ranks, simpleFirst):
+            yield self._submodel(indices)
+                
+    
+
+
+
+
+
+
+
+    
+
+    def selectSubmodels(self, observations, Nmin = 1, Nmax = None, nested = True, ranks = None, 
+                        simpleFirst = True, threads = 1):
+    
+        """
+        Computes the goodness-of-fit statistics of all submodels for the given observations.
+        
+        The submodels are the same, and in the same order, as those generated by
+        L{submodels}. Rather than setting up and fitting a new L{LinearModel} for each
+        of them, the design matrix is factorised only once (QR decomposition, with
+        the regressors sorted from low to high rank). The least-squares fit of a
+        submodel is then done on the corresponding columns of the small triangular
+        factor R, with the same singular value cut-off as in L{LinearModel}. For
+        nested submodels the sum of squared residuals follows directly from the
+        factorisation: adding a group of regressors to the model only adds the
+        corresponding columns to the QR decomposition. In either case the cost per
+        submodel does not depend on the number of observations (unless a
+        covariance matrix of the observations was given).
+        
+        Only the sum of squared residuals, the BIC and AIC values and the F-statistic
+        are computed for every submodel. A full L{LinearFit} of the best submodels
+        can be obtained with L{SubmodelSelection.bestFits}.
+        
+        Example:
+        
+        >>> x = linspace(0,10,100)
+        >>> lm = PolynomialModel(x, "x", [0,1,2,3,4])
+        >>> obs = 1.0 + 2.0 * x**2 + normal(0.0, 1.0, 100)
+        >>> selection = lm.selectSubmodels(obs, nested=False)
+        >>> bestFit = selection.bestFits("BIC")[0]
+        
+        @param observations: array with the observations y_i
+        @type observations: ndarray
+        @param Nmin, Nmax, nested, ranks, simpleFirst: see L{submodels}
+        @param threads: number of processes over which the submodels are distributed
+                        (an integer, 'max' or 'safe')
+        @type threads: integer or string
+        @return: the statistics of all submodels
+        @rtype: SubmodelSelection
+        
+        """
+        
+        if len(observations) != self._nObservations:
+            raise ValueError, "Number of observations should be %d != %d" % (self._nObservations, len(observations))
+        
+        return SubmodelSelection(self, observations, list(self._submodelIndices(Nmin, Nmax, nested, ranks, simpleFirst)),
+                                 nested = nested, threads = threads)
+        
+        
+
+
+
+
+
+
+
+
+
+    def _submodelIndices(self, Nmin, Nmax, nested, ranks, simpleFirst):
+    
+        """
+        Generates the indices of the regressors of the submodels
+        
+        Private class method, not to be used by the user. See L{submodels} for the
+        meaning of the parameters.
+        
+        @return: a python generator yielding lists of regressor indices
+        @rtype: generator
+        
+        """
+        
         # If no ranking of the regressors are given, consider the first regressor
         # having the most important, and going down, the last regressor the least 
         # important
         
-        if ranks == None:
+        if ranks is None:
             ranks = np.arange(self._nParameters)
+        ranks = np.asarray(ranks)
             
         # Sort the (unique) ranks from low (most important) to high (least important)    
         
         uniqueRanks = np.unique(ranks)
-        if Nmax == None:
+        if Nmax is None:
             Nmax = len(uniqueRanks)
         
         # nRegressor is a list to be looped over, containing for each submodel the number
@@ -1078,32 +1264,72 @@ class LinearModel(object):
         else:
             nRegressorRange = range(Nmax,Nmin-1,-1)
         
-        # Make a generator yield the submodels
+        # Make a generator yield the indices of the submodels
         
         if nested == True:
             for n in nRegressorRange:
-                nameListSub = []
-                regressorListSub = []
-                indices = [k for m in uniqueRanks[:n] for k in np.where(ranks == m)[0]] 
-                nameListSub += [self._regressorNames[k] for k in indices]
-                regressorListSub += [self._designMatrix[:,k] for k in indices]
-                if self._covMatrixObserv != None:
-                    covMatrixObservSub = self._covMatrixObserv[indices,:][:,indices]
-                    yield LinearModel(regressorListSub, nameListSub, covMatrixObservSub, regressorsAreWeighted=True)
-                else:
-                    yield LinearModel(regressorListSub, nameListSub)
+                yield [k for m in uniqueRanks[:n] for k in np.where(ranks == m)[0]] 
         else:
-            comboList = [combo for comboSize in nRegressorRange for combo in combinations(uniqueRanks, comboSize)]
-            for combo in comboList:
-                indices = [k for n in combo for k in np.where(ranks==n)[0]]
-                nameListSub = [self._regressorNames[k] for k in indices]
-                regressorListSub = [self._designMatrix[:,k] for k in indices]
-                if self._covMatrixObserv != None:
-                    covMatrixObservSub = self._covMatrixObserv[indices,:][:,indices]
-                    yield LinearModel(regressorListSub, nameListSub, covMatrixObservSub, regressorsAreWeighted=True)
-                else:
-                    yield LinearModel(regressorListSub, nameListSub)
+            for comboSize in nRegressorRange:
+                for combo in combinations(uniqueRanks, comboSize):
+                    yield [k for n in combo for k in np.where(ranks==n)[0]]
                 
+
+
+
+
+
+
+
+
+    def _submodel(self, indices):
+    
+        """
+        Returns the submodel with the regressors with the given indices
+        
+        Private class method, not to be used by the user.
+        
+        @param indices: indices of the regressors
+        @type indices: list
+        @return: the submodel
+        @rtype: LinearModel
+        
+        """
+        
+        nameListSub = [self._regressorNames[k] for k in indices]
+        regressorListSub = [self._designMatrix[:,k] for k in indices]
+        return self._sameWeights(LinearModel(regressorListSub, nameListSub))
+    
+
+
+
+
+
+
+    def _sameWeights(self, linearModel):
+    
+        """
+        Gives a linear model with an already weighted design matrix the covariance 
+        matrix of the observations of the current model
+        
+        Private class method, not to be used by the user.
+        
+        The cholesky decomposition of the covariance matrix is shared rather than 
+        recomputed, which matters for the many submodels of a model with a large
+        covariance matrix.
+        
+        @param linearModel: a LinearModel without covariance matrix, whose design 
+                            matrix is weighted with the covariance matrix of self
+        @type linearModel: LinearModel
+        @return: linearModel, with the covariance matrix of self
+        @rtype: LinearModel
+        
+        """
+        
+        linearModel._covMatrixObserv = self._covMatrixObserv
+        linearModel._choleskyLower = self._choleskyLower
+        linearModel._bandwidth = self._bandwidth
+        return linearModel
     
 
 
@@ -1130,10 +1356,12 @@ class LinearModel(object):
         
         """
         
-        if self._covMatrixObserv != None:
-            return LinearModel(self._designMatrix.copy(), copy.copy(self._regressorNames), self._covMatrixObserv.copy())
-        else:
-            return LinearModel(self._designMatrix.copy(), copy.copy(self._regressorNames))
+        linearModel = LinearModel(self._designMatrix.copy(), copy.copy(self._regressorNames))
+        if self._covMatrixObserv is not None:
+            linearModel._covMatrixObserv = self._covMatrixObserv.copy()
+            linearModel._choleskyLower = self._choleskyLower.copy()
+            linearModel._bandwidth = self._bandwidth
+        return linearModel
             
 
         
@@ -1225,7 +1453,7 @@ class PolynomialModel(LinearModel):
         @param covMatrix: square array containing the covariance matrix of the
                           observations. This way, weights and correlations can 
                           be taken into account.
-        @type covMatrix: ndarray
+        @type covMatrix: ndarray or scipy.sparse matrix
         @return: an instance of PolynomialModel, subclass of LinearModel
         @rtype: PolynomialModel
                
@@ -1316,7 +1544,7 @@ class HarmonicModel(LinearModel):
         @param covMatrix: square array containing the covariance matrix of the
                           observations. Weights, and correlations can hence be
                           taken into account.
-        @type covMatrix: ndarray
+        @type covMatrix: ndarray or scipy.sparse matrix
         @return: an instance of HarmonicModel, subclass of LinearModel
         @rtype: HarmonicModel
              
@@ -1425,8 +1653,8 @@ class LinearFit(object):
         # If a covariance of the observations was specified, weight the observations.
         
         self._originalObservations = observations
-        if linearModel._covMatrixObserv != None:
-            self._weightedObservations = np.linalg.solve(linearModel._choleskyLower, observations)
+        if linearModel._covMatrixObserv is not None:
+            self._weightedObservations = linearModel._weigh(observations)
         else:
             self._weightedObservations = observations
         
@@ -1706,17 +1934,14 @@ class LinearFit(object):
             if self._weightedPredictions is not None:
                 return self._weightedPredictions
             else:
-                if self._linearModel._covMatrixObserv != None:
-                    self._weightedPredictions = np.dot(self._linearModel._choleskyLower, np.dot(self._linearModel.designMatrix(), self.regressionCoefficients()))
-                else:
-                    self._weightedPredictions = np.dot(self._linearModel.designMatrix(), self.regressionCoefficients())
+                self._weightedPredictions = np.dot(self._linearModel.designMatrix(), self.regressionCoefficients())
                 return self._weightedPredictions
         else:
             if self._predictions is not None:
                 return self._predictions
             else:
-                if self._linearModel._covMatrixObserv != None:
-                    self._predictions = np.dot(self._linearModel._choleskyLower, np.dot(self._linearModel.designMatrix(), self.regressionCoefficients()))
+                if self._linearModel._covMatrixObserv is not None:
+                    self._predictions = self._linearModel._unweigh(np.dot(self._linearModel.designMatrix(), self.regressionCoefficients()))
                 else:
                     self._predictions = np.dot(self._linearModel.designMatrix(), self.regressionCoefficients())
                 return self._predictions
@@ -2081,4 +2306,445 @@ class LinearFit(object):
         
         
 
-__all__ = [LinearModel, PolynomialModel, HarmonicModel, LinearFit]
+class SubmodelSelection(object):
+
+    """
+    A class that holds the goodness-of-fit statistics of a set of submodels of
+    a linear model, fitted to the same observations.
+    
+    Instances are created with L{LinearModel.selectSubmodels}. Only the sum of
+    squared residuals, the BIC and AIC values, and the F-statistic are computed
+    for each submodel, which is much faster than creating a L{LinearFit} for each
+    of them. The latter can be done for the best submodels with L{bestFits}.
+    """
+    
+    
+    def __init__(self, linearModel, observations, submodelIndices, nested = False, threads = 1):
+    
+        """
+        Initialises the SubmodelSelection instance
+        
+        @param linearModel: the parent LinearModel instance
+        @type linearModel: LinearModel
+        @param observations: the observations
+        @type observations: ndarray
+        @param submodelIndices: for each submodel, the list of indices of its regressors
+        @type submodelIndices: list
+        @param nested: True if each submodel contains the regressors of the previous one
+                       (or of the next one), in the same order.
+        @type nested: boolean
+        @param threads: number of processes (an integer, 'max' or 'safe')
+        @type threads: integer or string
+        @return: a SubmodelSelection instance
+        @rtype: SubmodelSelection
+        
+        """
+        
+        self._linearModel = linearModel
+        self._observations = observations
+        self._submodelIndices = submodelIndices
+        nObservations = linearModel.nObservations()
+        designMatrix = linearModel.designMatrix()
+        
+        
+        # With a covariance matrix of the observations, the fit is done on the
+        # weighted observations, but the statistics use the original (unweighted)
+        # observations and design matrix.
+        
+        if linearModel._choleskyLower is not None:
+            weightedObservations = linearModel._weigh(observations)
+            unweightedDesignMatrix = linearModel._unweigh(designMatrix)
+        else:
+            weightedObservations = observations
+            unweightedDesignMatrix = None
+        
+        
+        # Factorise the design matrix once. The regressors are ordered as in the
+        # largest submodel, so that nested submodels correspond to the first columns
+        # of the factorisation.
+        
+        largest = max(submodelIndices, key=len) if submodelIndices else []
+        order = list(largest) + [k for k in range(designMatrix.shape[1]) if k not in largest]
+        position = np.empty(len(order), int)
+        position[order] = np.arange(len(order))
+        Q, R = np.linalg.qr(designMatrix[:,order])
+        QtObservations = np.dot(Q.T, weightedObservations)
+        rss0 = np.sum(np.square(weightedObservations - np.dot(Q, QtObservations)))
+        
+        
+        # If no singular value of the full design matrix is below the cut-off, the
+        # same holds for every submodel, and their least-squares solutions are the
+        # projections on the column spaces.
+        
+        w = np.linalg.svd(R, compute_uv=False)
+        wellConditioned = w.min() > linearModel._svdTOL * w.max()
+        nested = nested and wellConditioned and unweightedDesignMatrix is None
+        
+        
+        # Compute the sums of squared residuals, possibly distributed over several processes
+        
+        positions = [position[indices] for indices in submodelIndices]
+        if threads == 'max':
+            threads = cpu_count()
+        elif threads == 'safe':
+            threads = cpu_count()-1
+        threads = max(1, min(int(threads), len(positions)))
+        chunks = [positions[k::threads] for k in range(threads)]
+        args = [(chunk, R, QtObservations, rss0, linearModel._svdTOL, nested, wellConditioned, 
+                 None if unweightedDesignMatrix is None else unweightedDesignMatrix[:,order], observations)
+                for chunk in chunks]
+        if threads == 1:
+            output = map(_submodelSumSqResiduals, args)
+        else:
+            pool = Pool(threads)
+            try:
+                output = pool.map(_submodelSumSqResiduals, args)
+            finally:
+                pool.terminate()
+        self._sumSqResiduals = np.empty(len(positions))
+        ranks = np.empty(len(positions), int)
+        for k in range(threads):
+            self._sumSqResiduals[k::threads], ranks[k::threads] = output[k]
+        
+        
+        # Derive the other statistics in the same way as in LinearFit
+        
+        N = nObservations
+        nParameters = np.array([len(indices) for indices in submodelIndices])
+        nParam = nParameters + 1
+        self._nParameters = nParameters
+        self._BICvalues = N * np.log(self._sumSqResiduals / N) + nParam * log(N)
+        self._AICvalues = N * np.log(self._sumSqResiduals / N) + 2*nParam \
+                          + (2*nParam*(nParam+1)) // np.where(N-nParam-1 == 0, 1, N-nParam-1)
+        self._AICvalues[N-nParam-1 == 0] = np.nan
+        
+        isConstant = np.array([len(np.unique(designMatrix[:,k])) == 1 for k in range(designMatrix.shape[1])])
+        withIntercept = np.array([isConstant[indices].any() for indices in submodelIndices])
+        sampleVariance = np.where(withIntercept, np.sum(np.square(observations - np.mean(observations))),
+                                                 np.sum(np.square(observations)))
+        Rsq = 1.0 - self._sumSqResiduals / sampleVariance
+        df = N - np.minimum(N, ranks)
+        self._Fstatistics = Rsq / (1-Rsq) * df / np.maximum(nParameters-1, 1)
+
+
+
+
+
+    def nSubmodels(self):
+    
+        """
+        Returns the number of submodels
+        
+        @return: number of submodels
+        @rtype: integer
+        
+        """
+        
+        return len(self._submodelIndices)
+
+
+
+
+    def regressorIndices(self):
+    
+        """
+        Returns, for each submodel, the indices of its regressors in the parent model
+        
+        @return: list of lists of indices
+        @rtype: list
+        
+        """
+        
+        return self._submodelIndices
+
+
+
+
+    def nParameters(self):
+    
+        """
+        Returns the number of regressors of each submodel
+        
+        @return: number of regressors
+        @rtype: ndarray
+        
+        """
+        
+        return self._nParameters
+
+
+
+
+    def sumSqResiduals(self):
+    
+        """
+        Returns the sum of the squared (unweighted) residuals of each submodel
+        
+        @return: the sums of the squared residuals
+        @rtype: ndarray
+        
+        """
+        
+        return self._sumSqResiduals
+
+
+
+
+    def BICvalues(self):
+    
+        """
+        Returns the Bayesian Information Criterion value of each submodel.
+        See L{LinearFit.BICvalue}.
+        
+        @return: BIC values
+        @rtype: ndarray
+        
+        """
+        
+        return self._BICvalues
+
+
+
+
+    def AICvalues(self):
+    
+        """
+        Returns the 2nd order Akaike Information Criterion value of each submodel.
+        See L{LinearFit.AICvalue}.
+        
+        @return: AIC values
+        @rtype: ndarray
+        
+        """
+        
+        return self._AICvalues
+
+
+
+
+    def Fstatistics(self):
+    
+        """
+        Returns the (unweighted) F-statistic of each submodel. See L{LinearFit.Fstatistic}.
+        
+        @return: F-statistics
+        @rtype: ndarray
+        
+        """
+        
+        return self._Fstatistics
+
+
+
+
+    def submodel(self, index):
+    
+        """
+        Returns one of the submodels
+        
+        @param index: index of the submodel
+        @type index: integer
+        @return: the submodel
+        @rtype: LinearModel
+        
+        """
+        
+        return self._linearModel._submodel(self._submodelIndices[index])
+
+
+
+
+    def bestFits(self, criterion = "BIC", nBest = 1):
+    
+        """
+        Returns the fits of the best submodels
+        
+        Example:
+        
+        >>> x = linspace(0,10,100)
+        >>> lm = PolynomialModel(x, "x", [0,1,2,3,4])
+        >>> obs = 1.0 + 2.0 * x**2 + normal(0.0, 1.0, 100)
+        >>> fits = lm.selectSubmodels(obs, nested=False).bestFits("AIC", 3)
+        
+        @param criterion: "BIC", "AIC" or "RSS" (lowest is best) or "F" (highest is best)
+        @type criterion: string
+        @param nBest: number of submodels
+        @type nBest: integer
+        @return: the fits of the best submodels, the best one first
+        @rtype: list of LinearFit instances
+        
+        """
+        
+        if criterion == "BIC":
+            values = self._BICvalues
+        elif criterion == "AIC":
+            values = self._AICvalues
+        elif criterion == "RSS":
+            values = self._sumSqResiduals
+        elif criterion == "F":
+            values = -self._Fstatistics
+        else:
+            raise ValueError, "Unknown criterion '%s'" % criterion
+        
+        values = np.where(np.isnan(values), np.inf, values)
+        best = np.argsort(values, kind='mergesort')[:nBest]
+        return [self.submodel(k).fitData(self._observations) for k in best]
+        
+        
+        
+        
+
+def _choleskyDecompose(covMatrix):
+
+    """
+    Computes the cholesky decomposition C = L * L^t of the covariance matrix of the 
+    observations.
+    
+    Private function, not to be used by the user. See L{LinearModel}.
+    
+    If the covariance matrix is banded with a lower bandwidth b that is small compared
+    to the number of observations M, its cholesky factor has the same bandwidth, and
+    it is returned in the lower banded storage of scipy.linalg.cholesky_banded, i.e.
+    a (b+1) x M array with L[i+k,i] in element [k,i]. A diagonal covariance matrix
+    thus gives a 1 x M array with the standard deviations. Otherwise the full lower
+    triangular M x M matrix is returned, with bandwidth None.
+    
+    @param covMatrix: the M x M covariance matrix of the observations
+    @type covMatrix: ndarray or scipy.sparse matrix
+    @return: the cholesky factor, and its lower bandwidth (None for a full matrix)
+    @rtype: (ndarray, integer)
+    
+    """
+    
+    M = covMatrix.shape[0]
+    
+    # Determine the lower bandwidth, and collect the diagonals of the lower band
+    
+    if sp.sparse.issparse(covMatrix):
+        covMatrix = sp.sparse.coo_matrix(covMatrix)
+        covMatrix.sum_duplicates()
+        lower = covMatrix.row >= covMatrix.col
+        offsets = covMatrix.row[lower] - covMatrix.col[lower]
+        bandwidth = offsets.max() if len(offsets) else 0
+        if 2 * (bandwidth+1) > M:
+            return np.linalg.cholesky(covMatrix.toarray()), None
+        band = np.zeros((bandwidth+1, M))
+        band[offsets, covMatrix.col[lower]] = covMatrix.data[lower]
+    else:
+        bandwidth = M-1
+        while bandwidth > 0 and not np.any(np.diagonal(covMatrix, -bandwidth)):
+            bandwidth -= 1
+        if 2 * (bandwidth+1) > M:
+            return np.linalg.cholesky(covMatrix), None
+        band = np.zeros((bandwidth+1, M))
+        for k in range(bandwidth+1):
+            band[k,:M-k] = np.diagonal(covMatrix, -k)
+    
+    # Decompose the band
+    
+    if bandwidth == 0:
+        if np.any(band <= 0):
+            raise np.linalg.LinAlgError, "Covariance matrix is not positive definite"
+        return np.sqrt(band), 0
+    else:
+        return sp.linalg.cholesky_banded(band, lower=True), bandwidth
+
+
+
+
+
+
+def _sameCovariance(covMatrix1, covMatrix2):
+
+    """
+    Checks whether two covariance matrices of the observations are equal
+    
+    Private function, not to be used by the user.
+    
+    @param covMatrix1: a covariance matrix, or None
+    @type covMatrix1: ndarray, scipy.sparse matrix or None
+    @param covMatrix2: a covariance matrix, or None
+    @type covMatrix2: ndarray, scipy.sparse matrix or None
+    @return: True if both are None, or if both have the same elements
+    @rtype: boolean
+    
+    """
+    
+    if covMatrix1 is None or covMatrix2 is None:
+        return covMatrix1 is None and covMatrix2 is None
+    elif covMatrix1.shape != covMatrix2.shape:
+        return False
+    elif sp.sparse.issparse(covMatrix1) or sp.sparse.issparse(covMatrix2):
+        return (sp.sparse.csr_matrix(covMatrix1) != sp.sparse.csr_matrix(covMatrix2)).nnz == 0
+    else:
+        return np.alltrue(covMatrix1 == covMatrix2)
+
+
+
+
+
+
+def _submodelSumSqResiduals(args):
+
+    """
+    Computes the sum of squared residuals of a list of submodels, given the
+    QR decomposition of the (weighted) design matrix of the parent model.
+    
+    Private function, not to be used by the user. See L{SubmodelSelection}.
+    
+    @param args: the positions of the regressors of each submodel in the
+                 factorisation, R, Q^t y, the sum of squared residuals of the parent
+                 model, the tolerance on the singular values, whether the submodels
+                 are nested, whether the parent model is well-conditioned, the
+                 unweighted design matrix (or None) and the observations.
+    @type args: tuple
+    @return: the sums of squared residuals, and the ranks of the design matrices
+    @rtype: (ndarray, ndarray)
+    
+    """
+    
+    positions, R, QtObservations, rss0, svdTOL, nested, wellConditioned, unweightedDesignMatrix, observations = args
+    sumSqResiduals = np.empty(len(positions))
+    ranks = np.array([len(position) for position in positions], int)
+    
+    # Nested submodels: the residuals of the first m columns of the QR decomposition
+    # are the residuals of the parent model plus the components along columns m+1...
+    
+    if nested:
+        tail = np.cumsum(np.square(QtObservations)[::-1])[::-1]
+        tail = np.hstack([tail, 0.0])
+        for n, position in enumerate(positions):
+            sumSqResiduals[n] = rss0 + tail[len(position)]
+        return sumSqResiduals, ranks
+    
+    # Other submodels: solve the normal equations with the Cholesky decomposition
+    # of the sub-block of the Gram matrix R^t R, or, if the parent model is (nearly)
+    # singular, use the singular value decomposition of the columns of R as in
+    # LinearModel.
+    
+    for n, position in enumerate(positions):
+        Rsub = R[:,position]
+        solved = False
+        if wellConditioned:
+            try:
+                choleskyFactor = sp.linalg.cho_factor(np.dot(Rsub.T, Rsub))
+                coefficients = sp.linalg.cho_solve(choleskyFactor, np.dot(Rsub.T, QtObservations))
+                solved = True
+            except np.linalg.LinAlgError:
+                pass
+        if not solved:
+            U, w, Vt = np.linalg.svd(Rsub, full_matrices=0)
+            invSingularValues = np.where(w > svdTOL * w.max(), 1.0 / np.where(w > 0, w, 1.0), 0.0)
+            ranks[n] = np.sum(invSingularValues != 0.0)
+            coefficients = np.dot(Vt.T, invSingularValues * np.dot(U.T, QtObservations))
+        if unweightedDesignMatrix is None:
+            sumSqResiduals[n] = rss0 + np.sum(np.square(QtObservations - np.dot(Rsub, coefficients)))
+        else:
+            sumSqResiduals[n] = np.sum(np.square(observations - np.dot(unweightedDesignMatrix[:,position], coefficients)))
+    
+    return sumSqResiduals, ranks
+
+
+
+
+__all__ = [LinearModel, PolynomialModel, HarmonicModel, LinearFit, SubmodelSelection]
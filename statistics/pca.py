@@ -3,8 +3,9 @@
 """
 Principal component analysis
 """
+import numpy as np
 from numpy import abs, array, average, corrcoef, mat, shape, std, sum, transpose, zeros
-from numpy.linalg import svd
+from numpy.linalg import svd, qr
 
      
 __author__ = "Henning Risvik"
@@ -22,13 +23,7 @@ def mean_center(X):
     @return: Mean centered X (always has same dimensions as X)
     
     """
-    (rows, cols) = shape(X)
-    new_X = zeros((rows, cols), float)
-    _averages = average(X, 0)
-        
-    for row in range(rows):
-        new_X[row, 0:cols] = X[row, 0:cols] - _averages[0:cols]
-    return new_X
+    return X - average(X, 0)
         
         
 def standardization(X):        
@@ -41,16 +36,12 @@ def standardization(X):
     @return: Standardized X (always has same dimensions as X)
     
     """
-    (rows, cols) = shape(X)
-    new_X = zeros((rows, cols))
     _STDs = std(X, 0)
         
     for value in _STDs:
         if value == 0: raise ZeroDivisionError, 'division by zero, cannot proceed'
         
-    for row in range(rows):
-        new_X[row, 0:cols] = X[row, 0:cols] / _STDs[0:cols]
-    return new_X        
+    return X / _STDs
 
 #}
        
@@ -508,11 +499,10 @@ def PCA_svd(X, standardize=True):
         
     (rows, cols) = shape(X)
     
-    # Singular Value Decomposition
-    [U, S, V] = svd(X)
-    
-    # adjust if matrix shape does not match:
-    if shape(S)[0] < shape(U)[0]: U = U[:, 0:shape(S)[0]]
+    # Singular Value Decomposition. Only the first min(rows, cols) columns
+    # of U are ever used, so the rows x rows matrix of a tall X is never
+    # computed. A wide X still gets all cols x cols Loadings.
+    [U, S, V] = svd(X, full_matrices=rows<cols)
     
     Scores = U * S # all Scores (T)
     Loadings = V # all Loadings (P)
@@ -526,6 +516,105 @@ def PCA_svd(X, standardize=True):
 
 #}
 
+#{ Principal Component Analysis (using a randomized SVD)
+def PCA_randomized(X, standardize=True, PCs=10, oversampling=10, iterations=2, block_size=None, seed=None):
+    """
+    PCA by randomized SVD and get Scores, Loadings, explained_var of the first PCs
+    
+    The range of X is sampled with C{PCs+oversampling} random vectors, and
+    refined with a number of subspace (power) iterations, after which the SVD
+    of the small projected matrix gives the first PCs (Halko, Martinsson & Tropp
+    2011, SIAM Review 53, 217). This is much faster than a full SVD or NIPALS
+    when only a few components of a tall matrix are needed.
+    
+    X is only accessed through blocks of rows, one pass per step, so that the
+    matrix does not have to fit into memory: X can be a numpy memmap (e.g.
+    C{np.load(fname, mmap_mode='r')}) read in blocks of C{block_size} rows, or
+    a function that returns an iterator over the row blocks, e.g. read from a
+    list of files. Only the mean centered (and standardized) blocks are ever
+    computed, and the Scores (rows x PCs) are the only large output.
+    
+    The output is the same as the first PCs of L{PCA_svd}, up to the signs of
+    the components: the explained variance is relative to the total variance
+    of all components.
+    
+    @param X: 2-dimensional matrix of number data, or a function without
+    arguments returning an iterator over its row blocks
+    @type X: numpy array or callable
+    @param standardize: Wheter X should be standardized or not.
+    @type standardize: bool
+    @param PCs: Number of Principal Components.
+    @type PCs: int
+    @param oversampling: number of extra random vectors
+    @type oversampling: int
+    @param iterations: number of subspace iterations (each takes two passes over X)
+    @type iterations: int
+    @param block_size: number of rows per block if X is an array (None for all)
+    @type block_size: int
+    @param seed: seed of the random generator
+    @type seed: int
+    @return: (Scores, Loadings, explained_var)
+    """
+    if callable(X):
+        row_blocks = X
+    else:
+        if block_size is None:
+            block_size = max(len(X), 1)
+        row_blocks = lambda: (X[i:i+block_size] for i in xrange(0, len(X), block_size))
+    
+    #-- first pass: means and standard deviations of the columns, merging
+    #   the statistics of the blocks (Chan et al. 1979)
+    rows, means, M2 = 0, 0., 0.
+    for block in row_blocks():
+        n = len(block)
+        if n == 0: continue
+        block_means = average(block, 0)
+        delta = block_means - means
+        M2 = M2 + sum((block - block_means)**2, 0) + delta**2*rows*n/float(rows+n)
+        means = means + delta*n/float(rows+n)
+        rows += n
+    cols = len(means)
+    if standardize:
+        scale = np.sqrt(M2/rows)
+        if np.any(scale == 0): raise ZeroDivisionError, 'division by zero, cannot proceed'
+    else:
+        scale = np.ones(cols)
+    total_variance = sum(M2/scale**2)
+    center = lambda block: (block - means) / scale
+    
+    PCs = min(PCs, rows, cols)
+    l = min(PCs + oversampling, rows, cols)
+    
+    #-- range finder: Y = X * Omega, refined with Y = X * X^T * Y
+    Omega = np.random.RandomState(seed).normal(size=(cols, l))
+    Y = np.vstack([np.dot(center(block), Omega) for block in row_blocks()])
+    for i in range(iterations):
+        Y = qr(Y)[0]
+        Z = zeros((cols, l))
+        start = 0
+        for block in row_blocks():
+            Z += np.dot(center(block).T, Y[start:start+len(block)])
+            start += len(block)
+        Z = qr(Z)[0]
+        Y = np.vstack([np.dot(center(block), Z) for block in row_blocks()])
+    Q = qr(Y)[0]
+    
+    #-- SVD of the small projected matrix B = Q^T * X
+    B = zeros((Q.shape[1], cols))
+    start = 0
+    for block in row_blocks():
+        B += np.dot(Q[start:start+len(block)].T, center(block))
+        start += len(block)
+    U, S, V = svd(B, full_matrices=False)
+    
+    Scores = np.dot(Q, U[:, :PCs]) * S[:PCs]
+    Loadings = V[:PCs]
+    explained_var = S[:PCs]**2 / total_variance
+    
+    return Scores, Loadings, explained_var
+
+#}
+
 #{ Correlation Loadings 
 def CorrelationLoadings(X, Scores):
     """
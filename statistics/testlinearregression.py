@@ -5,10 +5,12 @@ Author: Joris De Ridder
 """
 
 
+import resource
 import unittest
 from math import pi, sqrt
 import numpy as np
-from linearregression import LinearModel, PolynomialModel, HarmonicModel, LinearFit
+import scipy.sparse
+from linearregression import LinearModel, PolynomialModel, HarmonicModel, LinearFit, SubmodelSelection
 
 
 
@@ -171,6 +173,14 @@ class LinearModelTestCase(unittest.TestCase):
        self.assertEqual(linearModel.degreesOfFreedom(), expectedDegreesOfFreedom)
 
 
+    def testLeverages(self):
+    
+       linearModel = LinearModel(self.regressorList, self.regressorNames)
+       leverages = linearModel.leverages()
+       self.assertEqual(leverages.shape, (self.nObservations,))
+       self.assertTrue(np.allclose(leverages, np.diag(linearModel.hatMatrix()), rtol=1.0e-10, atol=1.e-12))
+
+
     def testAddLinearModel(self):
     
        linearModel = LinearModel(self.regressorList, self.regressorNames)
@@ -325,6 +335,39 @@ class WeightedLinearModelTestCase(unittest.TestCase):
         self.assertAlmostEqual(linearModel.degreesOfFreedom(), expectedDegreesOfFreedom, places=6)
 
 
+    def testBandedCovarianceMatrix(self):
+    
+        # Diagonal and tridiagonal covariance matrices, given as full or as sparse 
+        # matrices, give the same weighted design matrix and observations as the 
+        # full cholesky decomposition
+        
+        covMatrix = np.diag(0.1 + 0.1 * np.arange(self.nObservations))
+        for i in range(self.nObservations-1):
+            covMatrix[i,i+1] = covMatrix[i+1,i] = 0.3 * sqrt(covMatrix[i,i] * covMatrix[i+1,i+1])
+        observations = 1.0 + 0.3 * self.time + np.sin(self.time)
+        
+        for denseMatrix in [self.covMatrixObserv1, covMatrix]:
+            choleskyLower = np.linalg.cholesky(denseMatrix)
+            for cov in [denseMatrix, scipy.sparse.csr_matrix(denseMatrix)]:
+                linearModel = LinearModel(self.regressorList, self.regressorNames, cov)
+                self.assertTrue(np.allclose(linearModel.designMatrix(), np.linalg.solve(choleskyLower, self.unweightedDesignMatrix), 
+                                            rtol=1.0e-10, atol=1.e-12))
+                linearFit = linearModel.fitData(observations)
+                self.assertTrue(np.allclose(linearFit.observations(weighted=True), np.linalg.solve(choleskyLower, observations)))
+                self.assertTrue(np.allclose(linearFit.predictions(weighted=False), 
+                                            np.dot(choleskyLower, linearFit.predictions(weighted=True))))
+                self.assertTrue(np.allclose(linearFit.residuals(weighted=False) + linearFit.predictions(weighted=False), observations))
+            
+        # Full and sparse covariance matrices can be combined if they are equal
+        
+        self.assertRaises(ValueError, lambda x,y :  x + y,
+                          LinearModel(self.regressorList, self.regressorNames, covMatrix),
+                          LinearModel([self.time**2], ["t^2"], scipy.sparse.csr_matrix(self.covMatrixObserv1)))
+        linearModel = LinearModel(self.regressorList, self.regressorNames, scipy.sparse.csr_matrix(covMatrix)) \
+                      + LinearModel([self.time**2], ["t^2"], covMatrix)
+        self.assertEqual(linearModel.nParameters(), 3)
+
+
     def testAddWeigthedLinearModel(self):
     
         regressorList2 = [self.time**2]
@@ -355,6 +398,50 @@ class WeightedLinearModelTestCase(unittest.TestCase):
 
 
 
+class LargeLinearModelTestCase(unittest.TestCase):
+
+    """
+    Test that a (weighted) linear model of many observations never computes 
+    an N x N matrix. For 10^5 observations such a matrix would need 80 GB.
+    """
+    
+    def setUp(self):
+    
+        self.nObservations = 100000
+        self.time = np.linspace(0.0, 100.0, self.nObservations)
+        self.observations = 2.0 + np.sin(2*pi*0.37*self.time) + 0.1 * np.cos(2*pi*1.3*self.time)
+        variances = 0.01 + 0.01 * np.random.uniform(size=self.nObservations)
+        covariances = 0.3 * np.sqrt(variances[1:] * variances[:-1])
+        self.covMatrix = scipy.sparse.diags([covariances, variances, covariances], [-1, 0, 1])
+
+    
+    def maxMemory(self):
+    
+        # Peak resident memory of the process in MB (ru_maxrss is in kB on Linux)
+        
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+    
+    def testLargeModel(self):
+    
+        memory0 = self.maxMemory()
+        for covMatrix in [None, self.covMatrix]:
+            harmonicModel = HarmonicModel(self.time, "t", [0.37, 1.3], ["f1", "f2"], covMatrix=covMatrix)
+            linearModel = PolynomialModel(self.time, "t", [0], covMatrix=covMatrix) + harmonicModel
+            self.assertAlmostEqual(linearModel.traceHatMatrix(), 5.0, places=6)
+            self.assertEqual(linearModel.degreesOfFreedom(), self.nObservations - 5)
+            self.assertEqual(linearModel.leverages().shape, (self.nObservations,))
+            self.assertTrue(np.all(linearModel.leverages() <= 1.0 + 1.e-12))
+            linearFit = linearModel.fitData(self.observations)
+            self.assertTrue(np.allclose(linearFit.residuals(weighted=True), 0.0, atol=1.e-6))
+            self.assertTrue(np.allclose(linearFit.residuals(weighted=False), 0.0, atol=1.e-6))
+            self.assertTrue(linearFit.residualVariance(weighted=True) < 1.e-12)
+        self.assertTrue(self.maxMemory() - memory0 < 500.0)
+
+
+
+
+
 class PolynomialModelTestCase(unittest.TestCase):
 
     """
@@ -621,6 +708,81 @@ class LinearSubmodelGeneratorTestCase(unittest.TestCase):
 
 
 
+class SubmodelSelectionTestCase(unittest.TestCase):
+
+    """
+    Test the LinearModel.selectSubmodels() method and the SubmodelSelection class
+    """
+
+    def setUp(self):
+    
+       np.random.seed(1111)
+       self.x = np.linspace(0, 10, 200)
+       x = self.x   # local shorter alias
+       self.observations = 1.0 + 2.0 * x**2 + np.sin(2*pi*0.77*x) + np.random.normal(0.0, 1.0, len(x))
+       self.polynomialModel = PolynomialModel(x, "x", [0,1,2,3,4])
+       self.harmonicModel = HarmonicModel(x, "x", [0.31, 0.77, 1.3], ["f1", "f2", "f3"], maxNharmonics=2)
+       self.singularModel = LinearModel([np.ones_like(x), x, 2*x+1, x**2], ["1", "x", "2x+1", "x^2"])
+
+
+    def tearDown(self):
+       pass
+
+
+    def testSubmodels(self):
+    
+       # Nested submodels, all submodels, and a model with a singular design matrix
+       
+       for linearModel, kwargs in [(self.polynomialModel, dict(nested=True)),
+                                   (self.polynomialModel, dict(nested=True, ranks=[1,0,2,4,3], simpleFirst=False)),
+                                   (self.harmonicModel, dict(nested=True, ranks=[0,0,0,0,1,1,1,1,2,2,2,2])),
+                                   (self.polynomialModel, dict(nested=False)),
+                                   (self.harmonicModel, dict(Nmin=2, nested=False, ranks=[0,0,1,1,2,2,3,3,4,4,5,5], threads=2)),
+                                   (self.singularModel, dict(nested=False))]:
+           selection = linearModel.selectSubmodels(self.observations, **kwargs)
+           self.assertTrue(isinstance(selection, SubmodelSelection))
+           kwargs.pop("threads", None)
+           submodels = list(linearModel.submodels(**kwargs))
+           self.assertTrue(selection.nSubmodels() == len(submodels))
+           for n, submodel in enumerate(submodels):
+               linearFit = submodel.fitData(self.observations)
+               self.assertTrue(selection.submodel(n).regressorNames() == submodel.regressorNames())
+               self.assertTrue(np.allclose(selection.sumSqResiduals()[n], linearFit.sumSqResiduals(), rtol=1e-8))
+               self.assertAlmostEqual(selection.BICvalues()[n], linearFit.BICvalue(), places=6)
+               self.assertAlmostEqual(selection.AICvalues()[n], linearFit.AICvalue(), places=6)
+               self.assertTrue(np.allclose(selection.Fstatistics()[n], linearFit.Fstatistic(), rtol=1e-6, atol=1e-8))
+
+
+    def testSingularSubmodel(self):
+    
+       # The hat matrix of a singular design matrix projects on its column space,
+       # and the F-statistic uses the rank of the design matrix
+       
+       self.assertAlmostEqual(self.singularModel.traceHatMatrix(), 3.0, places=10)
+       self.assertEqual(self.singularModel.degreesOfFreedom(), len(self.x) - 3)
+       linearFit = self.singularModel.fitData(self.observations)
+       self.assertTrue(np.allclose(np.dot(self.singularModel.hatMatrix(), self.observations), linearFit.predictions()))
+       selection = self.singularModel.selectSubmodels(self.observations, nested=False)
+       n = list(selection.nParameters()).index(4)
+       Rsq = linearFit.coefficientOfDetermination()
+       self.assertAlmostEqual(selection.Fstatistics()[n], Rsq / (1-Rsq) * (len(self.x) - 3) / 3, places=6)
+
+
+    def testBestFits(self):
+    
+       selection = self.polynomialModel.selectSubmodels(self.observations, nested=False)
+       bestFits = selection.bestFits("BIC", 3)
+       self.assertTrue(len(bestFits) == 3)
+       self.assertTrue(isinstance(bestFits[0], LinearFit))
+       self.assertAlmostEqual(bestFits[0].BICvalue(), selection.BICvalues().min(), places=6)
+       self.assertTrue(bestFits[0].BICvalue() <= bestFits[1].BICvalue() <= bestFits[2].BICvalue())
+       self.assertTrue("x^2" in selection.submodel(np.argmin(selection.BICvalues())).regressorNames())
+       self.assertRaises(ValueError, lambda : selection.bestFits("R^2"))
+
+
+
+
+
 class LinearFitTestCase(unittest.TestCase):
 
     """
@@ -948,15 +1110,19 @@ class WeightedLinearFitTestCase(unittest.TestCase):
 
 
 
-suite = [unittest.TestLoader().loadTestsFromTestCase(LinearModelTestCase)]
-suite += unittest.TestLoader().loadTestsFromTestCase(WeightedLinearModelTestCase)
-suite += unittest.TestLoader().loadTestsFromTestCase(PolynomialModelTestCase)
-suite += unittest.TestLoader().loadTestsFromTestCase(WeightedPolynomialModelTestCase)
-suite += unittest.TestLoader().loadTestsFromTestCase(HarmonicModelTestCase)
-suite += unittest.TestLoader().loadTestsFromTestCase(WeightedHarmonicModelTestCase)
-suite += unittest.TestLoader().loadTestsFromTestCase(LinearSubmodelGeneratorTestCase)
-suite += unittest.TestLoader().loadTestsFromTestCase(LinearFitTestCase)
-suite += unittest.TestLoader().loadTestsFromTestCase(WeightedLinearFitTestCase)
+if __name__ == "__main__":
+
+    suite = [unittest.TestLoader().loadTestsFromTestCase(LinearModelTestCase)]
+    suite += unittest.TestLoader().loadTestsFromTestCase(WeightedLinearModelTestCase)
+    suite += unittest.TestLoader().loadTestsFromTestCase(LargeLinearModelTestCase)
+    suite += unittest.TestLoader().loadTestsFromTestCase(PolynomialModelTestCase)
+    suite += unittest.TestLoader().loadTestsFromTestCase(WeightedPolynomialModelTestCase)
+    suite += unittest.TestLoader().loadTestsFromTestCase(HarmonicModelTestCase)
+    suite += unittest.TestLoader().loadTestsFromTestCase(WeightedHarmonicModelTestCase)
+    suite += unittest.TestLoader().loadTestsFromTestCase(LinearSubmodelGeneratorTestCase)
+    suite += unittest.TestLoader().loadTestsFromTestCase(SubmodelSelectionTestCase)
+    suite += unittest.TestLoader().loadTestsFromTestCase(LinearFitTestCase)
+    suite += unittest.TestLoader().loadTestsFromTestCase(WeightedLinearFitTestCase)
 
-allTests = unittest.TestSuite(suite)
-unittest.TextTestRunner(verbosity=2).run(allTests)
+    allTests = unittest.TestSuite(suite)
+    unittest.TextTestRunner(verbosity=2).run(allTests)
@@ -0,0 +1,72 @@
+"""
+Unit tests for the principal component analysis (statistics.pca).
+"""
+import os
+import tempfile
+import numpy as np
+from ivs.statistics import pca
+
+import unittest
+
+
+class PCATestCase(unittest.TestCase):
+
+    def setUp(self):
+        #-- a few dominant components plus noise and an offset per column
+        np.random.seed(1111)
+        self.X = np.dot(np.random.normal(size=(500, 5)) * np.logspace(1, 0, 5), np.random.normal(size=(5, 40)))
+        self.X += np.random.normal(size=(500, 40), scale=0.1) + np.linspace(0, 5, 40)
+
+    def testSVD(self):
+        """ statistics.pca.PCA_svd() equals the first PCs of NIPALS """
+        Scores, Loadings, explained_var = pca.PCA_svd(self.X)
+        self.assertEqual(Scores.shape, (500, 40))
+        self.assertEqual(Loadings.shape, (40, 40))
+        self.assertAlmostEqual(explained_var.sum(), 1.)
+        #-- components are only defined up to their sign
+        nipals = pca.PCA_nipals2(self.X, PCs=3, threshold=1e-12)
+        self.assertTrue(np.allclose(abs(np.sum(nipals[1]*Loadings[:3], axis=1)), 1., atol=1e-8))
+        self.assertTrue(np.allclose(np.dot(nipals[0], nipals[1]), np.dot(Scores[:, :3], Loadings[:3]), atol=1e-4))
+        self.assertTrue(np.allclose(nipals[2], explained_var[:3], rtol=1e-5))
+
+    def testSVDWide(self):
+        """ statistics.pca.PCA_svd() of a matrix with more columns than rows """
+        Scores, Loadings, explained_var = pca.PCA_svd(self.X[:20])
+        self.assertEqual(Scores.shape, (20, 20))
+        self.assertEqual(Loadings.shape, (40, 40))
+        self.assertTrue(np.allclose(np.dot(Loadings, Loadings.T), np.eye(40), atol=1e-10))
+        X = pca.standardization(pca.mean_center(self.X[:20]))
+        self.assertTrue(np.allclose(np.dot(Scores, Loadings[:20]), X, atol=1e-10))
+
+    def testRandomized(self):
+        """ statistics.pca.PCA_randomized() equals the first PCs of PCA_svd """
+        for standardize in [True, False]:
+            Scores, Loadings, explained_var = pca.PCA_svd(self.X, standardize=standardize)
+            output = pca.PCA_randomized(self.X, standardize=standardize, PCs=5, seed=1)
+            self.assertEqual(output[0].shape, (500, 5))
+            self.assertEqual(output[1].shape, (5, 40))
+            self.assertTrue(np.allclose(abs(np.sum(output[1]*Loadings[:5], axis=1)), 1., atol=1e-8))
+            self.assertTrue(np.allclose(np.dot(output[0], output[1]), np.dot(Scores[:, :5], Loadings[:5]), atol=1e-8))
+            self.assertTrue(np.allclose(output[2], explained_var[:5], rtol=1e-8))
+
+    def testBlocks(self):
+        """ statistics.pca.PCA_randomized() on row blocks of a memmap and from files """
+        reference = pca.PCA_randomized(self.X, PCs=5, seed=1)
+        tmpdir = tempfile.mkdtemp()
+        try:
+            fname = os.path.join(tmpdir, 'X.npy')
+            np.save(fname, self.X)
+            outputs = [pca.PCA_randomized(np.load(fname, mmap_mode='r'), PCs=5, block_size=77, seed=1)]
+            fnames = []
+            for i in range(0, 500, 120):
+                fnames.append(os.path.join(tmpdir, 'X%d.npy' % i))
+                np.save(fnames[-1], self.X[i:i+120])
+            outputs.append(pca.PCA_randomized(lambda: (np.load(fname) for fname in fnames), PCs=5, seed=1))
+        finally:
+            for fname in os.listdir(tmpdir):
+                os.remove(os.path.join(tmpdir, fname))
+            os.rmdir(tmpdir)
+        for Scores, Loadings, explained_var in outputs:
+            self.assertTrue(np.allclose(abs(np.sum(Loadings*reference[1], axis=1)), 1., atol=1e-8))
+            self.assertTrue(np.allclose(np.dot(Scores, Loadings), np.dot(reference[0], reference[1]), atol=1e-8))
+            self.assertTrue(np.allclose(explained_var, reference[2], rtol=1e-8))
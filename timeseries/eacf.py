@@ -63,7 +63,7 @@ __all__ = ['eacf']
 import numpy as np
 from ivs.timeseries.pergrams import DFTpower2
 
-def eacf(freqs, spectrum, spacings, kernelWidth, minFreq=None, maxFreq=None, doSanityCheck=False):
+def eacf(freqs, spectrum, spacings, kernelWidth, minFreq=None, maxFreq=None, doSanityCheck=False, threads=1):
 
     """
     Compute the Envelope Auto-Correlation Function (EACF) of a signal.
@@ -93,6 +93,9 @@ def eacf(freqs, spectrum, spacings, kernelWidth, minFreq=None, maxFreq=None, doS
     @param doSanityCheck: if True: make a few sanity checks of the arguments (e.g. equidistancy of freqs).
                           If False, do nothing.
     @type doSanityCheck: boolean
+    @param threads: number of threads to compute the power spectrum of the smoothed spectrum with
+                    (see L{ivs.timeseries.pergrams.DFTpower2})
+    @type threads: int or str
     @return: autoCorrelation, croppedFreqs, smoothedSpectrum
                 - autoCorrelation:  the EACF evaluated in the values of 'spacings'
                 - croppedFreqs:     the frequencies of the selected part [minFreq, maxFreq]
@@ -147,7 +150,7 @@ def eacf(freqs, spectrum, spacings, kernelWidth, minFreq=None, maxFreq=None, doS
     
     # Compute the power spectrum of the power spectrum
     
-    autoCorrelation = DFTpower2(croppedFreqs, smoothedSpectrum, 1.0/spacings)
+    autoCorrelation = DFTpower2(croppedFreqs, smoothedSpectrum, 1.0/spacings, threads=threads)
     
     # That's it.
     
@@ -150,6 +150,8 @@ or
 Author: Pieter Degroote
 """
 import logging
+import inspect
+import time
 import numpy as np
 import pylab as pl
 from ivs.sigproc import fit
@@ -157,16 +159,24 @@ from ivs.sigproc import evaluate
 from ivs.timeseries import pergrams
 from ivs.timeseries.decorators import defaults_pergram
 from ivs.aux import numpy_ext
+from scipy.linalg import solve_triangular
+from multiprocessing import Process,Queue,cpu_count
 import os
 
 logger = logging.getLogger("TS.FREQANAL")
 
+#-- maximum number of elements (frequencies x wavelength bins) of the
+#   periodogram matrix of one chunk of wavelength bins in spectrum_2D
+spectrum_2D_batch_size = 2**22
+#-- data shared with all processes (see _map_processes)
+_shared = {}
+
 #{ Convenience functions
 
 def find_frequency(times,signal,method='scargle',model='sine',full_output=False,
             optimize=0,max_loops=20, scale_region=0.1, scale_df=0.20, model_kwargs=None,
             correlation_correction=True,prewhiteningorder_snr=False,
-            prewhiteningorder_snr_window=1.,**kwargs):
+            prewhiteningorder_snr_window=1.,pergram=None,**kwargs):
     """
     Find one frequency, automatically going to maximum precision and return
     parameters & error estimates.
@@ -195,6 +205,10 @@ def find_frequency(times,signal,method='scargle',model='sine',full_output=False,
     
     Possible extra keywords: see definition of the used periodogram function.
     
+    If the periodogram on the initial frequency grid is already known (e.g.
+    because it was computed for many signals at once in L{spectrum_2D}), it
+    can be passed as C{pergram=(freqs,ampls)} and is then not recomputed.
+    
     B{Warning}: the timeseries must be B{sorted in time} and B{cannot contain
     the same timepoint twice}. Otherwise, a 'ValueError, concatenation problem'
     can occur.
@@ -253,7 +267,10 @@ def find_frequency(times,signal,method='scargle',model='sine',full_output=False,
             method_ = method[1]
             method = method[0]  # override method to be a string the next time
         #-- calculate periodogram
-        freqs,ampls = getattr(pergrams,method)(times,signal,**method_kwargs)
+        if pergram is not None and counter==0:
+            freqs,ampls = pergram
+        else:
+            freqs,ampls = getattr(pergrams,method)(times,signal,**method_kwargs)
         f0,fn,df = freqs[0],freqs[-1],freqs[1]-freqs[0]
         #-- now use the second method for the zoom-ins from now on
         if freq_diff==np.inf and not isinstance(method,str):
@@ -338,7 +355,8 @@ def find_frequency(times,signal,method='scargle',model='sine',full_output=False,
 
 def iterative_prewhitening(times,signal,maxiter=1000,optimize=0,method='scargle',
     model='sine',full_output=False,stopcrit=None,correlation_correction=True,
-    prewhiteningorder_snr=False,prewhiteningorder_snr_window=1.,**kwargs):
+    prewhiteningorder_snr=False,prewhiteningorder_snr_window=1.,timing=False,
+    **kwargs):
     """
     Fit one or more functions to a timeseries via iterative prewhitening.
     
@@ -366,26 +384,63 @@ def iterative_prewhitening(times,signal,maxiter=1000,optimize=0,method='scargle'
     C{prewhiteningorder_snr_window} wide box. Usage of this is strongly encouraged, 
     especially combined with L{stopcrit_scargle_snr} as C{stopcrit}.
     
+    For the C{sine} model, the fit of all frequencies is not redone from
+    scratch in every step: a L{PrewhiteningState} keeps the factorisation of
+    the design matrix and only adds the columns of the new frequency. If the
+    time points are equidistant, the periodogram of the residuals on the
+    initial frequency grid is also derived from that of the signal (see
+    L{PrewhiteningState.pergram}). The frequencies that are found are the
+    same as with a full fit in every step.
+    
+    Set C{timing=True} to add the time (in seconds) spent in every step as
+    a column C{time} to the parameters.
+    
     @return: parameters, model(, model function)
     @rtype: rec array(, ndarray)
     """
     residuals = signal.copy()
     frequencies = []
     stop_criteria = []
+    durations = []
+    #-- keep the linear fit of the harmonics from step to step
+    if model=='sine':
+        state = PrewhiteningState(times,signal)
+        incremental = state.equidistant and isinstance(method,str) \
+                  and method in ['scargle','deeming'] \
+                  and kwargs.get('weights',None) is None \
+                  and not kwargs.get('single',False) and not 'window' in kwargs
+        if incremental:
+            grid = _frequency_grid(times,signal,**kwargs)
+    else:
+        state = None
+        incremental = False
     while maxiter:
-        #-- compute the next frequency from the residuals
+        c0 = time.time()
+        #-- compute the next frequency from the residuals. The periodogram on
+        #   the initial grid can be updated if the residuals are those of the
+        #   linear fit
+        initial_pergram = None
+        if incremental:
+            initial_pergram = state.pergram(*grid,method=method,
+                                            norm=kwargs.get('norm','amplitude'))
         params,pergram,this_fit = find_frequency(times,residuals,method=method,
                 full_output=True,correlation_correction=correlation_correction,
                 prewhiteningorder_snr=prewhiteningorder_snr,
-                prewhiteningorder_snr_window=prewhiteningorder_snr_window,**kwargs)
+                prewhiteningorder_snr_window=prewhiteningorder_snr_window,
+                pergram=initial_pergram,**kwargs)
+        c1 = time.time()
         
         #-- do the fit including all frequencies
         frequencies.append(params['freq'][-1])
-        allparams = getattr(fit,model)(times,signal,frequencies)
+        if state is not None:
+            allparams = state.add(frequencies[-1])
+        else:
+            allparams = getattr(fit,model)(times,signal,frequencies)
+        linear = True
         
         #-- if there's a need to optimize, optimize the last n parameters
         if optimize>0:
-            residuals_for_optimization = residuals
+            residuals_for_optimization = residuals.copy()
             if optimize<=len(params):
                 model_fixed_params = getattr(evaluate,model)(times,allparams[:-optimize])
                 residuals_for_optimization -= model_fixed_params
@@ -393,11 +448,17 @@ def iterative_prewhitening(times,signal,maxiter=1000,optimize=0,method='scargle'
             #-- only accept the optimization if we gained prediction power
             if gain>0:
                 allparams[-optimize:] = uparams
+                linear = False
                 logger.info('Accepted optimization (gained %g%%)'%gain)
         
         #-- compute the residuals to use in the next prewhitening step
-        modelfunc = getattr(evaluate,model)(times,allparams)
-        residuals = signal - modelfunc
+        if state is not None and linear:
+            modelfunc = state.model()
+            residuals = state.residuals.copy()
+        else:
+            modelfunc = getattr(evaluate,model)(times,allparams)
+            residuals = signal - modelfunc
+        incremental = incremental and linear
         
         #-- exhaust the counter
         maxiter -= 1
@@ -409,9 +470,12 @@ def iterative_prewhitening(times,signal,maxiter=1000,optimize=0,method='scargle'
             condition,value = func(times,signal,modelfunc,allparams,pergram,*args) 
             logger.info('Stop criterion (%s): %.3g'%(func.__name__,value))
             stop_criteria.append(value)
-            if condition:
-                logger.info('Stop criterion reached')
-                break
+        c2 = time.time()
+        durations.append(c2-c0)
+        logger.info('Prewhitening step %d: %.3gs (frequency search %.3gs, fit %.3gs)'%(len(frequencies),c2-c0,c1-c0,c2-c1))
+        if stopcrit is not None and condition:
+            logger.info('Stop criterion reached')
+            break
         
     #-- calculate the errors
     e_allparams = getattr(fit,'e_'+model)(times,signal,allparams,correlation_correction=correlation_correction)
@@ -419,6 +483,8 @@ def iterative_prewhitening(times,signal,maxiter=1000,optimize=0,method='scargle'
     allparams = numpy_ext.recarr_join(allparams,e_allparams)
     if stopcrit is not None:
         allparams = numpy_ext.recarr_join(allparams,np.rec.fromarrays([stop_criteria],names=['stopcrit']))
+    if timing:
+        allparams = numpy_ext.recarr_join(allparams,np.rec.fromarrays([durations],names=['time']))
     
     if full_output:
         return allparams,modelfunc
@@ -429,7 +495,7 @@ def iterative_prewhitening(times,signal,maxiter=1000,optimize=0,method='scargle'
     
     
 def spectrum_2D(x,y,matrix,weights_2d=None,show_progress=False,
-                subs_av=True,full_output=False,**kwargs):
+                subs_av=True,full_output=False,threads=1,**kwargs):
     """
     Compute a 2D periodogram.
     
@@ -456,6 +522,12 @@ def spectrum_2D(x,y,matrix,weights_2d=None,show_progress=False,
     C{f0=frequency} and C{fn=frequency+df} with C{df} the size of the frequency
     step.
     
+    The frequency grid is determined once for all wavelength bins. For the
+    unweighted C{scargle} and C{deeming} periodograms, the periodograms of
+    all bins are computed together as one matrix operation (see
+    L{pergrams.pergram_2D}). The wavelength bins can be distributed over
+    several processes with C{threads} (an integer, 'max' or 'safe').
+    
     B{Example usage}: first we generate some variable line profiles. In this case,
     this is just a radial velocity variation
     
@@ -508,28 +580,41 @@ def spectrum_2D(x,y,matrix,weights_2d=None,show_progress=False,
     else:
         matrix_av = 0.
     
-    #-- prepare output of sine-parameters
-    params = []
-    freq_spectrum = []
-    mymodel = []
-    #-- do frequency analysis
-    for iwave in xrange(len(matrix[0])):
-        signal = matrix[:,iwave]
+    #-- the time points and frequency grid are the same for all wavelength
+    #   bins: fix the grid once, and compute the periodograms of a batch of
+    #   bins at once if the periodogram allows it
+    kwargs['f0'],kwargs['fn'],kwargs['df'] = _frequency_grid(x,x,**kwargs)
+    method = kwargs.get('method','scargle')
+    batch = method in ['scargle','deeming'] and weights_2d is None \
+            and kwargs.get('weights',None) is None \
+            and not kwargs.get('single',False) and not 'window' in kwargs
+    nf = int((kwargs['fn']-kwargs['f0'])/kwargs['df']+0.001)+1
+    
+    #-- divide the wavelength bins in chunks. When the periodograms are
+    #   batched, limit the size of the periodogram matrix of a chunk.
+    threads = _nprocesses(threads)
+    nchunks = batch and int(np.ceil(float(nf)*len(matrix[0])/spectrum_2D_batch_size)) or 1
+    nchunks = min(len(matrix[0]),max(nchunks,threads))
+    chunks = []
+    for columns in np.array_split(np.arange(len(matrix[0])),nchunks):
         if weights_2d is not None:
-            weights = weights_2d[:,iwave]
-            kwargs['weights'] = weights
-                
-        #-- make sure output is always a tuple, in case full output was asked
-        #   we don't want iterative zoom in so set scale_df=0
-        out = find_frequency(x,signal,full_output=full_output,scale_df=0,**kwargs)
-        
-        #-- add the parameters of this wavelength bin to the list
-        if full_output:
-            params.append(out[0])
-            freq_spectrum.append(out[1][1])
-            mymodel.append(out[2])
+            chunks.append((matrix[:,columns],weights_2d[:,columns],batch))
         else:
-            params.append(out)
+            chunks.append((matrix[:,columns],None,batch))
+    
+    #-- do frequency analysis
+    out = _map_processes(_spectrum_2D_chunk,chunks,threads,times=x,
+                         kwargs=dict(kwargs,full_output=full_output))
+    out = [column for chunk in out for column in chunk]
+    
+    #-- collect the parameters of all wavelength bins
+    if full_output:
+        params = [column[0] for column in out]
+        freq_spectrum = [column[1][1] for column in out]
+        mymodel = [column[2] for column in out]
+        out = out[-1]
+    else:
+        params = out
     
     #-- prepare output
     output = {}
@@ -543,7 +628,7 @@ def spectrum_2D(x,y,matrix,weights_2d=None,show_progress=False,
 
 @defaults_pergram
 def time_frequency(times,signal,window_width=None,n_windows=100,
-         window='rectangular',detrend=None,**kwargs):
+         window='rectangular',detrend=None,fit_params=True,threads=1,**kwargs):
     """
     Short Time (Fourier) Transform.
     
@@ -553,6 +638,15 @@ def time_frequency(times,signal,window_width=None,n_windows=100,
     It is best to fix explicitly C{f0}, C{fn} and C{df}, to limit the computation
     time!
     
+    For the (unweighted) C{scargle} and C{deeming} periodograms without
+    detrending, the spectrogram is computed incrementally: the contributions
+    of the points entering and leaving the window are added to and subtracted
+    from the periodogram (see L{pergrams.sliding_pergram}). Otherwise, the
+    windows are distributed over C{threads} processes.
+    
+    If only the spectrogram is needed, set C{fit_params=False} to skip the fit of
+    the parameters in every window.
+    
     Extra kwargs go to L{find_frequency}
     
     @param n_windows: number of slices
@@ -563,7 +657,12 @@ def time_frequency(times,signal,window_width=None,n_windows=100,
     @type detrend: callable
     @param window: window function to apply
     @type window: string
-    @return: spectrogram, times used, parameters, errors, points used per slice
+    @param fit_params: fit the parameters in every window
+    @type fit_params: bool
+    @param threads: number of processes (integer, 'max' or 'safe')
+    @type threads: int or str
+    @return: spectrogram, times used, parameters and errors (if C{fit_params}),
+    points used per slice
     @rtype: dict
     """
     if window_width is None:
@@ -577,44 +676,302 @@ def time_frequency(times,signal,window_width=None,n_windows=100,
     fn = kwargs.pop('fn')
     df = kwargs.pop('df')
     nyq_stat = kwargs.pop('nyq_stat',fn)
-    
-    #-- prepare arrays for parameters, points and spectrum
+    kwargs.update(dict(f0=f0,fn=fn,df=df,nyq_stat=nyq_stat))
+    
+    #-- the times are sorted, so that each slice is a range of indices
+    slices = []
+    for t in stft_times:
+        region = np.nonzero(abs(times-t) <= (window_width/2.))[0]
+        slices.append(len(region) and (region[0],region[-1]+1) or (0,0))
+    pnts = np.array([end-start for start,end in slices],float)
+    
+    #-- the periodogram of a slice can be updated from that of the previous
+    #   slice if it is a plain sum over the time points
+    method = kwargs.get('method','scargle')
+    incremental = method in ['scargle','deeming'] and detrend is None \
+                  and kwargs.get('weights',None) is None \
+                  and not kwargs.get('single',False)
+    if incremental:
+        freqs,spec = pergrams.sliding_pergram(times,signal,stft_times,window_width,
+                         method=method,norm=kwargs.get('norm','amplitude'),
+                         f0=f0,fn=fn,df=df,nyq_stat=nyq_stat)
+    
+    #-- compute the periodogram and/or parameters for each slice
     pars = []
-    pnts = np.zeros(n_windows)
-    spec = None
-    #-- compute the periodogram for each slice
-    for i,t in enumerate(stft_times):
-        region = (abs(times-t) <= (window_width/2.))
-        times_ = times[region]
-        signal_ = signal[region]
-        if detrend:
-            times_,signal_ = detrend(times_,signal_)
-        pnts[i] = len(times_)
-        if len(times_)>1:
-            output = find_frequency(times_,signal_,full_output=True,f0=f0,fn=fn,df=df,nyq_stat=nyq_stat,scale_df=0,**kwargs)
+    if fit_params or not incremental:
+        tasks = []
+        for i,(start,end) in enumerate(slices):
+            if incremental and not np.isnan(spec[i,0]):
+                tasks.append((start,end,(freqs,spec[i])))
+            else:
+                tasks.append((start,end,None))
+        output = _map_processes(_time_frequency_slice,tasks,threads,times=times,
+                     signal=signal,detrend=detrend,fit_params=fit_params,kwargs=kwargs)
+        if not incremental:
+            spec = None
+        for i,out in enumerate(output):
+            if out is None:
+                pars.append(None)
+                if spec is not None:
+                    spec[i] = np.nan
+                continue
+            pars.append(out[0])
             if spec is None:
-                spec = np.ones((n_windows,len(output[1][1])))
-            pars.append(output[0])
-            spec[i,:len(output[1][1])] = output[1][1]
-        else:
-            nanpars = np.rec.array(np.nan*np.ones(len(pars[-1].dtype.names)),dtype=pars[-1].dtype)
-            pars.append(nanpars)
-            #try:
-            #    pars.append(np.nan*pars[-1])
-            #except:
-            #    print pars
-            #    print pars[-1]
-            #    print pars[-1].dtype
-            #    print 0*pars[-1]
-            #    print np.nan*pars[-1]
-            #    raise
-            spec[i] = np.nan
+                freqs = out[1][0]
+                spec = np.ones((n_windows,len(out[1][1])))
+                spec[:i] = np.nan
+            spec[i,:len(out[1][1])] = out[1][1]
+        #-- slices with too few points get nan parameters
+        if fit_params:
+            dtype = [par for par in pars if par is not None][0].dtype
+            nanpars = np.rec.array(np.nan*np.ones(len(dtype.names)),dtype=dtype)
+            for i,par in enumerate(pars):
+                if par is None:
+                    pars[i] = nanpars
     out = {}
     out['times']     = stft_times
-    out['pars']      = np.hstack(pars)
-    out['pergram']   = (output[1][0],spec)
+    if fit_params:
+        out['pars']      = np.hstack(pars)
+    out['pergram']   = (freqs,spec)
+    out['points']    = pnts
     return out
     
+#{ Prewhitening state
+
+class PrewhiteningState(object):
+    """
+    Linear least-squares fit of a growing set of harmonics to a timeseries.
+    
+    The fit is of the same form as in L{fit.sine}: a constant and the sine and
+    cosine of every frequency. The state keeps the QR factorisation of this
+    design matrix. When a frequency is added, only its two columns are
+    orthogonalised against the previous ones (a rank-2 update of the
+    factorisation), and the residuals are updated with the projections of the
+    signal on the new columns. Fitting K frequencies to N points one by one
+    thus costs O(N K^2) in total instead of O(N K^3).
+    
+    For equidistant time points, the Fourier transform of a sine over the time
+    points is known analytically (it is the shifted window function). The
+    Scargle and Deeming periodograms of the residuals are then derived from the
+    transform of the signal, which is computed only once, by subtracting the
+    transforms of the fitted harmonics (see L{pergram}).
+    
+    >>> times = np.linspace(0,100,1000)
+    >>> signal = np.sin(2*np.pi*2.5*times) + 0.5*np.sin(2*np.pi*3.1*times+1.)
+    >>> state = PrewhiteningState(times,signal)
+    >>> params = state.add(2.5)
+    >>> params = state.add(3.1)
+    >>> freqs,ampls = state.pergram(0.01,5.,0.001)
+    
+    If a new frequency makes the design matrix singular, the fit falls back
+    to L{fit.sine} with all frequencies.
+    """
+    def __init__(self,times,signal,constant=True):
+        """
+        Start with an empty fit: the residuals are the signal.
+        
+        @param times: time points
+        @type times: numpy array
+        @param signal: observations
+        @type signal: numpy array
+        @param constant: also fit a constant
+        @type constant: boolean
+        """
+        self.times = np.asarray(times,float)
+        self.signal = np.asarray(signal,float)
+        self.constant = constant
+        self.frequencies = []
+        self.residuals = self.signal.copy()
+        n = len(self.times)
+        #-- orthonormal columns Q, upper triangular R and Q^T signal
+        self._Q = np.zeros((n,16),order='F')
+        self._R = np.zeros((16,16))
+        self._qtb = np.zeros(16)
+        self._ncols = 0
+        self._singular = False
+        #-- the time points are equidistant if they deviate less than a
+        #   millionth of the time step from a regular grid
+        if n>1:
+            self._dt = (self.times[-1]-self.times[0])/(n-1.)
+            grid = self.times[0]+self._dt*np.arange(n)
+            self.equidistant = self._dt>0 and abs(self.times-grid).max()<=1e-6*self._dt
+        else:
+            self.equidistant = False
+        self._pergram_grid = None
+    
+    def add(self,freq):
+        """
+        Add a frequency and refit all parameters.
+        
+        @param freq: frequency
+        @type freq: float
+        @return: parameters, as from L{fit.sine}
+        @rtype: record array
+        """
+        self.frequencies.append(freq)
+        #-- the constant is fitted together with the first frequency
+        if self.constant and not self._ncols and not self._singular:
+            self._singular = not self._append(np.ones(len(self.times)))
+        if not self._singular:
+            arg = 2*np.pi*(self.times*freq)
+            self._singular = not (self._append(np.sin(arg)) and self._append(np.cos(arg)))
+            if self._singular:
+                logger.warning('Frequency %g makes the fit singular, refitting from scratch'%(freq))
+        if self._singular:
+            parameters = fit.sine(self.times,self.signal,self.frequencies,constant=self.constant)
+            self.residuals = self.signal - evaluate.sine(self.times,parameters)
+            return parameters
+        return self.params()
+    
+    def params(self):
+        """
+        Parameters of the current fit.
+        
+        @return: parameters, as from L{fit.sine}
+        @rtype: record array
+        """
+        if self._singular:
+            return fit.sine(self.times,self.signal,self.frequencies,constant=self.constant)
+        coeffs = self._coefficients()
+        freq = np.array(self.frequencies,float)
+        amplitude = np.sqrt(coeffs[0]**2 + coeffs[1]**2)
+        phase = np.arctan2(coeffs[1],coeffs[0])
+        if self.constant:
+            constn = np.zeros(len(freq))
+            constn[0] = coeffs[2]
+            names = ['const','ampl','freq','phase']
+            fpars = [constn,amplitude,freq,phase/(2*np.pi)]
+        else:
+            names = ['ampl','freq','phase']
+            fpars = [amplitude,freq,phase/(2*np.pi)]
+        return np.rec.fromarrays(fpars,names=names)
+    
+    def model(self):
+        """
+        Model of the current fit in the time points.
+        
+        @return: model
+        @rtype: numpy array
+        """
+        return self.signal - self.residuals
+    
+    def pergram(self,f0,fn,df,method='scargle',norm='amplitude'):
+        """
+        Scargle or Deeming periodogram of the residuals.
+        
+        This is only possible for equidistant time points; otherwise C{None}
+        is returned. The transform of the signal is computed the first time
+        the periodogram is requested on a frequency grid, after that only
+        those of the fitted harmonics are subtracted.
+        
+        @param f0: start frequency
+        @type f0: float
+        @param fn: stop frequency
+        @type fn: float
+        @param df: step frequency
+        @type df: float
+        @param method: 'scargle' or 'deeming'
+        @type method: str
+        @param norm: type of normalisation
+        @type norm: str
+        @return: frequencies, periodogram (or None)
+        @rtype: array,array
+        """
+        if not self.equidistant or self._singular:
+            return None
+        n = len(self.times)
+        nf = int((fn-f0)/df+0.001)+1
+        #-- the same frequencies as the Fortran routines, which accumulate the
+        #   frequency step
+        if method=='deeming':
+            twopi = 6.28318530717959
+            freqs = np.add.accumulate(np.hstack([f0*twopi,df*twopi*np.ones(nf-1)]))/twopi
+        else:
+            freqs = np.add.accumulate(np.hstack([f0,df*np.ones(nf-1)]))
+        #-- sum(signal*exp(2 pi i f t)) and sum(exp(4 pi i f t))
+        if self._pergram_grid!=(f0,fn,df):
+            self._ft = pergrams._dft_equidistant(self.times,self.signal,f0,df,nf)
+            self._ft2 = pergrams._dft_equidistant(self.times,np.ones(n),2*f0,2*df,nf)
+            self._pergram_grid = (f0,fn,df)
+        #-- subtract the transforms of the fitted harmonics:
+        #   sin(2 pi f_k t) --> [W(f+f_k)-W(f-f_k)]/2i
+        #   cos(2 pi f_k t) --> [W(f+f_k)+W(f-f_k)]/2
+        ft = self._ft.copy()
+        coeffs = self._coefficients()
+        if self.constant and self.frequencies:
+            ft -= coeffs[2]*self._window(freqs)
+        for freq,a,b in zip(self.frequencies,coeffs[0],coeffs[1]):
+            Wp = self._window(freqs+freq)
+            Wm = self._window(freqs-freq)
+            ft -= (a/2j+b/2.)*Wp + (b/2.-a/2j)*Wm
+        ampls = pergrams._sums2pergram(ft,self._ft2,n,self.times.ptp(),
+                                       np.var(self.residuals),method=method,norm=norm)
+        return freqs,ampls
+    
+    def _append(self,column):
+        """
+        Orthogonalise a new column of the design matrix against the previous
+        ones and update the factorisation and the residuals.
+        
+        Returns False if the column is (numerically) a linear combination of
+        the previous ones.
+        """
+        p = self._ncols
+        #-- make room for more columns
+        if p==self._Q.shape[1]:
+            size = 2*p
+            self._Q = np.asfortranarray(np.hstack([self._Q,np.zeros_like(self._Q)]))
+            R = np.zeros((size,size))
+            R[:p,:p] = self._R
+            self._R = R
+            self._qtb = np.hstack([self._qtb,np.zeros(p)])
+        #-- Gram-Schmidt, with one reorthogonalisation
+        Q = self._Q[:,:p]
+        v = column.copy()
+        r = np.zeros(p)
+        for i in range(2):
+            ri = np.dot(Q.T,v)
+            v -= np.dot(Q,ri)
+            r += ri
+        rho = np.sqrt(np.dot(v,v))
+        if rho<=1e-10*np.sqrt(np.dot(column,column)):
+            return False
+        q = v/rho
+        self._Q[:,p] = q
+        self._R[:p,p] = r
+        self._R[p,p] = rho
+        self._qtb[p] = np.dot(q,self.signal)
+        self.residuals -= self._qtb[p]*q
+        self._ncols += 1
+        return True
+    
+    def _coefficients(self):
+        """
+        Coefficients of the sines and cosines (and the constant).
+        """
+        p = self._ncols
+        if not p:
+            return np.zeros(0),np.zeros(0),0.
+        x = solve_triangular(self._R[:p,:p],self._qtb[:p])
+        offset = self.constant and 1 or 0
+        return x[offset::2],x[offset+1::2],self.constant and x[0] or 0.
+    
+    def _window(self,freqs):
+        """
+        sum(exp(2 pi i f t)) over the (equidistant) time points.
+        """
+        n = len(self.times)
+        tmid = self.times[0] + self._dt*(n-1)/2.
+        x = np.pi*freqs*self._dt
+        denom = np.sin(x)
+        #-- at multiples of the sampling frequency, the ratio of the sines
+        #   goes to n cos(n x)/cos(x)
+        small = abs(denom)<1e-12
+        denom[small] = 1.
+        ratio = np.sin(n*x)/denom
+        ratio[small] = n*np.cos(n*x[small])/np.cos(x[small])
+        return np.exp(2j*np.pi*freqs*tmid)*ratio
+
 #{ Convenience stop-criteria
 
 def stopcrit_scargle_prob(times,signal,modelfunc,allparams,pergram,crit_value):
@@ -737,6 +1094,134 @@ def autocorrelation(frequencies,power,max_step=1.5,interval=(),threshold=None,me
     logger.info("Computed autocorrelation in interval %s with maxstep %s"%(interval,max_step))
     return domain, autocorr
 
+#{ Internal helper functions
+
+@defaults_pergram
+def _frequency_grid(times,signal,f0=None,fn=None,df=None,**kwargs):
+    """
+    Return the frequency grid a periodogram would use with these keywords.
+    """
+    return f0,fn,df
+
+def _nprocesses(threads):
+    """
+    Convert the C{threads} keyword (an integer, 'max' or 'safe') to a number
+    of processes.
+    """
+    if threads=='max':
+        threads = cpu_count()
+    elif threads=='safe':
+        threads = cpu_count()-1
+    return max(1,int(threads))
+
+def _map_processes(fctn,args,threads=1,**shared):
+    """
+    Apply a function to a list of arguments, possibly in several processes.
+    
+    The extra keyword arguments are made available to the function via the
+    module-level dictionary C{_shared}; the processes inherit it when they
+    are started, so that it is not sent along with every argument.
+    
+    As in L{decorators.parallel_pergram}, plain (non-daemonic) processes are
+    used, so that the function can itself start processes (e.g. to compute a
+    periodogram).
+    
+    @param fctn: function to apply
+    @type fctn: callable
+    @param args: list of arguments
+    @type args: list
+    @param threads: number of processes (integer, 'max' or 'safe')
+    @type threads: int or str
+    @return: results, in the order of the arguments
+    @rtype: list
+    """
+    threads = min(_nprocesses(threads),len(args))
+    _shared.update(shared)
+    try:
+        if threads==1:
+            return [fctn(arg) for arg in args]
+        #-- the processes take the index of the next argument from a queue,
+        #   and put the results in another queue
+        tasks,results = Queue(),Queue()
+        for i in xrange(len(args)):
+            tasks.put(i)
+        all_processes = []
+        for i in xrange(threads):
+            tasks.put(None)
+            p = Process(target=_map_processes_worker,args=(fctn,args,tasks,results))
+            p.start()
+            all_processes.append(p)
+        output = [None]*len(args)
+        try:
+            for i in xrange(len(args)):
+                index,result = results.get()
+                if index is None:
+                    raise result
+                output[index] = result
+        finally:
+            for p in all_processes:
+                if p.is_alive(): p.terminate()
+                p.join()
+        logger.debug("parallel: all processes ended")
+        return output
+    finally:
+        _shared.clear()
+
+def _map_processes_worker(fctn,args,tasks,results):
+    """
+    Process arguments of L{_map_processes} until there are none left.
+    """
+    for index in iter(tasks.get,None):
+        try:
+            results.put((index,fctn(args[index])))
+        except Exception,msg:
+            results.put((None,msg))
+            break
+
+def _spectrum_2D_chunk(args):
+    """
+    Frequency analysis of a chunk of wavelength bins of L{spectrum_2D}.
+    """
+    signals,weights_2d,batch = args
+    times = _shared['times']
+    kwargs = _shared['kwargs'].copy()
+    #-- compute the periodograms of the whole chunk at once
+    if batch:
+        keys = ['f0','fn','df','nyq_stat','method','norm']
+        freqs,ampls = pergrams.pergram_2D(times,signals,
+                      **dict([(key,kwargs[key]) for key in keys if key in kwargs]))
+    out = []
+    for i in xrange(signals.shape[1]):
+        if weights_2d is not None:
+            kwargs['weights'] = weights_2d[:,i]
+        if batch:
+            kwargs['pergram'] = freqs,ampls[:,i]
+        #-- we don't want iterative zoom in so set scale_df=0
+        out.append(find_frequency(times,signals[:,i],scale_df=0,**kwargs))
+    return out
+
+def _time_frequency_slice(args):
+    """
+    Periodogram (and parameters) of one slice of L{time_frequency}.
+    """
+    start,end,pergram = args
+    times = _shared['times'][start:end]
+    signal = _shared['signal'][start:end]
+    kwargs = _shared['kwargs']
+    if _shared['detrend']:
+        times,signal = _shared['detrend'](times,signal)
+    if len(times)<=1:
+        return None
+    if _shared['fit_params']:
+        return find_frequency(times,signal,full_output=True,scale_df=0,pergram=pergram,**kwargs)[:2]
+    #-- only the periodogram is needed: leave out the keywords of find_frequency
+    method = kwargs.get('method','scargle')
+    skip = inspect.getargspec(find_frequency)[0]
+    kwargs = dict([(key,kwargs[key]) for key in kwargs if not key in skip])
+    return None,getattr(pergrams,method)(times,signal,**kwargs)
+
+#}
+
 if __name__=="__main__":
     import doctest
     import pylab as pl
@@ -130,6 +130,9 @@ from ivs.coordinates import vectors
 
 logger = logging.getLogger('IVS.KEPLER')
 
+#-- maximum number of orbits x time points evaluated at once in grid_search
+grid_tile_size = 2**14
+
 #{ Radial velocities
 
 def radial_velocity(parameters,times=None,theta=None,itermax=8):
@@ -192,6 +195,48 @@ def radial_velocity(parameters,times=None,theta=None,itermax=8):
         
     return RVfit
 
+def radial_velocity_grid(times,P,T0,e,omega,K,RV0=0.,itermax=8):
+    """
+    Evaluate the radial velocities of many Keplerian orbits at once.
+    
+    The orbital parameters (see L{radial_velocity}) can be arrays of any
+    shape that broadcast against each other, e.g. a grid of periods and
+    eccentricities. The result has the shape of the (broadcasted) parameters,
+    followed by the shape of C{times}. Kepler's equation is solved for all
+    orbits and times in one go (see L{true_anomaly}).
+    
+    >>> times = np.linspace(0,10,5)
+    >>> RV = radial_velocity_grid(times,[3.,4.],1.,[[0.],[0.2],[0.5]],0.,10.)
+    >>> print RV.shape
+    (3, 2, 5)
+    
+    @parameter times: observation times (days)
+    @type times: numpy array
+    @parameter P: period of the system (days)
+    @type P: float or array
+    @parameter T0: time of periastron passage (HJD)
+    @type T0: float or array
+    @parameter e: eccentricity
+    @type e: float or array
+    @parameter omega: longitude of periastron (radians)
+    @type omega: float or array
+    @parameter K: semiamplitude of the velocity curve (km/s)
+    @type K: float or array
+    @parameter RV0: systemic velocity (km/s)
+    @type RV0: float or array
+    @param itermax: number of iterations to find true anomaly
+    @type itermax: integer
+    @return: radial velocities (km/s), shape parameters + shape times
+    @rtype: ndarray
+    """
+    times = np.asarray(times,float)
+    P,T0,e,omega,K,RV0 = np.broadcast_arrays(*[np.asarray(par,float) for par in [P,T0,e,omega,K,RV0]])
+    #-- add the time axes to the parameters
+    extra = (Ellipsis,)+(None,)*times.ndim
+    P,T0,e,omega,K,RV0 = [par[extra] for par in [P,T0,e,omega,K,RV0]]
+    E,true_an = true_anomaly((times-T0)*2*np.pi/P,e,itermax=itermax)
+    return RV0 + K*(e*np.cos(omega) + np.cos(true_an+omega))
+
 def orbit_in_plane(times,parameters,component='primary',coordinate_frame='polar'):
     """
     Construct an orbit in the orbital plane.
@@ -344,7 +389,7 @@ def orbit_on_sky(times,parameters,distance=None,component='primary'):
     
 
 
-def true_anomaly(M,e,itermax=8):
+def true_anomaly(M,e,itermax=8,tol=1e-12):
     """
     Calculation of true and eccentric anomaly in Kepler orbits.
     
@@ -352,35 +397,78 @@ def true_anomaly(M,e,itermax=8):
     
     See p.39 of Hilditch, 'An Introduction To Close Binary Stars'
     
+    Kepler's equation is solved with Halley's method, starting from the
+    initial value of Danby (1987). C{M} and C{e} can be arrays of any
+    shape that broadcast against each other (e.g. times x orbits); only the
+    elements that have not converged yet are iterated.
+    
     @parameter M: phase
-    @type M: float
+    @type M: float or array
     @parameter e: eccentricity
-    @type e: float
+    @type e: float or array
     @keyword itermax: maximum number of iterations
     @type itermax: integer
+    @keyword tol: absolute tolerance on the eccentric anomaly (radians)
+    @type tol: float
     @return: eccentric anomaly (E), true anomaly (theta)
-    @rtype: float,float
+    @rtype: float,float (or arrays)
     """
-    #-- initial value
-    Fn = M + e*np.sin(M) + e**2/2.*np.sin(2*M)
-    #-- iterative solving of the transcendent Kepler's equation
-    for i in range(itermax):
-        F = Fn
-        Mn = F-e*np.sin(F)
-        Fn = F+(M-Mn)/(1.-e*np.cos(F))
-        keep = F!=0 #-- take care of zerodivision
-        if hasattr(F,'__iter__'):
-            if np.all(abs((Fn-F)[keep]/F[keep])<0.00001):
-                break
-        elif (abs((Fn-F)/F)<0.00001):
-            break
+    M,e = np.broadcast_arrays(np.asarray(M,float),np.asarray(e,float))
+    Fn = _eccentric_anomaly(M,e,itermax=itermax,tol=tol)
     #-- relationship between true anomaly (theta) and eccentric
     #   anomalie (Fn)
     true_an = 2.*np.arctan(np.sqrt((1.+e)/(1.-e))*np.tan(Fn/2.))
-    return Fn,true_an
-
+    return Fn[()],true_an[()]
 
 
+def _eccentric_anomaly(M,e,itermax=8,tol=1e-12,full_output=False):
+    """
+    Solve Kepler's equation M = E - e sin(E) for arrays of the same shape.
+    
+    Halley's method is started from the initial value of Danby (1987). As
+    long as most elements are still converging, all elements are iterated
+    in place; after that, only the ones that did not converge yet.
+    
+    With C{full_output}, also the sine and cosine of E are returned. They are
+    taken from the last iteration and corrected to first order in the last
+    step, which is below C{tol} for the converged elements.
+    """
+    #-- reduce the mean anomaly to [-pi,pi], and add the turns again at the end
+    turns = np.round(M/(2*np.pi))
+    Mr = (M - 2*np.pi*turns).ravel()
+    e = np.ascontiguousarray(e).ravel()
+    #-- initial value
+    E = Mr + 0.85*e*np.sign(np.sin(Mr))
+    sinE,cosE = np.empty_like(E),np.empty_like(E)
+    #-- iterative solving of the transcendent Kepler's equation
+    todo = None
+    for i in range(itermax):
+        if todo is None:
+            E_,e_,M_ = E,e,Mr
+        else:
+            E_,e_,M_ = E[todo],e[todo],Mr[todo]
+        sin_,cos_ = np.sin(E_),np.cos(E_)
+        esin = e_*sin_
+        df = 1. - e_*cos_
+        f = E_ - esin - M_
+        dE = f/(df - 0.5*f*esin/df)
+        E_ -= dE
+        if full_output:
+            sin_,cos_ = sin_-cos_*dE,cos_+sin_*dE
+        busy = abs(dE)>tol
+        if todo is None:
+            sinE[:],cosE[:] = sin_,cos_
+            if busy.sum()<len(busy)/2:
+                todo = np.nonzero(busy)[0]
+        else:
+            E[todo],sinE[todo],cosE[todo] = E_,sin_,cos_
+            todo = todo[busy]
+        if todo is not None and not len(todo):
+            break
+    E = E.reshape(M.shape) + 2*np.pi*turns
+    if full_output:
+        return E,sinE.reshape(M.shape),cosE.reshape(M.shape)
+    return E
 
 def calculate_phase(T,e,omega,pshift=0):
     """
@@ -476,6 +564,112 @@ def omega_from_eclipse_separation(separation,e):
     
 #}
 
+#{ Orbit search
+
+def grid_search(times,signal,freqs,errors=None,wexp=2,e0=0.,en=0.91,de=0.1,
+                x00=0.,x0n=359.9,itermax=8):
+    """
+    Search a grid of Keplerian orbits for the best fit to radial velocities.
+    
+    For every frequency, eccentricity and phase of periastron C{x0} on the
+    grid, the true anomaly is known, and the remaining parameters follow
+    from a linear least squares fit of C{A*cos(theta)+B*sin(theta)+C}. The
+    power of an orbit is the fraction of the (weighted) variance it explains
+    (Zechmeister & Kuerster 2009, Zucker et al. 2010).
+    
+    The grid is polar in C{(e,x0)}: the step in C{x0} is C{2pi/int(2pi*e/de+1)}.
+    All orbits on the grid are evaluated as one array operation, in chunks
+    of at most C{grid_tile_size} orbits x time points.
+    
+    @param times: observation times
+    @type times: numpy 1D array
+    @param signal: radial velocities
+    @type signal: numpy 1D array
+    @param freqs: frequencies
+    @type freqs: numpy 1D array
+    @param errors: errors on the radial velocities
+    @type errors: numpy 1D array
+    @param wexp: weighting exponent of the errors (2: chi2, 0: variance)
+    @type wexp: float
+    @param e0: start eccentricity
+    @type e0: float
+    @param en: end eccentricity
+    @type en: float
+    @param de: eccentricity step
+    @type de: float
+    @param x00: start x0 (degrees)
+    @type x00: float
+    @param x0n: end x0 (degrees)
+    @type x0n: float
+    @param itermax: maximum number of iterations to find the true anomaly
+    @type itermax: integer
+    @return: best power per frequency, parameters of the best orbit
+    (frequency, x0 (radians), e, omega (radians), K, RV0). x0 is relative to the first time point.
+    @rtype: array, tuple
+    """
+    times = np.asarray(times,float)
+    signal = np.asarray(signal,float)
+    freqs = np.atleast_1d(np.asarray(freqs,float))
+    if errors is None:
+        errors = np.ones(len(times))
+    t = times - times.min()
+    #-- normalised weights and weighted signal
+    weights = (1./np.asarray(errors,float))**wexp
+    weights = weights/weights.sum()
+    RVmean = (signal*weights).sum()
+    wy = (signal-RVmean)*weights
+    YY = ((signal-RVmean)**2*weights).sum()
+    wsums = np.column_stack([weights,wy])
+    
+    #-- the polar (e,x0) grid
+    x00,x0n = x00/180.*np.pi,x0n/180.*np.pi
+    egrid,x0grid = [],[]
+    for e in e0 + de*np.arange(int((en-e0+de)/de)):
+        x0step = 2*np.pi/int(2*np.pi*e/de+1)
+        x0 = x00 + x0step*np.arange(int((x0n-x00+x0step)/x0step))
+        egrid.append(e*np.ones(len(x0)))
+        x0grid.append(x0)
+    egrid,x0grid = np.hstack(egrid),np.hstack(x0grid)
+    ngrid = len(egrid)
+    
+    #-- all orbits (frequency x grid), in chunks
+    norbits = len(freqs)*ngrid
+    chunk = max(1,grid_tile_size//len(t))
+    pars = np.zeros((4,norbits))
+    for start in range(0,norbits,chunk):
+        orbits = np.arange(start,min(start+chunk,norbits))
+        freq,e,x0 = freqs[orbits//ngrid],egrid[orbits%ngrid],x0grid[orbits%ngrid]
+        M = 2*np.pi*freq[:,None]*t - x0[:,None]
+        e = e[:,None]*np.ones(len(t))
+        E,sinE,cosE = _eccentric_anomaly(M,e,itermax=itermax,full_output=True)
+        #-- cosine and sine of the true anomaly
+        denom = 1./(1. - e*cosE)
+        cosx = (cosE-e)*denom
+        sinx = np.sqrt(1.-e**2)*sinE*denom
+        C,YC = np.dot(cosx,wsums).T
+        S,YS = np.dot(sinx,wsums).T
+        CC = np.dot(cosx*cosx,weights)
+        CS = np.dot(cosx*sinx,weights)
+        SS = 1. - CC - S*S
+        CC = CC - C*C
+        CS = CS - C*S
+        D = CC*SS - CS*CS
+        A = (YC*SS-YS*CS) / D
+        B = (YS*CC-YC*CS) / D
+        pars[:,orbits] = A,B,RVmean-A*C-B*S,(SS*YC**2+CC*YS**2-2*CS*YC*YS)/D/YY
+    A,B,off,power = pars
+    
+    #-- best orbit per frequency, and overall
+    best = np.argmax(power)
+    power = power.reshape(len(freqs),ngrid).max(axis=1)
+    freq,e,x0 = freqs[best//ngrid],egrid[best%ngrid],x0grid[best%ngrid]
+    omega = np.mod(-np.arctan2(B[best],A[best])+2*np.pi,2*np.pi)
+    K = -B[best]/np.sin(omega)
+    RV0 = off[best] - A[best]*e
+    return power,(freq,x0,e,omega,K,RV0)
+
+#}
+
 #{ Kepler's laws
 
 def third_law(M=None,a=None,P=None):
@@ -139,6 +139,9 @@ Phase folding techniques: L{box} and L{pdm}
 
 """
 import logging
+import hashlib
+from multiprocessing import Pool,cpu_count
+from multiprocessing.pool import ThreadPool
 import numpy as np
 from numpy import cos,sin,pi
 from scipy.special import jn
@@ -146,6 +149,7 @@ from ivs.aux.decorators import make_parallel
 from ivs.aux import loggers
 from ivs.aux import termtools
 from ivs.timeseries.decorators import parallel_pergram,defaults_pergram,getNyquist
+from ivs.timeseries import keplerorbit
 
 import pyscargle
 import pyscargle_single
@@ -153,7 +157,6 @@ import pyfasper
 import pyfasper_single
 import pyclean
 import pyGLS
-import pyKEP
 import pydft
 import multih
 import deeming as fdeeming
@@ -161,6 +164,15 @@ import eebls
 
 logger = logging.getLogger("TS.PERGRAMS")
 
+#-- maximum number of elements in the arrays of one tile of the DFT engine
+#   (see DFTpower, DFTpower2, windowfunction)
+dft_tile_size = 2**18
+
+#-- cache of window functions (see windowfunction_cached)
+window_cache_size = 16
+_window_cache = {}
+_window_cache_order = []
+
 
 #{ Periodograms
 
@@ -347,9 +359,136 @@ def deeming(times,signal, f0=None, fn=None, df=None, norm='amplitude'):
         s1 = fact * np.sqrt(s1)
     elif norm == "density": # power density
         s1 = fact**2 * s1 * T
-    
+
     return f1,s1
-    
+
+
+@defaults_pergram
+def pergram_2D(times, signals, f0=None, fn=None, df=None, method='scargle',
+               norm='amplitude', threads=1):
+    """
+    Scargle or Deeming periodograms of several signals sampled at the same
+    time points.
+
+    Each column of C{signals} is one signal. Because the time points and the
+    frequency grid are the same for all columns, the sums over the time
+    points are computed for all columns at once as one matrix product (see
+    L{_dft}), instead of calling L{scargle} or L{deeming} column per column.
+    The result is the same as that of these functions (unweighted, in double
+    precision).
+
+    @param times: time points
+    @type times: numpy array
+    @param signals: observations [0..Ntime-1,0..Nsignal-1]
+    @type signals: numpy array
+    @param f0: start frequency
+    @type f0: float
+    @param fn: stop frequency
+    @type fn: float
+    @param df: step frequency
+    @type df: float
+    @param method: 'scargle' or 'deeming'
+    @type method: str
+    @param norm: type of normalisation
+    @type norm: str
+    @param threads: number of threads (integer, 'max' or 'safe')
+    @type threads: int or str
+    @return: frequencies, amplitude spectra [0..Nfreq-1,0..Nsignal-1]
+    @rtype: array,array
+    """
+    n = len(times)
+    T = times.ptp()
+    nf = int((fn-f0)/df+0.001)+1
+    f1 = f0 + df*np.arange(nf)
+    #-- SC + i*SS for all signals
+    ft = _dft(times,signals,f1,threads=threads)
+    if method=='scargle':
+        #-- SC2 + i*SS2 do not depend on the signal
+        ft2 = _dft(times,np.ones(n),2*f1,threads=threads)[:,None]
+    else:
+        ft2 = None
+    s1 = _sums2pergram(ft,ft2,n,T,np.var(signals,axis=0),method=method,norm=norm)
+    return f1,s1
+
+
+@defaults_pergram
+def sliding_pergram(times, signal, centers, width, f0=None, fn=None, df=None,
+                    method='scargle', norm='amplitude'):
+    """
+    Scargle or Deeming periodograms in windows sliding through a time series.
+
+    Window C{i} contains the points within C{width/2} of C{centers[i]}. The
+    centers should be increasing. The sums over the time points in the
+    periodogram are not recomputed for every window: only the contributions
+    of the points that enter and leave the window are added and subtracted.
+    When two consecutive windows do not overlap, the sums are started anew.
+    The result is the same as that of L{scargle} or L{deeming} on every
+    window (unweighted, in double precision).
+
+    @param times: time points (sorted)
+    @type times: numpy array
+    @param signal: observations
+    @type signal: numpy array
+    @param centers: centers of the windows
+    @type centers: numpy array
+    @param width: width of the windows
+    @type width: float
+    @param f0: start frequency
+    @type f0: float
+    @param fn: stop frequency
+    @type fn: float
+    @param df: step frequency
+    @type df: float
+    @param method: 'scargle' or 'deeming'
+    @type method: str
+    @param norm: type of normalisation
+    @type norm: str
+    @return: frequencies, spectrogram [0..Nwindow-1,0..Nfreq-1] (nan for
+    windows with less than two points)
+    @rtype: array,array
+    """
+    if not method in ['scargle','deeming']:
+        raise ValueError, "Sliding periodogram not available for method '%s'"%(method)
+    nf = int((fn-f0)/df+0.001)+1
+    f1 = f0 + df*np.arange(nf)
+    spec = np.zeros((len(centers),nf))
+    #-- sum(signal*exp(2 pi i f t)) and sum(exp(4 pi i f t)) over the points
+    #   in [lo,hi)
+    ft = np.zeros(nf,complex)
+    ft2 = np.zeros(nf,complex)
+    lo = hi = 0
+    
+    def update(indices,signs):
+        #-- exp(4 pi i f t) is the square of exp(2 pi i f t)
+        chunk = max(1,dft_tile_size//nf)
+        for k in range(0,len(indices),chunk):
+            index,sign = indices[k:k+chunk],signs[k:k+chunk]
+            exp = np.exp(2j*pi*np.outer(f1,times[index]))
+            ft[:] += np.dot(exp,signal[index]*sign)
+            if method=='scargle':
+                ft2[:] += np.dot(exp*exp,sign)
+    
+    for i,center in enumerate(centers):
+        #-- the times are sorted, so the window is a slice [start,end)
+        region = np.nonzero(abs(times-center)<=(width/2.))[0]
+        if len(region)<2:
+            spec[i] = np.nan
+            continue
+        start,end = region[0],region[-1]+1
+        if start>=hi or end<=lo:
+            ft[:] = 0.
+            ft2[:] = 0.
+            lo = hi = start
+        #-- remove the points that left the window, add those that entered
+        changes = [(lo,start,-1),(start,lo,+1),(hi,end,+1),(end,hi,-1)]
+        indices = np.hstack([np.arange(a,b) for a,b,sign in changes])
+        signs = np.hstack([sign*np.ones(max(0,b-a)) for a,b,sign in changes])
+        update(indices,signs)
+        lo,hi = start,end
+        spec[i] = _sums2pergram(ft,ft2,end-start,times[end-1]-times[start],
+                                np.var(signal[start:end]),method=method,norm=norm)
+    return f1,spec
+
 
 @defaults_pergram
 @parallel_pergram
@@ -509,7 +648,7 @@ def schwarzenberg_czerny(times, signal, f0=None, fn=None, df=None, nh=2, mode=1)
         
     return frequencies,th
     
-def DFTpower(time, signal, f0=None, fn=None, df=None, full_output=False):
+def DFTpower(time, signal, f0=None, fn=None, df=None, full_output=False, threads=1):
 
     """
     Computes the modulus square of the fourier transform. 
@@ -518,6 +657,9 @@ def DFTpower(time, signal, f0=None, fn=None, df=None, full_output=False):
     The normalisation is such that a signal A*sin(2*pi*nu_0*t)
     gives power A^2 at nu=nu_0
     
+    The frequencies are computed in tiles (see C{dft_tile_size}), which can
+    be distributed over several threads.
+    
     @param time: time points [0..Ntime-1] 
     @type time: ndarray
     @param signal: signal [0..Ntime-1]
@@ -528,6 +670,8 @@ def DFTpower(time, signal, f0=None, fn=None, df=None, full_output=False):
     @type fn: float
     @param df: see f0
     @type df: float
+    @param threads: number of threads (integer, 'max' or 'safe')
+    @type threads: int or str
     @return: power spectrum of the signal
     @rtype: array 
     """
@@ -536,13 +680,7 @@ def DFTpower(time, signal, f0=None, fn=None, df=None, full_output=False):
     Ntime = len(time)
     Nfreq = int(np.ceil((fn-f0)/df))
   
-    A = np.exp(1j*2.*pi*f0*time) * signal
-    B = np.exp(1j*2.*pi*df*time)
-    ft = np.zeros(Nfreq, complex) 
-    ft[0] = A.sum()
-    for k in range(1,Nfreq):
-        A *= B
-        ft[k] = np.sum(A)
+    ft = _dft_equidistant(time,signal,f0,df,Nfreq,threads=threads)
     
     if full_output:
         return freqs,ft**2*4.0/Ntime**2
@@ -550,13 +688,16 @@ def DFTpower(time, signal, f0=None, fn=None, df=None, full_output=False):
         return freqs,(ft.real**2 + ft.imag**2) * 4.0 / Ntime**2    
 
 
-def DFTpower2(time, signal, freqs):
+def DFTpower2(time, signal, freqs, threads=1):
 
     """
     Computes the power spectrum of a signal using a discrete Fourier transform.
 
     The main difference between DFTpower and DFTpower2, is that the latter allows for non-equidistant
     frequencies for which the power spectrum will be computed.
+    
+    The frequencies are computed in tiles (see C{dft_tile_size}), which can
+    be distributed over several threads.
 
     @param time: time points, not necessarily equidistant
     @type time: ndarray
@@ -564,15 +705,14 @@ def DFTpower2(time, signal, freqs):
     @type signal: ndarray
     @param freqs: frequencies for which the power spectrum will be computed. Unit: inverse of 'time'.
     @type freqs: ndarray
+    @param threads: number of threads (integer, 'max' or 'safe')
+    @type threads: int or str
     @return: power spectrum. Unit: square of unit of 'signal'
     @rtype: ndarray
     """
     
-    powerSpectrum = np.zeros(len(freqs))
-
-    for i, freq in enumerate(freqs):
-        arg = 2.0 * np.pi * freq * time
-        powerSpectrum[i] = np.sum(signal * np.cos(arg))**2 + np.sum(signal * np.sin(arg))**2
+    ft = _dft(time, signal, freqs, threads=threads)
+    powerSpectrum = ft.real**2 + ft.imag**2
 
     powerSpectrum = powerSpectrum * 4.0 / len(time)**2
     return(powerSpectrum)
@@ -980,30 +1120,19 @@ def kepler(times,signal, f0=None, fn=None, df=None, e0=0., en=0.91, de=0.1,
     @return: frequencies, amplitude spectrum
     @rtype: array,array
     """
-    T = times.ptp()
-    n = len(times)
-    if errors is None:
-        errors = np.ones(n)
     maxstep = int((fn-f0)/df+1)
-    
-    #-- initialize parameters
-    f1 = np.zeros(maxstep) #-- frequency
-    s1 = np.zeros(maxstep) #-- power
-    p1 = np.zeros(maxstep) #-- window
-    l1 = np.zeros(maxstep) #-- power LS
-    s2 = np.zeros(maxstep) #-- power Kepler
-    k2 = np.zeros(6) #-- parameters for Kepler orbit
+    f1 = f0 + df*np.arange(maxstep) #-- frequency
     
     #-- calculate Kepler periodogram
-    pyKEP.kepler(times+0,signal+0,errors,f0,fn,df,wexp,e0,en,de,\
-          x00,x0n,f1,s1,p1,l1,s2,k2)
+    s2,k2 = keplerorbit.grid_search(times,signal,f1,errors=errors,wexp=wexp,
+                                    e0=e0,en=en,de=de,x00=x00,x0n=x0n)
     return f1,s2
 
 
 
 
 
-def Zwavelet(time, signal, freq, position, sigma=10.0):
+def Zwavelet(time, signal, freq, position, sigma=10.0, threads=1):
 
     """
     Weighted Wavelet Z-transform of Foster (1996)
@@ -1018,6 +1147,11 @@ def Zwavelet(time, signal, freq, position, sigma=10.0):
     Mind the max, min order for position. It's often useful to try log(Z)
     and/or different sigmas.
     
+    For every frequency, the weighted inner products of the base functions
+    are computed for all positions at once, and the 3x3 systems of all
+    positions are solved in one go. The frequencies can be distributed
+    over several processes with C{threads} (an integer, 'max' or 'safe').
+    
     @param time: time points [0..Ntime-1]
     @type time: ndarray
     @param signal: observed data points [0..Ntime-1]
@@ -1029,73 +1163,36 @@ def Zwavelet(time, signal, freq, position, sigma=10.0):
     @type position: ndarray
     @param sigma: smoothing parameter in time domain: sigma in Foster's paper
     @type sigma: float
+    @param threads: number of processes to distribute the frequencies over
+    @type threads: int or str
     @return: Z[0..Npos-1, 0..Nfreq-1]: the Z-transform: time-freq diagram
     @rtype: array
     
     """
-  
-    y = np.zeros(3)
-    S = np.zeros([3,3])
-    Z = np.zeros([len(position),len(freq)])
-  
-    for i in range(len(position)):
-        
-        tau = position[i]
-        arg = 2.0*pi*(time-tau)
- 
-        for j in range(len(freq)):
-        
-            nu = freq[j]
-      
-            # Compute statistical weights akin the Morlet wavelet
-      
-            weight = np.exp(-(time-tau)**2 * (nu / 2./sigma)**2)
-            W = np.sum(weight)
-      
-            # Compute the base functions. A 3rd base function is the constant 1.
-      
-            cosine = np.cos(arg*nu)
-            sine = np.sin(arg*nu)
-          
-            print arg, nu
-            print sine, cosine
-          
-            # Compute the innerproduct of the base functions
-            # phi_0 = 1 (constant), phi_1 = cosine, phi_2 = sine
-      
-            S[0,0] = 1.0
-            S[0,1] = S[1,0] = np.sum(weight * 1.0 * cosine) / W
-            S[0,2] = S[2,0] = np.sum(weight * 1.0 * sine) / W
-            S[1,1] = np.sum(weight * cosine * cosine) / W
-            S[1,2] = S[2,1] = np.sum(weight * cosine * sine) / W
-            S[2,2] = np.sum(weight * sine * sine) / W
-            print S
-            invS = np.linalg.inv(S)
-      
-            # Determine the best-fit coefficients y_k of the base functions
-      
-            for k in range(3):
-                y[k] =   np.sum(weight * 1.0 * signal) / W * invS[k,0]     \
-                       + np.sum(weight * cosine * signal) / W * invS[k,1]  \
-                       + np.sum(weight * sine * signal) / W * invS[k,2]      
-      
-            # Compute the best-fit model
-      
-            model = y[0] + y[1] * cosine + y[2] * sine
-      
-            # Compute the weighted variation of the signal and the model functions
-      
-            Vsignal = np.sum(weight * signal**2) / W -  (np.sum(weight * signal) / W)**2
-            Vmodel = np.sum(weight * model**2) / W -  (np.sum(weight * model) / W)**2
-      
-            # Calculate the weighted Wavelet Z-Transform
-      
-            Neff = W**2 / np.sum(weight**2)
-            Z[i,j] = (Neff - 3) * Vmodel / 2. / (Vsignal - Vmodel)
-      
+    time = np.asarray(time,float)
+    signal = np.asarray(signal,float)
+    freq = np.atleast_1d(np.asarray(freq,float))
+    position = np.atleast_1d(np.asarray(position,float))
+    if threads=='max':
+        threads = cpu_count()
+    elif threads=='safe':
+        threads = cpu_count()-1
+    threads = max(1,min(int(threads),len(freq)))
+    
+    #-- split up the frequencies in chunks, to be computed in parallel
+    chunks = [(time,signal,fchunk,position,sigma) for fchunk in np.array_split(freq,threads)]
+    if threads>1:
+        pool = Pool(threads)
+        try:
+            Z = pool.map(_Zwavelet_chunk,chunks)
+        finally:
+            pool.terminate()
+    else:
+        Z = [_Zwavelet_chunk(chunk) for chunk in chunks]
+    
     # That's it!
   
-    return Z
+    return np.hstack(Z)
     
 #}
 
@@ -1321,7 +1418,75 @@ def fasper_py(x,y,ofac,hifac, MACC=4):
 
 #{ Helper functions
 
-def windowfunction(time, freq):
+def _Zwavelet_chunk(args):
+    """
+    Compute the Weighted Wavelet Z-transform for a set of frequencies.
+    
+    Helper function for L{Zwavelet}. The cosine and sine base functions around
+    a position tau are written in terms of the base functions around zero:
+    
+    cos(2pi nu (t-tau)) = cos(2pi nu t) cos(2pi nu tau) + sin(2pi nu t) sin(2pi nu tau)
+    
+    such that all weighted inner products for all positions follow from one
+    matrix product of the (positions x time points) weights with the base
+    functions.
+    
+    @param args: time, signal, frequencies, positions and sigma
+    @type args: tuple
+    @return: Z[0..Npos-1, 0..Nfreq-1]
+    @rtype: array
+    """
+    time,signal,freq,position,sigma = args
+    Z = np.zeros([len(position),len(freq)])
+    #-- limit the size of the (positions x time points) weight matrices
+    pchunk = max(1,2**20//max(len(time),1))
+    for j,nu in enumerate(freq):
+        cosine = np.cos(2.0*pi*nu*time)
+        sine = np.sin(2.0*pi*nu*time)
+        base = np.column_stack([np.ones_like(time),cosine,sine,cosine**2,
+                                cosine*sine,sine**2,signal,signal*cosine,
+                                signal*sine,signal**2])
+        for p0 in range(0,len(position),pchunk):
+            tau = position[p0:p0+pchunk]
+            
+            # Compute statistical weights akin the Morlet wavelet
+            
+            weight = np.exp(-(time[None,:]-tau[:,None])**2 * (nu / 2./sigma)**2)
+            sums = np.dot(weight,base)
+            W = sums[:,0]
+            Neff = W**2 / (weight**2).sum(axis=1)
+            sums = sums[:,1:] / W[:,None]
+            c,s,cc,cs,ss,y,yc,ys,yy = sums.T
+            
+            # Rotate the inner products of the base functions to the position
+            # phi_0 = 1 (constant), phi_1 = cosine, phi_2 = sine
+            
+            ct,st = np.cos(2.0*pi*nu*tau),np.sin(2.0*pi*nu*tau)
+            S = np.empty((len(tau),3,3))
+            S[:,0,0] = 1.0
+            S[:,0,1] = S[:,1,0] = ct*c + st*s
+            S[:,0,2] = S[:,2,0] = ct*s - st*c
+            S[:,1,1] = ct**2*cc + 2*ct*st*cs + st**2*ss
+            S[:,1,2] = S[:,2,1] = (ct**2-st**2)*cs + ct*st*(ss-cc)
+            S[:,2,2] = ct**2*ss - 2*ct*st*cs + st**2*cc
+            proj = np.column_stack([y,ct*yc + st*ys,ct*ys - st*yc])
+            
+            # Determine the best-fit coefficients y_k of the base functions
+            
+            coeff = np.linalg.solve(S,proj[:,:,None])[:,:,0]
+            
+            # Compute the weighted variation of the signal and the model functions
+            
+            Vsignal = yy - y**2
+            Vmodel = np.sum(coeff*np.sum(S*coeff[:,None,:],axis=2),axis=1) \
+                     - np.sum(S[:,0,:]*coeff,axis=1)**2
+            
+            # Calculate the weighted Wavelet Z-Transform
+            
+            Z[p0:p0+pchunk,j] = (Neff - 3) * Vmodel / 2. / (Vsignal - Vmodel)
+    return Z
+
+def windowfunction(time, freq, threads=1):
 
     """
     Computes the modulus square of the window function of a set of 
@@ -1329,28 +1494,255 @@ def windowfunction(time, freq):
     equidistant. The normalisation is such that 1.0 is returned at 
     frequency 0.
     
+    For equidistant frequencies, the same recurrence as in L{DFTpower} is
+    used. The window function only depends on the time points, so if you
+    need it for many signals with the same sampling, use
+    L{windowfunction_cached}.
+    
     @param time: time points  [0..Ntime-1]
     @type time: ndarray       
     @param freq: frequency points. Units: inverse unit of 'time' [0..Nfreq-1]
     @type freq: ndarray       
+    @param threads: number of threads (integer, 'max' or 'safe')
+    @type threads: int or str
     @return: |W(freq)|^2      [0..Nfreq-1]
     @rtype: array
     
     """
   
+    time = np.asarray(time,float)
+    freq = np.asarray(freq,float)
     Ntime = len(time)
     Nfreq = len(freq)
-    winkernel = np.empty_like(freq)
-
-    for i in range(Nfreq):
-        winkernel[i] = np.sum(np.cos(2.0*pi*freq[i]*time))**2     \
-                     + np.sum(np.sin(2.0*pi*freq[i]*time))**2
+    
+    #-- equidistant frequencies: use the recurrence
+    if Nfreq>2:
+        df = (freq[-1]-freq[0])/(Nfreq-1.)
+        equidistant = df>0 and np.allclose(np.diff(freq),df,rtol=1e-8,atol=0)
+    else:
+        equidistant = False
+    if equidistant:
+        ft = _dft_equidistant(time,np.ones(Ntime),freq[0],df,Nfreq,threads=threads)
+    else:
+        ft = _dft(time,np.ones(Ntime),freq,threads=threads)
+    winkernel = ft.real**2 + ft.imag**2
 
     # Normalise such that winkernel(nu = 0.0) = 1.0 
 
     return winkernel/Ntime**2
 
 
+def windowfunction_cached(time, freq, threads=1):
+    
+    """
+    Computes the window function, and remembers it for the same time points
+    and frequencies.
+    
+    The cache is keyed on the contents of the time and frequency arrays, and
+    holds at most C{window_cache_size} window functions. The cached array is
+    returned as a copy.
+    
+    >>> times = np.linspace(0,100,1000)
+    >>> freqs = np.linspace(0,1,500)
+    >>> win1 = windowfunction_cached(times,freqs)
+    >>> win2 = windowfunction_cached(times,freqs) # this one is looked up
+    
+    @param time: time points  [0..Ntime-1]
+    @type time: ndarray       
+    @param freq: frequency points. Units: inverse unit of 'time' [0..Nfreq-1]
+    @type freq: ndarray       
+    @param threads: number of threads (integer, 'max' or 'safe')
+    @type threads: int or str
+    @return: |W(freq)|^2      [0..Nfreq-1]
+    @rtype: array
+    """
+    time = np.ascontiguousarray(time,float)
+    freq = np.ascontiguousarray(freq,float)
+    key = hashlib.sha1(time.data).hexdigest(),hashlib.sha1(freq.data).hexdigest()
+    if key in _window_cache:
+        _window_cache_order.remove(key)
+        logger.debug('Window function found in cache')
+    else:
+        _window_cache[key] = windowfunction(time,freq,threads=threads)
+        while len(_window_cache_order)>=window_cache_size:
+            _window_cache.pop(_window_cache_order.pop(0))
+    _window_cache_order.append(key)
+    return _window_cache[key].copy()
+
+
+def _dft_equidistant(time, signal, f0, df, Nfreq, threads=1):
+    
+    """
+    Computes the Fourier transform sum(signal*exp(2 pi i f t)) on an
+    equidistant frequency grid.
+    
+    The frequencies are divided in tiles of K consecutive frequencies. Within
+    a tile, the exponentials follow from the one at the start of the tile
+    by multiplication with the phasors exp(2 pi i k df t), k=0..K-1. These
+    phasors are computed once with a recurrence, and the transform of a group
+    of tiles is then one matrix product. The time points are processed in
+    chunks such that no array exceeds C{dft_tile_size} elements, and the
+    (time chunk, tile group) pieces can be computed by several threads.
+    
+    @param time: time points [0..Ntime-1]
+    @type time: ndarray
+    @param signal: signal [0..Ntime-1]
+    @type signal: ndarray
+    @param f0: first frequency
+    @type f0: float
+    @param df: frequency step
+    @type df: float
+    @param Nfreq: number of frequencies
+    @type Nfreq: int
+    @param threads: number of threads (integer, 'max' or 'safe')
+    @type threads: int or str
+    @return: complex Fourier transform [0..Nfreq-1]
+    @rtype: array
+    """
+    time = np.asarray(time,float)
+    signal = np.asarray(signal)
+    Ntime = len(time)
+    #-- tiles of K frequencies: computing the phasors costs K.Ntime, the start
+    #   of the tiles Nfreq/K.Ntime exponentials
+    K = int(min(max(np.sqrt(Nfreq),1),512,max(dft_tile_size//16,1)))
+    Ntile = int(np.ceil(Nfreq/float(K)))
+    starts = f0 + df*K*np.arange(Ntile)
+    tchunk = max(1,dft_tile_size//K)
+    gchunk = max(1,dft_tile_size//min(tchunk,max(Ntime,1)))
+    
+    def piece(args):
+        t0,g0 = args
+        t = time[t0:t0+tchunk]
+        #-- phasors exp(2 pi i k df t) via the recurrence
+        B = np.exp(1j*2.*pi*df*t)
+        P = np.empty((K,len(t)),complex)
+        P[0] = 1.
+        for k in range(1,K):
+            P[k] = P[k-1]*B
+        #-- exponentials at the start of every tile
+        A = np.exp(1j*2.*pi*np.outer(t,starts[g0:g0+gchunk])) * signal[t0:t0+tchunk,None]
+        return g0,np.dot(P,A)
+    
+    pieces = [(t0,g0) for t0 in range(0,Ntime,tchunk) for g0 in range(0,Ntile,gchunk)]
+    ft = np.zeros((K,Ntile), complex)
+    for g0,ft_piece in _map_threads(piece,pieces,threads):
+        ft[:,g0:g0+ft_piece.shape[1]] += ft_piece
+    #-- the transform is ordered per tile
+    return ft.T.ravel()[:Nfreq]
+
+
+def _dft(time, signal, freq, threads=1):
+    
+    """
+    Computes the Fourier transform sum(signal*exp(2 pi i f t)) on an arbitrary
+    set of frequencies.
+    
+    The frequencies and time points are handled in tiles of at most
+    C{dft_tile_size} elements, each as one matrix product. The tiles can
+    be computed by several threads.
+    
+    The signal can also be a 2D array, with one signal per column. The
+    transforms of all columns are then computed with the same tiles.
+    
+    @param time: time points [0..Ntime-1]
+    @type time: ndarray
+    @param signal: signal [0..Ntime-1] or [0..Ntime-1,0..Nsignal-1]
+    @type signal: ndarray
+    @param freq: frequencies [0..Nfreq-1]
+    @type freq: ndarray
+    @param threads: number of threads (integer, 'max' or 'safe')
+    @type threads: int or str
+    @return: complex Fourier transform [0..Nfreq-1](,[0..Nsignal-1])
+    @rtype: array
+    """
+    time = np.asarray(time,float)
+    signal = np.asarray(signal)
+    freq = np.asarray(freq,float)
+    tchunk = max(1,min(len(time),dft_tile_size))
+    fchunk = max(1,dft_tile_size//tchunk)
+    
+    def piece(args):
+        t0,f0 = args
+        arg = 2.0*pi*np.outer(freq[f0:f0+fchunk],time[t0:t0+tchunk])
+        return f0,np.dot(np.exp(1j*arg),signal[t0:t0+tchunk])
+    
+    pieces = [(t0,f0) for t0 in range(0,len(time),tchunk) for f0 in range(0,len(freq),fchunk)]
+    ft = np.zeros((len(freq),)+signal.shape[1:], complex)
+    for f0,ft_piece in _map_threads(piece,pieces,threads):
+        ft[f0:f0+len(ft_piece)] += ft_piece
+    return ft
+
+
+def _sums2pergram(ft, ft2, n, T, variance, method='scargle', norm='amplitude'):
+    
+    """
+    Scargle or Deeming periodogram from the sums over the time points.
+    
+    @param ft: sum(signal*exp(2 pi i f t)) [0..Nfreq-1](,[0..Nsignal-1])
+    @type ft: ndarray
+    @param ft2: sum(exp(4 pi i f t)) [0..Nfreq-1](,1), only for the Scargle periodogram
+    @type ft2: ndarray
+    @param n: number of time points
+    @type n: int
+    @param T: time span
+    @type T: float
+    @param variance: variance of the signal(s)
+    @type variance: float or ndarray
+    @param method: 'scargle' or 'deeming'
+    @type method: str
+    @param norm: type of normalisation
+    @type norm: str
+    @return: periodogram [0..Nfreq-1](,[0..Nsignal-1])
+    @rtype: ndarray
+    """
+    if method=='scargle':
+        SC,SS,SC2,SS2 = ft.real,ft.imag,ft2.real,ft2.imag
+        s1 = (SC**2*(n-SC2) + SS**2*(n+SC2) - 2*SS*SC*SS2) / (n**2-SC2**2-SS2**2)
+    elif method=='deeming':
+        s1 = (ft.real**2 + ft.imag**2) / n
+    else:
+        raise ValueError, "Batched periodogram not available for method '%s'"%(method)
+    fact  = np.sqrt(4./n)
+    if norm =='distribution': # statistical distribution
+        s1 /= variance
+    elif norm == "amplitude": # amplitude spectrum
+        s1 = fact * np.sqrt(s1)
+    elif norm == "density": # power density
+        s1 = fact**2 * s1 * T
+    return s1
+
+
+def _map_threads(fctn, args, threads=1):
+    
+    """
+    Apply a function to a list of arguments, possibly in a pool of threads.
+    
+    The heavy lifting in the DFT tiles is done by NumPy, which releases the
+    GIL, so threads run truly parallel.
+    
+    @param fctn: function to apply
+    @type fctn: callable
+    @param args: list of arguments
+    @type args: list
+    @param threads: number of threads (integer, 'max' or 'safe')
+    @type threads: int or str
+    @return: results, in the order of the arguments
+    @rtype: list
+    """
+    if threads=='max':
+        threads = cpu_count()
+    elif threads=='safe':
+        threads = cpu_count()-1
+    threads = max(1,min(int(threads),len(args)))
+    if threads==1:
+        return [fctn(arg) for arg in args]
+    pool = ThreadPool(threads)
+    try:
+        return pool.map(fctn,args)
+    finally:
+        pool.terminate()
+
+
 def check_input(times,signal,**kwargs):
     """
     Check the input arguments for periodogram calculations for mistakes.
@@ -0,0 +1,135 @@
+"""
+Unit tests for the frequency analysis convenience functions
+(timeseries.freqanalyse).
+"""
+import numpy as np
+from numpy import pi
+from ivs.timeseries import freqanalyse
+from ivs.timeseries import pergrams
+from ivs.sigproc import fit, evaluate
+
+import unittest
+
+
+class Spectrum2DTestCase(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(1111)
+        self.times = np.sort(np.random.uniform(0, 150, 100))
+        self.wave = np.linspace(4500, 4600, 12)
+        central_wave = 5*np.sin(2*pi/10*self.times)
+        self.matrix = 1 - 0.5*np.exp(-(self.wave-4550-central_wave[:, None])**2/10**2)
+        self.matrix += np.random.normal(size=self.matrix.shape, scale=0.01)
+        self.batch_size = freqanalyse.spectrum_2D_batch_size
+
+    def tearDown(self):
+        freqanalyse.spectrum_2D_batch_size = self.batch_size
+
+    def testSpectrum2D(self):
+        """ timeseries.freqanalyse.spectrum_2D() equals find_frequency() per column """
+        matrix = self.matrix - self.matrix.mean(axis=0)
+        #-- batched periodograms, batches on processes, a periodogram per column
+        for method, f0, fn, batch_size, threads in [('scargle', 0.05, 0.3, self.batch_size, 1),
+                                                    ('deeming', 0.05, 0.3, self.batch_size, 1),
+                                                    ('scargle', 0.05, 0.3, 1000, 2),
+                                                    ('gls', 0.095, 0.105, self.batch_size, 2)]:
+            freqanalyse.spectrum_2D_batch_size = batch_size
+            output = freqanalyse.spectrum_2D(self.times, self.wave, self.matrix, method=method, f0=f0, fn=fn,
+                                             full_output=True, threads=threads)
+            for i in [0, 5, 11]:
+                params, (freqs, ampls), model = freqanalyse.find_frequency(self.times, matrix[:, i], full_output=True,
+                                                          scale_df=0, method=method, f0=f0, fn=fn)
+                for name in params.dtype.names:
+                    self.assertTrue(np.allclose(output['pars'][name][i], params[name], rtol=1e-6, atol=1e-10), msg=(method, name))
+                self.assertTrue(np.allclose(output['pergram'][0], freqs))
+                self.assertTrue(np.allclose(output['pergram'][1][:, i], ampls, rtol=1e-9, atol=1e-12), msg=method)
+                self.assertTrue(np.allclose(output['model'][:, i], model, rtol=1e-6, atol=1e-10), msg=method)
+
+
+class TimeFrequencyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(1111)
+        self.times = np.sort(np.random.uniform(0, 15, 400))
+        self.signal = np.where(self.times<7.5, np.sin(2*pi*2.*self.times), np.sin(2*pi*4.*self.times))
+        self.signal += np.random.normal(size=len(self.times), scale=0.1)
+        self.kwargs = dict(window_width=1.5, n_windows=20, f0=0.5, fn=6., df=0.01)
+
+    def testTimeFrequency(self):
+        """ timeseries.freqanalyse.time_frequency() equals the periodograms of the slices """
+        detrend = lambda x, y: (x, y-y.mean())
+        #-- sliding periodograms, and a periodogram per slice on processes
+        for method, fit_params, detrend, threads in [('scargle', True, None, 1), ('scargle', False, None, 1),
+                                                     ('deeming', True, None, 1), ('deeming', False, None, 1),
+                                                     ('gls', False, None, 2), ('scargle', True, detrend, 2)]:
+            output = freqanalyse.time_frequency(self.times, self.signal, method=method, fit_params=fit_params,
+                                                detrend=detrend, threads=threads, **self.kwargs)
+            self.assertTrue(np.allclose(output['times'], np.linspace(self.times[0]+0.75, self.times[-1]-0.75, 20)))
+            self.assertEqual('pars' in output, fit_params)
+            for i in [0, 9, 19]:
+                region = abs(self.times-output['times'][i]) <= 0.75
+                times, signal = self.times[region], self.signal[region]
+                if detrend:
+                    times, signal = detrend(times, signal)
+                if fit_params:
+                    params, (freqs, ampls), model = freqanalyse.find_frequency(times, signal, full_output=True,
+                                    f0=0.5, fn=6., df=0.01, nyq_stat=6., scale_df=0, method=method)
+                    for name in params.dtype.names:
+                        self.assertTrue(np.allclose(output['pars'][name][i], params[name], rtol=1e-6, atol=1e-10), msg=name)
+                else:
+                    freqs, ampls = getattr(pergrams, method)(times, signal, f0=0.5, fn=6., df=0.01, nyq_stat=6.)
+                self.assertTrue(np.allclose(output['pergram'][0], freqs))
+                self.assertTrue(np.allclose(output['pergram'][1][i], ampls, rtol=1e-9, atol=1e-12), msg=(method, i))
+        self.assertTrue(np.all(output['points']>0))
+
+
+class PrewhiteningTestCase(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(1111)
+        self.freqs = np.array([0.8, 1.7, 2.35, 3.1, 4.6])
+
+    def signal(self, times, nfreq):
+        signal = 2. + np.random.normal(size=len(times), scale=0.5)
+        for ampl, freq, phase in zip(np.linspace(2, 0.5, nfreq), self.freqs, [0.1, 0.5, 0.3, 0.9, 0.7]):
+            signal += ampl*np.sin(2*pi*(freq*times+phase))
+        return signal
+
+    def testState(self):
+        """ timeseries.freqanalyse.PrewhiteningState() equals fit.sine() and the periodogram of the residuals """
+        for times in [np.linspace(1000, 1100, 1500), np.sort(np.random.uniform(0, 100, 1500))]:
+            signal = self.signal(times, 4)
+            state = freqanalyse.PrewhiteningState(times, signal)
+            frequencies = []
+            for freq in [1.2, 3.4, 2.05, 1.2]:
+                frequencies.append(freq)
+                params = state.add(freq)
+                reference = fit.sine(times, signal, frequencies)
+                for name in reference.dtype.names:
+                    self.assertTrue(np.allclose(params[name], reference[name], rtol=1e-8, atol=1e-10), msg=name)
+                residuals = signal - evaluate.sine(times, reference)
+                self.assertTrue(np.allclose(state.residuals, residuals, atol=1e-10))
+                output = state.pergram(0.01, 5., 0.002)
+                if state.equidistant and len(frequencies) < 4:
+                    freqs, ampls = pergrams.scargle(times, residuals, f0=0.01, fn=5., df=0.002)
+                    self.assertTrue(np.allclose(output[0], freqs))
+                    self.assertTrue(np.allclose(output[1], ampls, rtol=1e-6, atol=1e-9))
+                else:
+                    self.assertTrue(output is None)
+
+    def testPrewhitening(self):
+        """ timeseries.freqanalyse.iterative_prewhitening() finds the frequencies and fits them all """
+        for times in [np.linspace(0, 80, 1200), np.sort(np.random.uniform(0, 80, 1200))]:
+            signal = self.signal(times, 5)
+            output, model = freqanalyse.iterative_prewhitening(times, signal, maxiter=6, full_output=True,
+                                    stopcrit=(freqanalyse.stopcrit_scargle_snr, 4., 6.), timing=True,
+                                    f0=0.01, fn=6., df=0.002)
+            #-- the sixth frequency is noise, and stops the prewhitening
+            self.assertEqual(len(output), 6)
+            self.assertTrue(np.allclose(output['freq'][:5], self.freqs, atol=0.002))
+            self.assertTrue(np.all(output['stopcrit'][:5] > 6.) and output['stopcrit'][5] < 6.)
+            reference = fit.sine(times, signal, output['freq'])
+            for name in reference.dtype.names:
+                self.assertTrue(np.allclose(output[name], reference[name], rtol=1e-8, atol=1e-10), msg=name)
+            self.assertTrue(np.allclose(model, evaluate.sine(times, reference), atol=1e-10))
+            self.assertTrue(np.all(output['time'] > 0))
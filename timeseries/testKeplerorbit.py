@@ -0,0 +1,81 @@
+"""
+Unit tests for the Kepler equation solver and the orbit search
+(timeseries.keplerorbit).
+"""
+import numpy as np
+from numpy import pi
+from ivs.timeseries import keplerorbit
+from ivs.timeseries import pyKEP
+from ivs.sigproc import evaluate
+
+import unittest
+
+
+class TrueAnomalyTestCase(unittest.TestCase):
+
+    def testSolver(self):
+        """ timeseries.keplerorbit.true_anomaly() solves Kepler's equation """
+        M = np.linspace(-20, 20, 1001)[:, None]
+        e = np.array([0., 0.1, 0.5, 0.9, 0.99])
+        E, theta = keplerorbit.true_anomaly(M, e)
+        self.assertEqual(E.shape, (1001, 5))
+        self.assertTrue(np.all(abs(E - e*np.sin(E) - M) < 1e-10))
+        #-- the true anomaly belongs to the eccentric anomaly
+        self.assertTrue(np.allclose(np.cos(theta), (np.cos(E)-e)/(1-e*np.cos(E)), atol=1e-10))
+        self.assertTrue(np.allclose(np.sin(theta), np.sqrt(1-e**2)*np.sin(E)/(1-e*np.cos(E)), atol=1e-10))
+
+    def testScalar(self):
+        """ timeseries.keplerorbit.true_anomaly() on scalars """
+        E, theta = keplerorbit.true_anomaly(2.5, 0.7)
+        self.assertTrue(np.isscalar(E) and np.isscalar(theta))
+        self.assertAlmostEqual(E - 0.7*np.sin(E), 2.5, places=12)
+
+    def testRadialVelocityGrid(self):
+        """ timeseries.keplerorbit.radial_velocity_grid() equals radial_velocity() per orbit """
+        times = np.linspace(1000, 1100, 50)
+        P = np.array([3., 12.5, 40.])[:, None]
+        e = np.array([0., 0.3, 0.8])
+        RV = keplerorbit.radial_velocity_grid(times, P, 1003., e, 1.2, 30., 5.)
+        self.assertEqual(RV.shape, (3, 3, 50))
+        for i in range(3):
+            for j in range(3):
+                RV_ = keplerorbit.radial_velocity([P[i, 0], 1003., e[j], 1.2, 30., 5.], times=times)
+                self.assertTrue(np.allclose(RV[i, j], RV_, atol=1e-8))
+
+    def testEvaluate(self):
+        """ sigproc.evaluate.kepler() on several orbits """
+        times = np.linspace(1000, 1100, 50)
+        pars = np.rec.array([(12.456, 1003., 0.37, 3.7, 98.76, 55.), (3.2, 1000.5, 0.1, 1., 10., 2.)],
+                            dtype=[('P', 'f8'), ('T0', 'f8'), ('e', 'f8'), ('omega', 'f8'), ('K', 'f8'), ('gamma', 'f8')])
+        RV = evaluate.kepler(times, pars)
+        RV_ = pars['gamma'].sum()
+        for p in pars:
+            RV_ = RV_ + keplerorbit.radial_velocity([p['P'], p['T0'], p['e'], p['omega'], p['K'], 0], times=times)
+        self.assertTrue(np.allclose(RV, RV_, atol=1e-8))
+
+
+class GridSearchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(1111)
+        self.times = np.sort(np.random.uniform(1000, 1200, 100))
+        self.pars = [12.456, 1003., 0.37, 213/180.*pi, 98.76, 55.]
+        self.signal = keplerorbit.radial_velocity(self.pars, times=self.times) + np.random.normal(scale=5, size=100)
+
+    def testFortran(self):
+        """ timeseries.keplerorbit.grid_search() equals the Fortran periodogram """
+        f1, s1, p1, l1, s2 = [np.zeros(51) for i in range(5)]
+        k2 = np.zeros(6)
+        pyKEP.kepler(self.times-self.times.min(), self.signal+0, np.ones(100), 0.05, 0.1, 0.001, 2, 0., 0.91, 0.1,
+                     0., 359.9, f1, s1, p1, l1, s2, k2)
+        power, best = keplerorbit.grid_search(self.times, self.signal, f1)
+        self.assertTrue(np.allclose(power, s2, atol=1e-4))
+        self.assertTrue(np.allclose(best, k2, rtol=1e-4))
+
+    def testRecovery(self):
+        """ timeseries.keplerorbit.grid_search() recovers the orbit """
+        power, best = keplerorbit.grid_search(self.times, self.signal, np.linspace(0.07, 0.09, 41), de=0.05)
+        freq, x0, e, omega, K, RV0 = best
+        self.assertAlmostEqual(1/freq, self.pars[0], delta=0.1)
+        self.assertAlmostEqual(e, self.pars[2], delta=0.05)
+        self.assertAlmostEqual(K, self.pars[4], delta=5.)
@@ -0,0 +1,136 @@
+"""
+Unit tests for the periodograms and time-frequency transforms
+(timeseries.pergrams).
+"""
+import numpy as np
+from numpy import pi
+from ivs.timeseries import pergrams
+
+import unittest
+
+
+class ZwaveletTestCase(unittest.TestCase):
+    
+    def setUp(self):
+        np.random.seed(1111)
+        self.times = np.sort(np.random.uniform(0, 100, 300))
+        self.signal = np.sin(2*pi*0.2*self.times) + 0.5*np.sin(2*pi*(0.05+0.002*self.times)*self.times)
+        self.signal += np.random.normal(size=len(self.times), scale=0.2)
+        self.freq = np.linspace(0.02, 0.5, 13)
+        self.position = np.linspace(5, 95, 11)
+    
+    def testZwavelet(self):
+        """ timeseries.pergrams.Zwavelet() """
+        Z = pergrams.Zwavelet(self.times, self.signal, self.freq, self.position)
+        self.assertEqual(Z.shape, (11, 13))
+        #-- a few nodes from a weighted least-squares fit of a sine
+        for i, j in [(0, 0), (5, 3), (10, 12)]:
+            tau, nu = self.position[i], self.freq[j]
+            weight = np.exp(-(self.times-tau)**2 * (nu / 20.)**2)
+            base = np.array([np.ones_like(self.times), np.cos(2*pi*nu*(self.times-tau)),
+                             np.sin(2*pi*nu*(self.times-tau))]).T
+            y = np.linalg.lstsq(base*np.sqrt(weight)[:, None], self.signal*np.sqrt(weight), rcond=-1)[0]
+            Vsignal = np.average(self.signal**2, weights=weight) - np.average(self.signal, weights=weight)**2
+            model = np.dot(base, y)
+            Vmodel = np.average(model**2, weights=weight) - np.average(model, weights=weight)**2
+            Neff = weight.sum()**2 / np.sum(weight**2)
+            self.assertAlmostEqual(Z[i, j], (Neff-3) * Vmodel / 2. / (Vsignal-Vmodel), places=7)
+    
+    def testZwaveletThreads(self):
+        """ timeseries.pergrams.Zwavelet() with threads """
+        Z = pergrams.Zwavelet(self.times, self.signal, self.freq, self.position, sigma=5.)
+        Z_ = pergrams.Zwavelet(self.times, self.signal, self.freq, self.position, sigma=5., threads=3)
+        self.assertTrue(np.allclose(Z, Z_, rtol=1e-12, atol=0))
+
+
+class DFTTestCase(unittest.TestCase):
+    
+    def setUp(self):
+        np.random.seed(1111)
+        self.times = np.sort(np.random.uniform(0, 100, 700))
+        self.signal = np.sin(2*pi*0.7*self.times) + np.random.normal(size=len(self.times))
+        self.tile_size = pergrams.dft_tile_size
+    
+    def tearDown(self):
+        pergrams.dft_tile_size = self.tile_size
+    
+    def testDFTpower(self):
+        """ timeseries.pergrams.DFTpower() """
+        freqs = 0.01 + 0.001*np.arange(4990)
+        reference = abs(np.dot(np.exp(2j*pi*np.outer(freqs, self.times)), self.signal))**2 * 4.0 / len(self.times)**2
+        for tile_size, threads in [(self.tile_size, 1), (1000, 1), (1000, 3), (100, 2)]:
+            pergrams.dft_tile_size = tile_size
+            freqs, power = pergrams.DFTpower(self.times, self.signal, 0.01, 5., 0.001, threads=threads)
+            self.assertEqual(len(freqs), len(reference))
+            self.assertTrue(np.allclose(power, reference, rtol=0, atol=1e-10), msg=str(tile_size))
+    
+    def testDFTpower2(self):
+        """ timeseries.pergrams.DFTpower2() """
+        freqs = np.sort(np.random.uniform(0, 5, 999))
+        reference = np.array([np.sum(self.signal * np.cos(2*pi*f*self.times))**2 +
+                              np.sum(self.signal * np.sin(2*pi*f*self.times))**2 for f in freqs])
+        reference *= 4.0 / len(self.times)**2
+        for tile_size, threads in [(self.tile_size, 1), (1000, 3), (100, 2)]:
+            pergrams.dft_tile_size = tile_size
+            power = pergrams.DFTpower2(self.times, self.signal, freqs, threads=threads)
+            self.assertTrue(np.allclose(power, reference, rtol=0, atol=1e-10), msg=str(tile_size))
+
+
+class WindowfunctionTestCase(unittest.TestCase):
+    
+    def setUp(self):
+        np.random.seed(1111)
+        self.times = np.sort(np.random.uniform(0, 100, 500))
+    
+    def testWindowfunction(self):
+        """ timeseries.pergrams.windowfunction() """
+        for freqs in [np.linspace(0, 5, 2001), np.sort(np.random.uniform(0, 5, 300))]:
+            win = pergrams.windowfunction(self.times, freqs)
+            reference = abs(np.exp(2j*pi*np.outer(freqs, self.times)).sum(axis=1))**2 / len(self.times)**2
+            self.assertTrue(np.allclose(win, reference, rtol=0, atol=1e-10))
+        self.assertAlmostEqual(pergrams.windowfunction(self.times, np.linspace(0, 5, 11))[0], 1.0, places=12)
+    
+    def testWindowfunctionCached(self):
+        """ timeseries.pergrams.windowfunction_cached() """
+        freqs = np.linspace(0, 5, 501)
+        win = pergrams.windowfunction_cached(self.times, freqs)
+        win[:] = 0.
+        self.assertTrue(np.allclose(pergrams.windowfunction_cached(self.times, freqs),
+                                    pergrams.windowfunction(self.times, freqs)))
+        #-- the cache is limited in size
+        for i in range(pergrams.window_cache_size+2):
+            pergrams.windowfunction_cached(self.times+i, freqs)
+        self.assertEqual(len(pergrams._window_cache), pergrams.window_cache_size)
+
+
+class Pergram2DTestCase(unittest.TestCase):
+    
+    def setUp(self):
+        np.random.seed(1111)
+        self.times = np.sort(np.random.uniform(0, 50, 300))
+        self.signals = np.random.normal(size=(300, 5)) + np.sin(2*pi*0.7*self.times)[:, None]
+    
+    def testPergram2D(self):
+        """ timeseries.pergrams.pergram_2D() """
+        for method in ['scargle', 'deeming']:
+            for norm in ['amplitude', 'distribution', 'density']:
+                freqs, ampls = pergrams.pergram_2D(self.times, self.signals, fn=3., method=method, norm=norm)
+                self.assertEqual(ampls.shape, (len(freqs), 5))
+                for i in range(5):
+                    freqs_, ampls_ = getattr(pergrams, method)(self.times, self.signals[:, i], fn=3., norm=norm)
+                    self.assertTrue(np.allclose(freqs, freqs_, rtol=0, atol=1e-10))
+                    self.assertTrue(np.allclose(ampls[:, i], ampls_, rtol=1e-9, atol=1e-12), msg=(method, norm))
+    
+    def testSlidingPergram(self):
+        """ timeseries.pergrams.sliding_pergram() """
+        signal = self.signals[:, 0]
+        #-- overlapping windows, a jump, and windows around an empty stretch
+        centers = np.r_[np.linspace(5, 15, 11), 30., 31., 60., 61.]
+        for method in ['scargle', 'deeming']:
+            freqs, spec = pergrams.sliding_pergram(self.times, signal, centers, 4., fn=3., method=method)
+            self.assertTrue(np.all(np.isnan(spec[-2:])))
+            for i, center in enumerate(centers[:-2]):
+                region = abs(self.times-center) <= 2.
+                freqs_, ampls_ = getattr(pergrams, method)(self.times[region], signal[region], fn=3., df=freqs[1]-freqs[0],
+                                                           f0=freqs[0], nyq_stat=3.)
+                self.assertTrue(np.allclose(spec[i], ampls_, rtol=1e-9, atol=1e-12), msg=(method, center))